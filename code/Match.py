@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from RouteBase import LatLon, DriverRoute, WalkerRoute, RouteBase
+from AgentState import AgentState
 
 
 @dataclass
@@ -45,4 +46,28 @@ class MatchLight:
     pick_walk_dist_m: float
     drop_walk_dist_m: float
     pick_walk_s: float
-    drop_walk_s: float
\ No newline at end of file
+    drop_walk_s: float
+    # pickup/dropoff lie on segment pickup_index/dropoff_index, this far along it
+    pickup_frac: float = 0.0
+    dropoff_frac: float = 0.0
+
+
+@dataclass
+class MatchCandidate:
+    # a feasible (driver, walker) pair from best_match_'s checks, times from now
+    driver: AgentState
+    light: MatchLight
+    pickup_eta_s: float
+    dropoff_eta_s: float
+    saving_dist_m: float
+    saving_s: float
+
+    @property
+    def arrival_s(self) -> float:
+        # walker at the destination
+        return self.dropoff_eta_s + self.light.drop_walk_s
+
+    @property
+    def pickup_wait_s(self) -> float:
+        # walker waiting at the pickup for the driver
+        return self.pickup_eta_s - self.light.pick_walk_s
@@ -26,10 +26,12 @@ class MatchSimulation:
     creation_time_s: float = 0.0
     walker_pos: Optional[LatLon] = None
 
-    def update(self, t_s: float) -> None:
+    def update(self, t_s: float, positions_ready: bool = False) -> None:
+        # positions_ready: the agents were already moved to t_s (FleetPositionEngine)
         t = t_s - self.creation_time_s
         # update driver always
-        self.driver_agent.update_position(t_s)
+        if not positions_ready:
+            self.driver_agent.update_position(t_s)
 
         t_walk_to_pickup_end = self.match.walk_route_to_pickup.duration
         t_driver_pickup = self.match.driver_pickup_eta_s
@@ -38,7 +40,8 @@ class MatchSimulation:
 
         if t < t_walk_to_pickup_end:
             self.phase = Phase.WALK_TO_PICKUP
-            self.walk_to_pickup_agent.update_position(t_s)
+            if not positions_ready:
+                self.walk_to_pickup_agent.update_position(t_s)
             self.walker_pos = self.walk_to_pickup_agent.get_pos()
 
         elif t < t_driver_pickup:
@@ -52,7 +55,8 @@ class MatchSimulation:
         elif t < t_walk_from_dropoff_end:
             self.phase = Phase.WALK_FROM_DROPOFF
             # walker starts this sub-walk at t_driver_dropoff => use local time
-            self.walk_from_dropoff_agent.update_position(t_s)
+            if not positions_ready:
+                self.walk_from_dropoff_agent.update_position(t_s)
             self.walker_pos = self.walk_from_dropoff_agent.get_pos()
 
         else:
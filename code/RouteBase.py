@@ -1,5 +1,6 @@
+from array import array
 from dataclasses import dataclass
-from typing import List, Tuple, Optional
+from typing import Callable, Iterator, List, Tuple, Optional, Sequence
 from bisect import bisect_right
 
 LatLon = Tuple[float, float]
@@ -57,3 +58,187 @@ class WalkerRoute(RouteBase):
     #dist: float
     profile: str = "driving"
     nodes: Optional[List[int]] = None
+
+
+class LatLonView:
+    """
+    Read-only sequence of (lat, lon) tuples over an interleaved array('d'),
+    so code written against geometry_latlon lists keeps working.
+    """
+    __slots__ = ("_buf",)
+
+    def __init__(self, buf: array):
+        self._buf = buf
+
+    def __len__(self) -> int:
+        return len(self._buf) // 2
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n = len(self._buf) // 2
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("geometry index out of range")
+        return self._buf[2 * i], self._buf[2 * i + 1]
+
+    def __iter__(self) -> Iterator[LatLon]:
+        buf = self._buf
+        for i in range(0, len(buf), 2):
+            yield buf[i], buf[i + 1]
+
+
+class CompactRoute:
+    """
+    Same fields and get_pos_at_time() as RouteBase, but every per-point series
+    lives in one contiguous array('d') (geometry interleaved lat, lon) and the
+    instance has __slots__: 8 bytes per value instead of a boxed float (and a
+    tuple per point). Used for everything fetched from OSRM.
+    """
+    __slots__ = ("start", "dest", "dist", "duration", "profile",
+                 "_latlon", "duration_list", "cum_time_s", "seg_dist_m", "cum_dist_m", "nodes",
+                 "_bbox", "_seg_index", "_memo")  # derived data, set lazily by geometry.derived
+
+    def __init__(self,
+                 start: LatLon,
+                 dest: LatLon,
+                 dist: float,
+                 duration: float,
+                 duration_list: Sequence[float],
+                 cum_time_s: Sequence[float],
+                 geometry_latlon: Sequence[LatLon],
+                 seg_dist_m: Sequence[float],
+                 cum_dist_m: Sequence[float],
+                 profile: str = "driving",
+                 nodes: Optional[Sequence[int]] = None):
+        self.start = start
+        self.dest = dest
+        self.dist = dist
+        self.duration = duration
+        self.profile = profile
+
+        if isinstance(geometry_latlon, LatLonView):
+            self._latlon = geometry_latlon._buf
+        else:
+            self._latlon = array("d", [c for p in geometry_latlon for c in p])
+        self.duration_list = _as_array(duration_list)
+        self.cum_time_s = _as_array(cum_time_s)
+        self.seg_dist_m = _as_array(seg_dist_m)
+        self.cum_dist_m = _as_array(cum_dist_m)
+        self.nodes = array("q", nodes) if nodes is not None and not isinstance(nodes, array) else nodes
+
+    @classmethod
+    def from_osrm(cls, start: LatLon, dest: LatLon, profile: str, route: dict) -> "CompactRoute":
+        # route: one entry of an OSRM /route response (overview=full, geojson, annotations=true)
+        ann = route["legs"][0]["annotation"]
+        latlon = array("d")
+        for lon, lat in route["geometry"]["coordinates"]:
+            latlon.append(lat)
+            latlon.append(lon)
+
+        self = cls.__new__(cls)
+        self.start = start
+        self.dest = dest
+        self.dist = route["distance"]
+        self.duration = route["duration"]
+        self.profile = profile
+        self._latlon = latlon
+        self.duration_list = array("d", ann["duration"])
+        self.cum_time_s = cumulative(self.duration_list)
+        self.seg_dist_m = array("d", ann["distance"])
+        self.cum_dist_m = cumulative(self.seg_dist_m)
+        nodes = ann.get("nodes")
+        self.nodes = array("q", nodes) if nodes is not None else None
+        return self
+
+    @property
+    def geometry_latlon(self) -> LatLonView:
+        return LatLonView(self._latlon)
+
+    @property
+    def latlon_buffer(self) -> array:
+        # interleaved lat, lon; numpy can wrap it without a copy
+        return self._latlon
+
+    def get_pos_at_time(self, t_s: float) -> LatLon:
+        buf = self._latlon
+        if not buf:
+            raise ValueError("geometry_latlon is empty")
+
+        if t_s <= 0.0:
+            return buf[0], buf[1]
+
+        end_t = self.cum_time_s[-1] if self.cum_time_s else self.duration
+        if t_s >= end_t:
+            return buf[-2], buf[-1]
+
+        if len(buf) // 2 != len(self.duration_list) + 1 or len(self.cum_time_s) != len(self.duration_list) + 1:
+            raise ValueError("Length mismatch: geometry_latlon/cum_time_s must be duration_list + 1")
+
+        i = bisect_right(self.cum_time_s, t_s) - 1
+        seg_t = self.duration_list[i]
+        if seg_t <= 0.0:
+            return (buf[2 * i + 2], buf[2 * i + 3]), i + 1
+
+        alpha = (t_s - self.cum_time_s[i]) / seg_t
+        lat1, lon1, lat2, lon2 = buf[2 * i], buf[2 * i + 1], buf[2 * i + 2], buf[2 * i + 3]
+        return (lat1 + alpha * (lat2 - lat1), lon1 + alpha * (lon2 - lon1)), i  # return index as well
+
+
+class LazyRoute(CompactRoute):
+    """
+    A CompactRoute known only by distance and duration (an overview=false
+    answer). Geometry and annotations come from loader() the first time
+    anything reads them; from then on it is a plain CompactRoute.
+    """
+    __slots__ = ("_loader",)
+
+    _DEFERRED = frozenset(("_latlon", "duration_list", "cum_time_s", "seg_dist_m", "cum_dist_m", "nodes"))
+
+    def __init__(self,
+                 start: LatLon,
+                 dest: LatLon,
+                 dist: float,
+                 duration: float,
+                 loader: Callable[[], CompactRoute],
+                 profile: str = "walking"):
+        self.start = start
+        self.dest = dest
+        self.dist = dist
+        self.duration = duration
+        self.profile = profile
+        self._loader = loader
+
+    @property
+    def loaded(self) -> bool:
+        return self._loader is None
+
+    def load(self) -> None:
+        loader = self._loader
+        if loader is None:
+            return
+        full = loader()
+        for name in LazyRoute._DEFERRED:
+            setattr(self, name, getattr(full, name))
+        self._loader = None
+
+    def __getattr__(self, name):
+        # only reached for unset slots
+        if name in LazyRoute._DEFERRED and self._loader is not None:
+            self.load()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+
+def _as_array(values: Sequence[float]) -> array:
+    return values if isinstance(values, array) else array("d", values)
+
+
+def cumulative(values: array) -> array:
+    cum = array("d", [0.0])
+    s = 0.0
+    for v in values:
+        s += v
+        cum.append(s)
+    return cum
@@ -0,0 +1,221 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from queue import Queue, Empty
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from AgentState import AgentState
+from Match import Match
+
+
+@dataclass
+class Admission:
+    """
+    One create request on its way through the pipeline.
+    The route stage fills kind/agent, the match stage fills match/partner.
+    """
+    req: Dict[str, Any]
+    req_id: str = "unknown"
+    kind: str = ""
+    agent: Optional[AgentState] = None
+    match: Optional[Match] = None
+    partner: Optional[AgentState] = None
+    eval_t: float = 0.0  # simulation time the match was evaluated at
+    attempts: int = 0
+    error: Optional[str] = None
+    t_submit: float = field(default_factory=time.perf_counter)
+    t_stage: float = 0.0
+
+
+def run_inline(fn: Callable[..., Any], *args) -> Future:
+    # fn(*args) right away, as a finished future
+    fut: Future = Future()
+    try:
+        fut.set_result(fn(*args))
+    except Exception as e:
+        fut.set_exception(e)
+    return fut
+
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.last_s = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, dt_s: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total_s += dt_s
+            self.last_s = dt_s
+            if dt_s > self.max_s:
+                self.max_s = dt_s
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            avg = self.total_s / self.count if self.count else 0.0
+            return {"count": self.count,
+                    "avg_ms": avg * 1e3,
+                    "max_ms": self.max_s * 1e3,
+                    "last_ms": self.last_s * 1e3}
+
+
+class AdmissionPipeline:
+    """
+    Create requests -> route workers -> match workers -> ready queue -> tick loop.
+
+    route_fn(req, t) -> (req_id, agent, kind) fetches the agent's route.
+    match_fn(kind, agent, t) -> (match, partner) evaluates a match against the
+    current leftovers without mutating them; the tick loop commits the result
+    after drain_ready(). With workers=0 both stages run inline in submit(),
+    which keeps the old synchronous (and deterministic) behaviour.
+
+    offload() runs the tick loop's other matching work (rematch scoring and
+    finalizing, batch costing) on the same match workers.
+    """
+
+    def __init__(self,
+                 route_fn: Callable[[Dict[str, Any], float], Tuple[str, AgentState, str]],
+                 match_fn: Callable[[str, AgentState, float], Tuple[Optional[Match], Optional[AgentState]]],
+                 route_workers: int = 8,
+                 match_workers: int = 4):
+        self.route_fn = route_fn
+        self.match_fn = match_fn
+        self.now = 0.0  # simulation time, set by the tick loop
+
+        self.inline = route_workers <= 0 or match_workers <= 0
+        self._route_pool = None if self.inline else ThreadPoolExecutor(route_workers, "admit-route")
+        self._match_pool = None if self.inline else ThreadPoolExecutor(match_workers, "admit-match")
+        self._ready: "Queue[Admission]" = Queue()
+
+        self._lock = threading.Lock()
+        self._in_route = 0
+        self._in_match = 0
+        self._in_jobs = 0
+        self.stats = {
+            "route": StageStats(),
+            "match": StageStats(),
+            "job": StageStats(),
+            "ready_wait": StageStats(),
+            "total": StageStats(),
+        }
+
+    # stages
+
+    def _route_stage(self, adm: Admission) -> None:
+        adm.t_stage = time.perf_counter()
+        try:
+            adm.req_id, adm.agent, adm.kind = self.route_fn(adm.req, self.now)
+        except Exception as e:
+            adm.req_id = adm.req.get("request_id", "unknown")
+            adm.error = f"{type(e).__name__}: {e}"
+        finally:
+            self.stats["route"].add(time.perf_counter() - adm.t_stage)
+            with self._lock:
+                self._in_route -= 1
+
+        if adm.error is not None or adm.agent is None:
+            if adm.error is None:
+                adm.error = f"unknown agent type {adm.kind!r}"
+            self._to_ready(adm)
+            return
+        self._to_match(adm)
+
+    def _match_stage(self, adm: Admission) -> None:
+        adm.t_stage = time.perf_counter()
+        adm.eval_t = self.now
+        try:
+            adm.match, adm.partner = self.match_fn(adm.kind, adm.agent, adm.eval_t)
+        except Exception as e:
+            print("admission match failed:", req_id_of(adm), e)
+            adm.match, adm.partner = None, None
+        finally:
+            self.stats["match"].add(time.perf_counter() - adm.t_stage)
+            with self._lock:
+                self._in_match -= 1
+        self._to_ready(adm)
+
+    def _to_match(self, adm: Admission) -> None:
+        with self._lock:
+            self._in_match += 1
+        if self.inline:
+            self._match_stage(adm)
+        else:
+            self._match_pool.submit(self._match_stage, adm)
+
+    def _job(self, fn: Callable[..., Any], args: Tuple) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.stats["job"].add(time.perf_counter() - t0)
+            with self._lock:
+                self._in_jobs -= 1
+
+    def _to_ready(self, adm: Admission) -> None:
+        adm.t_stage = time.perf_counter()
+        self._ready.put(adm)
+
+    # tick loop side
+
+    def submit(self, req: Dict[str, Any]) -> None:
+        adm = Admission(req=req)
+        with self._lock:
+            self._in_route += 1
+        if self.inline:
+            self._route_stage(adm)
+        else:
+            self._route_pool.submit(self._route_stage, adm)
+
+    def retry(self, adm: Admission) -> None:
+        # commit found the partner taken in the meantime -> evaluate again
+        adm.attempts += 1
+        adm.match, adm.partner = None, None
+        self._to_match(adm)
+
+    def offload(self, fn: Callable[..., Any], *args) -> Future:
+        """
+        fn(*args) on a match worker. The tick loop polls the future and
+        commits the result itself; fn must only read the shared state.
+        """
+        with self._lock:
+            self._in_jobs += 1
+        if self.inline:
+            return run_inline(self._job, fn, args)
+        return self._match_pool.submit(self._job, fn, args)
+
+    def drain_ready(self) -> List[Admission]:
+        out = []
+        now = time.perf_counter()
+        while True:
+            try:
+                adm = self._ready.get_nowait()
+            except Empty:
+                break
+            self.stats["ready_wait"].add(now - adm.t_stage)
+            self.stats["total"].add(now - adm.t_submit)
+            out.append(adm)
+        return out
+
+    def queue_depth(self) -> Dict[str, int]:
+        with self._lock:
+            return {"route": self._in_route, "match": self._in_match, "jobs": self._in_jobs,
+                    "ready": self._ready.qsize()}
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue_depth(),
+            "latency": {name: s.as_dict() for name, s in self.stats.items()},
+        }
+
+    def close(self) -> None:
+        for pool in (self._route_pool, self._match_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+
+def req_id_of(adm: Admission) -> str:
+    return adm.req_id if adm.req_id != "unknown" else adm.req.get("request_id", "unknown")
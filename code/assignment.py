@@ -0,0 +1,122 @@
+from typing import Dict, Hashable, List, Tuple
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # pure python Hungarian below
+    linear_sum_assignment = None
+
+HAVE_SCIPY = linear_sum_assignment is not None
+
+Edge = Tuple[Hashable, Hashable]
+
+
+def components(weights: Dict[Edge, float]) -> List[Dict[Edge, float]]:
+    """
+    Split a sparse bipartite graph {(row, col): weight} into its connected
+    components; each one is an independent assignment problem.
+    """
+    parent: Dict[Tuple[int, Hashable], Tuple[int, Hashable]] = {}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for r, c in weights:
+        a, b = (0, r), (1, c)
+        parent.setdefault(a, a)
+        parent.setdefault(b, b)
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[ra] = rb
+
+    out: Dict[Tuple[int, Hashable], Dict[Edge, float]] = {}
+    for e, w in weights.items():
+        out.setdefault(find((0, e[0])), {})[e] = w
+    return list(out.values())
+
+
+def hungarian(cost: List[List[float]]) -> List[int]:
+    """
+    Min-cost assignment of every row of a dense n x m matrix (n <= m) to a
+    distinct column, O(n^2 m). Returns the column of each row.
+    """
+    n, m = len(cost), len(cost[0])
+    inf = float("inf")
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1)  # p[j]: row (1-based) assigned to column j
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            row = cost[i0 - 1]
+            delta, j1 = inf, 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta, j1 = minv[j], j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    cols = [0] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            cols[p[j] - 1] = j - 1
+    return cols
+
+
+def _solve_dense(rows: list, cols: list, weights: Dict[Edge, float]) -> List[Edge]:
+    transpose = len(rows) > len(cols)
+    if transpose:
+        rows, cols = cols, rows
+    # maximize the weight: minimize its negative, a missing edge costs 0 (= unmatched)
+    cost = [[-weights.get((c, r) if transpose else (r, c), 0.0) for c in cols] for r in rows]
+
+    if HAVE_SCIPY:
+        ri, ci = linear_sum_assignment(cost)
+        pairs = [(rows[i], cols[j]) for i, j in zip(ri, ci)]
+    else:
+        pairs = [(rows[i], cols[j]) for i, j in enumerate(hungarian(cost))]
+
+    if transpose:
+        pairs = [(c, r) for r, c in pairs]
+    return [e for e in pairs if e in weights]
+
+
+def max_weight_assignment(weights: Dict[Edge, float]) -> List[Edge]:
+    """
+    Pairs (row, col), each row and each col used at most once, with the largest
+    total weight. weights holds the candidate edges only and must be positive;
+    rows and cols without a chosen edge stay unassigned.
+    """
+    out: List[Edge] = []
+    for comp in components(weights):
+        if len(comp) == 1:
+            out.extend(comp)
+            continue
+        rows = list(dict.fromkeys(r for r, _ in comp))
+        cols = list(dict.fromkeys(c for _, c in comp))
+        out.extend(_solve_dense(rows, cols, comp))
+    return out
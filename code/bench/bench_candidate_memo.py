@@ -0,0 +1,78 @@
+# Unmatched walkers re-evaluated against the same drivers tick after tick, with
+# and without the candidate memo: walking legs requested and matcher time per tick.
+# run from code/:  python -m bench.bench_candidate_memo
+#
+# Legs are costed in process and counted as they would be requested (see
+# bench_corridor). Between ticks walkers walk 1.4 m towards their destination
+# and drivers move on along their route, so pickups are reused until a walker
+# has moved PICKUP_REUSE_M or a driver passes the pickup.
+import time
+
+import candidate_memo
+import local_osrm
+from bench.bench_corridor import counting_legs
+from bench.bench_matching import install_straight_walking, workload
+from spatial_index import DriverGridIndex
+
+
+def advance(drivers, walkers, tick):
+    for w in walkers:
+        (lat, lon), (dlat, dlon) = w.get_pos(), w.route.dest
+        f = 1.4 / max(local_osrm.haversine_m((lat, lon), (dlat, dlon)), 1.4)
+        w.pos = (lat + (dlat - lat) * f, lon + (dlon - lon) * f)
+    if tick % 5 == 0:  # ~50 m per 5 s at 10 m/s
+        for d in drivers:
+            d.idx = min(d.idx + 1, len(d.route.geometry_latlon) - 2)
+            d.pos = d.route.geometry_latlon[d.idx]
+
+
+def run(use_memo, seed, n_drivers, n_walkers, ticks):
+    local_osrm.USE_CANDIDATE_MEMO = use_memo
+    drivers, walkers = workload(seed, n_drivers, n_walkers)
+    index = DriverGridIndex()
+    for d in drivers:
+        index.add(d)
+    legs = [0]
+    local_osrm.walk_fast, local_osrm.walk_fast_many = counting_legs(legs)
+
+    per_tick = []
+    found = []
+    for tick in range(ticks):
+        legs[0] = 0
+        t0 = time.perf_counter()
+        n = 0
+        for w in walkers:
+            n += len(local_osrm.match_candidates(drivers, w, 300.0, driver_index=index))
+        per_tick.append((legs[0], time.perf_counter() - t0))
+        found.append(n)
+        advance(drivers, walkers, tick + 1)
+    return per_tick, found
+
+
+def main():
+    install_straight_walking()
+    n_drivers, n_walkers, ticks, seed = 300, 100, 20, 1
+    print(f"{n_drivers} drivers, {n_walkers} unmatched walkers re-evaluated for {ticks} ticks, seed {seed}")
+    results = {}
+    for use_memo in (False, True):
+        before = candidate_memo.memo_stats()
+        per_tick, found = run(use_memo, seed, n_drivers, n_walkers, ticks)
+        after = candidate_memo.memo_stats()
+        results[use_memo] = found
+        first_legs, first_dt = per_tick[0]
+        rest_legs = sum(l for l, _ in per_tick[1:]) / (ticks - 1)
+        rest_dt = sum(t for _, t in per_tick[1:]) / (ticks - 1)
+        label = "memo   " if use_memo else "no memo"
+        print(f"  {label}  first tick {first_legs:6d} legs {first_dt * 1e3:6.0f} ms   "
+              f"later ticks {rest_legs:8.0f} legs {rest_dt * 1e3:6.0f} ms")
+        if use_memo:
+            hits = {k: after[k] - before[k] for k in after}
+            print(f"           pickup hits {hits['pick_hits']} / misses {hits['pick_misses']}, "
+                  f"dropoff hits {hits['drop_hits']} / misses {hits['drop_misses']}")
+    same = sum(a == b for a, b in zip(results[False], results[True]))
+    print(f"  candidates per tick identical on {same}/{ticks} ticks "
+          f"(pickups are reused within {candidate_memo.PICKUP_REUSE_M:.0f} m)")
+
+
+if __name__ == "__main__":
+    main()
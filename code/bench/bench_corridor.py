@@ -0,0 +1,57 @@
+# Walking legs sent to OSRM while matching a seeded batch, with and without
+# the corridor prefilter; the matches must come out the same.
+# run from code/:  python -m bench.bench_corridor
+#
+# Legs are costed in process (see bench_matching) and counted as they would be
+# requested: one /route call per leg on the per-pair path, no cache.
+import time
+
+import local_osrm
+from bench.bench_matching import install_straight_walking, workload, walk_leg
+from spatial_index import DriverGridIndex
+
+
+def counting_legs(counter):
+    def walk_fast(a, b):
+        counter[0] += 1
+        return walk_leg(a, b)
+
+    def walk_fast_many(pairs):
+        counter[0] += len(pairs)
+        return [walk_leg(a, b) for a, b in pairs]
+    return walk_fast, walk_fast_many
+
+
+def run(use_filter, use_index, seed, n_drivers, n_walkers):
+    local_osrm.USE_CORRIDOR_FILTER = use_filter
+    drivers, walkers = workload(seed, n_drivers, n_walkers)
+    index = None
+    if use_index:
+        index = DriverGridIndex()
+        for d in drivers:
+            index.add(d)
+    legs = [0]
+    local_osrm.walk_fast, local_osrm.walk_fast_many = counting_legs(legs)
+    t0 = time.perf_counter()
+    sims, _, _ = local_osrm.create_matches(drivers, walkers, now_t=0.0, min_saving_m=300.0, driver_index=index)
+    dt = time.perf_counter() - t0
+    pairs = sorted((s.driver_agent.route.start, s.walker_agent.route.start) for s in sims)
+    return legs[0], dt, pairs
+
+
+def main():
+    install_straight_walking()
+    n_drivers, n_walkers, seed = 300, 100, 1
+    print(f"{n_drivers} drivers, {n_walkers} walkers, seed {seed}")
+    for use_index in (False, True):
+        off_legs, off_dt, off_pairs = run(False, use_index, seed, n_drivers, n_walkers)
+        on_legs, on_dt, on_pairs = run(True, use_index, seed, n_drivers, n_walkers)
+        assert on_pairs == off_pairs
+        label = "grid index + " if use_index else ""
+        print(f"  {label}no filter  {off_legs:7d} legs {off_dt * 1e3:7.0f} ms   "
+              f"{label}corridor  {on_legs:7d} legs {on_dt * 1e3:7.0f} ms   "
+              f"saved {1 - on_legs / off_legs:5.1%} of the OSRM calls, {len(on_pairs)} matches both")
+
+
+if __name__ == "__main__":
+    main()
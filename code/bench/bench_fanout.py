@@ -0,0 +1,113 @@
+# CPU per tick for the WebSocket fan-out at 1k subscribers: json.dumps per
+# event + send_str per client (before) vs. one serialization + shared buffer.
+# run from code/:  python -m bench.bench_fanout
+#
+# The sockets are stand-ins that do what aiohttp does before the write: send_str
+# encodes the str to UTF-8 for every client, send_frame takes the bytes as is.
+# The write itself is the same in both paths and left out.
+import asyncio
+import json
+import time
+
+from aiohttp import WSMsgType
+
+import local_osrm
+import wire
+from bench.bench_position_stream import SyntheticCity
+from position_stream import PositionDeltaEncoder, RequestFrameStream
+
+
+class NullWS:
+    closed = False
+
+    def __init__(self):
+        self.bytes = 0
+
+    async def send_str(self, data: str) -> None:
+        self.bytes += len(data.encode("utf-8"))
+
+    async def send_frame(self, data: bytes, opcode: WSMsgType) -> None:
+        self.bytes += len(data)
+
+
+def city_with_requests(n_subscribers: int):
+    # every sim has a walker and a driver request with one subscriber each
+    city = SyntheticCity(n_sims=n_subscribers // 2, n_left_drivers=500, n_left_walkers=500)
+    snap = city.snapshot()
+    for i, f in enumerate(snap["sims"]):
+        f["walker"]["req_id"] = f"w{i}"
+        f["driver"]["req_id"] = f"d{i}"
+    subs = {rid: {NullWS()} for f in snap["sims"] for rid in (f["walker"]["req_id"], f["driver"]["req_id"])}
+    return snap, subs
+
+
+async def per_request_old(snap, subs):
+    # dispatch_frames_by_req_id + broadcaster_by_id before: two events per sim,
+    # each json.dumps'ed, send_str per subscriber
+    t_s = snap["t_s"]
+    for frame in snap["sims"]:
+        for rid in (frame["walker"]["req_id"], frame["driver"]["req_id"]):
+            msg = json.dumps({"type": "position", "data": {"t_s": t_s, "frame": frame}})
+            for ws in subs[rid]:
+                await ws.send_str(msg)
+
+
+async def per_request_new(snap, subs, app):
+    sent = []
+
+    async def collect(_app, rid, buf, coalesce=False):
+        sent.append((rid, buf))
+
+    # the ws_bus queue hop is the same before and after, skip it
+    local_osrm.publish_by_id, orig = collect, local_osrm.publish_by_id
+    try:
+        await local_osrm.dispatch_frames_by_req_id(app, snap)
+    finally:
+        local_osrm.publish_by_id = orig
+    for rid, buf in sent:
+        msg = wire.encode_event(buf)
+        for ws in subs[rid]:
+            await wire.send_encoded(ws, msg)
+
+
+async def global_old(msg_obj, clients):
+    msg = json.dumps(msg_obj)
+    for ws in clients:
+        await ws.send_str(msg)
+
+
+async def global_new(msg_obj, clients):
+    msg = wire.dumps(msg_obj)
+    for ws in clients:
+        await wire.send_encoded(ws, msg)
+
+
+def cpu_ms(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(3):
+        t0 = time.process_time()
+        for _ in range(repeat):
+            asyncio.run(fn())
+        best = min(best, (time.process_time() - t0) / repeat)
+    return best * 1e3
+
+
+def main():
+    n = 1000
+    snap, subs = city_with_requests(n)
+    # every frame counts as changed, the per-request stream never skips here
+    app = {"subscribers": subs, "req_stream": RequestFrameStream(min_move_m=-1.0)}
+    clients = [NullWS() for _ in range(n)]
+    keyframe = PositionDeltaEncoder().encode(snap)
+
+    print(f"{n} subscribers, orjson={wire.HAVE_ORJSON}, send_frame={wire.HAVE_SEND_FRAME}")
+    old = cpu_ms(lambda: per_request_old(snap, subs), 5)
+    new = cpu_ms(lambda: per_request_new(snap, subs, app), 5)
+    print(f"per-request frames ({len(snap['sims'])} sims)  before {old:8.2f} ms  after {new:8.2f} ms  ({old / new:.1f}x)")
+    old = cpu_ms(lambda: global_old(keyframe, clients), 3)
+    new = cpu_ms(lambda: global_new(keyframe, clients), 3)
+    print(f"global keyframe to every client     before {old:8.2f} ms  after {new:8.2f} ms  ({old / new:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
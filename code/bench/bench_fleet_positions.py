@@ -0,0 +1,57 @@
+# Per-tick cost: AgentState.update_position loop vs FleetPositionEngine.
+# run from code/:  python -m bench.bench_fleet_positions
+import copy
+import random
+import time
+
+from AgentState import AgentState
+from RouteBase import CompactRoute
+from bench.bench_haversine import synthetic_polyline
+from fleet_positions import FleetPositionEngine
+from local_osrm import cum_array
+
+
+def synthetic_fleet(count: int, n_points: int = 300, seed: int = 7):
+    rnd = random.Random(seed)
+    agents = []
+    for k in range(count):
+        pts = synthetic_polyline(n_points, seed=k)
+        seg_t = [rnd.uniform(1.0, 4.0) for _ in range(n_points - 1)]
+        seg_d = [t * 10.0 for t in seg_t]
+        r = CompactRoute(start=pts[0], dest=pts[-1], dist=sum(seg_d), duration=sum(seg_t),
+                         duration_list=seg_t, cum_time_s=cum_array(seg_t), geometry_latlon=pts,
+                         seg_dist_m=seg_d, cum_dist_m=cum_array(seg_d))
+        agents.append(AgentState(route=r, start_offset_s=rnd.uniform(-300, 60)))
+    return agents
+
+
+def per_tick(update, agents, ticks: int, dt: float) -> float:
+    t0 = time.perf_counter()
+    for k in range(ticks):
+        update(agents, k * dt)
+    return (time.perf_counter() - t0) / ticks
+
+
+def scalar_loop(agents, t):
+    for a in agents:
+        a.update_position(t)
+
+
+def main():
+    ticks, dt = 50, 1.0
+    print(f"{'agents':>8} {'loop ms':>9} {'engine ms':>10} {'x':>6}")
+    for count in (1_000, 5_000, 10_000, 20_000):
+        agents = synthetic_fleet(count)
+        ref = copy.deepcopy(agents)
+
+        engine = FleetPositionEngine()
+        engine.update(agents, 0.0)  # registration is a one-off per agent
+
+        loop_s = per_tick(scalar_loop, ref, ticks, dt)
+        vec_s = per_tick(engine.update, agents, ticks, dt)
+        assert all(a.idx == b.idx for a, b in zip(agents, ref))
+        print(f"{count:8d} {loop_s * 1e3:9.2f} {vec_s * 1e3:10.2f} {loop_s / vec_s:6.1f}")
+
+
+if __name__ == "__main__":
+    main()
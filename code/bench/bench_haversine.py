@@ -0,0 +1,97 @@
+# Micro-benchmark: scalar vs NumPy top-k / closest-point on driver polylines.
+# run from code/:  python -m bench.bench_haversine
+import random
+import time
+from typing import List
+
+import numpy as np
+
+from RouteBase import LatLon
+from geometry import as_latlon_array, haversine_np
+from local_osrm import haversine_m
+
+
+# the per-vertex searches the matcher used before route_index.SegmentIndex
+def topk_by_haversine_py(points: List[LatLon], target: LatLon, k: int) -> list[int]:
+    idx_d = [(i, haversine_m(p, target)) for i, p in enumerate(points)]
+    idx_d.sort(key=lambda t: t[1])
+    return [i for i, _ in idx_d[:min(k, len(idx_d))]]
+
+
+def closest_point_index_py(points: List[LatLon], target: LatLon) -> int:
+    best_i = 0
+    best_d = float("inf")
+    for i, p in enumerate(points):
+        d = haversine_m(p, target)
+        if d < best_d:
+            best_d = d
+            best_i = i
+    return best_i
+
+
+def topk_by_haversine_np(points, target: LatLon, k: int) -> List[int]:
+    arr = points if isinstance(points, np.ndarray) else as_latlon_array(points)
+    n = arr.shape[0]
+    if n == 0 or k <= 0:
+        return []
+
+    d = haversine_np(arr, target)
+    k = min(k, n)
+    if k < n:
+        idx = np.argpartition(d, k - 1)[:k]
+    else:
+        idx = np.arange(n)
+    # nearest first, ties by index (same order as the stable python sort)
+    idx = idx[np.lexsort((idx, d[idx]))]
+    return idx.tolist()
+
+
+def closest_point_index_np(points, target: LatLon) -> int:
+    arr = points if isinstance(points, np.ndarray) else as_latlon_array(points)
+    if arr.shape[0] == 0:
+        return 0
+    return int(np.argmin(haversine_np(arr, target)))
+
+
+def synthetic_polyline(n: int, seed: int = 1):
+    # OSRM overview=full style: ~10-30 m between points
+    rnd = random.Random(seed)
+    lat, lon = 51.2562, 7.1508
+    pts = []
+    for _ in range(n):
+        lat += rnd.uniform(-0.0002, 0.0001)
+        lon += rnd.uniform(-0.0004, 0.0001)
+        pts.append((lat, lon))
+    return pts
+
+
+def timeit(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(3):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        best = min(best, (time.perf_counter() - t0) / repeat)
+    return best
+
+
+def main():
+    target = (51.22, 6.95)
+    print(f"{'points':>8} {'topk py':>10} {'topk np':>10} {'x':>6} {'closest py':>11} {'closest np':>11} {'x':>6}")
+    for n in (500, 2000, 5000, 10000, 20000):
+        pts = synthetic_polyline(n)
+        arr = as_latlon_array(pts)
+        assert topk_by_haversine_py(pts, target, 15) == topk_by_haversine_np(arr, target, 15)
+        assert closest_point_index_py(pts, target) == closest_point_index_np(arr, target)
+
+        rep = max(3, 20000 // n)
+        t_py = timeit(lambda: topk_by_haversine_py(pts, target, 15), rep)
+        t_np = timeit(lambda: topk_by_haversine_np(arr, target, 15), rep)
+        c_py = timeit(lambda: closest_point_index_py(pts, target), rep)
+        c_np = timeit(lambda: closest_point_index_np(arr, target), rep)
+        print(f"{n:>8} {t_py * 1e3:>8.2f}ms {t_np * 1e3:>8.3f}ms {t_py / t_np:>5.0f}x "
+              f"{c_py * 1e3:>9.2f}ms {c_np * 1e3:>9.3f}ms {c_py / c_np:>5.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Greedy (walkers in arrival order) vs. batch assignment on one batch of
+# requests in a synthetic city: time per batch, matches, total walking saved.
+# run from code/:  python -m bench.bench_matching
+#
+# Walking legs are straight lines at 1.4 m/s computed in process, so the
+# numbers are matcher CPU, not OSRM latency (both modes cost the same pairs).
+import random
+import time
+
+import assignment
+import local_osrm
+from AgentState import AgentState
+from RouteBase import CompactRoute, cumulative
+from spatial_index import DriverGridIndex
+
+WALK_MPS = 1.4
+DRIVE_MPS = 10.0
+CITY = ((51.19, 6.73), (51.27, 6.85))
+
+
+def polyline_route(pts, speed, profile):
+    seg_d = [local_osrm.haversine_m(pts[i], pts[i + 1]) for i in range(len(pts) - 1)]
+    seg_t = [d / speed for d in seg_d]
+    return CompactRoute(start=pts[0], dest=pts[-1], dist=sum(seg_d), duration=sum(seg_t),
+                        duration_list=seg_t, cum_time_s=cumulative(seg_t), geometry_latlon=pts,
+                        seg_dist_m=seg_d, cum_dist_m=cumulative(seg_d), profile=profile)
+
+
+def walk_leg(a, b):
+    m = local_osrm.haversine_m(a, b)
+    return m, m / WALK_MPS
+
+
+def install_straight_walking():
+    local_osrm.USE_TABLE = False
+    local_osrm.walk_fast = walk_leg
+    local_osrm.walk_fast_many = lambda pairs: [walk_leg(a, b) for a, b in pairs]
+    local_osrm.build_walker_routes_full = lambda legs: [
+        polyline_route([a, b], WALK_MPS, "walking") for a, b in legs]
+
+
+def rand_pt(rnd):
+    (lat0, lon0), (lat1, lon1) = CITY
+    return lat0 + rnd.random() * (lat1 - lat0), lon0 + rnd.random() * (lon1 - lon0)
+
+
+def driver(rnd):
+    # L-shaped drive through the city, a point every ~50 m
+    a, b = rand_pt(rnd), rand_pt(rnd)
+    corner = (b[0], a[1]) if rnd.random() < 0.5 else (a[0], b[1])
+    pts = []
+    for p, q in ((a, corner), (corner, b)):
+        n = max(2, int(local_osrm.haversine_m(p, q) / 50))
+        pts += [(p[0] + (q[0] - p[0]) * i / n, p[1] + (q[1] - p[1]) * i / n) for i in range(n)]
+    pts.append(b)
+    return AgentState(route=polyline_route(pts, DRIVE_MPS, "driving"), pos=a)
+
+
+def walker(rnd):
+    a = rand_pt(rnd)
+    while True:
+        b = rand_pt(rnd)
+        if 1500 < local_osrm.haversine_m(a, b) < 4000:
+            return AgentState(route=polyline_route([a, b], WALK_MPS, "walking"), pos=a)
+
+
+def workload(seed, n_drivers, n_walkers):
+    rnd = random.Random(seed)
+    return [driver(rnd) for _ in range(n_drivers)], [walker(rnd) for _ in range(n_walkers)]
+
+
+def run(mode, seed, n_drivers, n_walkers):
+    drivers, walkers = workload(seed, n_drivers, n_walkers)
+    index = DriverGridIndex()
+    for d in drivers:
+        index.add(d)
+    t0 = time.perf_counter()
+    sims, _, _ = local_osrm.create_matches(drivers, walkers, now_t=0.0, min_saving_m=300.0,
+                                           driver_index=index, batch=mode == "batch")
+    dt = time.perf_counter() - t0
+    return dt, len(sims), sum(s.match.saving_duration_seconds for s in sims)
+
+
+def main():
+    install_straight_walking()
+    print(f"scipy={assignment.HAVE_SCIPY}")
+    for n_drivers, n_walkers in ((100, 50), (300, 200), (500, 500)):
+        tot = {"greedy": [0.0, 0, 0.0], "batch": [0.0, 0, 0.0]}
+        seeds = range(5)
+        for seed in seeds:
+            for mode in tot:
+                for k, v in enumerate(run(mode, seed, n_drivers, n_walkers)):
+                    tot[mode][k] += v
+        print(f"{n_drivers} drivers, {n_walkers} walkers per batch ({len(seeds)} batches)")
+        for mode, (dt, n, saved) in tot.items():
+            print(f"  {mode:6s}  {dt / len(seeds) * 1e3:8.1f} ms/batch  "
+                  f"{n_walkers * len(seeds) / dt:8.0f} walkers/s  "
+                  f"matches {n:5d}  saved {saved / 3600:8.1f} h")
+
+
+if __name__ == "__main__":
+    main()
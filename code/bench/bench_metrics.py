@@ -0,0 +1,41 @@
+# Cost of the instrumentation: a timed() call enabled / disabled vs. the bare
+# function, and one headless run with metrics on and off.
+# run from code/:  python -m bench.bench_metrics
+import time
+
+import headless
+import metrics
+
+
+def per_call_ns(fn, n=1_000_000):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn(1)
+    return (time.perf_counter() - t0) / n * 1e9
+
+
+def main():
+    h = metrics.Histogram("bench_seconds", "bench")
+
+    def bare(x):
+        return x
+
+    wrapped = metrics.timed(h)(bare)
+    base = per_call_ns(bare)
+    metrics.ENABLED = False
+    off = per_call_ns(wrapped)
+    metrics.ENABLED = True
+    on = per_call_ns(wrapped)
+    print(f"call: bare {base:5.0f} ns (also DRIVEBY_METRICS=0: not wrapped)   "
+          f"timed, disabled at runtime {off:5.0f} ns   timed, enabled {on:5.0f} ns")
+
+    for enabled in (False, True, False, True):
+        metrics.ENABLED = enabled
+        r = headless.run_headless(ticks=200, seed=2, drivers=100, walkers=60)
+        print(f"headless, metrics {'on ' if enabled else 'off'}: {r['ticks_per_s']:6.1f} ticks/s   "
+              f"p50 {r['tick_ms']['p50']:6.2f} ms   p99 {r['tick_ms']['p99']:6.2f} ms")
+    metrics.ENABLED = True
+
+
+if __name__ == "__main__":
+    main()
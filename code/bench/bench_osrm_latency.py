@@ -0,0 +1,70 @@
+# Routing client and matcher under OSRM latency from 1 to 200 ms, against
+# FakeOsrmServer (grid graph) over real HTTP: no OSRM or map data needed.
+# run from code/:  python -m bench.bench_osrm_latency [--error-rate 0.02]
+import argparse
+import random
+import time
+
+import headless
+import local_osrm
+from fake_osrm import FakeOsrm, FakeOsrmServer
+from osrm_client import OsrmClient
+
+LATENCIES_MS = (1, 5, 20, 50, 100, 200)
+
+
+def client_round(url, n_legs, seed):
+    # n_legs distinct walking legs through walk_fast_many (concurrent, capped
+    # by max_in_flight), then 20 full routes one after the other
+    rnd = random.Random(seed)
+    legs = [(headless._in_city(rnd), headless._in_city(rnd)) for _ in range(n_legs)]
+    local_osrm.OSRM_DRIVE = local_osrm.OSRM_WALK = url
+    local_osrm.OSRM = OsrmClient(max_in_flight=32, timeout_s=20.0, retries=2)
+    local_osrm.clear_route_caches()
+    try:
+        t0 = time.perf_counter()
+        local_osrm.walk_fast_many(legs)
+        batch_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for a, b in legs[:20]:
+            local_osrm.fetch_route(a, b, "driving")
+        seq_ms = (time.perf_counter() - t0) / 20 * 1e3
+    finally:
+        local_osrm.OSRM.close()
+        local_osrm.clear_route_caches()
+    return n_legs / batch_s, seq_ms
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--legs", type=int, default=400)
+    ap.add_argument("--ticks", type=int, default=20)
+    args = ap.parse_args()
+
+    saved = local_osrm.OSRM, local_osrm.DISK_CACHE, local_osrm.OSRM_DRIVE, local_osrm.OSRM_WALK
+    local_osrm.DISK_CACHE = None
+    print(f"fake OSRM over HTTP, grid graph, error rate {args.error_rate:.0%}, "
+          f"client max_in_flight 32; matcher: headless, {args.ticks} ticks, 30 drivers + 20 walkers")
+    print(f"{'latency':>8s} {'legs/s':>8s} {'route ms':>9s}   {'ticks/s':>8s} {'p50 ms':>8s} "
+          f"{'p99 ms':>8s} {'matches':>8s} {'route %':>8s} {'match %':>8s} {'http':>6s} {'5xx':>5s}")
+    try:
+        for latency_ms in LATENCIES_MS:
+            with FakeOsrmServer(FakeOsrm(graph="grid"), latency_ms=latency_ms, jitter_ms=latency_ms * 0.2,
+                                error_rate=args.error_rate, seed=latency_ms) as srv:
+                legs_s, seq_ms = client_round(srv.url, args.legs, seed=1)
+                r = headless.run_headless(ticks=args.ticks, seed=1, drivers=30, walkers=20,
+                                          driver_rate=0.3, walker_rate=0.5, graph="grid", osrm_url=srv.url)
+                # route and match run inline in the admit stage
+                tick_ms = sum(r["tick_ms_series"])
+                route_share, match_share = (r["admission_ms"][k] / tick_ms for k in ("route", "match"))
+                print(f"{latency_ms:6d} ms {legs_s:8.0f} {seq_ms:9.1f}   {r['ticks_per_s']:8.2f} "
+                      f"{r['tick_ms']['p50']:8.1f} {r['tick_ms']['p99']:8.1f} {r['matches']:8d} "
+                      f"{route_share:8.0%} {match_share:8.0%} "
+                      f"{srv.stats['requests']:6d} {srv.stats['errors']:5d}")
+    finally:
+        local_osrm.OSRM, local_osrm.DISK_CACHE, local_osrm.OSRM_DRIVE, local_osrm.OSRM_WALK = saved
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Bytes per tick on /ws: full snapshots vs keyframes + deltas, 5k agents.
+# run from code/:  python -m bench.bench_position_stream
+import json
+import random
+import uuid
+
+from position_stream import PositionDeltaEncoder
+
+PHASE_SPEED = {  # walker m/s per phase, the driver always drives
+    "WALK_TO_PICKUP": 1.4, "WAIT_AT_PICKUP": 0.0, "RIDE_WITH_DRIVER": None,
+    "WALK_FROM_DROPOFF": 1.4, "DONE": 0.0,
+}
+M_DEG = 1 / 111320.0
+
+
+class SyntheticCity:
+    """
+    n_sims matches (driver + walker each) and the leftovers, so that
+    2 * n_sims + n_left_drivers + n_left_walkers agents move every tick.
+    """
+
+    def __init__(self, n_sims=1500, n_left_drivers=1000, n_left_walkers=1000, seed=11):
+        rnd = self.rnd = random.Random(seed)
+        phases = list(PHASE_SPEED)
+        self.t = 0.0
+        self.sims = []
+        for _ in range(n_sims):
+            w = [51.2 + rnd.random() * 0.1, 6.7 + rnd.random() * 0.2]
+            d = [51.2 + rnd.random() * 0.1, 6.7 + rnd.random() * 0.2]
+            self.sims.append({"id": str(uuid.UUID(int=rnd.getrandbits(128))), "phase": rnd.choice(phases),
+                              "w": w, "d": d, "idx": 0, "p": 0, "q": 0,
+                              "wid": str(uuid.uuid4()), "did": str(uuid.uuid4())})
+        self.left_d = {str(uuid.uuid4()): [51.2 + rnd.random() * 0.1, 6.7 + rnd.random() * 0.2]
+                       for _ in range(n_left_drivers)}
+        self.left_w = {str(uuid.uuid4()): [51.2 + rnd.random() * 0.1, 6.7 + rnd.random() * 0.2]
+                       for _ in range(n_left_walkers)}
+
+    def step(self, dt=1.0):
+        self.t += dt
+        for s in self.sims:
+            if s["phase"] != "DONE":
+                s["d"][0] += 10.0 * dt * M_DEG
+                if self.rnd.random() < 0.1:  # ~every 100 m a new OSRM point
+                    s["idx"] += 1
+            v = PHASE_SPEED[s["phase"]]
+            if v is None:
+                s["w"] = list(s["d"])
+            elif v:
+                s["w"][1] += v * dt * M_DEG * 1.6
+        for p in self.left_d.values():
+            p[0] += 10.0 * dt * M_DEG
+        for p in self.left_w.values():
+            p[1] += 1.4 * dt * M_DEG * 1.6
+
+    def snapshot(self):
+        return {
+            "t_s": self.t,
+            "sims": [{"sim_id": s["id"], "phase": s["phase"],
+                      "walker": {"agent_id": s["wid"], "req_id": None, "lat": s["w"][0], "lon": s["w"][1],
+                                 "pIdx": s["p"], "dIdx": s["q"]},
+                      "driver": {"agent_id": s["did"], "req_id": None, "lat": s["d"][0], "lon": s["d"][1],
+                                 "idx": s["idx"]},
+                      "meta": {"t_driver_pickup": 412.3, "t_driver_dropoff": 1093.8}}
+                     for s in self.sims],
+            "leftover_drivers": [{"lat": p[0], "lon": p[1], "agent_id": k} for k, p in self.left_d.items()],
+            "leftover_walkers": [{"lat": p[0], "lon": p[1], "agent_id": k} for k, p in self.left_w.items()],
+        }
+
+
+def run(min_move_m, ticks: int, dt: float):
+    city = SyntheticCity()
+    enc = PositionDeltaEncoder(min_move_m=min_move_m) if min_move_m is not None else None
+    total = 0
+    for _ in range(ticks):
+        city.step(dt)
+        snap = city.snapshot()
+        msg = enc.encode(snap) if enc else {"type": "positions", "data": snap}
+        total += len(json.dumps(msg))
+    return total / ticks
+
+
+def main():
+    ticks = 100
+    print("5000 agents (1500 sims + 1000 + 1000 leftovers), keyframe every 100 ticks")
+    for dt in (1.0, 0.25):
+        full = run(None, ticks, dt)
+        print(f"sim dt {dt:>4} s   full snapshot {full / 1024:8.1f} KiB/tick")
+        for m in (1.0, 2.0, 5.0):
+            d = run(m, ticks, dt)
+            print(f"{'':17} delta >{m:3.0f} m   {d / 1024:8.1f} KiB/tick  ({d / full:.0%})")
+
+
+if __name__ == "__main__":
+    main()
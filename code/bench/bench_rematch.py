@@ -0,0 +1,49 @@
+# Pairs scored per tick when leftovers are matched again: full re-scan of every
+# walker each tick vs. IncrementalMatcher (rescore due agents only).
+# run from code/:  python -m bench.bench_rematch
+#
+# score_fn is a counting stand-in, so this measures how much matching work a
+# tick asks for (each scored pair is OSRM walking legs in the real loop).
+import random
+import time
+
+from bench.bench_matching import driver, walker
+from rematch import IncrementalMatcher
+from spatial_index import DriverGridIndex
+
+
+def no_match(walker_agent, drivers):
+    return []
+
+
+def main():
+    ticks, dt = 120, 1.0
+    for n in (500, 2000, 5000):
+        rnd = random.Random(5)
+        drivers = [driver(rnd) for _ in range(n)]
+        walkers = [walker(rnd) for _ in range(n)]
+        index = DriverGridIndex()
+        for d in drivers:
+            index.add(d)
+
+        # before: every leftover walker against every nearby driver, every tick
+        t0 = time.perf_counter()
+        pairs = sum(len(index.candidates(w.get_pos(), w.route.dest, 1500.0)) for w in walkers)
+        full_ms = (time.perf_counter() - t0) * 1e3
+
+        m = IncrementalMatcher(no_match, lambda c: c.saving_s, index, max_rescore=64)
+        for d in drivers:
+            m.add("driver", d, rnd.random() * 60.0)
+        for w in walkers:
+            m.add("walker", w, rnd.random() * 60.0)
+        t0 = time.perf_counter()
+        for k in range(ticks):
+            m.step(60.0 + k * dt)
+        inc_ms = (time.perf_counter() - t0) * 1e3 / ticks
+        s = m.stats()
+        print(f"{n:5d} walkers + {n:5d} drivers  full re-scan {pairs:8d} pairs {full_ms:8.1f} ms/tick   "
+              f"incremental {s['scored_pairs'] / ticks:8.1f} pairs {inc_ms:6.2f} ms/tick")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Nearest-point queries on one driver route: top-k vertices by haversine over
+# the route tail (before) vs. SegmentIndex.nearest (after), and how much closer
+# the projected pickups are than the closest vertex.
+# run from code/:  python -m bench.bench_route_index
+import math
+import random
+import time
+
+import local_osrm
+from RouteBase import CompactRoute, cumulative
+from bench.bench_haversine import topk_by_haversine_np
+from geometry import route_array
+from route_index import SegmentIndex
+
+M_DEG = 1 / 111320.0
+
+
+def wiggly_route(n_points, step_m, rnd):
+    # a drive that keeps turning, a point every step_m on average
+    lat, lon, heading = 51.2, 6.75, 0.0
+    pts = [(lat, lon)]
+    for _ in range(n_points - 1):
+        heading += rnd.gauss(0.0, 0.3)
+        d = step_m * (0.2 + 1.6 * rnd.random())
+        lat += math.cos(heading) * d * M_DEG
+        lon += math.sin(heading) * d * M_DEG / math.cos(math.radians(lat))
+        pts.append((lat, lon))
+    seg_d = [local_osrm.haversine_m(pts[i], pts[i + 1]) for i in range(len(pts) - 1)]
+    seg_t = [d / 10.0 for d in seg_d]
+    return CompactRoute(start=pts[0], dest=pts[-1], dist=sum(seg_d), duration=sum(seg_t),
+                        duration_list=seg_t, cum_time_s=cumulative(seg_t), geometry_latlon=pts,
+                        seg_dist_m=seg_d, cum_dist_m=cumulative(seg_d))
+
+
+def near_targets(route, n, rnd, within_m=300.0):
+    pts = route.geometry_latlon
+    out = []
+    for _ in range(n):
+        lat, lon = pts[rnd.randrange(len(pts))]
+        out.append((lat + rnd.uniform(-within_m, within_m) * M_DEG,
+                    lon + rnd.uniform(-within_m, within_m) * M_DEG * 1.6))
+    return out
+
+
+def per_query_us(fn, targets):
+    t0 = time.perf_counter()
+    for t in targets:
+        fn(t)
+    return (time.perf_counter() - t0) / len(targets) * 1e6
+
+
+def main():
+    rnd = random.Random(4)
+    k = 15
+    for n_points in (200, 2_000, 20_000):
+        route = wiggly_route(n_points, 40.0, rnd)
+        arr = route_array(route)
+        targets = near_targets(route, 500, rnd)
+        after = [rnd.randrange(n_points // 2) for _ in targets]
+
+        t0 = time.perf_counter()
+        index = SegmentIndex(route)
+        build_ms = (time.perf_counter() - t0) * 1e3
+
+        it = iter(after)
+        old = per_query_us(lambda t: topk_by_haversine_np(arr[next(it):], t, k), targets)
+        it = iter(after)
+        new = per_query_us(lambda t: index.nearest(t, k, after=(next(it), 0.0)), targets)
+
+        gain = []
+        for t, a in zip(targets, after):
+            v = min(local_osrm.haversine_m(tuple(arr[a + i]), t)
+                    for i in topk_by_haversine_np(arr[a:], t, 1))
+            p = index.nearest(t, 1, after=(a, 0.0))[0]
+            gain.append(v - local_osrm.haversine_m(p.point, t))
+        gain.sort()
+        print(f"{n_points:6d} points  build {build_ms:7.1f} ms   top-{k} vertices {old:7.1f} us   "
+              f"segment index {new:7.1f} us   pickup closer by median {gain[len(gain) // 2]:5.1f} m, "
+              f"p90 {gain[int(len(gain) * 0.9)]:5.1f} m")
+
+
+if __name__ == "__main__":
+    main()
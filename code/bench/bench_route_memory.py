@@ -0,0 +1,61 @@
+# Memory benchmark: list-backed DriverRoute vs array-backed CompactRoute.
+# run from code/:  python -m bench.bench_route_memory [n_routes] [points_per_route]
+import sys
+import time
+import tracemalloc
+
+from RouteBase import CompactRoute, DriverRoute
+from bench.bench_haversine import synthetic_polyline
+from local_osrm import cum_array
+
+
+def osrm_like(n_points: int, seed: int):
+    # the lists an OSRM /route response is parsed into
+    pts = synthetic_polyline(n_points, seed)
+    seg_d = [12.0 + (i % 7) for i in range(n_points - 1)]
+    seg_t = [d / 10.0 for d in seg_d]
+    return dict(
+        start=pts[0], dest=pts[-1], dist=sum(seg_d), duration=sum(seg_t),
+        duration_list=seg_t, cum_time_s=cum_array(seg_t),
+        geometry_latlon=pts, seg_dist_m=seg_d, cum_dist_m=cum_array(seg_d),
+        profile="driving", nodes=list(range(10**9, 10**9 + n_points)),
+    )
+
+
+def measure(cls, n_routes: int, n_points: int):
+    # parsed lists are traced too: DriverRoute keeps them, CompactRoute copies
+    # them into arrays and lets them go
+    tracemalloc.start()
+    raw = [osrm_like(n_points, seed) for seed in range(n_routes)]
+    t0 = time.perf_counter()
+    routes = [cls(**kw) for kw in raw]
+    build_s = time.perf_counter() - t0
+    del raw
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # the hot path of the tick loop
+    t0 = time.perf_counter()
+    for r in routes:
+        for k in range(0, int(r.duration), 5):
+            r.get_pos_at_time(float(k))
+    pos_s = time.perf_counter() - t0
+
+    return size, build_s, pos_s
+
+
+def main():
+    n_routes = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    n_points = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    print(f"{n_routes} routes x {n_points} points")
+    print(f"{'':>14} {'MiB':>9} {'B/point':>9} {'build s':>9} {'pos s':>9}")
+    base = None
+    for cls in (DriverRoute, CompactRoute):
+        size, build_s, pos_s = measure(cls, n_routes, n_points)
+        base = base or size
+        print(f"{cls.__name__:>14} {size / 2**20:9.1f} {size / (n_routes * n_points):9.1f} "
+              f"{build_s:9.2f} {pos_s:9.2f}   ({size / base:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# Routes message for 1k concurrent matches: full inline geometry (the old
+# payload, rebroadcast on every change) vs. polyline geometries by route id,
+# a keyframe once and a delta per change.
+# run from code/:  python -m bench.bench_routes_payload [--matches 1000]
+import argparse
+import base64
+import random
+import time
+from array import array
+from types import SimpleNamespace
+
+import headless
+from MatchSimulation import Phase
+from RouteBase import CompactRoute
+from fake_osrm import FakeOsrm
+from local_osrm import build_routes_payload
+from route_stream import RouteStream
+from wire import dumps
+
+
+def fetch(fake, a, b, profile):
+    path = (f"/route/v1/{profile}/{a[1]},{a[0]};{b[1]},{b[0]}"
+            f"?overview=full&geometries=geojson&annotations=true")
+    return CompactRoute.from_osrm(a, b, profile, fake.handle(path)["routes"][0])
+
+
+def make_sim(fake, rnd, match_id):
+    d0, d1 = headless._in_city(rnd), headless._in_city(rnd)
+    driver = fetch(fake, d0, d1, "driving")
+    n = len(driver.geometry_latlon)
+    i, j = sorted(rnd.sample(range(n), 2)) if n > 1 else (0, 0)
+    pickup, dropoff = driver.geometry_latlon[i], driver.geometry_latlon[j]
+    m = SimpleNamespace(walk_route_to_pickup=fetch(fake, headless._in_city(rnd), pickup, "walking"),
+                        walk_route_from_dropoff=fetch(fake, dropoff, headless._in_city(rnd), "walking"),
+                        pickup=pickup, dropoff=dropoff, pickup_index=i, dropoff_index=j)
+    return SimpleNamespace(match_id=match_id, phase=Phase.WALK_TO_PICKUP, match=m,
+                           driver_agent=SimpleNamespace(route=driver))
+
+
+def legacy_payload(sims, version):
+    # build_routes_payload before route ids: every geometry inline, every time
+    routes = []
+    for sim in sims:
+        if sim.phase != Phase.DONE:
+            m = sim.match
+            routes.append({
+                "match_id": sim.match_id,
+                "driver_route": {"geometry_latlon": list(sim.driver_agent.route.geometry_latlon)},
+                "walk_to_pickup": {"geometry_latlon": list(m.walk_route_to_pickup.geometry_latlon)},
+                "walk_from_dropoff": {"geometry_latlon": list(m.walk_route_from_dropoff.geometry_latlon)},
+                "points": {"pickup": m.pickup, "dropoff": m.dropoff},
+                "idx": {"pickup": m.pickup_index, "dropoff": m.dropoff_index}})
+    return {"routes_version": version, "routes": routes}
+
+
+def timed(fn, n=5):
+    best, out = float("inf"), None
+    for _ in range(n):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--matches", type=int, default=1000)
+    ap.add_argument("--changes", type=int, default=50)
+    args = ap.parse_args()
+
+    rnd = random.Random(7)
+    fake = FakeOsrm(graph="grid")
+    sims = [make_sim(fake, rnd, k) for k in range(args.matches)]
+    points = sum(len(s.driver_agent.route.geometry_latlon) + len(s.match.walk_route_to_pickup.geometry_latlon)
+                 + len(s.match.walk_route_from_dropoff.geometry_latlon) for s in sims)
+    print(f"{args.matches} matches, {3 * args.matches} routes, {points} points")
+
+    s, buf = timed(lambda: dumps({"type": "routes", "data": legacy_payload(sims, 0.0)}))
+    print(f"inline lat/lon (per change) {len(buf) / 1e6:7.2f} MB  build+encode {s * 1e3:7.1f} ms")
+
+    f32 = sum(len(base64.b64encode(array("f", r.latlon_buffer).tobytes()))
+              for s in sims for r in (s.driver_agent.route, s.match.walk_route_to_pickup,
+                                      s.match.walk_route_from_dropoff))
+    print(f"  for reference, the geometries as base64 float32: {f32 / 1e6:.2f} MB")
+
+    stream = RouteStream()
+    t0 = time.perf_counter()
+    key = stream.encode(build_routes_payload(sims, 0.0, stream))
+    buf = dumps(key)
+    s = time.perf_counter() - t0
+    print(f"keyframe, polylines (once)  {len(buf) / 1e6:7.2f} MB  build+encode {s * 1e3:7.1f} ms")
+    s, buf = timed(lambda: dumps(stream.keyframe()))
+    print(f"keyframe replay (new client) {len(buf) / 1e6:6.2f} MB  encode {s * 1e3:7.1f} ms")
+
+    # steady state: one match ends and a new one starts per change
+    sizes, times = [], []
+    next_id = args.matches
+    for _ in range(args.changes):
+        live = [x for x in sims if x.phase != Phase.DONE]
+        rnd.choice(live).phase = Phase.DONE
+        sims.append(make_sim(fake, rnd, next_id))
+        next_id += 1
+        t0 = time.perf_counter()
+        buf = dumps(stream.encode(build_routes_payload(sims, float(next_id), stream)))
+        times.append(time.perf_counter() - t0)
+        sizes.append(len(buf))
+    times.sort()
+    print(f"delta per change           {sum(sizes) / len(sizes) / 1e3:7.2f} kB  build+encode "
+          f"p50 {times[len(times) // 2] * 1e3:6.2f} ms  max {times[-1] * 1e3:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# Soak: hours of simulated time at a steady arrival rate, with and without
+# Lifecycle retiring finished rides. Without it every match ever made stays
+# in the tick (sims, snapshot, encode) and the tick cost grows with time;
+# with it the cost follows the rides that are still active.
+# run from code/:  python -m bench.bench_soak [hours] [window_min]
+import sys
+
+from headless import run_headless
+
+
+def windows(series, per):
+    return [sum(series[i:i + per]) / len(series[i:i + per]) for i in range(0, len(series), per)]
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    window_min = float(sys.argv[2]) if len(sys.argv) > 2 else 30.0
+    ticks = int(hours * 3600)
+    per = int(window_min * 60)
+
+    runs = {}
+    for retire in (False, True):
+        r = run_headless(ticks=ticks, dt_s=1.0, seed=1, drivers=100, walkers=50,
+                         driver_rate=0.1, walker_rate=0.25, retire=retire)
+        runs[retire] = r
+        f = r["final"]
+        print(f"retire={retire!s:5s} {r['wall_s']:6.1f} s wall, {r['matches']} matches, "
+              f"final {f['sims']} sims / {f['leftover_drivers']} drivers / {f['leftover_walkers']} walkers"
+              + (f", retired {f['retired']}" if retire else ""))
+
+    print(f"{'window':>8s} {'keep all ms':>12s} {'retire ms':>10s}")
+    keep, ret = (windows(runs[x]["tick_ms_series"], per) for x in (False, True))
+    for i, (a, b) in enumerate(zip(keep, ret)):
+        print(f"{(i + 1) * window_min:6.0f}m {a:12.3f} {b:10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# State store: what recording costs the tick thread, what the writer does
+# per batch, and how long a restart takes from the log and from a snapshot.
+# run from code/:  python -m bench.bench_state_store [n_drivers] [n_walkers]
+import os
+import sys
+import tempfile
+import time
+
+import local_osrm
+from bench.bench_matching import install_straight_walking, workload
+from spatial_index import DriverGridIndex
+from state_store import StateStore, restore_state
+
+
+def state(n_drivers, n_walkers):
+    drivers, walkers = workload(1, n_drivers, n_walkers)
+    index = DriverGridIndex()
+    for d in drivers:
+        index.add(d)
+    sims, drivers, walkers = local_osrm.create_matches(drivers, walkers, now_t=0.0, min_saving_m=300.0,
+                                                       driver_index=index)
+    return sims, drivers, walkers
+
+
+def timed_restore(path):
+    t0 = time.perf_counter()
+    store = StateStore(path)
+    data = store.load()
+    t1 = time.perf_counter()
+    _, sims, drivers, walkers, _ = restore_state(data, load_walk=None)
+    t2 = time.perf_counter()
+    store.close()
+    return (t1 - t0) * 1e3, (t2 - t1) * 1e3, len(sims), len(drivers) + len(walkers)
+
+
+def main():
+    n_drivers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_walkers = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    install_straight_walking()
+    sims, drivers, walkers = state(n_drivers, n_walkers)
+    print(f"{len(sims)} sims, {len(drivers)} drivers and {len(walkers)} walkers left")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "state.sqlite")
+        store = StateStore(path, flush_every_s=3600.0, snapshot_every_s=3600.0)
+
+        t0 = time.perf_counter()
+        for ms in sims:
+            store.put_sim(ms, f"req-{ms.driver_agent.agent_id}", f"req-{ms.walker_agent.agent_id}")
+        for a in drivers:
+            store.put_agent("driver", a)
+        for a in walkers:
+            store.put_agent("walker", a)
+        store.tick(1.0)
+        n = len(sims) + len(drivers) + len(walkers)
+        print(f"tick thread  {(time.perf_counter() - t0) / n * 1e6:6.2f} us per change")
+
+        t0 = time.perf_counter()
+        store.flush()
+        print(f"writer       {(time.perf_counter() - t0) * 1e3:6.0f} ms for the first batch "
+              f"({n} changes, every route new)")
+
+        # an hour at one tick per second: a couple of matches replaced per tick, a batch every 10 ticks
+        batch_ms = []
+        for k in range(3600):
+            for ms in (sims[k % len(sims)], sims[(k * 7) % len(sims)]):
+                store.drop_sim(ms.match_id)
+                store.put_sim(ms)
+            store.tick(2.0 + k)
+            if k % 10 == 9:
+                t0 = time.perf_counter()
+                store.flush()
+                batch_ms.append((time.perf_counter() - t0) * 1e3)
+        print(f"writer       {sum(batch_ms) / len(batch_ms):6.2f} ms per batch of 41 changes "
+              f"({store.stats()['log_rows']} log rows)")
+
+        store.close()
+        size = os.path.getsize(path)
+        load_ms, build_ms, n_sims, n_agents = timed_restore(path)
+        print(f"restore from log       {load_ms:6.0f} ms load + {build_ms:6.0f} ms rebuild   "
+              f"{n_sims} sims, {n_agents} leftovers   file {size / 1e6:5.1f} MB")
+
+        store = StateStore(path)
+        store.load()
+        t0 = time.perf_counter()
+        store.snapshot()
+        snap_ms = (time.perf_counter() - t0) * 1e3
+        store.close()
+        load_ms, build_ms, _, _ = timed_restore(path)
+        print(f"restore from snapshot  {load_ms:6.0f} ms load + {build_ms:6.0f} ms rebuild   "
+              f"snapshot took {snap_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
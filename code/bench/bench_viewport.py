@@ -0,0 +1,68 @@
+# Global /ws fan-out per tick, everyone gets the whole fleet vs. viewport
+# groups: CPU for encoding (the views on top of the global encode) and bytes
+# handed to the client outboxes, 5k agents.
+# run from code/:  python -m bench.bench_viewport [--clients 200]
+import argparse
+import random
+import time
+
+from bench.bench_position_stream import SyntheticCity
+from interest import InterestManager
+from position_stream import PositionDeltaEncoder
+from wire import dumps
+
+
+def viewports(n, rnd, cluster_share):
+    # phone-sized views (zoom 15, ~1.5 x 2 km) around the city, a few zoomed out
+    out = []
+    for _ in range(n):
+        if rnd.random() < cluster_share:
+            out.append(([51.15, 6.65, 51.35, 6.95], 11))
+            continue
+        lat, lon = 51.2 + rnd.random() * 0.1, 6.7 + rnd.random() * 0.2
+        out.append(([lat, lon, lat + 0.014, lon + 0.028], 15))
+    return out
+
+
+def run(n_clients, ticks, cluster_share, seed=3):
+    rnd = random.Random(seed)
+    city = SyntheticCity()
+    enc = PositionDeltaEncoder()
+    views = InterestManager(enc)
+    for i, (bbox, zoom) in enumerate(viewports(n_clients, rnd, cluster_share)):
+        views.set_viewport(i, bbox, zoom)
+
+    glob_s = view_s = 0.0
+    glob_b = view_b = 0
+    for _ in range(ticks):
+        city.step(1.0)
+        snap = city.snapshot()
+
+        t0 = time.perf_counter()
+        event = enc.encode(snap)
+        buf = dumps(event)
+        glob_s += time.perf_counter() - t0
+        glob_b += len(buf) * n_clients
+
+        # on top of the global encode, which runs either way
+        t0 = time.perf_counter()
+        for group, event in views.on_positions(snap, event):
+            view_b += len(dumps(event)) * len(group.clients)
+        view_s += time.perf_counter() - t0
+    return glob_s / ticks, glob_b / ticks, view_s / ticks, view_b / ticks, len(views.groups)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=200)
+    ap.add_argument("--ticks", type=int, default=50)
+    args = ap.parse_args()
+    print("5000 agents, keyframe every 100 ticks; bytes are summed over all clients")
+    for n in (10, args.clients, 5 * args.clients):
+        g_s, g_b, v_s, v_b, groups = run(n, args.ticks, cluster_share=0.1)
+        print(f"{n:5d} clients  everything: {g_s * 1e3:6.2f} ms {g_b / 1e6:8.2f} MB/tick   "
+              f"viewports ({groups:4d} groups): {v_s * 1e3:6.2f} ms {v_b / 1e6:8.2f} MB/tick")
+
+
+if __name__ == "__main__":
+    main()
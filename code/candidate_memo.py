@@ -0,0 +1,92 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+from RouteBase import LatLon, RouteBase
+from geometry import derived, haversine_m
+from route_index import Pos, RoutePoint
+
+# a pickup found for a walker position is reused while the walker is this close to it
+PICKUP_REUSE_M = 25.0
+# destinations remembered per driver route, oldest dropped first
+MAX_DESTS_PER_ROUTE = 256
+DEST_DIGITS = 6  # ~0.1 m
+
+Cost = Tuple[float, float]  # walking metres, seconds
+
+
+class PairMemo:
+    """
+    Matching work for one (driver route, walker destination) pair.
+
+    drop: walking cost from a dropoff candidate on the route to the
+    destination, by the candidate's position. The route and the destination
+    never change, so these stay valid for as long as the route lives.
+
+    pick: the best pickup chosen from pick_pos. The choice is reused while the
+    walker is within PICKUP_REUSE_M of pick_pos and the driver (AgentState.idx)
+    has not passed the pickup's segment; its walking cost is only reused for
+    the exact position it was costed from (pick_cost), a walker that moved
+    gets the one leg to the same pickup costed again instead of all k.
+    """
+    __slots__ = ("drop", "pick", "pick_pos", "pick_cost")
+
+    def __init__(self):
+        self.drop: Dict[Pos, Cost] = {}
+        self.pick: Optional[RoutePoint] = None
+        self.pick_pos: Optional[LatLon] = None
+        self.pick_cost: Optional[Tuple[LatLon, Cost]] = None
+
+    def pickup(self, driver_idx: int, walker_pos: LatLon) -> Optional[Tuple[RoutePoint, Optional[Cost]]]:
+        pick = self.pick
+        if pick is None:
+            _count("pick_misses")
+            return None
+        if pick.seg < driver_idx:
+            self.pick = self.pick_cost = None  # the driver is past it
+            _count("pick_misses")
+            return None
+        if haversine_m(self.pick_pos, walker_pos) > PICKUP_REUSE_M:
+            _count("pick_misses")
+            return None
+        _count("pick_hits")
+        cost = self.pick_cost
+        return pick, (cost[1] if cost is not None and cost[0] == walker_pos else None)
+
+    def store_pickup(self, walker_pos: LatLon, c: RoutePoint, m: float, s: float) -> None:
+        # a fresh choice among the top-k candidates
+        self.pick, self.pick_pos = c, walker_pos
+        self.pick_cost = (walker_pos, (m, s))
+
+    def store_pickup_cost(self, walker_pos: LatLon, m: float, s: float) -> None:
+        # the reused pickup costed from where the walker is now
+        self.pick_cost = (walker_pos, (m, s))
+
+    def drop_cost(self, c: RoutePoint) -> Optional[Cost]:
+        cost = self.drop.get((c.seg, c.frac))
+        _count("drop_misses" if cost is None else "drop_hits")
+        return cost
+
+
+def pair_memo(route: RouteBase, dest: LatLon) -> PairMemo:
+    memo = derived(route, "_memo", lambda r: {})
+    key = (round(dest[0], DEST_DIGITS), round(dest[1], DEST_DIGITS))
+    e = memo.get(key)
+    if e is None:
+        if len(memo) >= MAX_DESTS_PER_ROUTE:
+            memo.pop(next(iter(memo)), None)
+        e = memo.setdefault(key, PairMemo())
+    return e
+
+
+_STATS = {"pick_hits": 0, "pick_misses": 0, "drop_hits": 0, "drop_misses": 0}
+_LOCK = threading.Lock()
+
+
+def _count(name: str) -> None:
+    with _LOCK:
+        _STATS[name] += 1
+
+
+def memo_stats() -> Dict[str, int]:
+    with _LOCK:
+        return dict(_STATS)
@@ -0,0 +1,97 @@
+import math
+from typing import Tuple
+
+from RouteBase import LatLon, RouteBase
+from geometry import HAVE_NUMPY, derived, route_array, haversine_m, haversine_np
+
+if HAVE_NUMPY:
+    import numpy as np
+
+M_PER_DEG_LAT = 111320.0
+
+# faster than OSRM's foot profile (5 km/h), so distance / speed is a lower bound on walking time
+WALK_MAX_MPS = 1.6
+# OSRM snaps both ends of a leg to the road network, the routed leg can be
+# this much shorter than the straight line between the raw points
+SNAP_SLACK_M = 50.0
+
+BBox = Tuple[float, float, float, float]  # lat_min, lon_min, lat_max, lon_max
+
+
+def _bbox(route: RouteBase) -> BBox:
+    if HAVE_NUMPY:
+        arr = route_array(route)
+        lo, hi = arr.min(axis=0), arr.max(axis=0)
+        return float(lo[0]), float(lo[1]), float(hi[0]), float(hi[1])
+    pts = list(route.geometry_latlon)
+    lats = [p[0] for p in pts]
+    lons = [p[1] for p in pts]
+    return min(lats), min(lons), max(lats), max(lons)
+
+
+def route_bbox(route: RouteBase) -> BBox:
+    return derived(route, "_bbox", _bbox)
+
+
+def near_bbox(bbox: BBox, p: LatLon, radius_m: float) -> bool:
+    dlat = radius_m / M_PER_DEG_LAT
+    dlon = radius_m / (M_PER_DEG_LAT * max(math.cos(math.radians(p[0])), 1e-6))
+    return (bbox[0] - dlat <= p[0] <= bbox[2] + dlat and
+            bbox[1] - dlon <= p[1] <= bbox[3] + dlon)
+
+
+def corridor_feasible(route: RouteBase,
+                      idx: int,
+                      walker_pos: LatLon,
+                      walker_dest: LatLon,
+                      max_walk_m: float,
+                      walk_mps: float = WALK_MAX_MPS,
+                      slack_m: float = SNAP_SLACK_M) -> bool:
+    """
+    Necessary condition for best_match_ to accept the driver, without any
+    routing call. On the route ahead of idx there must be a pickup point and a
+    dropoff point no earlier than it with
+      straight line walker_pos -> pickup  +  straight line dropoff -> walker_dest <= max_walk_m
+    (walking distances are at least the straight lines) and the walker able to
+    reach the pickup at walk_mps before the driver does. Pickups and dropoffs
+    can lie anywhere on a segment (route_index), so each is bounded through its
+    nearest vertex: distance minus half the longer adjacent segment, driver
+    time up to the next vertex. False means skip the driver; True does not
+    mean it matches.
+    """
+    if max_walk_m < 0:
+        return False
+    budget = max_walk_m + 2 * slack_m
+    bbox = route_bbox(route)
+    if not near_bbox(bbox, walker_pos, budget) or not near_bbox(bbox, walker_dest, budget):
+        return False
+
+    if HAVE_NUMPY:
+        pts = route_array(route)[idx:]
+        if len(pts) < 2:
+            return False
+        cum = np.asarray(route.cum_time_s, dtype=np.float64)[idx:]
+        seg = np.asarray(route.seg_dist_m, dtype=np.float64)[idx:]
+        half = 0.5 * np.maximum(np.r_[0.0, seg], np.r_[seg, 0.0])
+        eta = np.r_[cum[1:], cum[-1]] - cum[0]
+        to_pick = np.maximum(haversine_np(pts, walker_pos) - half, 0.0)
+        reach = np.where(to_pick - slack_m <= walk_mps * eta, to_pick, np.inf)
+        best_pick = np.minimum.accumulate(reach)  # best pickup up to each dropoff
+        to_drop = np.maximum(haversine_np(pts, walker_dest) - half, 0.0)
+        return bool((best_pick + to_drop).min() <= budget)
+
+    pts = route.geometry_latlon
+    cum = route.cum_time_s
+    seg = route.seg_dist_m
+    n = len(pts)
+    if n - idx < 2:
+        return False
+    best_pick = math.inf
+    for i in range(idx, n):
+        half = 0.5 * max(seg[i - 1] if i > idx else 0.0, seg[i] if i < n - 1 else 0.0)
+        d = max(haversine_m(pts[i], walker_pos) - half, 0.0)
+        if d < best_pick and d - slack_m <= walk_mps * (cum[min(i + 1, n - 1)] - cum[idx]):
+            best_pick = d
+        if best_pick + max(haversine_m(pts[i], walker_dest) - half, 0.0) <= budget:
+            return True
+    return False
@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+import math
+import random
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from aiohttp import web
+
+from RouteBase import LatLon
+from geometry import haversine_m
+from osrm_client import OsrmClient, OsrmError
+
+M_PER_DEG_LAT = 111320.0
+
+# OSRM profile speeds, roughly (car in town, foot profile 5 km/h)
+SPEED_MPS = {"driving": 10.0, "walking": 1.4}
+
+
+class FakeOsrm:
+    """
+    Answers OSRM /route and /table paths without a road network.
+
+    graph="straight": the straight line between the two points, a vertex
+    every step_m. graph="grid": a Manhattan street grid of block_m blocks;
+    both ends snap to the nearest crossing and the route runs along the
+    latitude first, then the longitude, a vertex at every crossing.
+    /table uses the same distances, so /route and /table agree like they do
+    on a real OSRM. Responses have the shape of the real ones (overview=full,
+    geojson, annotations) so CompactRoute.from_osrm parses them unchanged.
+    """
+
+    def __init__(self,
+                 graph: str = "straight",
+                 step_m: float = 50.0,
+                 block_m: float = 150.0,
+                 origin: LatLon = (51.2277, 6.7735),
+                 speed_mps: Optional[Dict[str, float]] = None):
+        if graph not in ("straight", "grid"):
+            raise ValueError(f"Unknown graph: {graph}")
+        self.graph = graph
+        self.step_m = step_m
+        self.block_m = block_m
+        self.speed_mps = dict(SPEED_MPS, **(speed_mps or {}))
+        self._lat0, self._lon0 = origin
+        self._dlat = block_m / M_PER_DEG_LAT
+        self._dlon = block_m / (M_PER_DEG_LAT * math.cos(math.radians(self._lat0)))
+        self.calls: Dict[str, int] = {"route": 0, "route_full": 0, "table": 0}
+
+    # geometry
+
+    def _snap(self, p: LatLon) -> Tuple[int, int]:
+        return round((p[0] - self._lat0) / self._dlat), round((p[1] - self._lon0) / self._dlon)
+
+    def _node(self, i: int, j: int) -> LatLon:
+        return self._lat0 + i * self._dlat, self._lon0 + j * self._dlon
+
+    def path(self, a: LatLon, b: LatLon) -> List[LatLon]:
+        if self.graph == "straight":
+            n = max(1, int(math.ceil(haversine_m(a, b) / self.step_m)))
+            return [(a[0] + (b[0] - a[0]) * k / n, a[1] + (b[1] - a[1]) * k / n) for k in range(n + 1)]
+
+        (i0, j0), (i1, j1) = self._snap(a), self._snap(b)
+        si = 1 if i1 >= i0 else -1
+        sj = 1 if j1 >= j0 else -1
+        pts = [self._node(i, j0) for i in range(i0, i1 + si, si)]
+        pts += [self._node(i1, j) for j in range(j0 + sj, j1 + sj, sj)]
+        if len(pts) == 1:
+            pts.append(pts[0])
+        return pts
+
+    def distance(self, a: LatLon, b: LatLon) -> float:
+        if self.graph == "straight":
+            return haversine_m(a, b)
+        (i0, j0), (i1, j1) = self._snap(a), self._snap(b)
+        lat_leg = haversine_m(self._node(i0, j0), self._node(i1, j0))
+        lon_leg = haversine_m(self._node(i1, j0), self._node(i1, j1))
+        return lat_leg + lon_leg
+
+    # services
+
+    def route(self, profile: str, a: LatLon, b: LatLon, full: bool) -> Dict[str, Any]:
+        speed = self.speed_mps[profile]
+        if not full:
+            m = self.distance(a, b)
+            return {"code": "Ok", "routes": [{"distance": m, "duration": m / speed}]}
+
+        pts = self.path(a, b)
+        seg_d = [haversine_m(pts[k], pts[k + 1]) for k in range(len(pts) - 1)]
+        seg_t = [d / speed for d in seg_d]
+        return {"code": "Ok", "routes": [{
+            "distance": sum(seg_d),
+            "duration": sum(seg_t),
+            "geometry": {"type": "LineString", "coordinates": [[lon, lat] for lat, lon in pts]},
+            "legs": [{"annotation": {"distance": seg_d, "duration": seg_t}}],
+        }]}
+
+    def table(self, profile: str, pts: List[LatLon], sources: List[int], destinations: List[int]) -> Dict[str, Any]:
+        speed = self.speed_mps[profile]
+        dist = [[self.distance(pts[i], pts[j]) for j in destinations] for i in sources]
+        dur = [[m / speed for m in row] for row in dist]
+        return {"code": "Ok", "distances": dist, "durations": dur}
+
+    def handle(self, path: str) -> Dict[str, Any]:
+        # "/route/v1/{profile}/{lon,lat;lon,lat}?..." -> OSRM JSON answer
+        u = urlsplit(path)
+        try:
+            _, service, _, profile, coords = u.path.split("/", 4)
+            pts = [(float(lat), float(lon)) for lon, lat in (c.split(",") for c in coords.split(";"))]
+        except ValueError:
+            return {"code": "InvalidUrl", "message": path}
+        if profile not in self.speed_mps:
+            return {"code": "InvalidOptions", "message": f"profile {profile}"}
+        qs = parse_qs(u.query)
+
+        if service == "route":
+            self.calls["route"] += 1
+            full = qs.get("overview", ["simplified"])[0] != "false"
+            self.calls["route_full"] += full
+            return self.route(profile, pts[0], pts[-1], full)
+
+        if service == "table":
+            self.calls["table"] += 1
+            everyone = list(range(len(pts)))
+            src = [int(i) for i in qs["sources"][0].split(";")] if "sources" in qs else everyone
+            dst = [int(i) for i in qs["destinations"][0].split(";")] if "destinations" in qs else everyone
+            return self.table(profile, pts, src, dst)
+
+        return {"code": "InvalidService", "message": service}
+
+
+class FakeOsrmClient(OsrmClient):
+    """
+    OsrmClient answering from a FakeOsrm in process: same run()/run_many()
+    bridge and error handling, no sockets. Drop-in for local_osrm.OSRM.
+    """
+
+    def __init__(self, fake: Optional[FakeOsrm] = None, **kw):
+        super().__init__(**kw)
+        self.fake = fake or FakeOsrm()
+
+    async def get_json(self, base: str, path: str, timeout_s: Optional[float] = None) -> Dict[str, Any]:
+        data = self.fake.handle(path)
+        if data.get("code") != "Ok":
+            raise OsrmError(data)
+        return data
+
+
+class FakeOsrmServer:
+    """
+    FakeOsrm over HTTP, for anything that talks to OSRM_DRIVE / OSRM_WALK:
+    one aiohttp server on its own loop thread, listening on every port in
+    `ports` (0 picks a free one) and serving both profiles on each.
+
+    Every request waits latency_ms plus up to jitter_ms, then fails with an
+    HTTP 500 with probability error_rate (OsrmClient retries those).
+    """
+
+    def __init__(self,
+                 fake: Optional[FakeOsrm] = None,
+                 latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0,
+                 error_rate: float = 0.0,
+                 seed: int = 0,
+                 host: str = "127.0.0.1",
+                 ports: Sequence[int] = (0,)):
+        self.fake = fake or FakeOsrm()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.host = host
+        self.ports = list(ports)
+        self.urls: List[str] = []
+        self.stats = {"requests": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+        self._rnd = random.Random(seed)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        return self.urls[0]
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/{service}/v1/{profile}/{coords}", self._handle)
+        return app
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        st = self.stats
+        st["requests"] += 1
+        st["in_flight"] += 1
+        st["max_in_flight"] = max(st["max_in_flight"], st["in_flight"])
+        try:
+            delay_ms = self.latency_ms + self.jitter_ms * self._rnd.random()
+            if delay_ms > 0:
+                await asyncio.sleep(delay_ms / 1000.0)
+            if self.error_rate and self._rnd.random() < self.error_rate:
+                st["errors"] += 1
+                return web.json_response({"code": "Error", "message": "injected"}, status=500)
+            data = self.fake.handle(request.path_qs)
+            return web.json_response(data, status=200 if data["code"] == "Ok" else 400)
+        finally:
+            st["in_flight"] -= 1
+
+    async def _start(self) -> None:
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        for port in self.ports:
+            site = web.TCPSite(self._runner, self.host, port)
+            await site.start()
+            bound = site._server.sockets[0].getsockname()[1]
+            self.urls.append(f"http://{self.host}:{bound}")
+
+    def start(self) -> "FakeOsrmServer":
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="fake-osrm", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def stop(self) -> None:
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop.close()
+        self._loop = None
+        self.urls = []
+
+    def __enter__(self) -> "FakeOsrmServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main():
+    # stands in for both OSRM backends of the app (OSRM_DRIVE :5000, OSRM_WALK :5001)
+    ap = argparse.ArgumentParser(description="OSRM-compatible /route and /table on a synthetic street graph")
+    ap.add_argument("--port", type=int, action="append", help="repeatable, default 5000 and 5001")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--graph", choices=("straight", "grid"), default="grid")
+    ap.add_argument("--block-m", type=float, default=150.0)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    srv = FakeOsrmServer(FakeOsrm(graph=args.graph, block_m=args.block_m),
+                         latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                         error_rate=args.error_rate, seed=args.seed,
+                         host=args.host, ports=args.port or [5000, 5001])
+    srv.start()
+    print("fake osrm on", ", ".join(srv.urls))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+from typing import Dict, Iterable, List
+
+from AgentState import AgentState
+from geometry import HAVE_NUMPY, np, route_array
+
+
+class FleetPositionEngine:
+    """
+    Batched AgentState.update_position() for the whole fleet.
+
+    The routes of every agent seen so far live in concatenated point arrays
+    (lat, lon and a sort key) with per-agent offsets. The key of a point is its
+    cum_time_s value plus a per-agent base that is larger than every key of the
+    agents before it, so one searchsorted() over the whole fleet finds each
+    agent's segment; positions are then interpolated in the same pass and
+    written back into the AgentState objects.
+
+    Same semantics as update_position(): done agents are skipped, agents that
+    have not started stay at their route start, agents past the end get the
+    last point and done=True. Without NumPy it falls back to the scalar loop.
+    """
+
+    def __init__(self, capacity_points: int = 1 << 16, capacity_agents: int = 1 << 10,
+                 compact_slack: int = 1024):
+        # routes of agents that stopped showing up are dropped once they
+        # outnumber the live ones by compact_slack
+        self.compact_slack = compact_slack
+        self.rebuilds = 0
+        self._reset(capacity_points, capacity_agents)
+
+    def _reset(self, capacity_points: int, capacity_agents: int) -> None:
+        self._slot: Dict[str, int] = {}
+        self._agents: List[AgentState] = []
+        if not HAVE_NUMPY:
+            return
+
+        # per point
+        self._lat = np.empty(capacity_points)
+        self._lon = np.empty(capacity_points)
+        self._key = np.empty(capacity_points)
+        self._n_points = 0
+        self._next_base = 0.0
+
+        # per agent slot
+        self._off = np.empty(capacity_agents, dtype=np.int64)
+        self._len = np.empty(capacity_agents, dtype=np.int64)
+        self._base = np.empty(capacity_agents)
+        self._end_t = np.empty(capacity_agents)
+        self._t0 = np.empty(capacity_agents)
+        self._scale = np.empty(capacity_agents)
+        self._idx = np.empty(capacity_agents, dtype=np.int64)
+        self._done = np.empty(capacity_agents, dtype=bool)
+        self._scalar = np.empty(capacity_agents, dtype=bool)  # routes the vector path cannot handle
+
+    def __len__(self) -> int:
+        return len(self._agents)
+
+    # registration
+
+    def _grow(self, name: str, need: int) -> None:
+        arr = getattr(self, name)
+        if need > arr.shape[0]:
+            new = np.empty(max(need, 2 * arr.shape[0]), dtype=arr.dtype)
+            new[:arr.shape[0]] = arr
+            setattr(self, name, new)
+
+    def _register(self, agent: AgentState) -> int:
+        route = agent.route
+        slot = len(self._agents)
+        self._slot[agent.agent_id] = slot
+        self._agents.append(agent)
+
+        pts = route_array(route)
+        cum = route.cum_time_s
+        n = pts.shape[0]
+        scalar = n == 0 or len(cum) != n
+
+        for name in ("_off", "_len", "_base", "_end_t", "_t0", "_scale", "_idx", "_done", "_scalar"):
+            self._grow(name, slot + 1)
+        self._off[slot] = self._n_points
+        self._len[slot] = 0 if scalar else n
+        self._base[slot] = self._next_base
+        self._end_t[slot] = 0.0 if scalar else cum[-1]
+        self._t0[slot] = agent.start_offset_s
+        self._scale[slot] = agent.time_scale
+        self._idx[slot] = agent.idx
+        self._done[slot] = agent.done
+        self._scalar[slot] = scalar
+        if scalar:
+            return slot
+
+        end = self._n_points + n
+        for name in ("_lat", "_lon", "_key"):
+            self._grow(name, end)
+        self._lat[self._n_points:end] = pts[:, 0]
+        self._lon[self._n_points:end] = pts[:, 1]
+        self._key[self._n_points:end] = np.asarray(cum, dtype=np.float64) + self._next_base
+        self._n_points = end
+        self._next_base = self._key[end - 1] + 1.0
+        return slot
+
+    def _compact(self, live: Iterable[AgentState]) -> None:
+        # drop routes of agents that left the fleet (finished sims, removed agents)
+        live = list(live)
+        self._reset(max(self._lat.shape[0] // 2, 1 << 16), max(self._off.shape[0] // 2, 1 << 10))
+        for a in live:
+            self._register(a)
+        self.rebuilds += 1
+
+    # tick
+
+    def update(self, agents: List[AgentState], t: float) -> None:
+        if not HAVE_NUMPY:
+            for a in agents:
+                a.update_position(t)
+            return
+
+        get = self._slot.get
+        slots = [get(a.agent_id) for a in agents]
+        if None in slots:
+            slots = [s if s is not None else self._register(a) for s, a in zip(slots, agents)]
+        if len(self._agents) > 2 * len(agents) + self.compact_slack:
+            self._compact(agents)
+            slots = [self._slot[a.agent_id] for a in agents]
+
+        s = np.fromiter(slots, dtype=np.int64, count=len(slots))
+        s = s[~self._done[s]]
+        scalar = self._scalar[s]
+        if scalar.any():
+            for k in s[scalar].tolist():
+                self._agents[k].update_position(t)  # keeps the scalar path's errors
+            s = s[~scalar]
+        if s.size == 0:
+            return
+
+        off = self._off[s]
+        last = off + self._len[s] - 1
+        end_t = self._end_t[s]
+        t_rel = (t - self._t0[s]) * self._scale[s]
+
+        before = t_rel <= 0.0
+        after = ~before & (t_rel >= end_t)
+        inside = ~(before | after)
+
+        # global segment index: agents only move forward, so most are still on the
+        # segment of the last tick; the rest go through one search over all routes
+        key = self._key
+        q = self._base[s] + np.clip(t_rel, 0.0, end_t)
+        last_seg = np.maximum(last - 1, off)
+        i = np.minimum(off + self._idx[s], last_seg)
+        miss = (q < key[i]) | (q >= key[np.minimum(i + 1, last)])
+        if miss.any():
+            found = np.searchsorted(key[:self._n_points], q[miss], side="right") - 1
+            i[miss] = np.clip(found, off[miss], last_seg[miss])
+        j = np.minimum(i + 1, last)
+
+        seg_t = key[j] - key[i]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            alpha = np.where(seg_t > 0.0, (q - key[i]) / seg_t, 1.0)
+        np.clip(alpha, 0.0, 1.0, out=alpha)
+
+        lat = self._lat[i] + alpha * (self._lat[j] - self._lat[i])
+        lon = self._lon[i] + alpha * (self._lon[j] - self._lon[i])
+        # same index get_pos_at_time() reports (next point on a zero-length segment)
+        seg_idx = np.where(seg_t > 0.0, i, j) - off
+
+        lat = np.where(before, self._lat[off], np.where(after, self._lat[last], lat))
+        lon = np.where(before, self._lon[off], np.where(after, self._lon[last], lon))
+        idx = np.where(inside, seg_idx, self._idx[s])
+        self._idx[s] = idx
+        self._done[s] = after
+
+        agent_list = self._agents
+        for k, la, lo, ix in zip(s.tolist(), lat.tolist(), lon.tolist(), idx.tolist()):
+            a = agent_list[k]
+            if a.done:
+                continue
+            a.pos = (la, lo)
+            a.idx = ix
+        for k in s[after].tolist():
+            agent_list[k].done = True
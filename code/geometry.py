@@ -0,0 +1,64 @@
+import math
+from typing import Callable, Sequence, TypeVar
+
+from RouteBase import LatLon, RouteBase, CompactRoute
+
+try:
+    import numpy as np
+except ImportError:  # corridor, route_index and fleet_positions fall back to pure python
+    np = None
+
+HAVE_NUMPY = np is not None
+
+EARTH_R_M = 6371000.0
+
+T = TypeVar("T")
+
+
+def derived(route: RouteBase, name: str, build: Callable[[RouteBase], T]) -> T:
+    """
+    Data derived from a route (bbox, segment index, pickup memo, ...), built
+    on first use. Routes are immutable, so it never goes stale and is kept
+    on the instance under name, going away with the route. The route
+    dataclasses are frozen, hence object.__setattr__; CompactRoute declares
+    a slot for every name used here.
+    """
+    value = getattr(route, name, None)
+    if value is None:
+        value = build(route)
+        object.__setattr__(route, name, value)
+    return value
+
+
+def as_latlon_array(points: Sequence[LatLon]) -> "np.ndarray":
+    # (N, 2) float64, columns lat, lon
+    arr = np.asarray(points, dtype=np.float64)
+    if arr.ndim != 2 or (arr.size and arr.shape[1] != 2):
+        arr = arr.reshape(-1, 2)
+    return arr
+
+
+def route_array(route: RouteBase) -> "np.ndarray":
+    if isinstance(route, CompactRoute):
+        # zero-copy view over the interleaved lat/lon buffer
+        return np.frombuffer(route.latlon_buffer, dtype=np.float64).reshape(-1, 2)
+    return derived(route, "_latlon_arr", lambda r: as_latlon_array(r.geometry_latlon))
+
+
+def haversine_m(a: LatLon, b: LatLon) -> float:
+    lat1, lon1 = map(math.radians, a)
+    lat2, lon2 = map(math.radians, b)
+    x = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_R_M * math.asin(math.sqrt(x))
+
+
+def haversine_np(points: "np.ndarray", target: LatLon) -> "np.ndarray":
+    lat = np.radians(points[:, 0])
+    lon = np.radians(points[:, 1])
+    t_lat = np.radians(target[0])
+    t_lon = np.radians(target[1])
+
+    x = np.sin((t_lat - lat) * 0.5) ** 2 + np.cos(lat) * np.cos(t_lat) * np.sin((t_lon - lon) * 0.5) ** 2
+    return 2.0 * EARTH_R_M * np.arcsin(np.sqrt(x))
+
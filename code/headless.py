@@ -0,0 +1,317 @@
+"""
+Headless simulation: the server's tick (sim_loop.SimLoop: admission,
+the fleet position update, rematching, sim phases, retirement, the state
+store, snapshots and route updates) and its TickScheduler on a simulated
+clock, without aiohttp, WebSockets or the per-tick sleep, driven as fast
+as it goes from a seeded synthetic request stream against the in-process
+FakeOsrm. Admission runs inline; what would go to clients is serialized
+and counted.
+
+run from code/:  python -m headless --ticks 600 --seed 1 --graph grid
+"""
+import argparse
+import hashlib
+import math
+import random
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import local_osrm
+from fake_osrm import FakeOsrm, FakeOsrmClient
+from lifecycle import Lifecycle
+from osrm_client import OsrmClient
+from position_stream import PositionDeltaEncoder
+from route_stream import RouteStream
+from sim_loop import DONE_KEEP_S, SimLoop
+from state_store import StateStore
+from tick_scheduler import TickScheduler
+from wire import dumps
+
+CITY_CENTER = (51.2277, 6.7735)
+CITY_RADIUS_M = 5000.0
+WALK_TRIP_M = (1000.0, 4000.0)
+M_PER_DEG_LAT = 111320.0
+
+# in tick order; route and match run inside "admit" (inline admission), see admission_ms
+STAGES = SimLoop.STAGES
+
+
+def _at(p, dist_m: float, heading: float):
+    return (p[0] + math.cos(heading) * dist_m / M_PER_DEG_LAT,
+            p[1] + math.sin(heading) * dist_m / (M_PER_DEG_LAT * math.cos(math.radians(p[0]))))
+
+
+def _in_city(rnd: random.Random):
+    return _at(CITY_CENTER, CITY_RADIUS_M * math.sqrt(rnd.random()), rnd.uniform(0.0, 2 * math.pi))
+
+
+def _poisson(rnd: random.Random, lam: float) -> int:
+    # Knuth; the rates here are a handful per tick at most
+    limit, k, p = math.exp(-lam), 0, rnd.random()
+    while p > limit:
+        k += 1
+        p *= rnd.random()
+    return k
+
+
+def synthetic_request(rnd: random.Random, n: int, kind: str) -> Dict[str, Any]:
+    # same shape as the create requests of the WebSocket API
+    start = _in_city(rnd)
+    if kind == "walker":
+        dest = _at(start, rnd.uniform(*WALK_TRIP_M), rnd.uniform(0.0, 2 * math.pi))
+    else:
+        dest = _in_city(rnd)
+    return {"request_id": f"req-{n}",
+            "payload": {"type": kind,
+                        "start": {"lat": start[0], "lon": start[1]},
+                        "dest": {"lat": dest[0], "lon": dest[1]}}}
+
+
+def synthetic_requests(seed: int,
+                       ticks: int,
+                       drivers: int,
+                       walkers: int,
+                       driver_rate: float,
+                       walker_rate: float) -> Iterator[List[Dict[str, Any]]]:
+    """
+    The requests arriving at each tick: the initial fleet at tick 0, then
+    Poisson arrivals at driver_rate / walker_rate per tick.
+    """
+    rnd = random.Random(seed)
+    n = 0
+    for k in range(ticks):
+        if k == 0:
+            kinds = ["driver"] * drivers + ["walker"] * walkers
+        else:
+            kinds = ["driver"] * _poisson(rnd, driver_rate) + ["walker"] * _poisson(rnd, walker_rate)
+            rnd.shuffle(kinds)
+        reqs = []
+        for kind in kinds:
+            reqs.append(synthetic_request(rnd, n, kind))
+            n += 1
+        yield reqs
+
+
+def _pct(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+def run_headless(ticks: int = 600,
+                 dt_s: float = 1.0,
+                 seed: int = 1,
+                 drivers: int = 200,
+                 walkers: int = 100,
+                 driver_rate: float = 0.2,
+                 walker_rate: float = 0.5,
+                 graph: str = "straight",
+                 min_saving_m: float = 800.0,
+                 rematch_every_s: float = 60.0,
+                 retire: bool = True,
+                 batch_window_s: float = 0.0,
+                 publish_hz: Optional[float] = None,
+                 state_db: Optional[str] = None,
+                 osrm_url: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Runs `ticks` ticks of dt_s simulated seconds and returns the report
+    (see format_report). Agent ids are derived from the request ids and
+    local_osrm.OSRM is swapped for a FakeOsrmClient for the duration of the
+    run, so the same arguments give the same simulation, and the same digest.
+    With osrm_url the run routes over HTTP instead (both profiles on that
+    server, e.g. a FakeOsrmServer), through a fresh OsrmClient. retire=False
+    keeps finished sims and agents in the tick, as before Lifecycle.
+    batch_window_s and publish_hz are in simulated seconds (publish_hz None:
+    every tick), state_db records the run in a StateStore at that path.
+    """
+    prev = local_osrm.OSRM, local_osrm.DISK_CACHE, local_osrm.OSRM_DRIVE, local_osrm.OSRM_WALK
+    if osrm_url is None:
+        client = FakeOsrmClient(FakeOsrm(graph=graph))
+    else:
+        client = OsrmClient(max_in_flight=32, timeout_s=20.0, retries=2)
+        local_osrm.OSRM_DRIVE = local_osrm.OSRM_WALK = osrm_url
+    local_osrm.OSRM, local_osrm.DISK_CACHE = client, None
+    local_osrm.clear_route_caches()
+    try:
+        report = _run(ticks, dt_s, seed, drivers, walkers, driver_rate, walker_rate,
+                      min_saving_m, rematch_every_s, retire, batch_window_s, publish_hz, state_db)
+    finally:
+        client.close()
+        local_osrm.OSRM, local_osrm.DISK_CACHE, local_osrm.OSRM_DRIVE, local_osrm.OSRM_WALK = prev
+        local_osrm.clear_route_caches()
+    report["routing"] = f"fake {graph} graph" if osrm_url is None else f"OSRM at {osrm_url}"
+    report["osrm_calls"] = dict(client.fake.calls) if osrm_url is None else None
+    return report
+
+
+def _route_fn(req: Dict[str, Any], t: float):
+    # handle_req with agent ids from the request ids, so equal runs have equal ids
+    req_id, agent, kind = local_osrm.handle_req(req, t)
+    if agent is not None:
+        agent.agent_id = f"{kind}-{req_id}"
+    return req_id, agent, kind
+
+
+def _run(ticks, dt_s, seed, drivers, walkers, driver_rate, walker_rate, min_saving_m, rematch_every_s,
+         retire, batch_window_s, publish_hz, state_db):
+    sims: list = []
+    driver_agents: list = []
+    walker_agents: list = []
+    now = [0.0]  # simulated clock of the scheduler and the batch window
+    sent = {"frame_bytes": 0, "route_bytes": 0}
+    pos_stream = PositionDeltaEncoder()
+    route_stream = RouteStream()
+
+    def on_positions(data):
+        # what the broadcaster does with it: delta against the last frame, serialized once
+        sent["frame_bytes"] += len(dumps({"type": "positions", "data": pos_stream.encode(data)}))
+
+    def on_routes(t):
+        event, _ = local_osrm.encode_routes(route_stream, sims, t)
+        if event is not None:
+            sent["route_bytes"] += len(dumps(event))
+
+    store = StateStore(state_db) if state_db else None
+    # the server's tick with inline admission (route and match stages run in submit)
+    sim_loop = SimLoop(
+        sims, driver_agents, walker_agents, {},
+        min_saving_m=min_saving_m,
+        rematch_every_s=rematch_every_s,
+        batch_window_s=batch_window_s,
+        route_workers=0,
+        match_workers=0,
+        route_fn=_route_fn,
+        lifecycle=Lifecycle(keep_s=DONE_KEEP_S if retire else math.inf),
+        store=store,
+        clock=lambda: now[0],
+        on_routes=on_routes,
+        on_positions=on_positions,
+    )
+    # and its scheduler on the simulated clock: nothing to sleep, publish_hz in simulated time
+    sched = TickScheduler(rate_hz=1.0 / dt_s, publish_hz=publish_hz, clock=lambda: now[0], sleep=lambda s: None)
+    sched.start()
+
+    stage_s = {s: [0.0] * ticks for s in STAGES}
+    tick_s = []
+    requests = 0
+    clock = time.perf_counter
+    t_start = clock()
+
+    try:
+        for k, reqs in enumerate(synthetic_requests(seed, ticks, drivers, walkers, driver_rate, walker_rate)):
+            t0 = clock()
+            sim_loop.tick(now[0], reqs, publish=sched.publish_due())
+            tick_s.append(clock() - t0)
+            for s in STAGES:
+                stage_s[s][k] = sim_loop.stage_s[s]
+            requests += len(reqs)
+            now[0] += sched.wait() * dt_s
+        wall_s = clock() - t_start
+    finally:
+        sim_loop.close()
+        if store is not None:
+            store.close()
+
+    ticks_sorted = sorted(tick_s)
+    stages = {}
+    for s in STAGES:
+        v = stage_s[s]
+        total = sum(v)
+        stages[s] = {"total_ms": total * 1e3,
+                     "mean_ms": total / max(ticks, 1) * 1e3,
+                     "p99_ms": _pct(sorted(v), 0.99) * 1e3,
+                     "share": total / max(sum(tick_s), 1e-12)}
+
+    matches = sum(sim_loop.matches.values())
+    latency = sim_loop.admission.metrics()["latency"]
+    final = local_osrm.build_snapshot_payload(now[0], sims, driver_agents, walker_agents,
+                                              agent_id_to_request_id=sim_loop.agent_id_to_request_id,
+                                              include_agent_id=True)
+    return {
+        "ticks": ticks,
+        "sim_s": ticks * dt_s,
+        "wall_s": wall_s,
+        "ticks_per_s": ticks / wall_s if wall_s else 0.0,
+        "requests": requests,
+        "matches": matches,
+        "matches_by_source": dict(sim_loop.matches),
+        "matches_per_s": matches / wall_s if wall_s else 0.0,
+        "tick_ms_series": [v * 1e3 for v in tick_s],
+        "tick_ms": {"p50": _pct(ticks_sorted, 0.50) * 1e3,
+                    "p99": _pct(ticks_sorted, 0.99) * 1e3,
+                    "max": ticks_sorted[-1] * 1e3 if ticks_sorted else 0.0},
+        "stages": stages,
+        "admission_ms": {name: latency[name]["count"] * latency[name]["avg_ms"] for name in ("route", "match")},
+        "frame_bytes": sent["frame_bytes"],
+        "route_bytes": sent["route_bytes"],
+        "final": {"sims": len(sims),
+                  "leftover_drivers": len(driver_agents),
+                  "leftover_walkers": len(walker_agents),
+                  "rematcher": sim_loop.rematcher.stats(),
+                  "retired": sim_loop.lifecycle.stats()["retired"] if retire else None},
+        "digest": state_digest(final),
+    }
+
+
+def state_digest(snapshot: Dict[str, Any]) -> str:
+    # the last snapshot without the match ids (uuids): equal for equal runs
+    h = hashlib.sha1()
+    for f in sorted(snapshot["sims"], key=lambda f: f["walker"]["agent_id"]):
+        h.update(f"{f['walker']['agent_id']}|{f['driver']['agent_id']}|{f['phase']}|"
+                 f"{f['walker']['lat']:.6f},{f['walker']['lon']:.6f}|"
+                 f"{f['driver']['lat']:.6f},{f['driver']['lon']:.6f}\n".encode())
+    for key in ("leftover_drivers", "leftover_walkers"):
+        for a in snapshot[key]:
+            h.update(f"{a['agent_id']}|{a['lat']:.6f},{a['lon']:.6f}\n".encode())
+    return h.hexdigest()[:16]
+
+
+def format_report(r: Dict[str, Any]) -> str:
+    lines = [
+        f"{r['ticks']} ticks ({r['sim_s']:.0f} s simulated, {r['routing']}) in {r['wall_s']:.2f} s: "
+        f"{r['ticks_per_s']:.1f} ticks/s",
+        f"{r['requests']} requests, {r['matches']} matches {r['matches_by_source']}, "
+        f"{r['matches_per_s']:.1f} matches/s   osrm {r['osrm_calls']}",
+        f"admission route {r['admission_ms']['route']:.1f} ms, match {r['admission_ms']['match']:.1f} ms   "
+        f"sent {r['frame_bytes']} position bytes, {r['route_bytes']} route bytes",
+        f"tick p50 {r['tick_ms']['p50']:.2f} ms   p99 {r['tick_ms']['p99']:.2f} ms   "
+        f"max {r['tick_ms']['max']:.2f} ms",
+        f"{'stage':10s} {'total ms':>10s} {'mean ms':>9s} {'p99 ms':>9s} {'share':>7s}",
+    ]
+    for s, v in r["stages"].items():
+        lines.append(f"{s:10s} {v['total_ms']:10.1f} {v['mean_ms']:9.3f} {v['p99_ms']:9.3f} {v['share']:7.1%}")
+    f = r["final"]
+    lines.append(f"final: {f['sims']} sims, {f['leftover_drivers']} drivers and "
+                 f"{f['leftover_walkers']} walkers left, digest {r['digest']}")
+    return "\n".join(lines)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--ticks", type=int, default=600)
+    ap.add_argument("--dt", type=float, default=1.0, help="simulated seconds per tick")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--drivers", type=int, default=200, help="initial drivers")
+    ap.add_argument("--walkers", type=int, default=100, help="initial walkers")
+    ap.add_argument("--driver-rate", type=float, default=0.2, help="new drivers per tick")
+    ap.add_argument("--walker-rate", type=float, default=0.5, help="new walkers per tick")
+    ap.add_argument("--graph", choices=("straight", "grid"), default="straight")
+    ap.add_argument("--min-saving", type=float, default=800.0)
+    ap.add_argument("--no-retire", action="store_true", help="keep finished sims and agents in the tick")
+    ap.add_argument("--batch-window", type=float, default=0.0,
+                    help="simulated seconds of admissions matched together (0: one by one)")
+    ap.add_argument("--publish-hz", type=float, help="snapshots per simulated second (default: every tick)")
+    ap.add_argument("--state-db", help="record the run in a state store at this path")
+    ap.add_argument("--osrm-url", help="route over HTTP (e.g. python -m fake_osrm) instead of in process")
+    args = ap.parse_args()
+    print(format_report(run_headless(ticks=args.ticks, dt_s=args.dt, seed=args.seed,
+                                     drivers=args.drivers, walkers=args.walkers,
+                                     driver_rate=args.driver_rate, walker_rate=args.walker_rate,
+                                     graph=args.graph, min_saving_m=args.min_saving,
+                                     retire=not args.no_retire, batch_window_s=args.batch_window,
+                                     publish_hz=args.publish_hz, state_db=args.state_db,
+                                     osrm_url=args.osrm_url)))
+
+
+if __name__ == "__main__":
+    main()
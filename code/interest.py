@@ -0,0 +1,301 @@
+import math
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from position_stream import PositionDeltaEncoder
+from route_stream import RouteStream
+from wire import dumps
+
+CELL_DEG = 0.01  # bucket size, ~1.1 km north-south
+CLUSTER_BELOW_ZOOM = 13  # below this zoom a view gets counts per cell instead of agents
+COORD_DIGITS = 5
+
+Cell = Tuple[int, int]
+CellRange = Tuple[int, int, int, int]  # y0, x0, y1, x1, inclusive
+ViewKey = Tuple[str, int, int, int, int, int]  # mode, cell size in CELL_DEG, range
+
+
+def cell_of(lat: float, lon: float, size: int = 1) -> Cell:
+    return math.floor(lat / (CELL_DEG * size)), math.floor(lon / (CELL_DEG * size))
+
+
+def view_key(bbox: Any, zoom: Any) -> ViewKey:
+    """
+    Quantizes a client's viewport: clients whose bboxes cover the same cells
+    at the same detail share one view. Raises ValueError on a bad bbox.
+    """
+    try:
+        s, w, n, e = (float(v) for v in bbox)
+        z = int(zoom)
+    except (TypeError, ValueError):
+        raise ValueError("viewport needs bbox [south, west, north, east] and zoom")
+    if not all(map(math.isfinite, (s, w, n, e))) or s > n or w > e:
+        raise ValueError("invalid bbox")
+    if z < CLUSTER_BELOW_ZOOM:
+        mode, size = "clusters", 2 ** (CLUSTER_BELOW_ZOOM - 1 - max(z, 0))
+    else:
+        mode, size = "agents", 1
+    y0, x0 = cell_of(s, w, size)
+    y1, x1 = cell_of(n, e, size)
+    return mode, size, y0, x0, y1, x1
+
+
+def _cells(table: Dict[Cell, Any], r: CellRange) -> Iterable[Any]:
+    # walk the range or the non-empty cells, whichever is shorter
+    y0, x0, y1, x1 = r
+    if (y1 - y0 + 1) * (x1 - x0 + 1) <= len(table):
+        for y in range(y0, y1 + 1):
+            for x in range(x0, x1 + 1):
+                v = table.get((y, x))
+                if v is not None:
+                    yield v
+    else:
+        for (y, x), v in table.items():
+            if y0 <= y <= y1 and x0 <= x <= x1:
+                yield v
+
+
+class SnapshotBuckets:
+    """
+    One pass over a build_snapshot_payload() snapshot: ids of the sims and
+    leftover agents by cell (a sim under the cells of its walker and its
+    driver), and driver/walker counts per cell for the cluster views.
+    """
+
+    def __init__(self, data: Dict[str, Any]):
+        self.t_s = data["t_s"]
+        self.sims: Dict[Cell, List[str]] = {}
+        self.drivers: Dict[Cell, List[str]] = {}
+        self.walkers: Dict[Cell, List[str]] = {}
+        self.counts: Dict[Cell, List[float]] = {}  # drivers, walkers, sum lat, sum lon
+        self._clusters: Dict[int, Dict[Cell, List[float]]] = {}
+
+        for f in data["sims"]:
+            cw = self._count(f["walker"], 1)
+            cd = self._count(f["driver"], 0)
+            self.sims.setdefault(cw, []).append(f["sim_id"])
+            if cd != cw:
+                self.sims.setdefault(cd, []).append(f["sim_id"])
+        for table, items, kind in ((self.drivers, data["leftover_drivers"], 0),
+                                   (self.walkers, data["leftover_walkers"], 1)):
+            for a in items:
+                table.setdefault(self._count(a, kind), []).append(a["agent_id"])
+
+    def _count(self, a: Dict[str, Any], kind: int) -> Cell:
+        c = cell_of(a["lat"], a["lon"])
+        acc = self.counts.get(c)
+        if acc is None:
+            acc = self.counts[c] = [0, 0, 0.0, 0.0]
+        acc[kind] += 1
+        acc[2] += a["lat"]
+        acc[3] += a["lon"]
+        return c
+
+    def ids(self, r: CellRange) -> Tuple[Set[str], Set[str], Set[str]]:
+        # sims, leftover drivers and leftover walkers in the range
+        return tuple({k for ids in _cells(table, r) for k in ids}
+                     for table in (self.sims, self.drivers, self.walkers))
+
+    def clusters(self, size: int, r: CellRange) -> List[Dict[str, Any]]:
+        merged = self._clusters.get(size)
+        if merged is None:
+            # shared by every cluster view of this size
+            merged = self._clusters[size] = {}
+            for (y, x), (nd, nw, slat, slon) in self.counts.items():
+                key = (y // size, x // size)
+                acc = merged.get(key)
+                if acc is None:
+                    merged[key] = [nd, nw, slat, slon]
+                else:
+                    acc[0] += nd
+                    acc[1] += nw
+                    acc[2] += slat
+                    acc[3] += slon
+        out = []
+        for nd, nw, slat, slon in _cells(merged, r):
+            n = nd + nw
+            out.append({"lat": round(slat / n, COORD_DIGITS), "lon": round(slon / n, COORD_DIGITS),
+                        "drivers": nd, "walkers": nw})
+        return out
+
+
+class ViewGroup:
+    """
+    The clients that look at the same cells, with their own position and
+    route streams over that part of the world.
+
+    Positions are not diffed again per group: a group's message is the
+    global delta (PositionDeltaEncoder) restricted to the ids in view, plus
+    the full frame of whatever came into view and the ids of what left it;
+    a global keyframe becomes a group keyframe. So the work per group and
+    tick follows the number of agents in view. Cluster views get "clusters"
+    messages and no agents or routes.
+    """
+
+    def __init__(self, key: ViewKey):
+        self.key = key
+        self.mode, self.size = key[0], key[1]
+        self.range: CellRange = key[2:]
+        y0, x0, y1, x1 = self.range
+        deg = CELL_DEG * self.size
+        self.bbox = (y0 * deg, x0 * deg, (y1 + 1) * deg, (x1 + 1) * deg)
+        self.clients: set = set()
+        self.routes = RouteStream()
+        self.last_clusters: Optional[Dict[str, Any]] = None
+
+        self.seq = 0
+        self.t_s = 0.0
+        # ids in view, as last sent
+        self._ids: Tuple[Set[str], Set[str], Set[str]] = (set(), set(), set())
+        self._keyframe_cache: Dict[str, Any] = {}
+
+    def has_state(self) -> bool:
+        return self.seq > 0
+
+    def keyframe(self, stream: PositionDeltaEncoder) -> Dict[str, Any]:
+        sims, drivers, walkers = stream.state()
+        ids_s, ids_d, ids_w = self._ids
+        return {"type": "positions", "seq": self.seq, "key": True, "data": {
+            "t_s": self.t_s,
+            "sims": [sims[k] for k in ids_s],
+            "leftover_drivers": [drivers[k] for k in ids_d],
+            "leftover_walkers": [walkers[k] for k in ids_w],
+        }}
+
+    def keyframe_bytes(self, stream: PositionDeltaEncoder) -> bytes:
+        cache = self._keyframe_cache
+        if cache.get("seq") != self.seq:
+            cache["seq"], cache["buf"] = self.seq, dumps(self.keyframe(stream))
+        return cache["buf"]
+
+    def encode_positions(self, buckets: SnapshotBuckets, stream: PositionDeltaEncoder,
+                         changed: Optional[Tuple[Dict[str, Any], ...]]) -> Dict[str, Any]:
+        """changed: the global delta's entries by id, None after a global keyframe."""
+        if self.mode == "clusters":
+            self.last_clusters = {"type": "clusters", "data": {
+                "t_s": buckets.t_s, "cell_deg": CELL_DEG * self.size,
+                "clusters": buckets.clusters(self.size, self.range)}}
+            return self.last_clusters
+
+        ids = buckets.ids(self.range)
+        prev = self._ids
+        self._ids = ids
+        self.seq += 1
+        self.t_s = buckets.t_s
+        if changed is None or self.seq == 1:
+            return self.keyframe(stream)
+
+        out: Dict[str, Any] = {"t_s": self.t_s}
+        for state, delta, now, before, name, removed in zip(
+                stream.state(), changed, ids, prev,
+                ("sims", "leftover_drivers", "leftover_walkers"),
+                ("sims_removed", "drivers_removed", "walkers_removed")):
+            items = [state[k] for k in now - before]  # came into view: the whole frame
+            items += [delta[k] for k in now & before if k in delta]
+            gone = list(before - now)
+            if items:
+                out[name] = items
+            if gone:
+                out[removed] = gone
+        return {"type": "positions_delta", "seq": self.seq, "data": out}
+
+    def encode_routes(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if self.mode == "clusters":
+            data = {"routes_version": data["routes_version"], "geometries": {}, "routes": []}
+        else:
+            s, w, n, e = self.bbox
+            routes = [r for r in data["routes"] if r.get("bbox") is not None
+                      and r["bbox"][0] <= n and r["bbox"][2] >= s and r["bbox"][1] <= e and r["bbox"][3] >= w]
+            geometries = data["geometries"]
+            data = {"routes_version": data["routes_version"], "routes": routes,
+                    "geometries": {r[k]: geometries[r[k]] for r in routes
+                                   for k in ("driver_route", "walk_to_pickup", "walk_from_dropoff")}}
+        return self.routes.encode(data)
+
+    def join_messages(self, stream: PositionDeltaEncoder) -> List[Tuple[Dict[str, Any], Optional[str]]]:
+        # (event, outbox key) for a client that just switched to this view
+        out: List[Tuple[Dict[str, Any], Optional[str]]] = [
+            ({"type": "view", "mode": self.mode, "bbox": list(self.bbox), "cell_deg": CELL_DEG * self.size}, None)]
+        if self.routes.has_state():
+            out.append((self.routes.keyframe(), None))
+        if self.mode == "clusters":
+            if self.last_clusters is not None:
+                out.append((self.last_clusters, "clusters"))
+        elif self.has_state():
+            out.append((self.keyframe(stream), "positions"))
+        return out
+
+
+class InterestManager:
+    """
+    Viewport subscriptions of the global /ws clients. A client that sent a
+    viewport is served by the ViewGroup of its quantized bbox and zoom
+    instead of the full stream. on_positions()/on_routes() run after the
+    global stream has encoded the tick: the snapshot is bucketed once and
+    every group gets one message for all its clients. Groups are created on
+    first use, primed from the last snapshot and routes, and dropped when
+    their last client leaves.
+    """
+
+    def __init__(self, stream: PositionDeltaEncoder):
+        self.stream = stream  # the global position stream the views are cut from
+        self.groups: Dict[ViewKey, ViewGroup] = {}
+        self.view_of: Dict[Hashable, ViewGroup] = {}
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._routes: Optional[Dict[str, Any]] = None
+
+    def __len__(self) -> int:
+        return len(self.view_of)
+
+    def __contains__(self, client: Hashable) -> bool:
+        return client in self.view_of
+
+    def set_viewport(self, client: Hashable, bbox: Any, zoom: Any) -> Optional[ViewGroup]:
+        """Returns the client's new group, None if its view did not change."""
+        key = view_key(bbox, zoom)
+        old = self.view_of.get(client)
+        if old is not None and old.key == key:
+            return None
+        self.remove(client)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = ViewGroup(key)
+            group.encode_routes(self._routes or {"routes_version": 0.0, "geometries": {}, "routes": []})
+            if self._snapshot is not None and self.stream.has_state():
+                group.encode_positions(SnapshotBuckets(self._snapshot), self.stream, None)
+        group.clients.add(client)
+        self.view_of[client] = group
+        return group
+
+    def remove(self, client: Hashable) -> None:
+        group = self.view_of.pop(client, None)
+        if group is not None:
+            group.clients.discard(client)
+            if not group.clients:
+                del self.groups[group.key]
+
+    def on_positions(self, data: Dict[str, Any], event: Dict[str, Any]) -> List[Tuple[ViewGroup, Dict[str, Any]]]:
+        """data: the tick's snapshot, event: what the global stream made of it."""
+        self._snapshot = data
+        if not self.groups:
+            return []
+        changed = None
+        if not event.get("key"):
+            d = event["data"]
+            changed = ({f["sim_id"]: f for f in d.get("sims", ())},
+                       {a["agent_id"]: a for a in d.get("leftover_drivers", ())},
+                       {a["agent_id"]: a for a in d.get("leftover_walkers", ())})
+        buckets = SnapshotBuckets(data)
+        return [(group, group.encode_positions(buckets, self.stream, changed)) for group in self.groups.values()]
+
+    def on_routes(self, data: Dict[str, Any]) -> List[Tuple[ViewGroup, Dict[str, Any]]]:
+        self._routes = data
+        out = []
+        for group in self.groups.values():
+            event = group.encode_routes(data)
+            if event is not None:
+                out.append((group, event))
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        return {"clients": len(self.view_of), "groups": len(self.groups),
+                "cluster_groups": sum(g.mode == "clusters" for g in self.groups.values())}
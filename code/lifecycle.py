@@ -0,0 +1,148 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+
+from AgentState import AgentState
+from MatchSimulation import MatchSimulation, Phase
+from wire import dumps
+
+
+def sim_done_at(sim: MatchSimulation) -> float:
+    # when the walker arrives, the end of Phase.WALK_FROM_DROPOFF
+    return sim.creation_time_s + sim.match.driver_dropoff_eta_s + sim.match.walk_route_from_dropoff.duration
+
+
+def agent_done_at(agent: AgentState) -> float:
+    # when update_position() sets done
+    r = agent.route
+    end_t = r.cum_time_s[-1] if len(r.cum_time_s) else r.duration
+    return agent.start_offset_s + end_t / agent.time_scale
+
+
+@dataclass
+class Retired:
+    # one sim (kind "sim") or leftover agent ("driver" / "walker") taken out of the tick
+    kind: str
+    record: Dict[str, Any]
+    req_ids: List[str] = field(default_factory=list)
+    sim: Optional[MatchSimulation] = None
+    agent: Optional[AgentState] = None
+
+
+class ArchiveSink:
+    """
+    Retired records appended to a JSON lines file. Writes are buffered; the
+    file is flushed every flush_every records and on close().
+    """
+
+    def __init__(self, path: str, flush_every: int = 256):
+        self.path = path
+        self.flush_every = flush_every
+        self.written = 0
+        self._f = open(path, "ab")
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._f.write(dumps(record) + b"\n")
+        self.written += 1
+        if self.written % self.flush_every == 0:
+            self._f.flush()
+
+    def close(self) -> None:
+        self._f.close()
+
+
+class Lifecycle:
+    """
+    Moves finished rides and agents out of the lists the tick walks over.
+
+    A sim is retired keep_s after its walker arrived (Phase.DONE), a leftover
+    driver or walker keep_s after it reached its destination unmatched, so
+    clients still see them arrive. retire() removes them from the hot lists
+    in place, drops their request ids from agent_id_to_request_id and
+    last_routes_by_req, and keeps a summary record of each: the last `tail`
+    in memory (archive), all of them in the sink if there is one. The caller
+    takes the Retired entries out of everything else that refers to them
+    (state store, driver index, rematcher) and sends each request its final
+    "done" status.
+
+    The hot lists are scanned at most every every_s simulated seconds, so
+    the cost per tick follows the number of active rides, not of all rides
+    so far.
+    """
+
+    def __init__(self, keep_s: float = 30.0, every_s: float = 1.0, tail: int = 1000,
+                 sink: Optional[ArchiveSink] = None):
+        self.keep_s = keep_s
+        self.every_s = every_s
+        self.sink = sink
+        self.archive: Deque[Dict[str, Any]] = deque(maxlen=tail)
+        self.retired = {"sim": 0, "driver": 0, "walker": 0}
+        self._next_t: Optional[float] = None
+
+    def retire(self,
+               now_t: float,
+               sims: List[MatchSimulation],
+               driver_agents: List[AgentState],
+               walker_agents: List[AgentState],
+               agent_id_to_request_id: Dict[str, str],
+               last_routes_by_req: Dict[str, Any]) -> List[Retired]:
+        if self._next_t is not None and now_t < self._next_t:
+            return []
+        self._next_t = now_t + self.every_s
+        cutoff = now_t - self.keep_s
+
+        out: List[Retired] = []
+        done = [sim for sim in sims if sim.phase is Phase.DONE and sim_done_at(sim) <= cutoff]
+        if done:
+            gone = {sim.match_id for sim in done}
+            sims[:] = [sim for sim in sims if sim.match_id not in gone]
+            for sim in done:
+                req_ids = self._release((sim.walker_agent, sim.driver_agent), agent_id_to_request_id,
+                                        last_routes_by_req)
+                m = sim.match
+                out.append(Retired("sim", {
+                    "kind": "sim", "match_id": sim.match_id,
+                    "created_s": sim.creation_time_s, "done_s": sim_done_at(sim),
+                    "walker": sim.walker_agent.agent_id, "driver": sim.driver_agent.agent_id,
+                    "req_ids": req_ids,
+                    "walk_m": m.total_walk_dist_meters, "ride_m": m.ride_dist_meters,
+                    "saving_m": m.saving_dist_meters, "saving_s": m.saving_duration_seconds,
+                }, req_ids, sim=sim))
+
+        for kind, agents in (("driver", driver_agents), ("walker", walker_agents)):
+            finished = [a for a in agents if a.done and agent_done_at(a) <= cutoff]
+            if not finished:
+                continue
+            gone = {a.agent_id for a in finished}
+            agents[:] = [a for a in agents if a.agent_id not in gone]
+            for a in finished:
+                req_ids = self._release((a,), agent_id_to_request_id, last_routes_by_req)
+                out.append(Retired(kind, {
+                    "kind": kind, "agent_id": a.agent_id, "req_ids": req_ids,
+                    "start_s": a.start_offset_s, "done_s": agent_done_at(a), "matched": False,
+                }, req_ids, agent=a))
+
+        for r in out:
+            self.retired[r.kind] += 1
+            self.archive.append(r.record)
+            if self.sink is not None:
+                self.sink.write(r.record)
+        return out
+
+    @staticmethod
+    def _release(agents, agent_id_to_request_id: Dict[str, str], last_routes_by_req: Dict[str, Any]) -> List[str]:
+        req_ids = []
+        for a in agents:
+            rid = agent_id_to_request_id.pop(a.agent_id, None)
+            if rid is not None:
+                last_routes_by_req.pop(rid, None)
+                req_ids.append(rid)
+        return req_ids
+
+    def stats(self) -> Dict[str, Any]:
+        return {"retired": dict(self.retired), "archive": len(self.archive),
+                "sink": self.sink.written if self.sink is not None else None}
+
+    def close(self) -> None:
+        if self.sink is not None:
+            self.sink.close()
@@ -1,29 +1,65 @@
 import asyncio
 import math
+import os
 import random
+import sqlite3
 import threading
-import time
 import folium
-import requests
 import webbrowser
 from typing import List, Tuple, Optional, Dict, Any
-from functools import lru_cache
+from pathlib import Path
 from queue import Queue, Empty
 
 from aiohttp import web
 
-from RouteBase import LatLon, DriverRoute, WalkerRoute, RouteBase
-from Match import Match, MatchLight
+import metrics
+from RouteBase import LatLon, DriverRoute, WalkerRoute, RouteBase, CompactRoute, LazyRoute
+from Match import Match, MatchLight, MatchCandidate
 from AgentState import AgentState
 from MatchSimulation import MatchSimulation, Phase
-from ws_bus import publish, publish_by_id, send_status
+from ws_bus import publish, publish_by_id
+from wire import dumps, position_event
+from spatial_index import DriverGridIndex
+from assignment import max_weight_assignment
+from corridor import corridor_feasible
+from geometry import haversine_m
+from candidate_memo import PairMemo, pair_memo
+from route_index import RoutePoint, segment_index, time_at, dist_at
+from route_stream import RouteStream
+from osrm_client import OsrmClient, OsrmError
+from route_cache import MemoryLRU, SqliteRouteCache, cache_key
 
 #from realtime_runner import *
 
 OSRM_DRIVE = "http://localhost:5000"
 OSRM_WALK = "http://localhost:5001"
 
-SESSION = requests.Session()
+# pooled async client shared by every routing call (drive + walk backends)
+OSRM = OsrmClient(max_in_flight=32, timeout_s=20.0, retries=2)
+
+# batch pickup/dropoff costing through /table (falls back to one /route per pair)
+USE_TABLE = True
+# OSRM default for --max-table-size
+OSRM_TABLE_MAX_COORDS = 100
+
+# drivers whose remaining route never comes this close to the walker start
+# and destination are not considered by best_match_
+MATCH_RADIUS_M = 1500.0
+
+# skip drivers that cannot match on straight-line bounds before any routing call
+USE_CORRIDOR_FILTER = True
+
+# reuse walking costs per (driver route, walker destination) across evaluations (candidate_memo)
+USE_CANDIDATE_MEMO = True
+
+# batch matching: seconds of walking saved that one second of the walker
+# waiting at the pickup costs
+BATCH_WAIT_WEIGHT = 0.1
+
+FETCH_ROUTE_S = metrics.histogram("driveby_fetch_route_seconds", "fetch_route (one full /route, blocking)")
+BEST_MATCH_S = metrics.histogram("driveby_best_match_seconds", "best_match_ for one walker")
+FINALIZE_MATCH_S = metrics.histogram("driveby_finalize_match_seconds", "finalize_match (full walking routes)")
+SNAPSHOT_S = metrics.histogram("driveby_build_snapshot_seconds", "build_snapshot_payload")
 
 
 def q(x: float, p: int = 5) -> float:  # 5 - 1m
@@ -39,53 +75,20 @@ def cum_array(values: List[float]) -> List[float]:
     return cum
 
 
-def haversine_m(a: LatLon, b: LatLon) -> float:
-    R = 6371000.0
-    lat1, lon1 = map(math.radians, a)
-    lat2, lon2 = map(math.radians, b)
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    x = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
-    return 2 * R * math.asin(math.sqrt(x))
-
-
-def topk_by_haversine(points: List[LatLon], target: LatLon, k: int) -> list[float]:
-    idx_d = [(i, haversine_m(p, target)) for i, p in enumerate(points)]
-    idx_d.sort(key=lambda t: t[1])
-    return [i for i, _ in idx_d[:min(k, len(idx_d))]]
-
-
-def closest_point_index(points: List[LatLon], target: LatLon) -> int:
-    best_i = 0
-    best_d = float("inf")
-    for i, p in enumerate(points):
-        d = haversine_m(p, target)
-        if d < best_d:
-            best_d = d
-            best_i = i
-    return best_i
-
-
 # -------------------------
 # OSRM route fetch + cache
 # -------------------------
 
-def build_walker_route(start: LatLon, dest: LatLon, profile: str = "walking") -> WalkerRoute:
-    r = fetch_route(start, dest, profile)
-
-    return WalkerRoute(
-        start=start,
-        dest=dest,
-        dist=r["total_dist"],
-        duration=r["total_time"],
-        duration_list=r["seg_time"],
-        cum_time_s=r["cum_time"],
-        profile=profile,
-        geometry_latlon=r["geometry"],
-        seg_dist_m=r["seg_dist"],
-        cum_dist_m=r["cum_dist"],
-        nodes=r["nodes"],
-    )
+def osrm_base(profile: str) -> str:
+    if profile == "walking":
+        return OSRM_WALK
+    elif profile == "driving":
+        return OSRM_DRIVE
+    raise ValueError(f"Unknown profile: {profile}")
+
+
+def build_walker_route(start: LatLon, dest: LatLon, profile: str = "walking") -> CompactRoute:
+    return fetch_route(start, dest, profile)
 
 
 def fetch_drive_route(start: LatLon, dest: LatLon):
@@ -96,114 +99,234 @@ def fetch_walk_route(start: LatLon, dest: LatLon):
     return fetch_route(start, dest, "walking")
 
 
-def fetch_route_fast(start: LatLon, dest: LatLon, profile: str):
-    base = OSRM_WALK if profile == "walking" else OSRM_DRIVE
+async def fetch_route_fast_async(start: LatLon, dest: LatLon, profile: str) -> Tuple[float, float]:
     a_lat, a_lon = start
     b_lat, b_lon = dest
     coords = f"{a_lon},{a_lat};{b_lon},{b_lat}"
-    url = f"{base}/route/v1/{profile}/{coords}?overview=false&steps=false"
-
-    r = requests.get(url, timeout=60)
-    r.raise_for_status()
-    data = r.json()
-    if data.get("code") != "Ok":
-        raise RuntimeError(data)
+    data = await OSRM.get_json(osrm_base(profile), f"/route/v1/{profile}/{coords}?overview=false&steps=false")
     route = data["routes"][0]
     return route["distance"], route["duration"]
 
 
-def build_walker_route_full(start: LatLon, dest: LatLon) -> WalkerRoute:
-    r = fetch_route(start, dest, "walking")
-    return WalkerRoute(
-        start=start, dest=dest,
-        dist=r["total_dist"], duration=r["total_time"],
-        duration_list=r["seg_time"], cum_time_s=r["cum_time"],
-        profile="walking", geometry_latlon=r["geometry"],
-        seg_dist_m=r["seg_dist"], cum_dist_m=r["cum_dist"],
-        nodes=r["nodes"],
-    )
+def fetch_route_fast(start: LatLon, dest: LatLon, profile: str):
+    return OSRM.run(fetch_route_fast_async(start, dest, profile))
 
 
-def fetch_route(start: LatLon, dest: LatLon, profile: str):
-    if profile == "walking":
-        base = OSRM_WALK
-    elif profile == "driving":
-        base = OSRM_DRIVE
-    else:
-        raise ValueError(f"Unknown profile: {profile}")
+def build_walker_route_full(start: LatLon, dest: LatLon) -> CompactRoute:
+    return fetch_route(start, dest, "walking")
+
+
+def build_walker_routes_full(legs: List[Tuple[LatLon, LatLon]]) -> List[CompactRoute]:
+    # all legs fetched concurrently, through the full-route cache
+    return OSRM.run_many([route_cached_async(a[0], a[1], b[0], b[1], "walking") for a, b in legs])
+
+
+def lazy_walk_route(a: LatLon, b: LatLon) -> LazyRoute:
+    # distance and duration now (walk_fast, usually cached), geometry on first use
+    dist, duration = walk_fast(a, b)
+    return LazyRoute(a, b, dist, duration, loader=lambda: route_cached(a[0], a[1], b[0], b[1], "walking"))
+
+
+async def fetch_route_async(start: LatLon, dest: LatLon, profile: str) -> CompactRoute:
+    base = osrm_base(profile)
 
     a_lat, a_lon = start
     b_lat, b_lon = dest
 
     coords = f"{a_lon},{a_lat};{b_lon},{b_lat}"
-    print(coords)
-    url = (
-        f"{base}/route/v1/{profile}/{coords}"
+    path = (
+        f"/route/v1/{profile}/{coords}"
         "?overview=full&geometries=geojson&annotations=true&steps=false"
     )
+    data = await OSRM.get_json(base, path, timeout_s=60)
+    return CompactRoute.from_osrm(start, dest, profile, data["routes"][0])
 
-    r = requests.get(url, timeout=60)
-    r.raise_for_status()
-    data = r.json()
-    if data.get("code") != "Ok":
-        raise RuntimeError(data)
 
-    route = data["routes"][0]
-    leg = route["legs"][0]
-    ann = leg["annotation"]
+@metrics.timed(FETCH_ROUTE_S)
+def fetch_route(start: LatLon, dest: LatLon, profile: str) -> CompactRoute:
+    return OSRM.run(fetch_route_async(start, dest, profile))
 
-    geometry_latlon = [(lat, lon) for lon, lat in route["geometry"]["coordinates"]]
-    seg_dist = ann["distance"]
-    seg_time = ann["duration"]
-    nodes = ann.get("nodes")
 
-    return {
-        "geometry": geometry_latlon,
-        "seg_dist": seg_dist,
-        "cum_dist": cum_array(seg_dist),
-        "seg_time": seg_time,
-        "cum_time": cum_array(seg_time),
-        "nodes": nodes,
-        "total_dist": route["distance"],
-        "total_time": route["duration"],
-    }
+_FAST_CACHE = MemoryLRU(maxsize=200_000)
+_FULL_CACHE = MemoryLRU(maxsize=50_000)
+
+# second level behind both in-process caches, shared across restarts and
+# server processes; DRIVEBY_ROUTE_CACHE="" disables it
+ROUTE_CACHE_PATH = os.environ.get("DRIVEBY_ROUTE_CACHE",
+                                  str(Path(__file__).resolve().parent / "route_cache.sqlite"))
+DISK_CACHE: Optional[SqliteRouteCache] = SqliteRouteCache(ROUTE_CACHE_PATH) if ROUTE_CACHE_PATH else None
+
+# key -> future of the request already on the wire (client loop only)
+_inflight: Dict[tuple, asyncio.Future] = {}
+
+
+def _disk_key(key: tuple) -> str:
+    kind, a_lat, a_lon, b_lat, b_lon, profile = key
+    # backend url in the key: a stub or test server never pollutes real routes
+    return cache_key(osrm_base(profile), kind, profile, a_lat, a_lon, b_lat, b_lon)
+
+
+def _from_disk(cache: MemoryLRU, key: tuple):
+    if DISK_CACHE is None:
+        return None
+    try:
+        v = DISK_CACHE.get(_disk_key(key))
+    except sqlite3.Error as e:
+        print("route cache read failed:", e)
+        return None
+    if v is not None:
+        cache.put(key, v)
+    return v
+
+
+def _to_disk(key: tuple, v) -> None:
+    if DISK_CACHE is None:
+        return
+    try:
+        DISK_CACHE.put(_disk_key(key), v)
+    except sqlite3.Error as e:
+        print("route cache write failed:", e)
+
+
+async def _fetch_once(cache: MemoryLRU, key: tuple, make):
+    # concurrent misses on the same key share one request
+    fut = _inflight.get(key)
+    if fut is not None:
+        return await asyncio.shield(fut)
+
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key] = fut
+    try:
+        v = await make()
+    except BaseException as e:
+        fut.set_exception(e)
+        fut.exception()  # retrieved, even if nobody else was waiting
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+    cache.put(key, v)
+    _to_disk(key, v)
+    fut.set_result(v)
+    return v
+
+
+async def _cached(cache: MemoryLRU, key: tuple, make):
+    v = cache.get(key)
+    if v is None:
+        v = _from_disk(cache, key)
+    if v is not None:
+        return v
+    return await _fetch_once(cache, key, make)
+
+
+def _cached_sync(cache: MemoryLRU, key: tuple, make):
+    # hits are served on the calling thread without a hop to the client loop
+    v = cache.get(key)
+    if v is None:
+        v = _from_disk(cache, key)
+    if v is not None:
+        return v
+    return OSRM.run(_fetch_once(cache, key, make))
+
+
+def _fast_key(a_lat: float, a_lon: float, b_lat: float, b_lon: float, profile: str) -> tuple:
+    return "fast", q(a_lat), q(a_lon), q(b_lat), q(b_lon), profile
+
+
+def _full_key(a_lat: float, a_lon: float, b_lat: float, b_lon: float, profile: str) -> tuple:
+    return "full", q(a_lat), q(a_lon), q(b_lat), q(b_lon), profile
+
+
+async def route_fast_cached_async(a_lat: float, a_lon: float, b_lat: float, b_lon: float, profile: str):
+    key = _fast_key(a_lat, a_lon, b_lat, b_lon, profile)
+    return await _cached(_FAST_CACHE, key,
+                         lambda: fetch_route_fast_async(key[1:3], key[3:5], profile))
 
 
-@lru_cache(maxsize=200_000)
 def route_fast_cached(a_lat: float, a_lon: float, b_lat: float, b_lon: float, profile: str):
-    base = OSRM_WALK if profile == "walking" else OSRM_DRIVE
-    coords = f"{a_lon},{a_lat};{b_lon},{b_lat}"
-    url = f"{base}/route/v1/{profile}/{coords}?overview=false&steps=false"
+    key = _fast_key(a_lat, a_lon, b_lat, b_lon, profile)
+    return _cached_sync(_FAST_CACHE, key,
+                        lambda: fetch_route_fast_async(key[1:3], key[3:5], profile))
 
-    r = SESSION.get(url, timeout=20)
-    r.raise_for_status()
-    data = r.json()
-    if data.get("code") != "Ok":
-        raise RuntimeError(data)
-    route = data["routes"][0]
-    return route["distance"], route["duration"]
+
+async def route_cached_async(a_lat: float, a_lon: float, b_lat: float, b_lon: float, profile: str):
+    key = _full_key(a_lat, a_lon, b_lat, b_lon, profile)
+    return await _cached(_FULL_CACHE, key,
+                         lambda: fetch_route_async(key[1:3], key[3:5], profile))
 
 
-@lru_cache(maxsize=50_000)
 def route_cached(
         a_lat: float, a_lon: float,
         b_lat: float, b_lon: float,
         profile: str
-) -> Dict[str, Any]:
-    # cache key is primitive floats + profile
-    return fetch_route((a_lat, a_lon), (b_lat, b_lon), profile)
+) -> CompactRoute:
+    # cache key is quantized floats + profile (same ~1 m grid as walk_fast)
+    key = _full_key(a_lat, a_lon, b_lat, b_lon, profile)
+    return _cached_sync(_FULL_CACHE, key,
+                        lambda: fetch_route_async(key[1:3], key[3:5], profile))
+
+
+def clear_route_caches() -> None:
+    _FAST_CACHE.clear()
+    _FULL_CACHE.clear()
+
+
+_CORRIDOR_STATS = {"checked": 0, "rejected": 0}
+_CORRIDOR_LOCK = threading.Lock()
+
+
+def corridor_stats() -> Dict[str, int]:
+    with _CORRIDOR_LOCK:
+        return dict(_CORRIDOR_STATS)
+
+
+def route_cache_stats() -> Dict[str, Any]:
+    return {
+        "fast": _FAST_CACHE.stats(),
+        "full": _FULL_CACHE.stats(),
+        "disk": DISK_CACHE.stats() if DISK_CACHE is not None else None,
+    }
 
 
 def walk_fast(a: LatLon, b: LatLon) -> tuple[float, float]:
     return route_fast_cached(q(a[0]), q(a[1]), q(b[0]), q(b[1]), "walking")
 
 
+def walk_fast_many(pairs: List[Tuple[LatLon, LatLon]]) -> List[Tuple[float, float]]:
+    # walk_fast for many legs, misses are fetched concurrently
+    return OSRM.run_many([
+        route_fast_cached_async(q(a[0]), q(a[1]), q(b[0]), q(b[1]), "walking") for a, b in pairs
+    ])
+
+
 def walk_dist(a: LatLon, b: LatLon) -> float:
-    return route_cached(a[0], a[1], b[0], b[1], "walking")["total_dist"]
+    return route_cached(a[0], a[1], b[0], b[1], "walking").dist
 
 
 def walk_time(a: LatLon, b: LatLon) -> float:
-    return route_cached(a[0], a[1], b[0], b[1], "walking")["total_time"]
+    return route_cached(a[0], a[1], b[0], b[1], "walking").duration
+
+
+async def fetch_table_async(sources: List[LatLon],
+                            destinations: List[LatLon],
+                            profile: str = "walking"):
+    pts = list(sources) + list(destinations)
+    coords = ";".join(f"{q(lon)},{q(lat)}" for lat, lon in pts)
+    src = ";".join(str(i) for i in range(len(sources)))
+    dst = ";".join(str(len(sources) + j) for j in range(len(destinations)))
+    path = (f"/table/v1/{profile}/{coords}"
+            f"?sources={src}&destinations={dst}&annotations=duration,distance")
+
+    data = await OSRM.get_json(osrm_base(profile), path)
+    return data["distances"], data["durations"]
+
+
+def fetch_table(sources: List[LatLon],
+                destinations: List[LatLon],
+                profile: str = "walking") -> Tuple[List[List[Optional[float]]], List[List[Optional[float]]]]:
+    # one /table request: distances[i][j] / durations[i][j] for sources[i] -> destinations[j]
+    return OSRM.run(fetch_table_async(sources, destinations, profile))
 
 
 # -------------------------
@@ -218,20 +341,7 @@ def random_offset(point: LatLon, radius_m: float) -> LatLon:
 
 
 def create_driver_agent(start: LatLon, dest: LatLon, offset: float) -> AgentState:
-    r = fetch_route(start, dest, "driving")
-    route = DriverRoute(
-        start=start,
-        dest=dest,
-        dist=r["total_dist"],
-        duration=r["total_time"],
-        duration_list=r["seg_time"],
-        cum_time_s=r["cum_time"],
-        profile="driving",
-        geometry_latlon=r["geometry"],
-        seg_dist_m=r["seg_dist"],
-        cum_dist_m=r["cum_dist"],
-        nodes=r["nodes"],
-    )
+    route = fetch_route(start, dest, "driving")
     driver_agent = AgentState(
         route=route,
         pos=route.start,
@@ -255,20 +365,7 @@ def create_drivers(start: LatLon,
 
 
 def create_walker_agent(start: LatLon, dest: LatLon, offset: float) -> AgentState:
-    r = fetch_route(start, dest, "walking")
-    route = WalkerRoute(
-        start=start,
-        dest=dest,
-        dist=r["total_dist"],
-        duration=r["total_time"],
-        duration_list=r["seg_time"],
-        cum_time_s=r["cum_time"],
-        profile="walking",
-        geometry_latlon=r["geometry"],
-        seg_dist_m=r["seg_dist"],
-        cum_dist_m=r["cum_dist"],
-        nodes=r["nodes"],
-    )
+    route = fetch_route(start, dest, "walking")
     walker_agent = AgentState(
         route=route,
         pos=route.start,
@@ -292,69 +389,80 @@ def create_walkers(center_start: LatLon,
 # pickup / dropoff selection
 
 
-def find_pickup_light(driver: AgentState, walker_pos: LatLon, k: int = 15):
-    pts = driver.route.geometry_latlon
-    start_index = driver.idx
-
-    tail = pts[start_index:]
-    if not tail:
+def find_pickup_light(driver: AgentState, walker_pos: LatLon, k: int = 15, memo: Optional[PairMemo] = None):
+    # k closest points of the remaining route (projected onto its segments), best by walking distance
+    if memo is not None:
+        hit = memo.pickup(driver.idx, walker_pos)
+        if hit is not None:
+            c, cost = hit
+            if cost is None:
+                cost = walk_fast(walker_pos, c.point)
+                memo.store_pickup_cost(walker_pos, *cost)
+            m, s = cost
+            return c.point, m, s, c.seg, c.frac
+
+    cands = segment_index(driver.route).nearest(walker_pos, k, after=(driver.idx, 0.0))
+    if not cands:
         raise RuntimeError("Driver at end")
 
-    cand_local = topk_by_haversine(tail, walker_pos, k)
-    cand_idx = [start_index + j for j in cand_local]
-
-    best_i = None
+    best = None
     best_m = float("inf")
     best_s = float("inf")
-    for i in cand_idx:
-        m, s = walk_fast(walker_pos, pts[i])  # pos -> pickup
+    costs = walk_fast_many([(walker_pos, c.point) for c in cands])  # pos -> pickup
+    for c, (m, s) in zip(cands, costs):
         if m < best_m:
-            best_m, best_s, best_i = m, s, i
-    if best_i is None:
+            best_m, best_s, best = m, s, c
+    if best is None:
         raise RuntimeError("No pickup point found")
-    return pts[best_i], best_m, best_s, best_i
+    if memo is not None:
+        memo.store_pickup(walker_pos, best, best_m, best_s)
+    return best.point, best_m, best_s, best.seg, best.frac
 
 
-def find_dropoff_light(driver: AgentState, walker_dest: LatLon, pickup_i: int, k: int = 10):
-    pts = driver.route.geometry_latlon
-    tail = pts[pickup_i + 1:]
-    if not tail:
+def find_dropoff_light(driver: AgentState, walker_dest: LatLon, pickup_i: int, k: int = 10,
+                       pickup_frac: float = 0.0, memo: Optional[PairMemo] = None):
+    after = (pickup_i, pickup_frac)
+    cands = [c for c in segment_index(driver.route).nearest(walker_dest, k, after=after)
+             if (c.seg, c.frac) > after]
+    if not cands:
         raise RuntimeError("Pickup at end")
 
-    cand_local = topk_by_haversine(tail, walker_dest, k)
-    cand_idx = [pickup_i + 1 + j for j in cand_local]
+    costs = [memo.drop_cost(c) for c in cands] if memo is not None else [None] * len(cands)
+    missing = [i for i, cost in enumerate(costs) if cost is None]
+    if missing:
+        fetched = walk_fast_many([(cands[i].point, walker_dest) for i in missing])  # dropoff -> dest
+        for i, cost in zip(missing, fetched):
+            costs[i] = cost
+            if memo is not None:
+                memo.drop[(cands[i].seg, cands[i].frac)] = cost
 
-    best_i = None
+    best = None
     best_m = float("inf")
     best_s = float("inf")
-    for i in cand_idx:
-        m, s = walk_fast(pts[i], walker_dest)  # dropoff -> dest
+    for c, (m, s) in zip(cands, costs):
         if m < best_m:
-            best_m, best_s, best_i = m, s, i
-    if best_i is None:
+            best_m, best_s, best = m, s, c
+    if best is None:
         raise RuntimeError("No dropoff")
-    return pts[best_i], best_m, best_s, best_i
+    return best.point, best_m, best_s, best.seg, best.frac
 
 
 def find_pickup(driver: RouteBase,
                 walker: RouteBase,
                 k: int = 15) -> Tuple[LatLon, float, float, int]:
-    pts = driver.geometry_latlon
-    cand_idx = topk_by_haversine(pts, walker.start, k)
-
-    best_i = None
+    best = None
     best_m = float("inf")
     best_s = float("inf")
-    for i in cand_idx:
-        m = walk_dist(pts[i], walker.start)
+    for c in segment_index(driver).nearest(walker.start, k):
+        m = walk_dist(c.point, walker.start)
         if m < best_m:
             best_m = m
-            best_s = walk_time(pts[i], walker.start)
-            best_i = i
+            best_s = walk_time(c.point, walker.start)
+            best = c
 
-    if best_i is None:
+    if best is None:
         raise RuntimeError("No pickup point found")
-    return pts[best_i], best_m, best_s, best_i
+    return best.point, best_m, best_s, best.seg
 
 
 def find_dropoff(driver: DriverRoute,
@@ -362,27 +470,24 @@ def find_dropoff(driver: DriverRoute,
                  pickup: LatLon,
                  pickup_i: int,
                  k: int = 10) -> Tuple[LatLon, float, float, int]:
-    pts = driver.geometry_latlon
-    tail = pts[pickup_i + 1:]
-    if not tail:
+    cands = [c for c in segment_index(driver).nearest(walker.dest, k, after=(pickup_i, 0.0))
+             if c.point != pickup]
+    if not cands:
         raise RuntimeError("Pickup is at/near end of driver route")
 
-    cand_local = topk_by_haversine(tail, walker.dest, k)
-    cand_idx = [pickup_i + 1 + j for j in cand_local]
-
-    best_i = None
+    best = None
     best_m = float("inf")
     best_s = float("inf")
-    for i in cand_idx:
-        m = walk_dist(pts[i], walker.dest)
+    for c in cands:
+        m = walk_dist(c.point, walker.dest)
         if m < best_m:
             best_m = m
-            best_s = walk_time(pts[i], walker.dest)
-            best_i = i
+            best_s = walk_time(c.point, walker.dest)
+            best = c
 
-    if best_i is None:
+    if best is None:
         raise RuntimeError("No dropoff point found")
-    return pts[best_i], best_m, best_s, best_i
+    return best.point, best_m, best_s, best.seg
 
 
 def is_within_dist(p1, p2, max_dist_m):
@@ -390,34 +495,172 @@ def is_within_dist(p1, p2, max_dist_m):
 
 
 def build_match_light(driver: AgentState, walker: AgentState) -> MatchLight:
-    pickup, pick_m, pick_s, pi = find_pickup_light(driver, walker.get_pos())
-    dropoff, drop_m, drop_s, di = find_dropoff_light(driver, walker.route.dest, pi)
-    if di <= pi:
+    walker_pos = walker.get_pos()
+    walker_dest = walker.route.dest
+    memo = pair_memo(driver.route, walker_dest) if USE_CANDIDATE_MEMO else None
+    pickup, pick_m, pick_s, pi, pf = find_pickup_light(driver, walker_pos, memo=memo)
+    dropoff, drop_m, drop_s, di, df = find_dropoff_light(driver, walker_dest, pi, pickup_frac=pf, memo=memo)
+    if (di, df) <= (pi, pf):
         raise RuntimeError("Dropoff before pickup")
 
     return MatchLight(
         pickup=pickup, dropoff=dropoff,
         pickup_index=pi, dropoff_index=di,
         pick_walk_dist_m=pick_m, drop_walk_dist_m=drop_m,
-        pick_walk_s=pick_s, drop_walk_s=drop_s
+        pick_walk_s=pick_s, drop_walk_s=drop_s,
+        pickup_frac=pf, dropoff_frac=df
     )
 
 
+def _table_candidates(driver: AgentState, walker_pos: LatLon, walker_dest: LatLon,
+                      k_pick: int = 15, k_drop: int = 10,
+                      pick_hit: Optional[RoutePoint] = None) -> Optional[Tuple[list, list]]:
+    # same top-k preselection as find_pickup_light / find_dropoff_light, but the
+    # dropoff candidates are taken after the earliest pickup candidate, so both
+    # sets are known before any routing call; with a memoized pickup there are
+    # no pickup candidates to cost and the dropoffs are taken after it
+    index = segment_index(driver.route)
+    if pick_hit is not None:
+        pick = []
+        first = (pick_hit.seg, pick_hit.frac)
+    else:
+        pick = index.nearest(walker_pos, k_pick, after=(driver.idx, 0.0))
+        if not pick:
+            return None
+        first = min((c.seg, c.frac) for c in pick)
+    drop = [c for c in index.nearest(walker_dest, k_drop, after=first) if (c.seg, c.frac) > first]
+    if not drop:
+        return None
+    return pick, drop
+
+
+def build_match_light_batch(drivers: List[AgentState], walker: AgentState) -> List[Tuple[AgentState, MatchLight]]:
+    """
+    MatchLight for every driver with all walking legs costed through /table:
+    sources = [walker_pos] + dropoff candidates, destinations = [walker_dest] + pickup
+    candidates. Drivers are chunked so a request stays below OSRM_TABLE_MAX_COORDS.
+    Legs the candidate memo already knows are left out of the requests; a chunk
+    that needs nothing new costs no request at all.
+    """
+    walker_pos = walker.get_pos()
+    walker_dest = walker.route.dest
+
+    # (driver, memo, memoized pickup, pickup candidates to cost, dropoff candidates, their known costs)
+    cands = []
+    for d in drivers:
+        memo = pair_memo(d.route, walker_dest) if USE_CANDIDATE_MEMO else None
+        hit = memo.pickup(d.idx, walker_pos) if memo is not None else None
+        c = _table_candidates(d, walker_pos, walker_dest, pick_hit=hit[0] if hit else None)
+        if c is not None:
+            pick, drop = c
+            if hit is not None and hit[1] is None:
+                pick = [hit[0]]  # same pickup, the walker moved: one leg
+            known = [memo.drop_cost(x) for x in drop] if memo is not None else [None] * len(drop)
+            cands.append((d, memo, hit, pick, drop, known))
+
+    def n_new(cand) -> int:
+        return len(cand[3]) + sum(k is None for k in cand[5])
+
+    out: List[Tuple[AgentState, MatchLight]] = []
+    i = 0
+    while i < len(cands):
+        # grow the chunk while the coordinate count fits
+        j = i
+        n_coords = 2
+        while j < len(cands) and (j == i or n_coords + n_new(cands[j]) <= OSRM_TABLE_MAX_COORDS):
+            n_coords += n_new(cands[j])
+            j += 1
+        chunk = cands[i:j]
+        i = j
+
+        pick_pts: List[LatLon] = []
+        drop_pts: List[LatLon] = []
+        for d, memo, hit, pick, drop, known in chunk:
+            pick_pts.extend(c.point for c in pick)
+            drop_pts.extend(c.point for c, k in zip(drop, known) if k is None)
+
+        if pick_pts or drop_pts:
+            distances, durations = fetch_table([walker_pos] + drop_pts, [walker_dest] + pick_pts)
+
+        pcol = 1
+        drow = 1
+        for d, memo, hit, pick, drop, known in chunk:
+            if hit is not None and hit[1] is not None:
+                best_p, (best_pm, best_ps) = hit
+            else:
+                best_p, best_pm, best_ps = None, float("inf"), float("inf")
+                for k, c in enumerate(pick):
+                    m = distances[0][pcol + k]
+                    if m is not None and m < best_pm:
+                        best_p, best_pm, best_ps = c, m, durations[0][pcol + k]
+                pcol += len(pick)
+                if memo is not None and best_p is not None:
+                    if hit is not None:
+                        memo.store_pickup_cost(walker_pos, best_pm, best_ps)
+                    else:
+                        memo.store_pickup(walker_pos, best_p, best_pm, best_ps)
+
+            best_d, best_dm, best_ds = None, float("inf"), float("inf")
+            for c, cost in zip(drop, known):
+                if cost is None:
+                    m, s = distances[drow][0], durations[drow][0]
+                    drow += 1
+                    if m is None:
+                        continue
+                    if memo is not None:
+                        memo.drop[(c.seg, c.frac)] = (m, s)
+                else:
+                    m, s = cost
+                if best_p is not None and (c.seg, c.frac) > (best_p.seg, best_p.frac) and m < best_dm:
+                    best_d, best_dm, best_ds = c, m, s
+
+            if best_d is None:
+                continue
+
+            out.append((d, MatchLight(
+                pickup=best_p.point, dropoff=best_d.point,
+                pickup_index=best_p.seg, dropoff_index=best_d.seg,
+                pick_walk_dist_m=best_pm, drop_walk_dist_m=best_dm,
+                pick_walk_s=best_ps, drop_walk_s=best_ds,
+                pickup_frac=best_p.frac, dropoff_frac=best_d.frac
+            )))
+    return out
+
+
+def match_lights(drivers: List[AgentState], walker: AgentState) -> List[Tuple[AgentState, MatchLight]]:
+    if USE_TABLE:
+        try:
+            return build_match_light_batch(drivers, walker)
+        except (OsrmError, KeyError, IndexError) as e:
+            print("table costing failed, falling back to /route:", e)
+
+    out = []
+    for d_agent in drivers:
+        try:
+            out.append((d_agent, build_match_light(d_agent, walker)))
+        except RuntimeError:
+            continue
+    return out
+
+
+@metrics.timed(FINALIZE_MATCH_S)
 def finalize_match(driver_agent: AgentState, walker_agent: AgentState, ml: MatchLight) -> Match:
     driver = driver_agent.route
 
     walker_pos = walker_agent.get_pos()
     walker_dest = walker_agent.route.dest
 
-    # baseline remaining walk from now -> dest (saving must be based on current state)
-    baseline_walk = build_walker_route_full(walker_pos, walker_dest)
-
-    # expensive only once
-    walk_to = build_walker_route_full(walker_pos, ml.pickup)
+    # baseline remaining walk from now -> dest (saving must be based on current state):
+    # only its distance and duration are used, no geometry unless something reads it
+    baseline_walk = lazy_walk_route(walker_pos, walker_dest)
+    # both legs are simulated and drawn right away: full geometry, fetched concurrently
+    walk_to, walk_from = build_walker_routes_full([
+        (walker_pos, ml.pickup),
+        (ml.dropoff, walker_dest),
+    ])
     if not is_within_dist(walk_to.dest, ml.pickup, 30.0):
         raise RuntimeError("Pickup endpoint too far")
 
-    walk_from = build_walker_route_full(ml.dropoff, walker_dest)
     if not is_within_dist(walk_from.start, ml.dropoff, 30.0):
         raise RuntimeError("Dropoff start too far")
 
@@ -425,13 +668,13 @@ def finalize_match(driver_agent: AgentState, walker_agent: AgentState, ml: Match
     total_walk_s = ml.pick_walk_s + ml.drop_walk_s
 
     pi, di = ml.pickup_index, ml.dropoff_index
-    ride_m = driver.cum_dist_m[di] - driver.cum_dist_m[pi]
-    ride_s = driver.cum_time_s[di] - driver.cum_time_s[pi]
+    ride_m = dist_at(driver, di, ml.dropoff_frac) - dist_at(driver, pi, ml.pickup_frac)
+    ride_s = time_at(driver, di, ml.dropoff_frac) - time_at(driver, pi, ml.pickup_frac)
 
     # driver ETA from NOW (driver may already be mid-route)
     t0 = driver.cum_time_s[driver_agent.idx]
-    pickup_eta_from_now = driver.cum_time_s[pi] - t0
-    dropoff_eta_from_now = driver.cum_time_s[di] - t0
+    pickup_eta_from_now = time_at(driver, pi, ml.pickup_frac) - t0
+    dropoff_eta_from_now = time_at(driver, di, ml.dropoff_frac) - t0
 
     saving_m = baseline_walk.dist - total_walk_m
     saving_s = baseline_walk.duration - total_walk_s
@@ -468,78 +711,106 @@ def valid_match(match: Match, min_saving_m: float = 800.0) -> bool:
     return True
 
 
-def best_match_(drivers: List[AgentState], walker_agent: AgentState, min_saving_m: float = 800.0):
-    best_light = None
-    best_driver = None
-    best_arrival = float("inf")
-
+def match_candidates(drivers: List[AgentState],
+                     walker_agent: AgentState,
+                     min_saving_m: float = 800.0,
+                     driver_index: Optional[DriverGridIndex] = None,
+                     radius_m: float = MATCH_RADIUS_M) -> List[MatchCandidate]:
     walker_pos = walker_agent.get_pos()
     walker_dest = walker_agent.route.dest
 
+    # only drivers whose remaining route passes near the walker (indexed ones),
+    # drivers not in the index (e.g. a brand new one) are always checked
+    if driver_index is not None and len(driver_index):
+        near = driver_index.candidates(walker_pos, walker_dest, radius_m)
+        drivers = near + [d for d in drivers
+                          if d not in driver_index and not d.assigned and not d.done]
+    if not drivers:
+        return []
+
     # baseline remaining walk distance/time from NOW -> dest
     base_m, base_s = walk_fast(walker_pos, walker_dest)
 
-    for d_agent in drivers:
-        try:
-            ml = build_match_light(d_agent, walker_agent)
+    if USE_CORRIDOR_FILTER:
+        # the walking legs of an accepted match add up to at most base_m - min_saving_m
+        n = len(drivers)
+        drivers = [d for d in drivers
+                   if corridor_feasible(d.route, d.idx, walker_pos, walker_dest, base_m - min_saving_m)]
+        with _CORRIDOR_LOCK:
+            _CORRIDOR_STATS["checked"] += n
+            _CORRIDOR_STATS["rejected"] += n - len(drivers)
+        if not drivers:
+            return []
 
-            # ETA from NOW
-            t0 = d_agent.route.cum_time_s[d_agent.idx]
-            pickup_eta = d_agent.route.cum_time_s[ml.pickup_index] - t0
-            dropoff_eta = d_agent.route.cum_time_s[ml.dropoff_index] - t0
-
-            # sanity: pickup must be reachable in future
-            if pickup_eta < 0 or dropoff_eta < 0:
-                continue
+    out = []
+    for d_agent, ml in match_lights(drivers, walker_agent):
+        # ETA from NOW
+        t0 = d_agent.route.cum_time_s[d_agent.idx]
+        pickup_eta = time_at(d_agent.route, ml.pickup_index, ml.pickup_frac) - t0
+        dropoff_eta = time_at(d_agent.route, ml.dropoff_index, ml.dropoff_frac) - t0
+
+        # sanity: pickup must be reachable in future
+        if pickup_eta < 0 or dropoff_eta < 0:
+            continue
 
-            # saving check (from current situation)
-            total_walk_m = ml.pick_walk_dist_m + ml.drop_walk_dist_m
-            saving_m = base_m - total_walk_m
-            if saving_m < min_saving_m:
-                continue
+        # saving check (from current situation)
+        total_walk_m = ml.pick_walk_dist_m + ml.drop_walk_dist_m
+        saving_m = base_m - total_walk_m
+        if saving_m < min_saving_m:
+            continue
 
-            # walker must arrive before driver at pickup
-            if ml.pick_walk_s > pickup_eta:
-                continue
+        # walker must arrive before driver at pickup
+        if ml.pick_walk_s > pickup_eta:
+            continue
 
-            arrival = dropoff_eta + ml.drop_walk_s
-            if arrival < best_arrival:
-                best_arrival = arrival
-                best_light = ml
-                best_driver = d_agent
+        out.append(MatchCandidate(
+            driver=d_agent, light=ml,
+            pickup_eta_s=pickup_eta, dropoff_eta_s=dropoff_eta,
+            saving_dist_m=saving_m, saving_s=base_s - ml.pick_walk_s - ml.drop_walk_s,
+        ))
+    return out
 
-        except RuntimeError:
-            continue
 
-    if best_driver is None:
+@metrics.timed(BEST_MATCH_S)
+def best_match_(drivers: List[AgentState],
+                walker_agent: AgentState,
+                min_saving_m: float = 800.0,
+                driver_index: Optional[DriverGridIndex] = None,
+                radius_m: float = MATCH_RADIUS_M):
+    cands = match_candidates(drivers, walker_agent, min_saving_m, driver_index, radius_m)
+    if not cands:
         return None, None
+    # earliest arrival at the destination
+    best = min(cands, key=lambda c: c.arrival_s)
 
     try:
-        m = finalize_match(best_driver, walker_agent, best_light)
+        m = finalize_match(best.driver, walker_agent, best.light)
 
-        return m, best_driver
+        return m, best.driver
     except RuntimeError:
         return None, None
 
 
 
-def build_routes_payload(sims: List[MatchSimulation], version: float) -> dict:
+def build_routes_payload(sims: List[MatchSimulation], version: float,
+                         stream: Optional[RouteStream] = None) -> dict:
+    # geometries are referenced by route id; a stream that outlives the call
+    # encodes every route only once
+    stream = stream or RouteStream()
     routes = []
 
     for sim in sims:
         if sim.phase != Phase.DONE:
             m = sim.match
+            rids = (stream.ref(sim.driver_agent.route),
+                    stream.ref(m.walk_route_to_pickup),
+                    stream.ref(m.walk_route_from_dropoff))
             routes.append({
                 "match_id": sim.match_id,
-                "driver_route": {
-                    "geometry_latlon": sim.driver_agent.route.geometry_latlon,
-                },
-                "walk_to_pickup": {
-                    "geometry_latlon": m.walk_route_to_pickup.geometry_latlon,
-                },
-                "walk_from_dropoff": {
-                    "geometry_latlon": m.walk_route_from_dropoff.geometry_latlon,
-                },
+                "driver_route": rids[0],
+                "walk_to_pickup": rids[1],
+                "walk_from_dropoff": rids[2],
+                "bbox": stream.bbox(*rids),
                 "points": {
                     "pickup": m.pickup,
                     "dropoff": m.dropoff,
@@ -549,7 +820,25 @@ def build_routes_payload(sims: List[MatchSimulation], version: float) -> dict:
                     "dropoff": m.dropoff_index}
             })
 
-    return {"routes_version": version, "routes": routes}
+    return stream.payload(routes, version)
+
+
+def encode_routes(stream: RouteStream, sims: List[MatchSimulation], version: float) -> Tuple[Optional[dict], dict]:
+    # the routes_update event for the global stream (None if nothing changed) and the full data
+    data = build_routes_payload(sims, version, stream)
+    return stream.encode(data), data
+
+
+def publish_routes(app: web.Application, loop: asyncio.AbstractEventLoop,
+                   sims: List[MatchSimulation], version: float) -> None:
+    # only what changed goes out; app["routes"] is the keyframe new clients start from
+    stream: RouteStream = app["route_stream"]
+    event, data = encode_routes(stream, sims, version)
+    if event is None:
+        return
+    app["routes"] = stream.keyframe()
+    # the full data goes along for the viewport clients (interest.InterestManager)
+    asyncio.run_coroutine_threadsafe(publish(app, {"type": "routes_update", "event": event, "data": data}), loop)
 
 
 # demo / map (OBSOLET)
@@ -559,13 +848,13 @@ def draw_map(drivers: List[DriverRoute], match: Optional[Match], walker: WalkerR
 
     folium.Marker(walker.start, popup="Walker Start", icon=folium.Icon(color="blue")).add_to(m)
     folium.Marker(walker.dest, popup="Walker End", icon=folium.Icon(color="orange")).add_to(m)
-    folium.PolyLine(walker.geometry_latlon, color="green", weight=5, opacity=0.8, tooltip="Walker Route").add_to(m)
+    folium.PolyLine(list(walker.geometry_latlon), color="green", weight=5, opacity=0.8, tooltip="Walker Route").add_to(m)
 
     for i, d in enumerate(drivers):
-        folium.PolyLine(d.geometry_latlon, color="red", weight=3, opacity=1, tooltip=f"Driver {i} Route").add_to(m)
+        folium.PolyLine(list(d.geometry_latlon), color="red", weight=3, opacity=1, tooltip=f"Driver {i} Route").add_to(m)
 
     if match is not None:
-        folium.PolyLine(match.driver.geometry_latlon, color="blue", weight=5, opacity=0.8,
+        folium.PolyLine(list(match.driver.geometry_latlon), color="blue", weight=5, opacity=0.8,
                         tooltip="Best Driver Route").add_to(m)
 
         folium.Marker(match.pickup, tooltip=f"Pickup (walk {match.pick_walk_dist_meters:.0f} m)",
@@ -574,10 +863,10 @@ def draw_map(drivers: List[DriverRoute], match: Optional[Match], walker: WalkerR
                       icon=folium.Icon(color="black")).add_to(m)
 
         # walking lines for visualization (use cached routes)
-        wtp = route_cached(walker.start[0], walker.start[1], match.pickup[0], match.pickup[1], "walking")["geometry"]
-        wfd = route_cached(match.dropoff[0], match.dropoff[1], walker.dest[0], walker.dest[1], "walking")["geometry"]
-        folium.PolyLine(wtp, color="cyan", weight=3, opacity=0.7, dash_array="6").add_to(m)
-        folium.PolyLine(wfd, color="cyan", weight=3, opacity=0.7, dash_array="6").add_to(m)
+        wtp = route_cached(walker.start[0], walker.start[1], match.pickup[0], match.pickup[1], "walking").geometry_latlon
+        wfd = route_cached(match.dropoff[0], match.dropoff[1], walker.dest[0], walker.dest[1], "walking").geometry_latlon
+        folium.PolyLine(list(wtp), color="cyan", weight=3, opacity=0.7, dash_array="6").add_to(m)
+        folium.PolyLine(list(wfd), color="cyan", weight=3, opacity=0.7, dash_array="6").add_to(m)
 
     m.save("map.html")
     webbrowser.open("web/map.html")
@@ -589,33 +878,78 @@ def create_agent(route: RouteBase, offset: float) -> AgentState:
     return AgentState(route=route, pos=route.start, start_offset_s=offset)
 
 
+def make_match_sim(match: Match, driver_agent: AgentState, walker_agent: AgentState, now_t: float) -> MatchSimulation:
+    return MatchSimulation(
+        match=match,
+        driver_agent=driver_agent,
+        walker_agent=walker_agent,
+        walk_to_pickup_agent=create_agent(match.walk_route_to_pickup,
+                                          offset=now_t),
+        walk_from_dropoff_agent=create_agent(match.walk_route_from_dropoff,
+                                             offset=now_t + match.driver_dropoff_eta_s),
+        creation_time_s=now_t
+    )
+
+
+def batch_weight(c: MatchCandidate, wait_weight: float = BATCH_WAIT_WEIGHT) -> float:
+    # every feasible pair is worth something, so more pairs beat fewer
+    return max(c.saving_s - wait_weight * c.pickup_wait_s, 1.0)
+
+
+def assign_batch(cands_by_walker: Dict[AgentState, List[MatchCandidate]],
+                 wait_weight: float = BATCH_WAIT_WEIGHT) -> List[Tuple[AgentState, MatchCandidate]]:
+    """
+    One driver per walker for a whole batch at once, maximizing the summed
+    batch_weight instead of taking the walkers one by one.
+    """
+    weights = {}
+    by_edge = {}
+    for w, cands in cands_by_walker.items():
+        for c in cands:
+            e = (w.agent_id, c.driver.agent_id)
+            weights[e] = batch_weight(c, wait_weight)
+            by_edge[e] = (w, c)
+    return [by_edge[e] for e in max_weight_assignment(weights)]
+
+
 def create_matches(driver_agent_list,
                    walker_agent_list,
                    now_t: float,
-                   min_saving_m=800) -> Tuple[List[MatchSimulation], List[AgentState], List[AgentState]]:
+                   min_saving_m=800,
+                   driver_index: Optional[DriverGridIndex] = None,
+                   batch: bool = False
+                   ) -> Tuple[List[MatchSimulation], List[AgentState], List[AgentState]]:
+    # batch=False: greedy, every walker in list order takes its best remaining driver
     match_simulation_list = []
     drivers = driver_agent_list.copy()
     walkers = walker_agent_list.copy()
+
+    def assign(match: Match, driver_agent: AgentState, walker_agent: AgentState) -> None:
+        driver_agent.assigned = True
+        walker_agent.assigned = True
+        if driver_index is not None:
+            driver_index.remove(driver_agent)
+        drivers.remove(driver_agent)
+        driver_agent_list.remove(driver_agent)
+        walker_agent_list.remove(walker_agent)
+
+        match_sim = make_match_sim(match, driver_agent, walker_agent, now_t)
+        match_simulation_list.append(match_sim)
+
+    if batch:
+        cands = {w: match_candidates(drivers, w, min_saving_m, driver_index=driver_index) for w in walkers}
+        for walker_agent, c in assign_batch(cands):
+            try:
+                match = finalize_match(c.driver, walker_agent, c.light)
+            except RuntimeError:
+                continue
+            assign(match, c.driver, walker_agent)
+        return match_simulation_list, driver_agent_list, walker_agent_list
+
     for walker_agent in walkers:
-        match, driver_agent = best_match_(drivers, walker_agent, min_saving_m)
+        match, driver_agent = best_match_(drivers, walker_agent, min_saving_m, driver_index=driver_index)
         if match is not None:
-            driver_agent.assigned = True
-            walker_agent.assigned = True
-            drivers.remove(driver_agent)
-            driver_agent_list.remove(driver_agent)
-            walker_agent_list.remove(walker_agent)
-
-            match_sim = MatchSimulation(
-                match=match,
-                driver_agent=driver_agent,
-                walker_agent=walker_agent,
-                walk_to_pickup_agent=create_agent(match.walk_route_to_pickup,
-                                                  offset=now_t),
-                walk_from_dropoff_agent=create_agent(match.walk_route_from_dropoff,
-                                                     offset=now_t + match.driver_dropoff_eta_s),
-                creation_time_s=now_t
-            )
-            match_simulation_list.append(match_sim)
+            assign(match, driver_agent, walker_agent)
     return match_simulation_list, driver_agent_list, walker_agent_list
 
 
@@ -671,20 +1005,27 @@ def handle_req(req, offset: float):
 
 async def dispatch_frames_by_req_id(app: web.Application, data: Dict[str, Any]) -> None:
     t_s = data["t_s"]
+    stream = app["req_stream"]
+    subs = app["subscribers"]
 
     for frame in data["sims"]:
         w_rid = frame["walker"].get("req_id")
         d_rid = frame["driver"].get("req_id")
+        if w_rid not in subs and d_rid not in subs:
+            continue
 
-        event = {
-            "type": "position",
-            "data": {"t_s": t_s, "frame": frame}
-        }
-
-        if w_rid is not None:
-            await publish_by_id(app, w_rid, event)
-        if d_rid is not None:
-            await publish_by_id(app, d_rid, event)
+        # the frame is serialized once, for both requests and all their subscribers
+        frame_buf = None
+        for rid in (w_rid, d_rid):
+            if rid is None or rid not in subs:
+                continue
+            # None while the sim did not move enough since the last frame sent
+            event = stream.encode(rid, t_s, frame)
+            if event is None:
+                continue
+            if frame_buf is None:
+                frame_buf = dumps(frame)
+            await publish_by_id(app, rid, position_event(event, frame_buf), coalesce=True)
 
 
 
@@ -701,6 +1042,7 @@ def build_leftovers_payload(agent_list: list, include_agent_id: bool) -> list[di
 
 
 # full snapshot with leftovers
+@metrics.timed(SNAPSHOT_S)
 def build_snapshot_payload(t_s: float,
                            sims: list,
                            driver_agents: list,
@@ -723,7 +1065,8 @@ def process_new_agent(kind: str,
                       agent_id_to_request_id: dict,
                       handler,
                       req_id: str,
-                      min_saving_m: float) -> dict:
+                      min_saving_m: float,
+                      driver_index: Optional[DriverGridIndex] = None) -> dict:
 
     if kind == "driver":
         matches_new, _, _ = create_matches(
@@ -733,6 +1076,8 @@ def process_new_agent(kind: str,
 
         if not matches_new:
             driver_agent_list.append(new_agent)
+            if driver_index is not None:
+                driver_index.add(new_agent)
             return {"status": "not_matched",
                     "req_id": req_id,
                     "agent_id": new_agent.agent_id}
@@ -750,7 +1095,8 @@ def process_new_agent(kind: str,
 
     if kind == "walker":
         matches_new, _, _ = create_matches(
-            driver_agent_list, [new_agent], now_t=t, min_saving_m=min_saving_m)
+            driver_agent_list, [new_agent], now_t=t, min_saving_m=min_saving_m,
+            driver_index=driver_index)
         matches_sim_list.extend(matches_new)
         agent_id_to_request_id[new_agent.agent_id] = req_id
         if not matches_new:
@@ -782,178 +1128,24 @@ def drain_create_queue(q: Queue) -> list:
     return reqs
 
 
-def start_simulation(app: web.Application, loop: asyncio.AbstractEventLoop):
-    def run():
-        start_pt = (51.2562, 7.1508)
-        end_pt = (51.2277, 6.7735)
-        walker_start = (51.202561, 6.780486)
-        walker_end = (51.219105, 6.787711)
-
-        min_saving_m = 800.0
-        agent_id_to_request_id: dict[str, str] = {}
-
-        walker_agent_list = create_walkers(walker_start, walker_end, 300, 0)
-        driver_agent_list = create_drivers(start_pt, end_pt, radius_m=1000, count=0)
-
-        matches_sim_list, driver_agent_list, walker_agent_list = create_matches(
-            driver_agent_list, walker_agent_list, now_t=0.0, min_saving_m=min_saving_m
-        )
-
-        if matches_sim_list is None:
-            print("no match")
-            raise SystemExit(0)
-
-        routes = build_routes_payload(matches_sim_list, version=0.0)
-        app["routes"] = routes
-
-        asyncio.run_coroutine_threadsafe(
-            publish(app, {"type": "routes", "data": routes}),
-            loop
-        )
-
-
-        # Initial snapshot (force sim update at t=0)
-        for sim in matches_sim_list:
-            sim.update(0.0)
-
-        data0 = build_snapshot_payload(
-            t_s=0.0,
-            sims=matches_sim_list,
-            driver_agents=driver_agent_list,
-            walker_agents=walker_agent_list,
-            include_agent_id=False
-        )
-
-        app["last_positions"] = data0
-        asyncio.run_coroutine_threadsafe(
-            publish(app, {"type": "positions", "data": data0}),
-            loop
-        )
-
-        #webbrowser.open("http://127.0.0.1:8000/web/map.html?v=" + str(time.time()))
-
-        t = 0.0
-        dt = app["speed"]
-        while True:
-            # Handle incoming create-requests
-            routes_changed = False
-            for req in drain_create_queue(app["create_q"]):
-                req_id, new_agent, kind = handle_req(req, offset=t)
-                res = process_new_agent(
-                    kind=kind,
-                    new_agent=new_agent,
-                    t=t,
-                    matches_sim_list=matches_sim_list,
-                    driver_agent_list=driver_agent_list,
-                    walker_agent_list=walker_agent_list,
-                    agent_id_to_request_id=agent_id_to_request_id,
-                    handler=None,
-                    req_id=req_id,
-                    min_saving_m=min_saving_m
-                )
-                if res["status"] == "not_matched":
-                    asyncio.run_coroutine_threadsafe(
-                        send_status(app,
-                                    res["req_id"],
-                                    "not_matched",
-                                    agent_id=res["agent_id"]),
-                        loop
-                    )
-
-
-
-
-                elif res["status"] == "matched":
-                    ms = res["match_sim"]
-
-                    asyncio.run_coroutine_threadsafe(
-                        send_status(app, res["req_id"],
-                                    "matched",
-                                    match_id=res["match_id"],
-                                    agent_id=res["agent_id"]),
-                        loop
-                    )
-
-
-                    if res["partner_req_id"] is not None:
-                        asyncio.run_coroutine_threadsafe(
-                            send_status(app,
-                                        res["partner_req_id"],
-                                        "matched",
-                                        match_id=res["match_id"],
-                                        agent_id=res["partner_agent_id"]),
-                            loop
-                        )
-
-                    routes_for_this_match = build_routes_payload([ms], version=t)
-                    event = {"type": "routes", "data": routes_for_this_match}
-                    app["last_routes_by_req"][res["req_id"]] = routes_for_this_match
-                    asyncio.run_coroutine_threadsafe(
-                        publish_by_id(app, res["req_id"], event),
-                        loop
-                    )
-                    if res["partner_req_id"] is not None:
-                        app["last_routes_by_req"][res["partner_req_id"]] = routes_for_this_match
-                        asyncio.run_coroutine_threadsafe(
-                            publish_by_id(app, res["partner_req_id"], event),
-                            loop
-                        )
-
-
-
-                routes_changed = True
-
-            # Update unmatched drivers
-            for a in driver_agent_list:
-                a.update_position(t)
-
-            # Update unmatched walkers
-            for a in walker_agent_list:
-                a.update_position(t)
-
-            # Update all simulations
-            for sim in matches_sim_list:
-                sim.update(t)
-
-            # Write one combined snapshot
-            data = build_snapshot_payload(
-                t_s=t,
-                sims=matches_sim_list,
-                driver_agents=driver_agent_list,
-                walker_agents=walker_agent_list,
-                agent_id_to_request_id=agent_id_to_request_id,
-                include_agent_id=True
-            )
-            # data : dict with t_s, sims, leftover_drivers, leftover_walkers
-
-            app["last_positions"] = data
-
-            asyncio.run_coroutine_threadsafe(
-                publish(app, {"type": "positions", "data": data}),
-                loop
-            )
-            #print("dispatch sims", len(data["sims"]))
-
-            asyncio.run_coroutine_threadsafe(
-                dispatch_frames_by_req_id(app, data),
-                loop
-            )
-
-            # If routes changed, send updated routes
-            if routes_changed:
-                routes = build_routes_payload(matches_sim_list, version=t)
-                asyncio.run_coroutine_threadsafe(
-                    publish(app, {"type": "routes", "data": routes}),
-                    loop
-                )
-
-            #dt = handler.speed
-            dt = app["speed"]
-            t += dt
-            time.sleep(0.05)
-
-    threading.Thread(target=run, daemon=True).start()
-
-
+# admission match stage (runs on worker threads, sim_loop commits on the tick thread)
+def propose_match(kind: str,
+                  new_agent: AgentState,
+                  driver_agent_list: list,
+                  walker_agent_list: list,
+                  driver_index: Optional[DriverGridIndex],
+                  min_saving_m: float) -> Tuple[Optional[Match], Optional[AgentState]]:
+    # same choice as process_new_agent, but only reads the leftover lists
+    if kind == "walker":
+        return best_match_(list(driver_agent_list), new_agent, min_saving_m, driver_index=driver_index)
 
+    if kind == "driver":
+        for walker_agent in list(walker_agent_list):
+            if walker_agent.assigned or walker_agent.done:
+                continue
+            match, _ = best_match_([new_agent], walker_agent, min_saving_m)
+            if match is not None:
+                return match, walker_agent
+        return None, None
 
+    raise ValueError(f"Unknown kind: {kind}")
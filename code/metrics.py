@@ -0,0 +1,219 @@
+"""
+Counters, gauges and histograms for the hot paths, rendered in the
+Prometheus text format by the /metrics route (realtime_runner).
+
+Metrics are module-level singletons created at import time. With
+DRIVEBY_METRICS=0 timed() leaves the functions unwrapped and nothing is
+recorded; metrics.ENABLED = False at runtime stops recording, the wrappers
+then only cost the flag check.
+"""
+import asyncio
+import functools
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+ENABLED = os.environ.get("DRIVEBY_METRICS", "1") != "0"
+
+# seconds, 0.5 ms .. 30 s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[str, ...]
+# name, type, help, [(labels, value)]: scrape-time values that live elsewhere (caches, queues)
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Labels, "_Metric"] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> "_Metric":
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self) -> "_Metric":
+        return type(self)(self.name, self.help)
+
+    def _series(self) -> Iterable[Tuple[Dict[str, str], "_Metric"]]:
+        if not self.labelnames:
+            yield {}, self
+        for values, child in list(self._children.items()):
+            yield dict(zip(self.labelnames, values)), child
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        if ENABLED:
+            with self._lock:
+                self.value += amount
+
+    def _samples(self):
+        for labels, m in self._series():
+            yield self.name, labels, m.value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        if ENABLED:
+            self.value = value
+
+    def _samples(self):
+        for labels, m in self._series():
+            yield self.name, labels, m.value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value: float) -> None:
+        if not ENABLED:
+            return
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def _samples(self):
+        for labels, m in self._series():
+            with m._lock:
+                counts, total, n = list(m.counts), m.sum, m.count
+            acc = 0
+            for le, c in zip(self.buckets + (math.inf,), counts):
+                acc += c
+                yield self.name + "_bucket", dict(labels, le=_fmt(le)), acc
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, n
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help: str, labelnames: Sequence[str], **kw) -> _Metric:
+        with self._lock:
+            m = self._metrics.get(name)
+            if m is None:
+                m = self._metrics[name] = cls(name, help, labelnames, **kw)
+            elif not isinstance(m, cls):
+                raise ValueError(f"{name} is already a {m.kind}")
+            return m
+
+    def render(self, extra: Iterable[Family] = ()) -> str:
+        lines = []
+        for m in list(self._metrics.values()):
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labels, value in m._samples():
+                lines.append(f"{name}{_labels(labels)} {_fmt(value)}")
+        for name, kind, help, samples in extra:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(labels)} {_fmt(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+    return REGISTRY._get(Counter, name, help, labels)
+
+
+def gauge(name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+    return REGISTRY._get(Gauge, name, help, labels)
+
+
+def histogram(name: str, help: str, labels: Sequence[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY._get(Histogram, name, help, labels, buckets=buckets)
+
+
+def timed(h: Histogram) -> Callable:
+    """Decorator: observe the wall time of every call (coroutine functions too)."""
+    def deco(fn):
+        if not ENABLED:
+            return fn
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kw):
+                if not ENABLED:
+                    return await fn(*args, **kw)
+                t0 = time.perf_counter()
+                try:
+                    return await fn(*args, **kw)
+                finally:
+                    h.observe(time.perf_counter() - t0)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kw):
+            if not ENABLED:
+                return fn(*args, **kw)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kw)
+            finally:
+                h.observe(time.perf_counter() - t0)
+        return wrapper
+    return deco
+
+
+def render(extra: Iterable[Family] = ()) -> str:
+    return REGISTRY.render(extra)
+
+
+def _fmt(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if isinstance(v, int) or float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return ""
+    body = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+    return "{" + body + "}"
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
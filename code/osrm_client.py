@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+import metrics
+
+OSRM_SECONDS = metrics.histogram("driveby_osrm_request_seconds",
+                                 "OSRM HTTP request time per attempt", ("profile", "service"))
+OSRM_ERRORS = metrics.counter("driveby_osrm_errors_total",
+                              "OSRM attempts that failed (timeout, connection, 5xx)", ("profile",))
+OSRM_FAILED = metrics.counter("driveby_osrm_failed_total",
+                              "OSRM requests that failed after all retries", ("profile",))
+
+
+class OsrmError(RuntimeError):
+    # RuntimeError so the matching code keeps skipping drivers it cannot route
+    pass
+
+
+class OsrmClient:
+    """
+    Asyncio OSRM client with one pooled aiohttp session per backend base URL.
+
+    The client owns an event loop in a daemon thread, so the (synchronous)
+    simulation thread can call run()/run_many() while the coroutines of one
+    match are in flight concurrently. In-flight requests per backend are capped
+    by a semaphore; timeouts, connection errors and 5xx answers are retried.
+    """
+
+    def __init__(self,
+                 max_in_flight: int = 32,
+                 timeout_s: float = 20.0,
+                 retries: int = 2,
+                 backoff_s: float = 0.1):
+        self.max_in_flight = max_in_flight
+        self.timeout_s = timeout_s
+        self.retries = retries
+        self.backoff_s = backoff_s
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+        # base url -> session / semaphore, only touched on the client loop
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self._limits: Dict[str, asyncio.Semaphore] = {}
+
+    # loop thread
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is not None:
+            return self._loop
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=loop.run_forever, name="osrm-client", daemon=True)
+                self._thread.start()
+                self._loop = loop
+        return self._loop
+
+    def run(self, coro: Awaitable) -> Any:
+        # blocking bridge for synchronous callers (never call from the client loop)
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()).result()
+
+    def run_many(self, coros: List[Awaitable]) -> List[Any]:
+        async def _all():
+            return await asyncio.gather(*coros)
+        return self.run(_all())
+
+    def close(self) -> None:
+        if self._loop is None:
+            return
+
+        async def _close():
+            for s in self._sessions.values():
+                await s.close()
+            self._sessions.clear()
+            self._limits.clear()
+
+        self.run(_close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._loop = None
+        self._thread = None
+
+    # http
+
+    def _session(self, base: str) -> aiohttp.ClientSession:
+        s = self._sessions.get(base)
+        if s is None or s.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60)
+            s = aiohttp.ClientSession(connector=connector)
+            self._sessions[base] = s
+            self._limits[base] = asyncio.Semaphore(self.max_in_flight)
+        return s
+
+    async def get_json(self, base: str, path: str, timeout_s: Optional[float] = None) -> Dict[str, Any]:
+        session = self._session(base)
+        limit = self._limits[base]
+        timeout = aiohttp.ClientTimeout(total=timeout_s or self.timeout_s)
+        url = base + path
+
+        service, profile = path_labels(path)
+        seconds = OSRM_SECONDS.labels(profile, service)
+        last_exc: Optional[BaseException] = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff_s * (2 ** (attempt - 1)))
+            try:
+                async with limit:
+                    t0 = time.perf_counter()
+                    try:
+                        async with session.get(url, timeout=timeout) as r:
+                            if r.status >= 500:
+                                last_exc = OsrmError(f"HTTP {r.status} from {base}")
+                                OSRM_ERRORS.labels(profile).inc()
+                                continue
+                            data = await r.json(content_type=None)
+                    finally:
+                        seconds.observe(time.perf_counter() - t0)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_exc = e
+                OSRM_ERRORS.labels(profile).inc()
+                continue
+            except ValueError as e:
+                raise OsrmError(f"invalid JSON from {base}: {e}") from e
+
+            if data.get("code") != "Ok":
+                raise OsrmError(data)
+            return data
+
+        OSRM_FAILED.labels(profile).inc()
+        raise OsrmError(f"{url} failed after {self.retries + 1} attempts: {last_exc!r}")
+
+
+def path_labels(path: str) -> Tuple[str, str]:
+    # "/route/v1/walking/..." -> ("route", "walking")
+    parts = path.split("/", 4)
+    if len(parts) < 4:
+        return "unknown", "unknown"
+    return parts[1], parts[3]
@@ -0,0 +1,232 @@
+import math
+from typing import Any, Dict, List, Optional
+
+M_PER_DEG_LAT = 111320.0
+COORD_DIGITS = 6  # ~0.1 m, positions in deltas are rounded to this
+
+WALKER_KEYS = ("pIdx", "dIdx", "req_id")
+DRIVER_KEYS = ("idx", "req_id")
+
+
+def moved_m(a: Dict[str, Any], b: Dict[str, Any]) -> float:
+    # equirectangular distance between two {"lat", "lon"} items, fine at these scales
+    dlat = (b["lat"] - a["lat"]) * M_PER_DEG_LAT
+    dlon = (b["lon"] - a["lon"]) * M_PER_DEG_LAT * math.cos(math.radians(a["lat"]))
+    return math.hypot(dlat, dlon)
+
+
+class PositionDeltaEncoder:
+    """
+    Turns the per-tick snapshots of build_snapshot_payload() into the global
+    /ws position stream.
+
+    Every message carries a sequence number. A keyframe ("positions", key=True)
+    holds the full state in the old snapshot format; in between, a
+    "positions_delta" only holds what changed: per sim the phase and the
+    walker/driver fields that moved more than min_move_m or got a new route
+    index (merged into the previous frame by the client), leftovers that moved,
+    and the ids of entities that disappeared. Deltas are taken
+    against what was last *sent*, so a snapshot that is never encoded (the
+    publish queue keeps only the latest one) costs nothing, and keyframe()
+    always matches what a client holds after applying the stream.
+    """
+
+    def __init__(self, min_move_m: float = 2.0, keyframe_every: int = 100):
+        self.min_move_m = min_move_m
+        self.keyframe_every = keyframe_every
+        self.seq = 0
+        self.last_key_seq = 0
+        self.t_s = 0.0
+
+        # client-visible state, as last sent
+        self._sims: Dict[str, Dict[str, Any]] = {}
+        self._drivers: Dict[str, Dict[str, Any]] = {}
+        self._walkers: Dict[str, Dict[str, Any]] = {}
+
+    def has_state(self) -> bool:
+        return self.seq > 0
+
+    def state(self):
+        # (sims, leftover drivers, leftover walkers) by id, as the clients hold them; read-only
+        return self._sims, self._drivers, self._walkers
+
+    def keyframe(self) -> Dict[str, Any]:
+        return {"type": "positions", "seq": self.seq, "key": True, "data": {
+            "t_s": self.t_s,
+            "sims": list(self._sims.values()),
+            "leftover_drivers": list(self._drivers.values()),
+            "leftover_walkers": list(self._walkers.values()),
+        }}
+
+    def encode(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        self.seq += 1
+        self.t_s = data["t_s"]
+        if self.seq - self.last_key_seq >= self.keyframe_every or self.seq == 1:
+            self._sims = {f["sim_id"]: f for f in data["sims"]}
+            self._drivers = {a["agent_id"]: a for a in data["leftover_drivers"]}
+            self._walkers = {a["agent_id"]: a for a in data["leftover_walkers"]}
+            self.last_key_seq = self.seq
+            return self.keyframe()
+
+        out: Dict[str, Any] = {"t_s": self.t_s}
+        sims, sims_removed = self._diff_sims(data["sims"])
+        drivers, drivers_removed = self._diff_agents(self._drivers, data["leftover_drivers"])
+        walkers, walkers_removed = self._diff_agents(self._walkers, data["leftover_walkers"])
+        for name, v in (("sims", sims), ("sims_removed", sims_removed),
+                        ("leftover_drivers", drivers), ("drivers_removed", drivers_removed),
+                        ("leftover_walkers", walkers), ("walkers_removed", walkers_removed)):
+            if v:
+                out[name] = v
+        return {"type": "positions_delta", "seq": self.seq, "data": out}
+
+    def _diff_part(self, prev: Dict[str, Any], cur: Dict[str, Any], keys) -> Dict[str, Any]:
+        # only the fields that changed; ids never change within a sim
+        part = {k: cur[k] for k in keys if prev.get(k) != cur.get(k)}
+        if moved_m(prev, cur) > self.min_move_m:
+            part["lat"] = round(cur["lat"], COORD_DIGITS)
+            part["lon"] = round(cur["lon"], COORD_DIGITS)
+        return part
+
+    def _diff_sims(self, frames: List[Dict[str, Any]]):
+        changed = []
+        seen = set()
+        for f in frames:
+            sim_id = f["sim_id"]
+            seen.add(sim_id)
+            prev = self._sims.get(sim_id)
+            if prev is None:
+                self._sims[sim_id] = f
+                changed.append(f)
+                continue
+
+            d: Dict[str, Any] = {"sim_id": sim_id}
+            if prev["phase"] != f["phase"]:
+                d["phase"] = f["phase"]
+            merged = None
+            for role, keys in (("walker", WALKER_KEYS), ("driver", DRIVER_KEYS)):
+                part = self._diff_part(prev[role], f[role], keys)
+                if part:
+                    d[role] = part
+                    merged = merged or dict(prev)
+                    merged[role] = {**prev[role], **part}
+            if len(d) > 1:
+                if merged is None:
+                    merged = dict(prev)
+                merged["phase"] = f["phase"]
+                self._sims[sim_id] = merged
+                changed.append(d)
+
+        removed = [k for k in self._sims if k not in seen]
+        for k in removed:
+            del self._sims[k]
+        return changed, removed
+
+    def _diff_agents(self, state: Dict[str, Dict[str, Any]], items: List[Dict[str, Any]]):
+        changed = []
+        seen = set()
+        for a in items:
+            agent_id = a["agent_id"]
+            seen.add(agent_id)
+            prev = state.get(agent_id)
+            if prev is None:
+                state[agent_id] = a
+                changed.append(a)
+            elif moved_m(prev, a) > self.min_move_m:
+                a = {"agent_id": agent_id, "lat": round(a["lat"], COORD_DIGITS), "lon": round(a["lon"], COORD_DIGITS)}
+                state[agent_id] = a
+                changed.append(a)
+
+        removed = [k for k in state if k not in seen]
+        for k in removed:
+            del state[k]
+        return changed, removed
+
+
+def apply_positions(state: Optional[Dict[str, Any]], msg: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Client side of the global stream (web/map.js does the same in JS).
+    state is None or {"seq", "t_s", "sims", "drivers", "walkers"} with dicts
+    keyed by id; returns the new state, or None when a message was missed and
+    the client has to send {"type": "resync"} and wait for a keyframe.
+    """
+    data = msg["data"]
+    if msg.get("key"):
+        return {"seq": msg.get("seq", 0), "t_s": data["t_s"],
+                "sims": {f["sim_id"]: f for f in data["sims"]},
+                "drivers": {a["agent_id"]: a for a in data["leftover_drivers"]},
+                "walkers": {a["agent_id"]: a for a in data["leftover_walkers"]}}
+    if state is None or msg["seq"] != state["seq"] + 1:
+        return None
+
+    state["seq"] = msg["seq"]
+    state["t_s"] = data["t_s"]
+    for d in data.get("sims", ()):
+        prev = state["sims"].get(d["sim_id"])
+        if prev is None:
+            state["sims"][d["sim_id"]] = d
+            continue
+        merged = {**prev, **d}
+        for role in ("walker", "driver"):
+            if role in d:
+                merged[role] = {**prev[role], **d[role]}
+        state["sims"][d["sim_id"]] = merged
+    for k in data.get("sims_removed", ()):
+        state["sims"].pop(k, None)
+    for name, removed in (("drivers", "drivers_removed"), ("walkers", "walkers_removed")):
+        items = state[name]
+        for a in data.get("leftover_" + name, ()):
+            items[a["agent_id"]] = a
+        for k in data.get(removed, ()):
+            items.pop(k, None)
+    return state
+
+
+class RequestFrameStream:
+    """
+    Per-request position stream (/ws_agent). Each message is still one full
+    sim frame, but a request only gets a new one when its sim changed phase or
+    a position moved more than min_move_m, plus a keyframe every
+    keyframe_every ticks. seq counts per request; resync() hands out the
+    latest frame.
+    """
+
+    def __init__(self, min_move_m: float = 2.0, keyframe_every: int = 100):
+        self.min_move_m = min_move_m
+        self.keyframe_every = keyframe_every
+        # req_id -> [seq, ticks since last sent, last sent frame, latest event data]
+        self._req: Dict[str, list] = {}
+
+    def __len__(self) -> int:
+        return len(self._req)
+
+    def encode(self, req_id: str, t_s: float, frame: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        data = {"t_s": t_s, "frame": frame}
+        st = self._req.get(req_id)
+        if st is None:
+            st = self._req[req_id] = [0, 0, None, data]
+        st[3] = data
+        st[1] += 1
+
+        sent = st[2]
+        key = sent is None or st[1] >= self.keyframe_every
+        if not key and sent["sim_id"] == frame["sim_id"] and sent["phase"] == frame["phase"] \
+                and moved_m(sent["walker"], frame["walker"]) <= self.min_move_m \
+                and moved_m(sent["driver"], frame["driver"]) <= self.min_move_m:
+            return None
+
+        st[0] += 1
+        st[1] = 0
+        st[2] = frame
+        return {"type": "position", "request_id": req_id, "seq": st[0], "key": key, "data": data}
+
+    def resync(self, req_id: str) -> Optional[Dict[str, Any]]:
+        st = self._req.get(req_id)
+        if st is None:
+            return None
+        st[0] += 1
+        st[1] = 0
+        st[2] = st[3]["frame"]
+        return {"type": "position", "request_id": req_id, "seq": st[0], "key": True, "data": st[3]}
+
+    def forget(self, req_id: str) -> None:
+        self._req.pop(req_id, None)
@@ -1,5 +1,8 @@
 import asyncio
+import functools
 import json
+import os
+import time
 import uuid
 from queue import Queue
 from dataclasses import dataclass, field
@@ -8,13 +11,24 @@ from typing import Any, Dict, Set
 from pathlib import Path
 from aiohttp import web, WSMsgType
 
-from local_osrm import start_simulation
+import metrics
+from local_osrm import OSRM, route_cache_stats, corridor_stats
+from sim_loop import start_simulation
+from candidate_memo import memo_stats
+from interest import InterestManager
+from state_store import StateStore
+from position_stream import PositionDeltaEncoder, RequestFrameStream
+from wire import dumps, encode_event
+from ws_bus import CoalescingQueue, outbox_of, open_outbox, close_outbox
 
 
 def create_uuid() -> str:
     return str(uuid.uuid4())
 
 
+BROADCAST_S = metrics.histogram("driveby_broadcast_seconds",
+                                "broadcaster: one event handed to every client outbox", ("loop",))
+
 # for status subscriptions
 subscribers: Dict[str, Set[web.WebSocketResponse]] = {}
 
@@ -22,63 +36,99 @@ subscribers: Dict[str, Set[web.WebSocketResponse]] = {}
 ws_clients: Set[web.WebSocketResponse] = set()
 
 
+def fan_out(app: web.Application, clients: Set[web.WebSocketResponse], msg: bytes,
+            key=None, on_coalesce=None) -> Set[web.WebSocketResponse]:
+    # returns the clients whose connection is gone
+    dead_clients = set()
+    for ws in clients:
+        box = outbox_of(app, ws)
+        if ws.closed or box is None or box.closed:
+            dead_clients.add(ws)
+            continue
+        box.put(msg, key=key, on_coalesce=on_coalesce)
+    return dead_clients
+
+
 async def broadcaster(app: web.Application):
-    q: asyncio.Queue = app["pub_q"]
+    q: CoalescingQueue = app["pub_q"]
     global_ws = app["global_ws"]
+    views: InterestManager = app["views"]
 
     while True:
         evnt = await q.get()
-        msg = json.dumps(evnt)
-
+        on_coalesce = None
+        key = None
+        t0 = time.perf_counter()
         dead_clients = set()
-        for ws in global_ws:
-            if ws.closed:
-                dead_clients.add(ws)
-                continue
-            try:
-                await ws.send_str(msg)
-            except Exception:
-                dead_clients.add(ws)
+        if evnt.get("type") == "positions":
+            # keyframe or delta against what the clients were sent last; a client
+            # that could not keep up gets a keyframe instead of its unsent deltas
+            data = evnt["data"]
+            evnt = app["pos_stream"].encode(data)
+            key, on_coalesce = "positions", lambda: keyframe_bytes(app)
+            # clients with a viewport: the same, cut down to what each group of them looks at
+            for group, ev in views.on_positions(data, evnt):
+                if ev["type"] == "clusters":
+                    dead_clients |= fan_out(app, group.clients, dumps(ev), key="clusters")
+                else:
+                    dead_clients |= fan_out(app, group.clients, dumps(ev), key="positions",
+                                            on_coalesce=functools.partial(group.keyframe_bytes, app["pos_stream"]))
+        elif evnt.get("type") == "routes_update":
+            for group, ev in views.on_routes(evnt["data"]):
+                dead_clients |= fan_out(app, group.clients, dumps(ev))
+            evnt = evnt["event"]
+
+        # serialized once, the same buffer goes to every client's outbox
+        if global_ws:
+            dead_clients |= fan_out(app, global_ws, dumps(evnt), key=key, on_coalesce=on_coalesce)
 
         for ws in dead_clients:
             app["global_ws"].discard(ws)
+            views.remove(ws)
+        BROADCAST_S.labels("global").observe(time.perf_counter() - t0)
 
-        q.task_done()
+
+def keyframe_bytes(app: web.Application) -> bytes:
+    # shared by all lagging clients until the stream moves on
+    stream = app["pos_stream"]
+    cache = app["keyframe_cache"]
+    if cache.get("seq") != stream.seq:
+        cache["seq"], cache["buf"] = stream.seq, dumps(stream.keyframe())
+    return cache["buf"]
 
 
 # Broadcaster for request_id specific messages
 async def broadcaster_by_id(app: web.Application):
-    q: asyncio.Queue = app["pub_q_by_id"]
+    q: CoalescingQueue = app["pub_q_by_id"]
     subs: Dict[str, set[web.WebSocketResponse]] = app["subscribers"]
 
     while True:
-        request_id, event = await q.get()
+        request_id, event, coalesce, last = await q.get()
         #print("broadcaster_by_id got", request_id, event.get("type"))
 
-        msg = json.dumps(event)
-
         conns = subs.get(request_id)
         if not conns:
-            q.task_done()
             continue
 
+        t0 = time.perf_counter()
+        # position events arrive pre-encoded (dispatch_frames_by_req_id)
+        msg = encode_event(event)
+        key = ("position", request_id) if coalesce else None
+
         dead = set()
         for ws in conns:
-            if ws.closed:
+            box = outbox_of(app, ws)
+            if ws.closed or box is None or box.closed:
                 dead.add(ws)
                 continue
-            try:
-                await ws.send_str(msg)
-            except Exception:
-                dead.add(ws)
+            box.put(msg, key=key)
 
         for ws in dead:
             conns.discard(ws)
 
-        if not conns:
+        if not conns or last:
             subs.pop(request_id, None)
-
-        q.task_done()
+        BROADCAST_S.labels("by_id").observe(time.perf_counter() - t0)
 
 
 # Health check endpoint
@@ -86,6 +136,70 @@ async def health_check(request: web.Request) -> web.Response:
     return web.Response(text="OK")
 
 
+# Tick schedule, admission pipeline queue depths, per-stage latency, route cache, corridor filter and candidate memo counters, state store, retired rides, send queues
+async def stats(request: web.Request) -> web.Response:
+    admission = request.app.get("admission")
+    sched = request.app.get("tick_scheduler")
+    store = request.app.get("state_store")
+    lifecycle = request.app.get("lifecycle")
+    boxes = list(request.app["outboxes"].values())
+    return web.json_response({
+        "tick": sched.stats() if sched is not None else None,
+        "admission": admission.metrics() if admission is not None else None,
+        "route_cache": route_cache_stats(),
+        "corridor_filter": corridor_stats(),
+        "candidate_memo": memo_stats(),
+        "state_store": store.stats() if store is not None else None,
+        "lifecycle": lifecycle.stats() if lifecycle is not None else None,
+        "ws": {
+            "clients": len(boxes),
+            "pending": sum(len(b) for b in boxes),
+            "max_pending": max((len(b) for b in boxes), default=0),
+            "coalesced": sum(b.coalesced for b in boxes),
+            "publish_pending": [len(request.app["pub_q"]), len(request.app["pub_q_by_id"])],
+            "views": request.app["views"].stats(),
+        },
+    })
+
+
+# Prometheus text format: the hot-path metrics plus queue depths and cache counters read at scrape time
+async def metrics_handler(request: web.Request) -> web.Response:
+    app = request.app
+    boxes = list(app["outboxes"].values())
+    queues = [({"queue": "create"}, app["create_q"].qsize()),
+              ({"queue": "publish"}, len(app["pub_q"])),
+              ({"queue": "publish_by_id"}, len(app["pub_q_by_id"])),
+              ({"queue": "outbox"}, sum(len(b) for b in boxes))]
+    admission = app.get("admission")
+    if admission is not None:
+        queues += [({"queue": f"admission_{k}"}, v) for k, v in admission.queue_depth().items()]
+
+    caches = {name: st for name, st in route_cache_stats().items() if st is not None}
+    memo = memo_stats()
+    extra = [
+        ("driveby_queue_depth", "gauge", "items waiting per queue", queues),
+        ("driveby_outbox_max_pending", "gauge", "deepest client outbox",
+         [({}, max((len(b) for b in boxes), default=0))]),
+        ("driveby_ws_clients", "gauge", "connected WebSocket clients", [({}, len(boxes))]),
+        ("driveby_view_groups", "gauge", "viewport groups, each encodes its own stream",
+         [({}, len(app["views"].groups))]),
+        ("driveby_route_cache_hits_total", "counter", "route cache hits",
+         [({"cache": n}, st["hits"]) for n, st in caches.items()]),
+        ("driveby_route_cache_misses_total", "counter", "route cache misses",
+         [({"cache": n}, st["misses"]) for n, st in caches.items()]),
+        ("driveby_route_cache_hit_ratio", "gauge", "hits / lookups since start",
+         [({"cache": n}, st["hits"] / max(st["hits"] + st["misses"], 1)) for n, st in caches.items()]),
+        ("driveby_corridor_rejected_total", "counter", "drivers skipped by the corridor prefilter",
+         [({}, corridor_stats()["rejected"])]),
+        ("driveby_candidate_memo_hits_total", "counter", "walking legs answered by the candidate memo",
+         [({"leg": "pickup"}, memo["pick_hits"]), ({"leg": "dropoff"}, memo["drop_hits"])]),
+        ("driveby_candidate_memo_misses_total", "counter", "walking legs the candidate memo did not know",
+         [({"leg": "pickup"}, memo["pick_misses"]), ({"leg": "dropoff"}, memo["drop_misses"])]),
+    ]
+    return web.Response(body=metrics.render(extra).encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
 # Add a subscriber for a specific request_id
 def add_subscriber(request_id: str, ws: web.WebSocketResponse):
     if request_id not in subscribers:
@@ -106,33 +220,24 @@ def remove_subscriber_everywhere(ws: web.WebSocketResponse) -> None:
         del subscribers[rid]
 
 
-async def broadcast_status(request_id: str, status: str):
-    msg = json.dumps({
+def broadcast_status(app: web.Application, request_id: str, status: str) -> None:
+    msg = dumps({
         "type": "status",
         "request_id": request_id,
         "status": status
     })
 
-    conns = subscribers.get(request_id, set())
-    if not conns:
-        return
-
-    dead_conns = set()
-    for ws in conns:
-        if ws.closed:
-            dead_conns.add(ws)
-            continue
-        try:
-            await ws.send_str(msg)
-        except Exception:
-            dead_conns.add(ws)
-    for ws in dead_conns:
-        conns.discard(ws)
+    for ws in subscribers.get(request_id, set()):
+        box = outbox_of(app, ws)
+        if box is not None:
+            box.put(msg)
 
 
 async def ws_agent_handler(request: web.Request) -> web.WebSocketResponse:
     ws = web.WebSocketResponse(heartbeat=20)
     await ws.prepare(request)
+    # everything to this client goes through its outbox, in order
+    box = open_outbox(request.app, ws)
 
     request_id = request.query.get("request_id")
     if request_id:
@@ -145,7 +250,7 @@ async def ws_agent_handler(request: web.Request) -> web.WebSocketResponse:
                 try:
                     data = json.loads(msg.data)
                 except json.JSONDecodeError:
-                    await ws.send_str(json.dumps({"error": "invalid JSON"}))
+                    box.put(dumps({"error": "invalid JSON"}))
                     continue
 
                 t = data.get("type")
@@ -160,7 +265,7 @@ async def ws_agent_handler(request: web.Request) -> web.WebSocketResponse:
                         "payload": payload
                     })
 
-                    await broadcast_status(request_id, "queued")
+                    broadcast_status(request.app, request_id, "queued")
                     continue
                 if t == "subscribe":
                     req_id = data.get("request_id")
@@ -168,42 +273,74 @@ async def ws_agent_handler(request: web.Request) -> web.WebSocketResponse:
                     add_subscriber(req_id, ws)
                     last_r = request.app.get(
                         "last_routes_by_req",
-                        {}).get(request_id)
+                        {}).get(req_id)
                     if last_r is not None:
-                        await ws.send_str(json.dumps({"type": "routes", "data": last_r}))
-                    await ws.send_str(json.dumps({
+                        box.put(dumps({"type": "routes", "data": last_r}))
+                    box.put(dumps({
                          "type": "status",
                          "request_id": req_id,
                          "status": "subscribed"
                     }))
 
                     continue
-                await ws.send_str(json.dumps({"error": "unknown message type"}))
+                if t == "resync":
+                    # client saw a gap in the position seq numbers
+                    rid = data.get("request_id")
+                    event = request.app["req_stream"].resync(rid)
+                    if event is not None:
+                        box.put(dumps(event), key=("position", rid))
+                    continue
+                box.put(dumps({"error": "unknown message type"}))
 
 
             elif msg.type == WSMsgType.ERROR:
                 print(f'WebSocket connection closed with exception {ws.exception()}')
     finally:
         remove_subscriber_everywhere(ws)
+        close_outbox(request.app, ws)
     return ws
 
 
 # WebSocket handler for global updates
+def join_global(app: web.Application, ws: web.WebSocketResponse, box) -> None:
+    # Replay: routes keyframe, the deltas after it arrive through the broadcaster
+    routes = app.get("routes")
+    if routes is not None:
+        box.put(dumps(routes))
+
+    # Replay: keyframe of the position stream; queued in the same step the client
+    # joins the broadcast set, so the next delta it gets is seq + 1
+    app["global_ws"].add(ws)
+    if app["pos_stream"].has_state():
+        box.put(keyframe_bytes(app), key="positions")
+
+
+def join_view(app: web.Application, ws: web.WebSocketResponse, box, data: Dict[str, Any]) -> None:
+    # {"type": "viewport", "bbox": [south, west, north, east], "zoom": z}; bbox null: back to everything
+    views: InterestManager = app["views"]
+    if data.get("bbox") is None:
+        if ws in views:
+            views.remove(ws)
+            join_global(app, ws, box)
+        return
+    try:
+        group = views.set_viewport(ws, data.get("bbox"), data.get("zoom"))
+    except ValueError as e:
+        box.put(dumps({"error": str(e)}))
+        return
+    if group is None:
+        return
+    app["global_ws"].discard(ws)
+    for event, key in group.join_messages(app["pos_stream"]):
+        box.put(dumps(event), key=key)
+
+
 async def ws_handler(request: web.Request) -> web.WebSocketResponse:
     ws = web.WebSocketResponse(heartbeat=20)
     await ws.prepare(request)
-
-    request.app["global_ws"].add(ws)
-
-    # Replay: routes
-    routes = request.app.get("routes")
-    if routes is not None:
-        await ws.send_str(json.dumps({"type": "routes", "data": routes}))
-
-    # Replay: last positions
-    last_pos = request.app.get("last_positions")
-    if last_pos is not None:
-        await ws.send_str(json.dumps({"type": "positions", "data": last_pos}))
+    box = open_outbox(request.app, ws)
+    views: InterestManager = request.app["views"]
+    join_global(request.app, ws, box)
 
     try:
         async for msg in ws:
@@ -212,7 +349,23 @@ async def ws_handler(request: web.Request) -> web.WebSocketResponse:
             try:
                 data = json.loads(msg.data)
             except json.JSONDecodeError:
-                await ws.send_str(json.dumps({"error": "invalid JSON"}))
+                box.put(dumps({"error": "invalid JSON"}))
+                continue
+            if data.get("type") == "viewport":
+                join_view(request.app, ws, box, data)
+                continue
+            if data.get("type") == "resync":
+                group = views.view_of.get(ws)
+                if data.get("stream") == "routes":
+                    routes = group.routes.keyframe() if group is not None else request.app.get("routes")
+                    if routes is not None:
+                        box.put(dumps(routes))
+                    continue
+                # replaces a delta that may still be queued
+                if group is not None:
+                    box.put(group.keyframe_bytes(request.app["pos_stream"]), key="positions")
+                else:
+                    box.put(keyframe_bytes(request.app), key="positions")
                 continue
             if data.get("type") == "speed":
                 v = float(data.get("value", 1.0))
@@ -223,34 +376,73 @@ async def ws_handler(request: web.Request) -> web.WebSocketResponse:
 
     finally:
         request.app["global_ws"].discard(ws)
+        views.remove(ws)
+        close_outbox(request.app, ws)
 
     return ws
 
 
-# Startup task to run the worker loop
-async def on_startup(app: web.Application):
-    app['pub_q'] = asyncio.Queue(maxsize=1)
-    app['broadcaster_task'] = asyncio.create_task(broadcaster(app))
+def init_bus(app: web.Application) -> None:
+    # publish queues, broadcaster tasks and per-client outboxes
+    app["pub_q"] = CoalescingQueue()
+    app["pub_q_by_id"] = CoalescingQueue()
+    app["broadcaster_task"] = asyncio.create_task(broadcaster(app))
     app["broadcaster_by_id_task"] = asyncio.create_task(broadcaster_by_id(app))
-    app["create_q"] = Queue()
-    app["pub_q_by_id"] = asyncio.Queue(maxsize=10)
     app["global_ws"] = set()
+    app["outboxes"] = {}
     app["subscribers"] = subscribers
     app["last_routes_by_req"] = {}
+    app["pos_stream"] = PositionDeltaEncoder()
+    app["req_stream"] = RequestFrameStream()
+    app["keyframe_cache"] = {}
+    app["views"] = InterestManager(app["pos_stream"])
+
+
+async def on_startup_bus(app: web.Application):
+    init_bus(app)
+    app["create_q"] = Queue()
     app["speed"] = 1.0
 
+
+# agents and matches survive a restart; DRIVEBY_STATE_DB="" keeps them in memory only
+STATE_DB_PATH = os.environ.get("DRIVEBY_STATE_DB", str(Path(__file__).resolve().parent / "state.sqlite"))
+# finished rides are appended here as JSON lines when set (the last ones are always kept in memory)
+ARCHIVE_PATH = os.environ.get("DRIVEBY_ARCHIVE", "")
+
+
+# Startup task to run the worker loop
+async def on_startup(app: web.Application):
+    await on_startup_bus(app)
+    if STATE_DB_PATH:
+        app["state_store"] = StateStore(STATE_DB_PATH)
+    app["archive_path"] = ARCHIVE_PATH
+
     loop = asyncio.get_running_loop()
     start_simulation(app, loop)
 
 
 # Cleanup on shutdown
+async def close_bus(app: web.Application) -> None:
+    for name in ("broadcaster_task", "broadcaster_by_id_task"):
+        app[name].cancel()
+        try:
+            await app[name]
+        except asyncio.CancelledError:
+            pass
+    for box in list(app["outboxes"].values()):
+        box.close()
+    app["outboxes"].clear()
+
+
 async def on_cleanup(app: web.Application):
-    app['broadcaster_task'].cancel()
-    app['broadcaster_by_id_task'].cancel()
-    try:
-        await app['broadcaster_task']
-    except asyncio.CancelledError:
-        pass
+    await close_bus(app)
+    if app.get("admission") is not None:
+        app["admission"].close()
+    if app.get("state_store") is not None:
+        await asyncio.to_thread(app["state_store"].close)
+    if app.get("lifecycle") is not None:
+        app["lifecycle"].close()
+    await asyncio.to_thread(OSRM.close)
 
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -271,11 +463,14 @@ async def no_cache(request, handler):
     return resp
 
 
-def create_app() -> web.Application:
+def create_app(simulate: bool = True) -> web.Application:
+    # simulate=False: only the WebSocket side (load tests publish themselves)
     app = web.Application(middlewares=[no_cache])
     app.add_routes([
         web.get("/", index),
         web.get("/health", health_check),
+        web.get("/stats", stats),
+        web.get("/metrics", metrics_handler),
         web.get("/ws", ws_handler),
         web.get("/ws_agent", ws_agent_handler),
     ])
@@ -283,7 +478,7 @@ def create_app() -> web.Application:
     # Serve static files
     app.router.add_static("/web/", path=str(WEB_DIR), show_index=True)
 
-    app.on_startup.append(on_startup)
+    app.on_startup.append(on_startup if simulate else on_startup_bus)
     app.on_cleanup.append(on_cleanup)
     return app
 
@@ -0,0 +1,252 @@
+import heapq
+import itertools
+import math
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from AgentState import AgentState
+from admission import run_inline
+from Match import MatchCandidate
+from spatial_index import Cell, DriverGridIndex
+
+
+class IncrementalMatcher:
+    """
+    Keeps scored candidate pairs between leftover walkers and drivers in a
+    max-heap, so the tick loop gets new matches without re-scanning every pair.
+
+    score_fn(walker, drivers) -> [MatchCandidate] checks one walker against some
+    drivers (match_candidates), weight_fn(candidate) ranks the pairs. Only the
+    pairs of an agent that changed are scored again: an agent is scored when it
+    is added and then every rescore_every_s (it moved on its route meanwhile),
+    at most max_rescore agents per step. Scoring an agent bumps its version,
+    which invalidates its old pairs in the heap lazily. Walkers are paired with
+    the drivers the index returns for them, drivers with the walkers whose
+    position and destination lie within radius_m of their remaining route.
+
+    The heap outlives the step: at most max_emit pairs are handed out per step,
+    the rest wait for the next one. A pair is handed out with the candidate it
+    was scored with while it is younger than max_pair_age_s; an older one is
+    dropped and its walker scored again.
+
+    score_fn calls OSRM, so the scoring runs through submit(fn, *args) ->
+    Future (AdmissionPipeline.offload on the server, inline by default); step()
+    pushes the pairs of every scoring that finished and never waits for one.
+    """
+
+    def __init__(self,
+                 score_fn: Callable[[AgentState, List[AgentState]], List[MatchCandidate]],
+                 weight_fn: Callable[[MatchCandidate], float],
+                 driver_index: DriverGridIndex,
+                 radius_m: float = 1500.0,
+                 rescore_every_s: float = 60.0,
+                 max_rescore: int = 16,
+                 max_emit: int = 16,
+                 max_pair_age_s: float = 10.0,
+                 submit: Optional[Callable[..., Future]] = None):
+        self.score_fn = score_fn
+        self.weight_fn = weight_fn
+        self.index = driver_index
+        self.radius_m = radius_m
+        self.rescore_every_s = rescore_every_s
+        self.max_rescore = max_rescore
+        self.max_emit = max_emit
+        self.max_pair_age_s = max_pair_age_s
+        self.submit = submit or run_inline
+
+        self._walkers: Dict[str, AgentState] = {}
+        self._drivers: Dict[str, AgentState] = {}
+        self._ver: Dict[str, int] = {}
+        # walkers by the cells of their position and destination
+        self._walker_cells: Dict[Cell, Set[str]] = {}
+        self._walker_at: Dict[str, Tuple[Cell, Cell]] = {}
+
+        self._seq = itertools.count()
+        self._due: List[Tuple[float, int, str, int]] = []  # (t, seq, agent_id, version)
+        # (-weight, seq, walker_id, version, driver_id, version, scored_t, candidate)
+        self._pairs: List[Tuple[float, int, str, int, str, int, float, MatchCandidate]] = []
+        # scorings in flight: (future, scored_t, versions of the agents at submit)
+        self._scoring: List[Tuple[Future, float, Dict[str, int]]] = []
+        self._compact_due_at = 1024
+        self._compact_pairs_at = 1024
+
+        self.scored_agents = 0
+        self.scored_pairs = 0
+        self.emitted = 0
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._walkers) + len(self._drivers)
+
+    # fleet changes
+
+    def add(self, kind: str, agent: AgentState, t: float, scored: bool = True) -> None:
+        """
+        scored: the agent was just checked against all leftovers (admission),
+        so its first rescore is due only after rescore_every_s.
+        """
+        if kind == "walker":
+            self._walkers[agent.agent_id] = agent
+            self._place_walker(agent)
+        elif kind == "driver":
+            self._drivers[agent.agent_id] = agent
+        else:
+            raise ValueError(f"Unknown kind: {kind}")
+        self._bump(agent.agent_id)
+        self._schedule(agent.agent_id, t + (self.rescore_every_s if scored else 0.0))
+
+    def remove(self, agent: AgentState) -> None:
+        aid = agent.agent_id
+        self._drivers.pop(aid, None)
+        if self._walkers.pop(aid, None) is not None:
+            self._unplace_walker(aid)
+        self._ver.pop(aid, None)
+
+    # tick
+
+    def step(self, t: float) -> List[Tuple[AgentState, MatchCandidate]]:
+        """
+        Submits the scoring of the agents that are due, takes in the scorings
+        that finished, then returns the best pairs that are still valid, each
+        agent at most once. Returned agents are forgotten; the caller commits
+        the matches.
+        """
+        budget = self.max_rescore
+        while self._due and self._due[0][0] <= t and budget > 0:
+            _, _, aid, ver = heapq.heappop(self._due)
+            if self._ver.get(aid) != ver:
+                continue
+            agent = self._walkers.get(aid) or self._drivers.get(aid)
+            if agent.assigned or agent.done:
+                self.remove(agent)
+                continue
+            if aid in self._walkers:
+                self._rescore_walker(agent, t)
+            else:
+                self._rescore_driver(agent, t)
+            self._schedule(aid, t + self.rescore_every_s)
+            budget -= 1
+        self._collect()
+
+        out = []
+        expired: Set[str] = set()
+        while self._pairs and len(out) < self.max_emit:
+            _, _, wid, wv, did, dv, scored_t, cand = heapq.heappop(self._pairs)
+            if self._ver.get(wid) != wv or self._ver.get(did) != dv:
+                continue
+            walker, driver = self._walkers[wid], self._drivers[did]
+            if walker.assigned or walker.done or driver.assigned or driver.done:
+                continue
+            if t - scored_t > self.max_pair_age_s:
+                # both moved a while since: score the walker again rather than trust the old pair
+                if wid not in expired:
+                    expired.add(wid)
+                    self._schedule(wid, t)
+                self.expired += 1
+                continue
+            out.append((walker, cand))
+            self.remove(walker)
+            self.remove(driver)
+        self.emitted += len(out)
+
+        if len(self._due) > self._compact_due_at:
+            self._due = [e for e in self._due if self._ver.get(e[2]) == e[3]]
+            heapq.heapify(self._due)
+            self._compact_due_at = max(1024, 2 * len(self._due))
+        if len(self._pairs) > self._compact_pairs_at:
+            self._pairs = [e for e in self._pairs if self._ver.get(e[2]) == e[3] and self._ver.get(e[4]) == e[5]]
+            heapq.heapify(self._pairs)
+            self._compact_pairs_at = max(1024, 2 * len(self._pairs))
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        return {"walkers": len(self._walkers), "drivers": len(self._drivers),
+                "pairs": len(self._pairs), "due": len(self._due), "scoring": len(self._scoring),
+                "scored_agents": self.scored_agents, "scored_pairs": self.scored_pairs,
+                "emitted": self.emitted, "expired": self.expired}
+
+    # internals
+
+    def _bump(self, aid: str) -> int:
+        v = self._ver.get(aid, 0) + 1
+        self._ver[aid] = v
+        return v
+
+    def _schedule(self, aid: str, t: float) -> None:
+        heapq.heappush(self._due, (t, next(self._seq), aid, self._ver[aid]))
+
+    def _score(self, jobs: List[Tuple[AgentState, List[AgentState]]]) -> List[Tuple[AgentState, MatchCandidate]]:
+        # on a worker: score_fn only reads the agents
+        return [(walker, cand) for walker, drivers in jobs for cand in self.score_fn(walker, drivers)]
+
+    def _submit(self, jobs: List[Tuple[AgentState, List[AgentState]]], t: float) -> None:
+        vers = {}
+        for walker, drivers in jobs:
+            vers[walker.agent_id] = self._ver[walker.agent_id]
+            for d in drivers:
+                vers[d.agent_id] = self._ver[d.agent_id]
+        self.scored_pairs += sum(len(drivers) for _, drivers in jobs)
+        self._scoring.append((self.submit(self._score, jobs), t, vers))
+
+    def _collect(self) -> None:
+        running = []
+        for fut, scored_t, vers in self._scoring:
+            if not fut.done():
+                running.append((fut, scored_t, vers))
+                continue
+            if fut.cancelled():
+                continue
+            if fut.exception() is not None:
+                # the agents are scored again when they are next due
+                print("rematch scoring failed:", fut.exception())
+                continue
+            for walker, cand in fut.result():
+                self._push(walker.agent_id, vers[walker.agent_id], cand.driver.agent_id,
+                           vers[cand.driver.agent_id], cand, scored_t)
+        self._scoring = running
+
+    def _push(self, wid: str, wv: int, did: str, dv: int, cand: MatchCandidate, t: float) -> None:
+        heapq.heappush(self._pairs, (-self.weight_fn(cand), next(self._seq), wid, wv, did, dv, t, cand))
+
+    def _place_walker(self, walker: AgentState) -> None:
+        self._unplace_walker(walker.agent_id)
+        cells = (self.index.cell_of(walker.get_pos()), self.index.cell_of(walker.route.dest))
+        self._walker_at[walker.agent_id] = cells
+        self._walker_cells.setdefault(cells[0], set()).add(walker.agent_id)
+
+    def _unplace_walker(self, aid: str) -> None:
+        cells = self._walker_at.pop(aid, None)
+        if cells is None:
+            return
+        bucket = self._walker_cells[cells[0]]
+        bucket.discard(aid)
+        if not bucket:
+            del self._walker_cells[cells[0]]
+
+    def _rescore_walker(self, walker: AgentState, t: float) -> None:
+        self._bump(walker.agent_id)
+        self._place_walker(walker)
+        drivers = [d for d in self.index.candidates(walker.get_pos(), walker.route.dest, self.radius_m)
+                   if d.agent_id in self._drivers]
+        self.scored_agents += 1
+        if drivers:
+            self._submit([(walker, drivers)], t)
+
+    def _rescore_driver(self, driver: AgentState, t: float) -> None:
+        self._bump(driver.agent_id)
+        self.scored_agents += 1
+        k = int(math.ceil(self.radius_m / self.index.cell_m))
+        near: Set[Cell] = set()
+        for ci, cj in set(self.index.route_cells(driver)):
+            for di in range(-k, k + 1):
+                for dj in range(-k, k + 1):
+                    near.add((ci + di, cj + dj))
+
+        jobs = []
+        for c in near:
+            for wid in self._walker_cells.get(c, ()):
+                walker = self._walkers[wid]
+                if self._walker_at[wid][1] in near and not walker.assigned and not walker.done:
+                    jobs.append((walker, [driver]))
+        if jobs:
+            self._submit(jobs, t)
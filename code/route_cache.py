@@ -0,0 +1,260 @@
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from RouteBase import CompactRoute, LatLonView, cumulative
+
+
+class MemoryLRU:
+    """
+    Thread-safe in-process LRU for routing results (replaces functools.lru_cache
+    so the async fetch paths can look up and fill the cache themselves).
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            v = self._data.get(key)
+            if v is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return v
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "size": len(self._data)}
+
+
+# -------------------------
+# persistent cache (sqlite)
+# -------------------------
+
+_FMT_FAST = 1
+_FMT_ROUTE = 3
+_FAST = struct.Struct("<BBIdd")  # format, 0, 0, distance, duration
+# format, has_nodes, n_points, dist, duration, start lat/lon, dest lat/lon, len(profile)
+_ROUTE = struct.Struct("<BBIddddddB")
+
+
+def encode_fast(v: Tuple[float, float]) -> bytes:
+    return _FAST.pack(_FMT_FAST, 0, 0, v[0], v[1])
+
+
+def encode_route(r: CompactRoute) -> bytes:
+    # header, profile, then the route's own arrays: geometry (interleaved
+    # lat/lon), seg_dist, duration_list as float64 and nodes as int64
+    n = len(r.latlon_buffer) // 2
+    nodes = r.nodes
+    has_nodes = nodes is not None and len(nodes) == n
+    profile = r.profile.encode()
+
+    parts = [
+        _ROUTE.pack(_FMT_ROUTE, 1 if has_nodes else 0, n, r.dist, r.duration,
+                    r.start[0], r.start[1], r.dest[0], r.dest[1], len(profile)),
+        profile,
+        r.latlon_buffer.tobytes(),
+        r.seg_dist_m.tobytes(),
+        r.duration_list.tobytes(),
+    ]
+    if has_nodes:
+        parts.append(nodes.tobytes() if isinstance(nodes, array) else array("q", nodes).tobytes())
+    return zlib.compress(b"".join(parts), 1)
+
+
+def _take(raw: bytes, off: int, typecode: str, count: int) -> Tuple[array, int]:
+    a = array(typecode)
+    end = off + a.itemsize * count
+    a.frombytes(raw[off:end])
+    return a, end
+
+
+def decode(blob: bytes):
+    if len(blob) == _FAST.size:
+        fmt, _, _, dist, duration = _FAST.unpack(blob)
+        if fmt == _FMT_FAST:
+            return dist, duration
+
+    raw = zlib.decompress(blob)
+    if not raw or raw[0] != _FMT_ROUTE:
+        raise ValueError(f"unknown route cache format {raw[:1]!r}")
+    _, has_nodes, n, dist, duration, s_lat, s_lon, d_lat, d_lon, plen = _ROUTE.unpack_from(raw, 0)
+
+    off = _ROUTE.size
+    profile = raw[off:off + plen].decode()
+    off += plen
+    n_seg = max(n - 1, 0)
+    latlon, off = _take(raw, off, "d", 2 * n)
+    seg_dist, off = _take(raw, off, "d", n_seg)
+    seg_time, off = _take(raw, off, "d", n_seg)
+    nodes = _take(raw, off, "q", n)[0] if has_nodes else None
+
+    return CompactRoute(
+        start=(s_lat, s_lon), dest=(d_lat, d_lon),
+        dist=dist, duration=duration,
+        duration_list=seg_time, cum_time_s=cumulative(seg_time),
+        geometry_latlon=LatLonView(latlon),
+        seg_dist_m=seg_dist, cum_dist_m=cumulative(seg_dist),
+        profile=profile, nodes=nodes,
+    )
+
+
+def cache_key(namespace: str, kind: str, profile: str,
+              a_lat: float, a_lon: float, b_lat: float, b_lon: float) -> str:
+    # callers pass quantized coordinates (local_osrm.q), formatted at the same precision
+    return f"{namespace}|{kind}|{profile}|{a_lat:.5f},{a_lon:.5f}|{b_lat:.5f},{b_lon:.5f}"
+
+
+class SqliteRouteCache:
+    """
+    Route cache in a local sqlite file, shared across restarts and processes.
+
+    Values are the binary encodings above; entries expire after ttl_s and the
+    least recently used ones are evicted (in batches) above max_entries.
+    Each thread gets its own connection; the file runs in WAL mode so several
+    server processes can read and write it concurrently.
+    """
+
+    def __init__(self, path: str, ttl_s: float = 7 * 24 * 3600.0, max_entries: int = 1_000_000,
+                 touch_every_s: float = 3600.0):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.touch_every_s = touch_every_s
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.writes = 0
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._count: Optional[int] = None
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS routes ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " expires REAL NOT NULL,"
+                " atime REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS routes_atime ON routes(atime)")
+            self._local.conn = conn
+        return conn
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+
+    def get(self, key: str):
+        conn = self._conn()
+        row = conn.execute("SELECT value, expires, atime FROM routes WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        value, expires, atime = row
+        try:
+            decoded = decode(value)
+        except (ValueError, zlib.error, struct.error):
+            decoded = None  # written by an older format
+        if decoded is None or expires < now:
+            conn.execute("DELETE FROM routes WHERE key = ?", (key,))
+            with self._lock:
+                self.misses += 1
+                self.expired += 1
+                if self._count is not None:
+                    self._count -= 1
+            return None
+
+        # LRU bookkeeping without a write on every hit
+        if now - atime > self.touch_every_s:
+            conn.execute("UPDATE routes SET atime = ? WHERE key = ?", (now, key))
+        with self._lock:
+            self.hits += 1
+        return decoded
+
+    def put(self, key: str, value) -> None:
+        blob = encode_fast(value) if isinstance(value, tuple) else encode_route(value)
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO routes(key, value, expires, atime) VALUES (?, ?, ?, ?)",
+            (key, blob, now + self.ttl_s, now),
+        )
+        with self._lock:
+            self.writes += 1
+            if self._count is None:
+                self._count = conn.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+            else:
+                self._count += 1  # replaces count too, evict() recounts
+            over = self._count > self.max_entries
+        if over:
+            self.evict()
+
+    def evict(self) -> None:
+        conn = self._conn()
+        now = time.time()
+        n_exp = conn.execute("DELETE FROM routes WHERE expires < ?", (now,)).rowcount
+        count = conn.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+        n_lru = 0
+        if count > self.max_entries:
+            # drop down to 90% so eviction does not run on every put
+            n_lru = count - int(self.max_entries * 0.9)
+            conn.execute(
+                "DELETE FROM routes WHERE key IN (SELECT key FROM routes ORDER BY atime LIMIT ?)",
+                (n_lru,),
+            )
+        with self._lock:
+            self.expired += n_exp
+            self.evictions += n_lru
+            self._count = count - n_lru
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "expired": self.expired,
+                    "evictions": self.evictions, "writes": self.writes}
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
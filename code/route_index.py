@@ -0,0 +1,203 @@
+import heapq
+import math
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, NamedTuple, Tuple
+
+from RouteBase import LatLon, RouteBase
+from geometry import derived
+
+try:
+    import numpy as np
+except ImportError:  # grid path only
+    np = None
+
+Cell = Tuple[int, int]
+Pos = Tuple[int, float]  # (segment, fraction along it): a point on the route
+
+M_PER_DEG_LAT = 111320.0
+
+# up to this many segments one vectorized pass over the tail beats any
+# python-level index; longer routes get the grid
+SCAN_MAX_SEGS = 2048
+
+
+class RoutePoint(NamedTuple):
+    seg: int  # on segment seg -> seg + 1
+    frac: float  # 0..1 along that segment
+    point: LatLon
+    dist_m: float  # to the query target
+
+
+class SegmentIndex:
+    """
+    Uniform grid over the segments of one route (planar metres around the
+    route start, fine at city scale). Every cell lists, in route order, the
+    segments that pass through it, so "nearest points after position p"
+    searches rings of cells outwards from the target, skips the segments
+    before p by bisection and stops once no farther cell can hold anything
+    closer. Results are projections onto the segments, not just vertices.
+    Short routes (SCAN_MAX_SEGS) skip the grid for one numpy pass over the
+    remaining segments, which gives the same answer.
+    """
+
+    def __init__(self, route: RouteBase, cell_m: float = 200.0):
+        pts = route.geometry_latlon  # a view on CompactRoute, not copied
+        self.cell_m = cell_m
+        self._lat0, self._lon0 = pts[0]
+        self._kx = M_PER_DEG_LAT * math.cos(math.radians(self._lat0))
+        self._pts = pts
+        self._x = array("d")
+        self._y = array("d")
+        for p in pts:
+            x, y = self._to_xy(p)
+            self._x.append(x)
+            self._y.append(y)
+
+        self._cells: Dict[Cell, List[int]] = {}
+        self.scan = np is not None and len(pts) - 1 <= SCAN_MAX_SEGS
+        if self.scan:
+            return
+        for s in range(len(pts) - 1):
+            for c in self._segment_cells(s):
+                self._cells.setdefault(c, []).append(s)
+        if self._cells:
+            self._lo = (min(c[0] for c in self._cells), min(c[1] for c in self._cells))
+            self._hi = (max(c[0] for c in self._cells), max(c[1] for c in self._cells))
+
+    def __len__(self) -> int:
+        return max(len(self._pts) - 1, 0)
+
+    def _to_xy(self, p: LatLon) -> Tuple[float, float]:
+        return (p[1] - self._lon0) * self._kx, (p[0] - self._lat0) * M_PER_DEG_LAT
+
+    def _cell(self, x: float, y: float) -> Cell:
+        return int(math.floor(x / self.cell_m)), int(math.floor(y / self.cell_m))
+
+    def _segment_cells(self, s: int) -> List[Cell]:
+        # every cell of the segment's box whose centre is within half a cell
+        # diagonal of the segment: a superset of the cells it crosses
+        ax, ay, bx, by = self._x[s], self._y[s], self._x[s + 1], self._y[s + 1]
+        (i0, j0), (i1, j1) = self._cell(min(ax, bx), min(ay, by)), self._cell(max(ax, bx), max(ay, by))
+        reach = self.cell_m * math.sqrt(0.5)
+        out = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                cx, cy = (i + 0.5) * self.cell_m, (j + 0.5) * self.cell_m
+                if self._project(s, cx, cy)[1] <= reach:
+                    out.append((i, j))
+        return out
+
+    def _project(self, s: int, x: float, y: float) -> Tuple[float, float]:
+        # (fraction along segment s of the closest point to (x, y), its distance)
+        ax, ay = self._x[s], self._y[s]
+        dx, dy = self._x[s + 1] - ax, self._y[s + 1] - ay
+        len2 = dx * dx + dy * dy
+        f = 0.0 if len2 == 0.0 else min(max(((x - ax) * dx + (y - ay) * dy) / len2, 0.0), 1.0)
+        return f, math.hypot(ax + f * dx - x, ay + f * dy - y)
+
+    def point_at(self, seg: int, frac: float) -> LatLon:
+        if frac >= 1.0:
+            return self._pts[seg + 1]
+        (lat1, lon1), (lat2, lon2) = self._pts[seg], self._pts[seg + 1]
+        return lat1 + frac * (lat2 - lat1), lon1 + frac * (lon2 - lon1)
+
+    def nearest(self, target: LatLon, k: int = 1, after: Pos = (0, 0.0)) -> List[RoutePoint]:
+        """
+        Up to k closest points of the route at or after position `after`, one
+        per segment, nearest first.
+        """
+        after_seg, after_frac = after
+        x, y = self._to_xy(target)
+        if self.scan:
+            return self._nearest_scan(x, y, k, after_seg, after_frac)
+        if not self._cells or k <= 0:
+            return []
+        ci, cj = self._cell(x, y)
+        lo, hi = self._lo, self._hi
+
+        found: Dict[int, Tuple[float, float]] = {}  # seg -> (dist, frac)
+        kth = math.inf
+        # rings entirely outside the grid hold nothing
+        r = max(lo[0] - ci, ci - hi[0], lo[1] - cj, cj - hi[1], 0)
+        r_max = max(ci - lo[0], hi[0] - ci, cj - lo[1], hi[1] - cj)
+        while r <= r_max:
+            # no cell of ring r is closer than (r - 1) cells
+            if len(found) >= k and kth <= (r - 1) * self.cell_m:
+                break
+            for c in self._ring(ci, cj, r):
+                segs = self._cells.get(c)
+                if not segs:
+                    continue
+                for s in segs[bisect_left(segs, after_seg):]:
+                    if s in found:
+                        continue
+                    f, d = self._project(s, x, y)
+                    if s == after_seg and f < after_frac:
+                        f = after_frac
+                        sx, sy = self._seg_xy(s, f)
+                        d = math.hypot(sx - x, sy - y)
+                    found[s] = (d, f)
+            if len(found) >= k:
+                kth = heapq.nsmallest(k, (d for d, _ in found.values()))[-1]
+            r += 1
+
+        best = sorted(found.items(), key=lambda e: (e[1][0], e[0]))[:k]
+        return [RoutePoint(s, f, self.point_at(s, f), d) for s, (d, f) in best]
+
+    def _nearest_scan(self, x: float, y: float, k: int, after_seg: int, after_frac: float) -> List[RoutePoint]:
+        xs = np.frombuffer(self._x, dtype=np.float64)[after_seg:]
+        ys = np.frombuffer(self._y, dtype=np.float64)[after_seg:]
+        if len(xs) < 2 or k <= 0:
+            return []
+        ax, ay = xs[:-1], ys[:-1]
+        dx, dy = xs[1:] - ax, ys[1:] - ay
+        len2 = dx * dx + dy * dy
+        with np.errstate(invalid="ignore", divide="ignore"):
+            f = np.where(len2 > 0.0, ((x - ax) * dx + (y - ay) * dy) / len2, 0.0)
+        f = np.clip(f, 0.0, 1.0)
+        f[0] = max(f[0], after_frac)
+        d = np.hypot(ax + f * dx - x, ay + f * dy - y)
+
+        k = min(k, len(d))
+        idx = np.argpartition(d, k - 1)[:k] if k < len(d) else np.arange(len(d))
+        idx = idx[np.lexsort((idx, d[idx]))]  # nearest first, ties by segment
+        return [RoutePoint(after_seg + int(i), float(f[i]), self.point_at(after_seg + int(i), float(f[i])),
+                           float(d[i])) for i in idx]
+
+    def _seg_xy(self, s: int, f: float) -> Tuple[float, float]:
+        ax, ay = self._x[s], self._y[s]
+        return ax + f * (self._x[s + 1] - ax), ay + f * (self._y[s + 1] - ay)
+
+    def _ring(self, ci: int, cj: int, r: int):
+        # cells at Chebyshev distance r, clipped to the grid
+        lo, hi = self._lo, self._hi
+        i0, i1 = max(ci - r, lo[0]), min(ci + r, hi[0])
+        j0, j1 = max(cj - r, lo[1]), min(cj + r, hi[1])
+        if r == 0:
+            if i0 <= ci <= i1 and j0 <= cj <= j1:
+                yield ci, cj
+            return
+        for j in (cj - r, cj + r):
+            if j0 <= j <= j1:
+                for i in range(i0, i1 + 1):
+                    yield i, j
+        for i in (ci - r, ci + r):
+            if i0 <= i <= i1:
+                for j in range(max(cj - r + 1, j0), min(cj + r - 1, j1) + 1):
+                    yield i, j
+
+
+def segment_index(route: RouteBase) -> SegmentIndex:
+    return derived(route, "_seg_index", SegmentIndex)
+
+
+def time_at(route: RouteBase, seg: int, frac: float = 0.0) -> float:
+    # seconds from the route start to a point on segment seg
+    t = route.cum_time_s[seg]
+    return t + frac * route.duration_list[seg] if frac else t
+
+
+def dist_at(route: RouteBase, seg: int, frac: float = 0.0) -> float:
+    d = route.cum_dist_m[seg]
+    return d + frac * route.seg_dist_m[seg] if frac else d
@@ -0,0 +1,206 @@
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from RouteBase import LatLon
+
+POLYLINE_PRECISION = 5  # Google's default, ~1 m
+
+BBox = Tuple[float, float, float, float]  # south, west, north, east
+
+# the entry fields that hold route ids
+ROUTE_KEYS = ("driver_route", "walk_to_pickup", "walk_from_dropoff")
+
+
+def encode_polyline(points: Iterable[LatLon], precision: int = POLYLINE_PRECISION) -> str:
+    # Google encoded polyline: zigzag deltas of the rounded coordinates in 5 bit chunks
+    factor = 10 ** precision
+    out: List[str] = []
+    plat = plon = 0
+    for lat, lon in points:
+        ilat = int(round(lat * factor))
+        ilon = int(round(lon * factor))
+        for d in (ilat - plat, ilon - plon):
+            v = ~(d << 1) if d < 0 else d << 1
+            while v >= 0x20:
+                out.append(chr((0x20 | (v & 0x1f)) + 63))
+                v >>= 5
+            out.append(chr(v + 63))
+        plat, plon = ilat, ilon
+    return "".join(out)
+
+
+def decode_polyline(s: str, precision: int = POLYLINE_PRECISION) -> List[LatLon]:
+    factor = 10 ** precision
+    points: List[LatLon] = []
+    coord = [0, 0]
+    i, n = 0, len(s)
+    while i < n:
+        for k in (0, 1):
+            shift = result = 0
+            while True:
+                b = ord(s[i]) - 63
+                i += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            coord[k] += ~(result >> 1) if result & 1 else result >> 1
+        points.append((coord[0] / factor, coord[1] / factor))
+    return points
+
+
+class RouteStream:
+    """
+    Route geometries for the WebSocket clients, sent once under a stable id.
+
+    ref() gives a route object an id and encodes its geometry as a polyline
+    the first time it is seen. payload() builds routes data from entries
+    (match id, route ids, pickup/dropoff points and indices) plus the
+    geometries they reference; it is self-contained, for per-request messages.
+
+    encode() turns the full routes data of a tick into the global /ws stream:
+    a keyframe ("routes", key=True) first, then "routes_delta" messages with
+    only the geometries the clients do not have yet, new or changed entries,
+    and the ids of entries and geometries that went away. Route messages are
+    never dropped on the way to a client; the seq numbers only catch a client
+    that missed one anyway, it sends {"type": "resync", "stream": "routes"}
+    and gets keyframe().
+    """
+
+    def __init__(self, precision: int = POLYLINE_PRECISION):
+        self.precision = precision
+        self.seq = 0
+        self.version = 0.0
+        self._next_id = 0
+        # id(route) -> (route, route id); holding the route keeps its id() from being reused
+        self._by_obj: Dict[int, Tuple[Any, str]] = {}
+        self._polylines: Dict[str, str] = {}
+        self._bboxes: Dict[str, BBox] = {}
+
+        # client-visible state, as last sent
+        self._entries: Dict[Hashable, Dict[str, Any]] = {}
+        self._geometries: Dict[str, str] = {}
+
+    def has_state(self) -> bool:
+        return self.seq > 0
+
+    def ref(self, route) -> str:
+        hit = self._by_obj.get(id(route))
+        if hit is not None:
+            return hit[1]
+        self._next_id += 1
+        rid = f"r{self._next_id}"
+        self._by_obj[id(route)] = (route, rid)
+        pts = route.geometry_latlon
+        self._polylines[rid] = encode_polyline(pts, self.precision)
+        if len(pts):
+            lats = [p[0] for p in pts]
+            lons = [p[1] for p in pts]
+            self._bboxes[rid] = (min(lats), min(lons), max(lats), max(lons))
+        return rid
+
+    def bbox(self, *rids: str) -> Optional[List[float]]:
+        # [south, west, north, east] around the given routes
+        boxes = [self._bboxes[r] for r in rids if r in self._bboxes]
+        if not boxes:
+            return None
+        return [round(min(b[0] for b in boxes), 6), round(min(b[1] for b in boxes), 6),
+                round(max(b[2] for b in boxes), 6), round(max(b[3] for b in boxes), 6)]
+
+    def payload(self, entries: List[Dict[str, Any]], version: float) -> Dict[str, Any]:
+        geometries = {}
+        for e in entries:
+            for k in ROUTE_KEYS:
+                rid = e[k]
+                geometries[rid] = self._polylines[rid]
+        return {"routes_version": version, "precision": self.precision,
+                "geometries": geometries, "routes": entries}
+
+    def keyframe(self) -> Dict[str, Any]:
+        return {"type": "routes", "seq": self.seq, "key": True, "data": {
+            "routes_version": self.version,
+            "precision": self.precision,
+            "geometries": dict(self._geometries),
+            "routes": list(self._entries.values()),
+        }}
+
+    def encode(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        data is a payload() of every active match. Returns the message for the
+        clients, None when nothing they hold changed.
+        """
+        geometries = data["geometries"]
+        self._release(geometries)
+        if self.seq == 0:
+            self.seq = 1
+            self.version = data["routes_version"]
+            self._entries = {e["match_id"]: e for e in data["routes"]}
+            self._geometries = dict(geometries)
+            return self.keyframe()
+
+        new_geometries = {rid: p for rid, p in geometries.items() if rid not in self._geometries}
+        removed_geometries = [rid for rid in self._geometries if rid not in geometries]
+        changed = []
+        seen = set()
+        for e in data["routes"]:
+            match_id = e["match_id"]
+            seen.add(match_id)
+            if self._entries.get(match_id) != e:
+                self._entries[match_id] = e
+                changed.append(e)
+        removed = [k for k in self._entries if k not in seen]
+        if not (changed or removed or new_geometries or removed_geometries):
+            return None
+
+        for k in removed:
+            del self._entries[k]
+        for rid in removed_geometries:
+            del self._geometries[rid]
+        self._geometries.update(new_geometries)
+
+        self.seq += 1
+        self.version = data["routes_version"]
+        out: Dict[str, Any] = {"routes_version": self.version}
+        for name, v in (("geometries", new_geometries), ("routes", changed),
+                        ("routes_removed", removed), ("geometries_removed", removed_geometries)):
+            if v:
+                out[name] = v
+        return {"type": "routes_delta", "seq": self.seq, "data": out}
+
+    def _release(self, live: Dict[str, str]) -> None:
+        # forget the routes no active match refers to any more
+        if len(self._polylines) == len(live):
+            return
+        for key, (_, rid) in list(self._by_obj.items()):
+            if rid not in live:
+                del self._by_obj[key]
+                del self._polylines[rid]
+                self._bboxes.pop(rid, None)
+
+
+def apply_routes(state: Optional[Dict[str, Any]], msg: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Client side of the routes stream (web/map.js does the same in JS).
+    state is None or {"seq", "routes_version", "geometries", "routes"} with
+    geometries decoded and routes keyed by match id; returns the new state, or
+    None when a message was missed and the client has to resync.
+    """
+    data = msg["data"]
+    if msg.get("key"):
+        precision = data.get("precision", POLYLINE_PRECISION)
+        return {"seq": msg.get("seq", 0), "routes_version": data["routes_version"], "precision": precision,
+                "geometries": {rid: decode_polyline(p, precision) for rid, p in data["geometries"].items()},
+                "routes": {e["match_id"]: e for e in data["routes"]}}
+    if state is None or msg["seq"] != state["seq"] + 1:
+        return None
+
+    state["seq"] = msg["seq"]
+    state["routes_version"] = data["routes_version"]
+    for rid, p in data.get("geometries", {}).items():
+        state["geometries"][rid] = decode_polyline(p, state["precision"])
+    for e in data.get("routes", ()):
+        state["routes"][e["match_id"]] = e
+    for k in data.get("routes_removed", ()):
+        state["routes"].pop(k, None)
+    for rid in data.get("geometries_removed", ()):
+        state["geometries"].pop(rid, None)
+    return state
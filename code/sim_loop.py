@@ -0,0 +1,786 @@
+import asyncio
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+import metrics
+from AgentState import AgentState
+from Match import Match, MatchCandidate
+from admission import Admission, AdmissionPipeline
+from fleet_positions import FleetPositionEngine
+from lifecycle import ArchiveSink, Lifecycle, Retired
+from local_osrm import (MATCH_RADIUS_M, assign_batch, batch_weight, build_routes_payload, build_snapshot_payload,
+                        create_drivers, create_matches, create_walkers, dispatch_frames_by_req_id,
+                        drain_create_queue, finalize_match, handle_req, make_match_sim, match_candidates,
+                        propose_match, publish_routes, route_cached)
+from rematch import IncrementalMatcher
+from route_stream import RouteStream
+from spatial_index import DriverGridIndex
+from state_store import StateStore, restore_state
+from tick_scheduler import TickScheduler
+from ws_bus import publish, publish_by_id, send_done, send_status
+
+# finished sims and agents stay this many simulated seconds (clients see them arrive), then Lifecycle retires them
+DONE_KEEP_S = 30.0
+
+# app["speed"] is simulated seconds per this much wall-clock time (one tick at the default 20 Hz)
+TICK_INTERVAL_S = 0.05
+
+TICK_S = metrics.histogram("driveby_tick_seconds", "simulation tick, without the pause between ticks")
+TICK_LAG_S = metrics.gauge("driveby_tick_lag_seconds", "how far the tick loop is behind its wall-clock schedule")
+TICKS = metrics.counter("driveby_ticks_total", "simulation ticks")
+TICK_OVERRUNS = metrics.counter("driveby_tick_overruns_total", "ticks whose work ran past their period")
+TICK_DROPPED = metrics.counter("driveby_tick_dropped_periods_total",
+                               "tick periods given up after stalls longer than the catch-up limit")
+MATCHES = metrics.counter("driveby_matches_total", "matches committed", ("source",))
+AGENTS = metrics.gauge("driveby_agents", "simulations and leftover agents", ("kind",))
+RETIRED = metrics.counter("driveby_retired_total", "finished sims and agents moved out of the tick", ("kind",))
+
+
+def commit_admission(adm: Admission,
+                     matches_sim_list: list,
+                     driver_agent_list: list,
+                     walker_agent_list: list,
+                     agent_id_to_request_id: dict,
+                     driver_index: Optional[DriverGridIndex],
+                     max_attempts: int = 2) -> Optional[dict]:
+    # returns a process_new_agent style result, or None if the match must be re-evaluated
+    if adm.error is not None:
+        return {"status": "error", "req_id": adm.req_id, "error": adm.error}
+
+    kind, new_agent, req_id = adm.kind, adm.agent, adm.req_id
+    match, partner = adm.match, adm.partner
+
+    if match is not None:
+        driver_agent, walker_agent = (new_agent, partner) if kind == "driver" else (partner, new_agent)
+        # the partner may have been taken, or the driver may have passed the pickup, since evaluation
+        stale = (partner.assigned or partner.done or
+                 driver_agent.idx >= match.pickup_index)
+        if stale:
+            if adm.attempts < max_attempts:
+                return None
+            match = None
+
+    agent_id_to_request_id[new_agent.agent_id] = req_id
+
+    if match is None:
+        if kind == "driver":
+            driver_agent_list.append(new_agent)
+            if driver_index is not None:
+                driver_index.add(new_agent)
+        else:
+            walker_agent_list.append(new_agent)
+        return {"status": "not_matched", "req_id": req_id, "agent_id": new_agent.agent_id}
+
+    driver_agent.assigned = True
+    walker_agent.assigned = True
+    if kind == "driver":
+        walker_agent_list.remove(walker_agent)
+    else:
+        driver_agent_list.remove(driver_agent)
+        if driver_index is not None:
+            driver_index.remove(driver_agent)
+
+    # ETAs in the match are relative to the evaluation time
+    ms = make_match_sim(match, driver_agent, walker_agent, adm.eval_t)
+    matches_sim_list.append(ms)
+    return {
+        "status": "matched",
+        "req_id": req_id,
+        "agent_id": new_agent.agent_id,
+        "match_id": ms.match_id,
+        "partner_req_id": agent_id_to_request_id.get(partner.agent_id),
+        "partner_agent_id": partner.agent_id,
+        "match_sim": ms
+    }
+
+
+def prepare_admission_batch(batch: List[Admission],
+                            agent_id_to_request_id: dict,
+                            now_t: float) -> Tuple[List[dict], List[Admission]]:
+    # a closed batch window: the error results, and the admissions to match
+    errors, new = [], []
+    for adm in batch:
+        if adm.error is not None:
+            errors.append({"status": "error", "req_id": adm.req_id, "error": adm.error})
+            continue
+        agent_id_to_request_id[adm.agent.agent_id] = adm.req_id
+        # the agents did not move while waiting for the batch
+        adm.agent.update_position(now_t)
+        new.append(adm)
+    return errors, new
+
+
+def batch_candidates(new: List[Admission],
+                     driver_agent_list: list,
+                     walker_agent_list: list,
+                     driver_index: Optional[DriverGridIndex],
+                     min_saving_m: float) -> Dict[AgentState, List[MatchCandidate]]:
+    """
+    The cost matrix of a batch: new walkers against all free drivers, waiting
+    walkers against the new drivers. Only reads the leftovers, so it runs on
+    a match worker; assign_batch solves it on the tick thread.
+    """
+    new_drivers = [adm.agent for adm in new if adm.kind == "driver"]
+    cands = {}
+    for adm in new:
+        if adm.kind == "walker":
+            cands[adm.agent] = match_candidates(list(driver_agent_list) + new_drivers, adm.agent,
+                                                min_saving_m, driver_index=driver_index)
+    if new_drivers:
+        for w in list(walker_agent_list):
+            if not w.assigned and not w.done:
+                cands[w] = match_candidates(new_drivers, w, min_saving_m)
+    return cands
+
+
+def commit_admission_batch(new: List[Admission],
+                           matched: List[Tuple[AgentState, MatchCandidate, Optional[Match], float]],
+                           matches_sim_list: list,
+                           driver_agent_list: list,
+                           walker_agent_list: list,
+                           agent_id_to_request_id: dict,
+                           driver_index: Optional[DriverGridIndex]) -> List[dict]:
+    """
+    Commit a batch: matched holds the assigned pairs with their match,
+    finalized at eval_t (None if that failed). A pair whose leftover was
+    taken or whose driver passed the pickup meanwhile is dropped. Returns
+    one commit_admission style result per admission in new.
+    """
+    partner_of = {}
+    for walker_agent, c, match, eval_t in matched:
+        driver_agent = c.driver
+        if match is None:
+            continue
+        if (walker_agent.assigned or walker_agent.done or driver_agent.assigned or driver_agent.done or
+                driver_agent.idx >= match.pickup_index):
+            continue
+        driver_agent.assigned = True
+        walker_agent.assigned = True
+        if driver_agent in driver_agent_list:
+            driver_agent_list.remove(driver_agent)
+            if driver_index is not None:
+                driver_index.remove(driver_agent)
+        if walker_agent in walker_agent_list:
+            walker_agent_list.remove(walker_agent)
+
+        # ETAs in the match are relative to the evaluation time
+        ms = make_match_sim(match, driver_agent, walker_agent, eval_t)
+        matches_sim_list.append(ms)
+        partner_of[driver_agent] = (ms, walker_agent)
+        partner_of[walker_agent] = (ms, driver_agent)
+
+    results = []
+    for adm in new:
+        agent = adm.agent
+        if agent not in partner_of:
+            if adm.kind == "driver":
+                driver_agent_list.append(agent)
+                if driver_index is not None:
+                    driver_index.add(agent)
+            else:
+                walker_agent_list.append(agent)
+            results.append({"status": "not_matched", "req_id": adm.req_id, "agent_id": agent.agent_id})
+            continue
+        ms, partner = partner_of[agent]
+        results.append({
+            "status": "matched",
+            "req_id": adm.req_id,
+            "agent_id": agent.agent_id,
+            "match_id": ms.match_id,
+            "partner_req_id": agent_id_to_request_id.get(partner.agent_id),
+            "partner_agent_id": partner.agent_id,
+            "match_sim": ms
+        })
+    return results
+
+
+def commit_rematch(walker_agent: AgentState,
+                   cand: MatchCandidate,
+                   match: Optional[Match],
+                   matches_sim_list: list,
+                   driver_agent_list: list,
+                   walker_agent_list: list,
+                   agent_id_to_request_id: dict,
+                   driver_index: Optional[DriverGridIndex],
+                   eval_t: float) -> Optional[dict]:
+    # a pair of leftovers from IncrementalMatcher.step(), finalized at eval_t
+    # (None if that failed); None if it does not hold any more
+    driver_agent = cand.driver
+    if match is None:
+        return None
+    # an admission may have taken either side, or the driver passed the pickup, since evaluation
+    if (walker_agent.assigned or walker_agent.done or driver_agent.assigned or driver_agent.done or
+            driver_agent.idx >= match.pickup_index):
+        return None
+
+    driver_agent.assigned = True
+    walker_agent.assigned = True
+    driver_agent_list.remove(driver_agent)
+    walker_agent_list.remove(walker_agent)
+    if driver_index is not None:
+        driver_index.remove(driver_agent)
+
+    # ETAs in the match are relative to the evaluation time
+    ms = make_match_sim(match, driver_agent, walker_agent, eval_t)
+    matches_sim_list.append(ms)
+
+    # reported to the walker's request, the driver's is the partner
+    w_rid = agent_id_to_request_id.get(walker_agent.agent_id)
+    d_rid = agent_id_to_request_id.get(driver_agent.agent_id)
+    agent, partner, rid, partner_rid = walker_agent, driver_agent, w_rid, d_rid
+    if w_rid is None:
+        agent, partner, rid, partner_rid = driver_agent, walker_agent, d_rid, None
+    return {
+        "status": "matched",
+        "req_id": rid,
+        "agent_id": agent.agent_id,
+        "match_id": ms.match_id,
+        "partner_req_id": partner_rid,
+        "partner_agent_id": partner.agent_id,
+        "match_sim": ms
+    }
+
+
+def publish_admission(app: web.Application, loop: asyncio.AbstractEventLoop, res: dict, t: float) -> None:
+    if res["status"] == "error":
+        asyncio.run_coroutine_threadsafe(
+            send_status(app, res["req_id"], "error", error=res["error"]),
+            loop
+        )
+
+    elif res["status"] == "not_matched":
+        asyncio.run_coroutine_threadsafe(
+            send_status(app,
+                        res["req_id"],
+                        "not_matched",
+                        agent_id=res["agent_id"]),
+            loop
+        )
+
+    elif res["status"] == "matched":
+        ms = res["match_sim"]
+
+        asyncio.run_coroutine_threadsafe(
+            send_status(app, res["req_id"],
+                        "matched",
+                        match_id=res["match_id"],
+                        agent_id=res["agent_id"]),
+            loop
+        )
+
+        if res["partner_req_id"] is not None:
+            asyncio.run_coroutine_threadsafe(
+                send_status(app,
+                            res["partner_req_id"],
+                            "matched",
+                            match_id=res["match_id"],
+                            agent_id=res["partner_agent_id"]),
+                loop
+            )
+
+        routes_for_this_match = build_routes_payload([ms], version=t, stream=app.get("route_stream"))
+        event = {"type": "routes", "data": routes_for_this_match}
+        app["last_routes_by_req"][res["req_id"]] = routes_for_this_match
+        asyncio.run_coroutine_threadsafe(
+            publish_by_id(app, res["req_id"], event),
+            loop
+        )
+        if res["partner_req_id"] is not None:
+            app["last_routes_by_req"][res["partner_req_id"]] = routes_for_this_match
+            asyncio.run_coroutine_threadsafe(
+                publish_by_id(app, res["partner_req_id"], event),
+                loop
+            )
+
+
+async def finish_request(app: web.Application, req_id: str, r: Retired) -> None:
+    # the request's last event; its subscribers are dropped once it is delivered
+    app["req_stream"].forget(req_id)
+    await send_done(app, req_id, kind=r.kind, record=r.record)
+
+
+def record_result(store: Optional[StateStore], res: Optional[dict], kind: str, agent: Optional[AgentState],
+                  agent_id_to_request_id: dict) -> None:
+    # mirrors a process_new_agent / commit_* result into the state store
+    if store is None or res is None:
+        return
+    if res["status"] == "matched":
+        ms = res["match_sim"]
+        store.put_sim(ms, agent_id_to_request_id.get(ms.driver_agent.agent_id),
+                      agent_id_to_request_id.get(ms.walker_agent.agent_id))
+    elif res["status"] == "not_matched":
+        store.put_agent(kind, agent, res["req_id"])
+
+
+def fleet_agents(sims: list, driver_agents: list, walker_agents: list) -> List[AgentState]:
+    # everything the tick moves; a simulation's walk legs are moved even outside
+    # their phase, MatchSimulation.update only reads them while they are active
+    agents = driver_agents + walker_agents
+    for sim in sims:
+        agents.append(sim.driver_agent)
+        agents.append(sim.walk_to_pickup_agent)
+        agents.append(sim.walk_from_dropoff_agent)
+    return agents
+
+
+class SimLoop:
+    """
+    The simulation tick, shared by start_simulation and headless.run_headless.
+
+    tick(t, reqs, publish) hands the new create requests to the admission
+    pipeline and commits what it finished (one by one, or every
+    batch_window_s in one assignment), moves the fleet, commits the
+    rematches of leftovers, updates the sim phases, retires what finished,
+    records the changes in the store and, on a publishing tick, builds the
+    positions snapshot. Whatever leaves the process goes through the hooks,
+    so the server talks to its WebSocket clients where headless only counts:
+
+      on_result(res, t)   an admission or rematch result of a request
+      on_retired(r)       a lifecycle.Retired sim or agent
+      on_routes(t)        the set of active routes changed
+      on_positions(data)  the snapshot of a publishing tick
+
+    clock() measures the batch window; stage_s has the duration of every
+    stage of the last tick.
+    """
+
+    STAGES = ("admit", "move", "rematch", "sims", "retire", "snapshot", "publish", "routes")
+
+    def __init__(self,
+                 sims: list,
+                 driver_agents: list,
+                 walker_agents: list,
+                 agent_id_to_request_id: dict,
+                 t: float = 0.0,
+                 min_saving_m: float = 800.0,
+                 rematch_every_s: float = 60.0,
+                 batch_window_s: float = 0.0,
+                 route_workers: int = 8,
+                 match_workers: int = 4,
+                 route_fn: Callable[[Dict[str, Any], float], Tuple[str, AgentState, str]] = handle_req,
+                 lifecycle: Optional[Lifecycle] = None,
+                 store: Optional[StateStore] = None,
+                 last_routes_by_req: Optional[dict] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 on_result: Optional[Callable[[dict, float], None]] = None,
+                 on_retired: Optional[Callable[[Retired], None]] = None,
+                 on_routes: Optional[Callable[[float], None]] = None,
+                 on_positions: Optional[Callable[[dict], None]] = None):
+        self.sims = sims
+        self.driver_agents = driver_agents
+        self.walker_agents = walker_agents
+        self.agent_id_to_request_id = agent_id_to_request_id
+        self.min_saving_m = min_saving_m
+        self.batch_window_s = batch_window_s
+        self.lifecycle = lifecycle if lifecycle is not None else Lifecycle(keep_s=DONE_KEEP_S)
+        self.store = store
+        self.last_routes_by_req = last_routes_by_req if last_routes_by_req is not None else {}
+        self.clock = clock
+        self.on_result = on_result or (lambda res, t: None)
+        self.on_retired = on_retired or (lambda r: None)
+        self.on_routes = on_routes or (lambda t: None)
+        self.on_positions = on_positions or (lambda data: None)
+
+        # spatial index over the remaining route of every unassigned driver
+        self.driver_index = DriverGridIndex()
+        for a in driver_agents:
+            self.driver_index.add(a)
+
+        # leftovers are matched again later, as they move along their routes
+        self.rematcher = IncrementalMatcher(
+            score_fn=lambda walker, drivers: match_candidates(drivers, walker, min_saving_m),
+            weight_fn=batch_weight,
+            driver_index=self.driver_index,
+            radius_m=MATCH_RADIUS_M,
+            rescore_every_s=rematch_every_s,
+            submit=lambda fn, *args: self.admission.offload(fn, *args),
+        )
+        for a in driver_agents:
+            self.rematcher.add("driver", a, t)
+        for a in walker_agents:
+            self.rematcher.add("walker", a, t)
+        # rematch pairs finalizing on a match worker: (future, walker, candidate)
+        self.finalizing: List[Tuple[Any, AgentState, MatchCandidate]] = []
+
+        self.admission = AdmissionPipeline(
+            route_fn=route_fn,
+            match_fn=self._propose,
+            route_workers=route_workers,
+            match_workers=match_workers,
+        )
+        self.fleet = FleetPositionEngine()
+
+        # admissions collected for the current batch window
+        self.pending: List[Admission] = []
+        self.pending_since = 0.0
+        # the closed window on its way through the match workers: its admissions,
+        # the cost matrix (batch_candidates), then the assigned pairs finalizing
+        self.batch: List[Admission] = []
+        self.batch_cost: Optional[Any] = None
+        self.batch_final: List[Tuple[Any, AgentState, MatchCandidate]] = []
+
+        self.matches = {"admission": 0, "batch": 0, "rematch": 0}
+        self.stage_s = dict.fromkeys(self.STAGES, 0.0)
+
+    def _propose(self, kind: str, agent: AgentState, now: float):
+        if self.batch_window_s > 0:
+            return None, None  # matched in batches by _admit_batch
+        return propose_match(kind, agent, self.driver_agents, self.walker_agents, self.driver_index,
+                             self.min_saving_m)
+
+    def tick(self, t: float, reqs: List[Dict[str, Any]], publish: bool = True) -> Optional[dict]:
+        # returns the positions snapshot on a publishing tick
+        clock = time.perf_counter
+        stage = self.stage_s
+        tick_t0 = a = clock()
+
+        # new create requests go to the admission workers (route fetch + match
+        # evaluation run off this thread), whatever finished since is committed here
+        self.admission.now = t
+        for req in reqs:
+            self.admission.submit(req)
+        if self.batch_window_s > 0:
+            routes_changed = self._admit_batch(t)
+        else:
+            routes_changed = self._admit(t)
+        b = clock()
+        stage["admit"] = b - a
+
+        # move every agent (leftovers and the agents of all simulations) in one
+        # vectorized pass, then derive the simulation phases from those positions
+        self.fleet.update(fleet_agents(self.sims, self.driver_agents, self.walker_agents), t)
+        for d in self.driver_agents:
+            self.driver_index.advance(d)
+        a = clock()
+        stage["move"] = a - b
+
+        routes_changed |= self._rematch(t)
+        b = clock()
+        stage["rematch"] = b - a
+
+        for sim in self.sims:
+            sim.update(t, positions_ready=True)
+        a = clock()
+        stage["sims"] = a - b
+
+        # finished rides and agents leave the tick, the store and the per-request state
+        routes_changed |= self._retire(t)
+        if self.store is not None:
+            self.store.tick(t)
+        b = clock()
+        stage["retire"] = b - a
+
+        data = None
+        if publish:
+            data = build_snapshot_payload(
+                t_s=t,
+                sims=self.sims,
+                driver_agents=self.driver_agents,
+                walker_agents=self.walker_agents,
+                agent_id_to_request_id=self.agent_id_to_request_id,
+                include_agent_id=True
+            )
+        a = clock()
+        stage["snapshot"] = a - b
+        if data is not None:
+            self.on_positions(data)
+        b = clock()
+        stage["publish"] = b - a
+
+        # if routes changed, send the new and changed ones
+        if routes_changed:
+            self.on_routes(t)
+        a = clock()
+        stage["routes"] = a - b
+
+        TICK_S.observe(a - tick_t0)
+        TICKS.inc()
+        AGENTS.labels("sims").set(len(self.sims))
+        AGENTS.labels("leftover_drivers").set(len(self.driver_agents))
+        AGENTS.labels("leftover_walkers").set(len(self.walker_agents))
+        return data
+
+    def _report(self, res: dict, kind: str, agent: AgentState, t: float) -> None:
+        record_result(self.store, res, kind, agent, self.agent_id_to_request_id)
+        # agents without a request (the initial demo fleet) have nobody to tell
+        if res["req_id"] is not None:
+            self.on_result(res, t)
+
+    def _admit(self, t: float) -> bool:
+        changed = False
+        for adm in self.admission.drain_ready():
+            res = commit_admission(
+                adm,
+                matches_sim_list=self.sims,
+                driver_agent_list=self.driver_agents,
+                walker_agent_list=self.walker_agents,
+                agent_id_to_request_id=self.agent_id_to_request_id,
+                driver_index=self.driver_index
+            )
+            if res is None:
+                self.admission.retry(adm)
+                continue
+            self._report(res, adm.kind, adm.agent, t)
+            if res["status"] == "not_matched":
+                self.rematcher.add(adm.kind, adm.agent, t)
+            elif res["status"] == "matched":
+                self.matches["admission"] += 1
+                MATCHES.labels("admission").inc()
+            changed = True
+        return changed
+
+    def _admit_batch(self, t: float) -> bool:
+        ready = self.admission.drain_ready()
+        if ready and not self.pending:
+            self.pending_since = self.clock()
+        self.pending.extend(ready)
+        changed = self._advance_batch(t)
+
+        # one batch at a time: the next window closes once the last one is committed
+        if self.batch or not self.pending or self.clock() - self.pending_since < self.batch_window_s:
+            return changed
+        pending, self.pending = self.pending, []
+        errors, self.batch = prepare_admission_batch(pending, self.agent_id_to_request_id, t)
+        for res in errors:
+            self.on_result(res, t)
+        if self.batch:
+            self.batch_cost = self.admission.offload(batch_candidates, self.batch, self.driver_agents,
+                                                     self.walker_agents, self.driver_index, self.min_saving_m)
+            changed |= self._advance_batch(t)
+        return changed
+
+    def _advance_batch(self, t: float) -> bool:
+        # the costing and finalizing (the OSRM requests) run on the match workers,
+        # the assignment and the commit here
+        if not self.batch:
+            return False
+        # waiting agents move like the leftovers they are about to become
+        for adm in self.batch:
+            adm.agent.update_position(t)
+        if self.batch_cost is not None:
+            if not self.batch_cost.done():
+                return False
+            cands = {}
+            if not self.batch_cost.cancelled() and self.batch_cost.exception() is None:
+                cands = self.batch_cost.result()
+            else:
+                print("batch costing failed:", None if self.batch_cost.cancelled() else self.batch_cost.exception())
+            self.batch_cost = None
+            for walker_agent, c in assign_batch(cands):
+                self.batch_final.append((self.admission.offload(self._finalize, walker_agent, c), walker_agent, c))
+        if not all(fut.done() for fut, _, _ in self.batch_final):
+            return False
+
+        matched = []
+        for fut, walker_agent, c in self.batch_final:
+            if fut.cancelled() or fut.exception() is not None:
+                # the pair is dropped, its new agents become leftovers
+                print("batch finalize failed:", None if fut.cancelled() else fut.exception())
+                continue
+            eval_t, match = fut.result()
+            matched.append((walker_agent, c, match, eval_t))
+        batch, self.batch, self.batch_final = self.batch, [], []
+        n_sims = len(self.sims)
+        for adm, res in zip(batch, commit_admission_batch(
+                batch,
+                matched,
+                matches_sim_list=self.sims,
+                driver_agent_list=self.driver_agents,
+                walker_agent_list=self.walker_agents,
+                agent_id_to_request_id=self.agent_id_to_request_id,
+                driver_index=self.driver_index)):
+            self._report(res, adm.kind, adm.agent, t)
+        # waiting walkers matched to a new driver are reported as the driver's partner
+        n = len(self.sims) - n_sims
+        self.matches["batch"] += n
+        MATCHES.labels("batch").inc(n)
+        for adm in batch:
+            if not adm.agent.assigned:
+                self.rematcher.add(adm.kind, adm.agent, t)
+        return True
+
+    def _finalize(self, walker_agent: AgentState, cand: MatchCandidate) -> Tuple[float, Match]:
+        # on a match worker, like the admission match stage
+        eval_t = self.admission.now
+        return eval_t, finalize_match(cand.driver, walker_agent, cand.light)
+
+    def _rematch(self, t: float) -> bool:
+        # scoring and finalizing (the OSRM requests) run on the match workers,
+        # the pairs are committed here once their match is ready
+        for walker_agent, cand in self.rematcher.step(t):
+            self.finalizing.append((self.admission.offload(self._finalize, walker_agent, cand), walker_agent, cand))
+
+        changed = False
+        running = []
+        for fut, walker_agent, cand in self.finalizing:
+            if not fut.done():
+                running.append((fut, walker_agent, cand))
+                continue
+            match, eval_t = None, t
+            if not fut.cancelled():
+                if fut.exception() is not None:
+                    # the agents are scored again when they are next due
+                    print("rematch finalize failed:", fut.exception())
+                else:
+                    eval_t, match = fut.result()
+            res = commit_rematch(walker_agent, cand, match, self.sims, self.driver_agents, self.walker_agents,
+                                 self.agent_id_to_request_id, self.driver_index, eval_t)
+            if res is None:
+                # back to the leftovers, unless something else took them meanwhile
+                for kind, a in (("walker", walker_agent), ("driver", cand.driver)):
+                    if not a.assigned and not a.done:
+                        self.rematcher.add(kind, a, t)
+                continue
+            self._report(res, "walker", walker_agent, t)
+            self.matches["rematch"] += 1
+            MATCHES.labels("rematch").inc()
+            changed = True
+        self.finalizing = running
+        return changed
+
+    def _retire(self, t: float) -> bool:
+        changed = False
+        for r in self.lifecycle.retire(t, self.sims, self.driver_agents, self.walker_agents,
+                                       self.agent_id_to_request_id, self.last_routes_by_req):
+            if r.sim is not None:
+                if self.store is not None:
+                    self.store.drop_sim(r.sim.match_id)
+                changed = True
+            else:
+                if self.store is not None:
+                    self.store.drop_agent(r.agent.agent_id)
+                self.rematcher.remove(r.agent)
+                self.driver_index.remove(r.agent)
+            self.on_retired(r)
+            RETIRED.labels(r.kind).inc()
+        return changed
+
+    def close(self) -> None:
+        self.admission.close()
+
+
+def start_simulation(app: web.Application, loop: asyncio.AbstractEventLoop):
+    def run():
+        start_pt = (51.2562, 7.1508)
+        end_pt = (51.2277, 6.7735)
+        walker_start = (51.202561, 6.780486)
+        walker_end = (51.219105, 6.787711)
+
+        min_saving_m = 800.0
+        agent_id_to_request_id: dict[str, str] = {}
+
+        # everything still active at the last shutdown, or a fresh start
+        store: Optional[StateStore] = app.get("state_store")
+        restored = store.load() if store is not None else None
+        if restored is not None:
+            t, matches_sim_list, driver_agent_list, walker_agent_list, agent_id_to_request_id = restore_state(
+                restored, load_walk=lambda a, b: route_cached(a[0], a[1], b[0], b[1], "walking"))
+            print(f"restored {len(matches_sim_list)} sims, {len(driver_agent_list)} drivers and "
+                  f"{len(walker_agent_list)} walkers at t={t:.0f}")
+        else:
+            t = 0.0
+            walker_agent_list = create_walkers(walker_start, walker_end, 300, 0)
+            driver_agent_list = create_drivers(start_pt, end_pt, radius_m=1000, count=0)
+
+            matches_sim_list, driver_agent_list, walker_agent_list = create_matches(
+                driver_agent_list, walker_agent_list, now_t=0.0, min_saving_m=min_saving_m
+            )
+            if store is not None:
+                for ms in matches_sim_list:
+                    store.put_sim(ms)
+                for a in driver_agent_list:
+                    store.put_agent("driver", a)
+                for a in walker_agent_list:
+                    store.put_agent("walker", a)
+
+        if matches_sim_list is None:
+            print("no match")
+            raise SystemExit(0)
+
+        def publish_positions(data: dict) -> None:
+            # data : dict with t_s, sims, leftover_drivers, leftover_walkers
+            app["last_positions"] = data
+            asyncio.run_coroutine_threadsafe(publish(app, {"type": "positions", "data": data}), loop)
+            asyncio.run_coroutine_threadsafe(dispatch_frames_by_req_id(app, data), loop)
+
+        def finish(r: Retired) -> None:
+            for rid in r.req_ids:
+                asyncio.run_coroutine_threadsafe(finish_request(app, rid, r), loop)
+
+        archive_path = app.get("archive_path")
+        sim_loop = SimLoop(
+            matches_sim_list, driver_agent_list, walker_agent_list, agent_id_to_request_id,
+            t=t,
+            min_saving_m=min_saving_m,
+            rematch_every_s=app.get("rematch_every_s", 60.0),
+            # > 0: admissions are collected for this many seconds and matched together
+            batch_window_s=app.get("match_batch_window_s", 0.0),
+            route_workers=app.get("admission_route_workers", 8),
+            match_workers=app.get("admission_match_workers", 4),
+            lifecycle=Lifecycle(keep_s=DONE_KEEP_S, tail=app.get("archive_tail", 1000),
+                                sink=ArchiveSink(archive_path) if archive_path else None),
+            store=store,
+            last_routes_by_req=app["last_routes_by_req"],
+            on_result=lambda res, t: publish_admission(app, loop, res, t),
+            on_retired=finish,
+            on_routes=lambda t: publish_routes(app, loop, matches_sim_list, version=t),
+            on_positions=publish_positions,
+        )
+        app["admission"] = sim_loop.admission
+        app["lifecycle"] = sim_loop.lifecycle
+
+        app["route_stream"] = RouteStream()
+        publish_routes(app, loop, matches_sim_list, version=t)
+        # what a restored request gets when it subscribes again
+        for ms in matches_sim_list:
+            rids = [agent_id_to_request_id.get(a.agent_id) for a in (ms.walker_agent, ms.driver_agent)]
+            if any(rids):
+                routes_for_this_match = build_routes_payload([ms], version=t, stream=app["route_stream"])
+                for rid in rids:
+                    if rid is not None:
+                        app["last_routes_by_req"][rid] = routes_for_this_match
+
+        # Initial snapshot (force sim update at the start time)
+        for sim in matches_sim_list:
+            sim.update(t)
+
+        data0 = build_snapshot_payload(
+            t_s=t,
+            sims=matches_sim_list,
+            driver_agents=driver_agent_list,
+            walker_agents=walker_agent_list,
+            agent_id_to_request_id=agent_id_to_request_id,
+            include_agent_id=True
+        )
+
+        app["last_positions"] = data0
+        asyncio.run_coroutine_threadsafe(
+            publish(app, {"type": "positions", "data": data0}),
+            loop
+        )
+
+        #webbrowser.open("http://127.0.0.1:8000/web/map.html?v=" + str(time.time()))
+
+        # positions are computed at tick_hz and sent to clients at publish_hz
+        sched = TickScheduler(rate_hz=app.get("tick_hz", 20.0),
+                              publish_hz=app.get("publish_hz", 10.0),
+                              max_catch_up=app.get("tick_max_catch_up", 5))
+        app["tick_scheduler"] = sched
+        sched.start()
+
+        while True:
+            sim_loop.tick(t, drain_create_queue(app["create_q"]), publish=sched.publish_due())
+
+            # sleep out the rest of the period; after an overrun advance by every
+            # period that went by, so simulated time follows app["speed"]
+            overruns, dropped = sched.overruns, sched.dropped
+            periods = sched.wait()
+            TICK_OVERRUNS.inc(sched.overruns - overruns)
+            TICK_DROPPED.inc(sched.dropped - dropped)
+            TICK_LAG_S.set(sched.lag_s)
+            t += app["speed"] * periods * sched.period_s / TICK_INTERVAL_S
+
+    threading.Thread(target=run, daemon=True).start()
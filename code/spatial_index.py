@@ -0,0 +1,148 @@
+import math
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Set, Tuple
+
+from AgentState import AgentState
+from RouteBase import LatLon
+
+Cell = Tuple[int, int]
+
+M_PER_DEG_LAT = 111320.0
+
+
+class DriverGridIndex:
+    """
+    Uniform lat/lon grid over the *remaining* segments of unassigned drivers.
+
+    Every driver keeps a FIFO of (last_segment_index, cell) runs in route order.
+    When the driver advances (AgentState.idx grows) the runs behind it are
+    popped and the per-cell counters are decremented, so a query only returns
+    drivers that still have route ahead of them inside the searched cells.
+    Safe to query from admission workers while the tick thread advances it.
+    """
+
+    def __init__(self, cell_m: float = 500.0, ref_lat: float = 51.2):
+        self.cell_m = cell_m
+        self.cell_lat = cell_m / M_PER_DEG_LAT
+        self.cell_lon = cell_m / (M_PER_DEG_LAT * math.cos(math.radians(ref_lat)))
+
+        # cell -> {agent_id: number of runs of that agent in the cell}
+        self._cells: Dict[Cell, Dict[str, int]] = {}
+        self._runs: Dict[str, Deque[Tuple[int, Cell]]] = {}
+        self._agents: Dict[str, AgentState] = {}
+        self._seq: Dict[str, int] = {}
+        self._next_seq = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._agents)
+
+    def __contains__(self, agent: AgentState) -> bool:
+        return agent.agent_id in self._agents
+
+    def cell_of(self, p: LatLon) -> Cell:
+        return int(math.floor(p[0] / self.cell_lat)), int(math.floor(p[1] / self.cell_lon))
+
+    def _segment_cells(self, a: LatLon, b: LatLon) -> List[Cell]:
+        # sample the segment at half a cell so no crossed cell is skipped
+        steps = max(abs(b[0] - a[0]) / self.cell_lat, abs(b[1] - a[1]) / self.cell_lon)
+        n = int(math.ceil(steps * 2.0))
+        cells: List[Cell] = []
+        for s in range(n + 1):
+            f = s / n if n else 0.0
+            c = self.cell_of((a[0] + f * (b[0] - a[0]), a[1] + f * (b[1] - a[1])))
+            if not cells or cells[-1] != c:
+                cells.append(c)
+        return cells
+
+    def add(self, agent: AgentState) -> None:
+        pts = agent.route.geometry_latlon
+        runs: Deque[Tuple[int, Cell]] = deque()
+        for i in range(max(agent.idx, 0), len(pts) - 1):
+            for c in self._segment_cells(pts[i], pts[i + 1]):
+                if runs and runs[-1][1] == c:
+                    runs[-1] = (i, c)
+                else:
+                    runs.append((i, c))
+        if len(pts) == 1:
+            runs.append((0, self.cell_of(pts[0])))
+
+        with self._lock:
+            if agent.agent_id in self._agents:
+                self.remove(agent)
+
+            for _, c in runs:
+                bucket = self._cells.setdefault(c, {})
+                bucket[agent.agent_id] = bucket.get(agent.agent_id, 0) + 1
+
+            self._runs[agent.agent_id] = runs
+            self._agents[agent.agent_id] = agent
+            self._seq[agent.agent_id] = self._next_seq
+            self._next_seq += 1
+
+    def _drop_run(self, agent_id: str, c: Cell) -> None:
+        bucket = self._cells.get(c)
+        if bucket is None:
+            return
+        n = bucket.get(agent_id, 0) - 1
+        if n > 0:
+            bucket[agent_id] = n
+        else:
+            bucket.pop(agent_id, None)
+            if not bucket:
+                del self._cells[c]
+
+    def remove(self, agent: AgentState) -> None:
+        with self._lock:
+            runs = self._runs.pop(agent.agent_id, None)
+            if runs is None:
+                return
+            for _, c in runs:
+                self._drop_run(agent.agent_id, c)
+            self._agents.pop(agent.agent_id, None)
+            self._seq.pop(agent.agent_id, None)
+
+    def advance(self, agent: AgentState) -> None:
+        # call after update_position(); forgets the segments the driver has passed
+        with self._lock:
+            if agent.done or agent.assigned:
+                self.remove(agent)
+                return
+            runs = self._runs.get(agent.agent_id)
+            if runs is None:
+                return
+            while runs and runs[0][0] < agent.idx:
+                _, c = runs.popleft()
+                self._drop_run(agent.agent_id, c)
+
+    def route_cells(self, agent: AgentState) -> List[Cell]:
+        # cells the driver's remaining route passes through, in route order
+        with self._lock:
+            return [c for _, c in self._runs.get(agent.agent_id, ())]
+
+    def query(self, p: LatLon, radius_m: float) -> Set[str]:
+        dlat = radius_m / M_PER_DEG_LAT
+        dlon = radius_m / (M_PER_DEG_LAT * max(math.cos(math.radians(p[0])), 1e-6))
+        lo = self.cell_of((p[0] - dlat, p[1] - dlon))
+        hi = self.cell_of((p[0] + dlat, p[1] + dlon))
+
+        ids: Set[str] = set()
+        with self._lock:
+            for ci in range(lo[0], hi[0] + 1):
+                for cj in range(lo[1], hi[1] + 1):
+                    bucket = self._cells.get((ci, cj))
+                    if bucket:
+                        ids.update(bucket)
+        return ids
+
+    def candidates(self, walker_pos: LatLon, walker_dest: LatLon, radius_m: float) -> List[AgentState]:
+        # drivers whose remaining route passes near both the walker and its destination
+        with self._lock:
+            ids = self.query(walker_pos, radius_m)
+            if ids:
+                ids &= self.query(walker_dest, radius_m)
+            out = [self._agents[i] for i in ids]
+            out = [a for a in out if not a.assigned and not a.done]
+            out.sort(key=lambda a: self._seq[a.agent_id])
+            return out
@@ -0,0 +1,353 @@
+import sqlite3
+import threading
+import time
+import zlib
+from collections import deque
+from dataclasses import fields
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from AgentState import AgentState
+from Match import Match
+from MatchSimulation import MatchSimulation
+from RouteBase import CompactRoute, LatLon, LazyRoute, RouteBase
+from route_cache import decode, encode_route
+from wire import dumps, loads
+
+# Match fields that hold routes, stored by route id; everything else is a plain value
+MATCH_ROUTES = ("driver", "walker", "walk_route_to_pickup", "walk_route_from_dropoff")
+MATCH_VALUES = tuple(f.name for f in fields(Match) if f.name not in MATCH_ROUTES)
+
+
+def route_id(route) -> str:
+    # routes are immutable and OSRM answers the same endpoints with the same route,
+    # so the endpoints, length and point count identify one across restarts
+    if isinstance(route, LazyRoute) and not route.loaded:
+        return f"L|{route.profile}|{route.start[0]!r},{route.start[1]!r}|{route.dest[0]!r},{route.dest[1]!r}"
+    return (f"R|{route.profile}|{route.start[0]!r},{route.start[1]!r}|{route.dest[0]!r},{route.dest[1]!r}|"
+            f"{route.dist!r}|{len(route.geometry_latlon)}")
+
+
+def _encode_route(route) -> Tuple[str, bytes]:
+    if isinstance(route, LazyRoute) and not route.loaded:
+        # distance and duration only, the geometry is fetched again if something reads it
+        return "lazy", dumps({"start": route.start, "dest": route.dest, "dist": route.dist,
+                              "duration": route.duration, "profile": route.profile})
+    if not isinstance(route, CompactRoute):
+        route = CompactRoute(start=route.start, dest=route.dest, dist=route.dist, duration=route.duration,
+                             duration_list=route.duration_list, cum_time_s=route.cum_time_s,
+                             geometry_latlon=route.geometry_latlon, seg_dist_m=route.seg_dist_m,
+                             cum_dist_m=route.cum_dist_m, profile=route.profile, nodes=route.nodes)
+    return "route", encode_route(route)
+
+
+def _plain(v: Any) -> Any:
+    # numpy scalars (from the route index) as Python numbers, points as lists
+    if isinstance(v, (tuple, list)):
+        return [_plain(x) for x in v]
+    return v.item() if hasattr(v, "item") else v
+
+
+def _agent_record(agent: AgentState, routes: Dict[str, Any], req_id: Optional[str] = None) -> Dict[str, Any]:
+    rid = route_id(agent.route)
+    routes[rid] = agent.route
+    rec = {"id": agent.agent_id, "route": rid, "offset": agent.start_offset_s, "scale": agent.time_scale}
+    if req_id is not None:
+        rec["req"] = req_id
+    return rec
+
+
+def _sim_record(sim: MatchSimulation, routes: Dict[str, Any],
+                driver_req: Optional[str], walker_req: Optional[str]) -> Dict[str, Any]:
+    match = sim.match
+    m = {name: _plain(getattr(match, name)) for name in MATCH_VALUES}
+    for name in MATCH_ROUTES:
+        route = getattr(match, name)
+        m[name] = route_id(route)
+        routes[m[name]] = route
+    return {"id": sim.match_id, "created": sim.creation_time_s, "match": m,
+            "driver": _agent_record(sim.driver_agent, routes, driver_req),
+            "walker": _agent_record(sim.walker_agent, routes, walker_req),
+            "walk_to": _agent_record(sim.walk_to_pickup_agent, routes),
+            "walk_from": _agent_record(sim.walk_from_dropoff_agent, routes)}
+
+
+def _empty() -> Dict[str, Any]:
+    return {"t": 0.0, "agents": {}, "sims": {}}
+
+
+def _apply(state: Dict[str, Any], op: str, key: str, value: Any) -> None:
+    if op == "agent":
+        state["agents"][key] = value
+    elif op == "agent-":
+        state["agents"].pop(key, None)
+    elif op == "sim":
+        state["sims"][key] = value
+        # a match takes its agents out of the leftovers
+        state["agents"].pop(value["driver"]["id"], None)
+        state["agents"].pop(value["walker"]["id"], None)
+    elif op == "sim-":
+        state["sims"].pop(key, None)
+    elif op == "clock":
+        state["t"] = value
+    else:
+        raise ValueError(f"unknown state op {op!r}")
+
+
+def _referenced(state: Dict[str, Any]) -> set:
+    rids = {a["route"] for a in state["agents"].values()}
+    for s in state["sims"].values():
+        rids.update(s["match"][name] for name in MATCH_ROUTES)
+        rids.update(s[k]["route"] for k in ("driver", "walker", "walk_to", "walk_from"))
+    return rids
+
+
+class StateStore:
+    """
+    Durable agents, matches and request ids in a local sqlite file, so a
+    restart picks up every active ride.
+
+    The tick thread only appends changes to a queue (put_agent, put_sim,
+    drop_agent, drop_sim, tick); nothing on it serializes or touches the
+    file. A writer thread drains the queue every flush_every_s, applies the
+    changes to its own copy of the state and appends them to an append-only
+    log in one transaction. Routes are written once, by route_id. Every
+    snapshot_every_s the state is written as one compressed snapshot and
+    the log up to it, and the routes nothing refers to any more, are
+    deleted; load() is the latest snapshot plus the log after it.
+
+    Positions are not stored: they follow from the routes, the agents'
+    start offsets and the clock, which restore_state() resumes from.
+    """
+
+    def __init__(self, path: str, flush_every_s: float = 0.5, snapshot_every_s: float = 60.0):
+        self.path = path
+        self.flush_every_s = flush_every_s
+        self.snapshot_every_s = snapshot_every_s
+
+        self.records = 0
+        self.batches = 0
+        self.snapshots = 0
+        self.log_rows = 0  # since the last snapshot
+        self.last_flush_ms = 0.0
+
+        self._q: Deque[Tuple[str, str, Any]] = deque()
+        self._t: Optional[float] = None
+        self._state = _empty()
+        self._have_routes: set = set()
+        self._last_snapshot = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self._conn = sqlite3.connect(path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS log ("
+                           " seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL, key TEXT NOT NULL, value BLOB)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS snapshots ("
+                           " seq INTEGER PRIMARY KEY, t REAL NOT NULL, value BLOB NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS routes ("
+                           " id TEXT PRIMARY KEY, kind TEXT NOT NULL, value BLOB NOT NULL)")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # tick thread
+
+    def put_agent(self, kind: str, agent: AgentState, req_id: Optional[str] = None) -> None:
+        # a leftover driver or walker
+        self._q.append(("agent", agent.agent_id, (kind, agent, req_id)))
+
+    def drop_agent(self, agent_id: str) -> None:
+        self._q.append(("agent-", agent_id, None))
+
+    def put_sim(self, sim: MatchSimulation, driver_req: Optional[str] = None, walker_req: Optional[str] = None) -> None:
+        self._q.append(("sim", sim.match_id, (sim, driver_req, walker_req)))
+
+    def drop_sim(self, match_id: str) -> None:
+        self._q.append(("sim-", match_id, None))
+
+    def tick(self, t: float) -> None:
+        self._t = t
+
+    # writer thread
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_every_s):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print("state store write failed:", e)
+
+    def flush(self) -> None:
+        with self._lock:
+            t0 = time.perf_counter()
+            rows = []
+            routes: Dict[str, Any] = {}
+            q = self._q
+            while q:
+                op, key, obj = q.popleft()
+                if op == "agent":
+                    value = _agent_record(obj[1], routes, obj[2])
+                    value["kind"] = obj[0]
+                elif op == "sim":
+                    value = _sim_record(obj[0], routes, obj[1], obj[2])
+                else:
+                    value = None
+                _apply(self._state, op, key, value)
+                rows.append((op, key, None if value is None else dumps(value)))
+            t = self._t
+            if t is not None and t != self._state["t"]:
+                _apply(self._state, "clock", "", t)
+                rows.append(("clock", "", dumps(t)))
+
+            new_routes = [(rid, *_encode_route(r)) for rid, r in routes.items() if rid not in self._have_routes]
+            if rows:
+                conn = self._conn
+                conn.execute("BEGIN")
+                try:
+                    conn.executemany("INSERT OR IGNORE INTO routes(id, kind, value) VALUES (?, ?, ?)", new_routes)
+                    conn.executemany("INSERT INTO log(op, key, value) VALUES (?, ?, ?)", rows)
+                    conn.execute("COMMIT")
+                except sqlite3.Error:
+                    conn.execute("ROLLBACK")
+                    raise
+                self._have_routes.update(rid for rid, _, _ in new_routes)
+                self.records += len(rows)
+                self.log_rows += len(rows)
+                self.batches += 1
+
+            if self.log_rows and time.monotonic() - self._last_snapshot >= self.snapshot_every_s:
+                self._snapshot()
+            self.last_flush_ms = (time.perf_counter() - t0) * 1e3
+
+    def snapshot(self) -> None:
+        # flush, then compact right away
+        self.flush()
+        with self._lock:
+            self._snapshot()
+
+    def _snapshot(self) -> None:
+        conn = self._conn
+        blob = zlib.compress(dumps(self._state), 1)
+        live = _referenced(self._state)
+        conn.execute("BEGIN")
+        try:
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM log").fetchone()[0]
+            conn.execute("INSERT OR REPLACE INTO snapshots(seq, t, value) VALUES (?, ?, ?)",
+                         (seq, self._state["t"], blob))
+            conn.execute("DELETE FROM snapshots WHERE seq < ?", (seq,))
+            conn.execute("DELETE FROM log WHERE seq <= ?", (seq,))
+            dead = [(rid,) for rid in self._have_routes if rid not in live]
+            conn.executemany("DELETE FROM routes WHERE id = ?", dead)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        self._have_routes = live & self._have_routes
+        self._last_snapshot = time.monotonic()
+        self.log_rows = 0
+        self.snapshots += 1
+
+    # startup
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """
+        The stored state, {"t", "agents", "sims", "routes"} with routes decoded
+        (lazy ones as their record), or None when the file holds nothing.
+        Call before recording anything: the writer continues from it.
+        """
+        with self._lock:
+            conn = self._conn
+            state = _empty()
+            row = conn.execute("SELECT seq, value FROM snapshots ORDER BY seq DESC LIMIT 1").fetchone()
+            seq = 0
+            if row is not None:
+                seq, blob = row
+                state = loads(zlib.decompress(blob))
+            n = 0
+            for op, key, value in conn.execute("SELECT op, key, value FROM log WHERE seq > ? ORDER BY seq", (seq,)):
+                _apply(state, op, key, None if value is None else loads(value))
+                n += 1
+            self._state = state
+            self.log_rows = n
+            if row is None and n == 0:
+                return None
+
+            routes = {}
+            for rid, kind, value in conn.execute("SELECT id, kind, value FROM routes"):
+                self._have_routes.add(rid)
+                routes[rid] = loads(value) if kind == "lazy" else value
+            out = dict(state)
+            out["routes"] = routes
+            return out
+
+    def stats(self) -> Dict[str, Any]:
+        return {"records": self.records, "batches": self.batches, "snapshots": self.snapshots,
+                "log_rows": self.log_rows, "pending": len(self._q), "last_flush_ms": self.last_flush_ms,
+                "agents": len(self._state["agents"]), "sims": len(self._state["sims"])}
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        try:
+            self.flush()
+        finally:
+            self._conn.close()
+
+
+def restore_state(data: Dict[str, Any],
+                  load_walk: Callable[[LatLon, LatLon], CompactRoute]
+                  ) -> Tuple[float, List[MatchSimulation], List[AgentState], List[AgentState], Dict[str, str]]:
+    """
+    Rebuilds (t, sims, leftover drivers, leftover walkers, agent id -> request id)
+    from StateStore.load(), every agent moved to t. load_walk(a, b) fetches the
+    geometry of a walk stored without one.
+    """
+    t = data["t"]
+    blobs = data["routes"]
+    routes: Dict[str, RouteBase] = {}
+    agent_id_to_request_id: Dict[str, str] = {}
+
+    def route(rid: str):
+        r = routes.get(rid)
+        if r is None:
+            v = blobs[rid]
+            if isinstance(v, dict):
+                a, b = tuple(v["start"]), tuple(v["dest"])
+                r = LazyRoute(a, b, v["dist"], v["duration"], loader=lambda: load_walk(a, b), profile=v["profile"])
+            else:
+                r = decode(v)
+            routes[rid] = r
+        return r
+
+    def agent(rec: Dict[str, Any]) -> AgentState:
+        r = route(rec["route"])
+        a = AgentState(route=r, agent_id=rec["id"], start_offset_s=rec["offset"], time_scale=rec["scale"],
+                       pos=r.start)
+        a.update_position(t)
+        if "req" in rec:
+            agent_id_to_request_id[a.agent_id] = rec["req"]
+        return a
+
+    drivers: List[AgentState] = []
+    walkers: List[AgentState] = []
+    for rec in data["agents"].values():
+        (drivers if rec["kind"] == "driver" else walkers).append(agent(rec))
+
+    sims: List[MatchSimulation] = []
+    for rec in data["sims"].values():
+        m = dict(rec["match"])
+        for name in MATCH_ROUTES:
+            m[name] = route(m[name])
+        for name in ("pickup", "dropoff"):
+            m[name] = tuple(m[name])
+        sim = MatchSimulation(match=Match(**m),
+                              driver_agent=agent(rec["driver"]),
+                              walker_agent=agent(rec["walker"]),
+                              walk_to_pickup_agent=agent(rec["walk_to"]),
+                              walk_from_dropoff_agent=agent(rec["walk_from"]),
+                              match_id=rec["id"],
+                              creation_time_s=rec["created"])
+        sim.driver_agent.assigned = sim.walker_agent.assigned = True
+        sim.update(t)
+        sims.append(sim)
+    return t, sims, drivers, walkers, agent_id_to_request_id
@@ -0,0 +1,116 @@
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+
+# modules in code/ are imported flat (from local_osrm import ...)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import local_osrm  # noqa: E402
+from AgentState import AgentState  # noqa: E402
+from RouteBase import DriverRoute, WalkerRoute  # noqa: E402
+
+# Stub OSRM (straight-line routing) serving /route and /table for tests.
+
+SPEED = {"walking": 1.4, "driving": 10.0}
+
+
+def hav(a, b):
+    return local_osrm.haversine_m(a, b)
+
+
+class StubOsrm(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    calls = []
+    fail_table = False
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        u = urlsplit(self.path)
+        _, service, _, profile, coords = u.path.split("/", 4)
+        qs = parse_qs(u.query)
+        pts = [(float(c.split(",")[1]), float(c.split(",")[0])) for c in coords.split(";")]
+        StubOsrm.calls.append(service)
+
+        if service == "table":
+            if StubOsrm.fail_table:
+                return self._send(500, {"code": "Error"})
+            src = [int(i) for i in qs["sources"][0].split(";")]
+            dst = [int(i) for i in qs["destinations"][0].split(";")]
+            dist = [[hav(pts[i], pts[j]) for j in dst] for i in src]
+            dur = [[m / SPEED[profile] for m in row] for row in dist]
+            return self._send(200, {"code": "Ok", "distances": dist, "durations": dur})
+
+        if service == "route":
+            a, b = pts
+            m = hav(a, b)
+            route = {"distance": m, "duration": m / SPEED[profile]}
+            if qs.get("overview", ["false"])[0] == "full":
+                route["geometry"] = {"coordinates": [[a[1], a[0]], [b[1], b[0]]]}
+                route["legs"] = [{"annotation": {"distance": [m], "duration": [m / SPEED[profile]], "nodes": [1, 2]}}]
+            return self._send(200, {"code": "Ok", "routes": [route]})
+
+        self._send(404, {"code": "InvalidService"})
+
+
+class StubServer(ThreadingHTTPServer):
+    # candidate legs arrive concurrently, the default backlog of 5 drops SYNs
+    request_queue_size = 128
+    daemon_threads = True
+
+
+@pytest.fixture
+def stub_osrm(monkeypatch):
+    srv = StubServer(("127.0.0.1", 0), StubOsrm)
+    th = threading.Thread(target=srv.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    th.start()
+    url = f"http://127.0.0.1:{srv.server_address[1]}"
+    monkeypatch.setattr(local_osrm, "OSRM_WALK", url)
+    monkeypatch.setattr(local_osrm, "OSRM_DRIVE", url)
+    monkeypatch.setattr(local_osrm, "DISK_CACHE", None)
+    StubOsrm.calls = []
+    StubOsrm.fail_table = False
+    local_osrm.clear_route_caches()
+    yield StubOsrm
+    local_osrm.OSRM.close()
+    srv.shutdown()
+    srv.server_close()
+
+
+def straight_route(cls, a, b, n, speed):
+    pts = [(a[0] + (b[0] - a[0]) * i / (n - 1), a[1] + (b[1] - a[1]) * i / (n - 1)) for i in range(n)]
+    seg_d = [hav(pts[i], pts[i + 1]) for i in range(n - 1)]
+    seg_t = [d / speed for d in seg_d]
+    return cls(geometry_latlon=pts, dist=sum(seg_d), duration=sum(seg_t), start=a, dest=b,
+               duration_list=seg_t, cum_time_s=local_osrm.cum_array(seg_t),
+               seg_dist_m=seg_d, cum_dist_m=local_osrm.cum_array(seg_d))
+
+
+def make_driver(a, b, n=200):
+    r = straight_route(DriverRoute, a, b, n, SPEED["driving"])
+    return AgentState(route=r, pos=r.start)
+
+
+def make_walker(a, b):
+    r = straight_route(WalkerRoute, a, b, 2, SPEED["walking"])
+    return AgentState(route=r, pos=r.start)
+
+
+def random_point(rnd, box):
+    # box: south, west, north, east
+    return rnd.uniform(box[0], box[2]), rnd.uniform(box[1], box[3])
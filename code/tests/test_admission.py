@@ -0,0 +1,90 @@
+# Admission pipeline: route fetch + match evaluation off the tick thread.
+import time
+
+import local_osrm
+import sim_loop
+from admission import AdmissionPipeline
+from spatial_index import DriverGridIndex
+from conftest import make_driver
+
+WALKER = {"type": "walker",
+          "start": {"lat": 51.2026, "lon": 6.7805},
+          "dest": {"lat": 51.2191, "lon": 6.7877}}
+
+
+def make_world():
+    world = {
+        "matches": [],
+        "drivers": [],
+        "walkers": [],
+        "req_ids": {},
+        "index": DriverGridIndex(),
+    }
+    d = make_driver((51.1990, 6.7790), (51.2250, 6.7900))
+    world["drivers"].append(d)
+    world["index"].add(d)
+    return world
+
+
+def make_pipeline(world, workers):
+    return AdmissionPipeline(
+        route_fn=local_osrm.handle_req,
+        match_fn=lambda kind, agent, now: local_osrm.propose_match(
+            kind, agent, world["drivers"], world["walkers"], world["index"], 100.0),
+        route_workers=workers,
+        match_workers=workers,
+    )
+
+
+def run_until_idle(pipe, world, timeout_s=10.0):
+    results = []
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        for adm in pipe.drain_ready():
+            res = sim_loop.commit_admission(
+                adm, world["matches"], world["drivers"], world["walkers"], world["req_ids"], world["index"])
+            if res is None:
+                pipe.retry(adm)
+            else:
+                results.append(res)
+        d = pipe.queue_depth()
+        if d["route"] == d["match"] == d["ready"] == 0 and results:
+            return results
+        time.sleep(0.01)
+    raise AssertionError(f"pipeline did not drain: {pipe.queue_depth()}")
+
+
+def test_two_walkers_compete_for_one_driver(stub_osrm):
+    world = make_world()
+    pipe = make_pipeline(world, workers=4)
+    try:
+        pipe.submit({"request_id": "w1", "payload": WALKER})
+        pipe.submit({"request_id": "w2", "payload": WALKER})
+        # both proposals are evaluated against the same free driver before any commit
+        deadline = time.monotonic() + 10.0
+        while pipe.queue_depth()["ready"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        results = run_until_idle(pipe, world)
+    finally:
+        pipe.close()
+
+    by_status = sorted(r["status"] for r in results)
+    assert by_status == ["matched", "not_matched"]
+    assert len(world["matches"]) == 1
+    assert world["drivers"] == [] and len(world["index"]) == 0
+    assert len(world["walkers"]) == 1
+
+    m = pipe.metrics()
+    assert m["latency"]["route"]["count"] == 2
+    # the loser was evaluated again after the winner's commit
+    assert m["latency"]["match"]["count"] == 3
+
+
+def test_route_failure_is_reported_not_raised(stub_osrm):
+    world = make_world()
+    pipe = make_pipeline(world, workers=0)
+    pipe.submit({"request_id": "bad", "payload": {"type": "walker"}})
+    [res] = run_until_idle(pipe, world)
+
+    assert res["status"] == "error" and res["req_id"] == "bad"
+    assert "KeyError" in res["error"]
@@ -0,0 +1,118 @@
+# Batch matching: assignment solver and the batch commit of admissions.
+import itertools
+import random
+import threading
+import time
+
+import pytest
+
+import assignment
+import local_osrm
+import sim_loop
+from admission import Admission
+from Match import MatchCandidate, MatchLight
+from spatial_index import DriverGridIndex
+from conftest import make_driver, make_walker
+
+
+def brute_force(weights):
+    rows = sorted({r for r, _ in weights})
+    cols = sorted({c for _, c in weights})
+    best = 0.0
+    for perm in itertools.permutations(cols + [None] * len(rows), len(rows)):
+        total = sum(weights.get((r, c), 0.0) for r, c in zip(rows, perm))
+        best = max(best, total)
+    return best
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_assignment_is_optimal(monkeypatch, seed):
+    monkeypatch.setattr(assignment, "HAVE_SCIPY", False)
+    rnd = random.Random(seed)
+    n_rows, n_cols = rnd.randint(1, 5), rnd.randint(1, 5)
+    weights = {(f"w{r}", f"d{c}"): rnd.uniform(1, 100)
+               for r in range(n_rows) for c in range(n_cols) if rnd.random() < 0.5}
+    pairs = assignment.max_weight_assignment(weights)
+
+    assert len({r for r, _ in pairs}) == len(pairs) == len({c for _, c in pairs})
+    assert all(e in weights for e in pairs)
+    assert sum(weights[e] for e in pairs) == pytest.approx(brute_force(weights))
+
+
+def test_batch_beats_arrival_order():
+    # w1 comes first and prefers d1 a little, w2 can only use d1
+    d1, d2 = make_driver((51.20, 6.77), (51.23, 6.79)), make_driver((51.20, 6.78), (51.23, 6.80))
+    w1, w2 = make_walker((51.20, 6.78), (51.22, 6.79)), make_walker((51.20, 6.78), (51.22, 6.79))
+    ml = MatchLight((0, 0), (0, 0), 1, 2, 10.0, 10.0, 60.0, 60.0)
+
+    def cand(d, saving_s):
+        return MatchCandidate(d, ml, pickup_eta_s=60.0, dropoff_eta_s=300.0, saving_dist_m=900.0, saving_s=saving_s)
+
+    cands = {w1: [cand(d1, 700.0), cand(d2, 650.0)], w2: [cand(d1, 800.0)]}
+    pairs = local_osrm.assign_batch(cands)
+    assert {(w.agent_id, c.driver.agent_id) for w, c in pairs} == {(w1.agent_id, d2.agent_id),
+                                                                  (w2.agent_id, d1.agent_id)}
+
+
+def test_commit_admission_batch(stub_osrm):
+    drivers, walkers, sims, req_ids = [], [], [], {}
+    index = DriverGridIndex()
+    waiting = make_walker((51.2026, 6.7805), (51.2191, 6.7877))
+    waiting.update_position(0.0)
+    walkers.append(waiting)
+    req_ids[waiting.agent_id] = "old"
+
+    def admitted(req_id, kind, agent):
+        return Admission(req={}, req_id=req_id, kind=kind, agent=agent)
+
+    batch = [
+        admitted("d", "driver", make_driver((51.1990, 6.7790), (51.2250, 6.7900))),
+        admitted("w", "walker", make_walker((51.2026, 6.7805), (51.2191, 6.7877))),
+        Admission(req={}, req_id="bad", error="KeyError: 'start'"),
+    ]
+    errors, new = sim_loop.prepare_admission_batch(batch, req_ids, 0.0)
+    cands = sim_loop.batch_candidates(new, drivers, walkers, index, min_saving_m=100.0)
+    matched = [(w, c, local_osrm.finalize_match(c.driver, w, c.light), 0.0)
+               for w, c in local_osrm.assign_batch(cands)]
+    results = errors + sim_loop.commit_admission_batch(new, matched, sims, drivers, walkers, req_ids, index)
+    by_req = {r["req_id"]: r for r in results}
+
+    assert by_req["bad"]["status"] == "error"
+    assert by_req["d"]["status"] == "matched"
+    # one driver for two walkers: the new one or the waiting one, never both
+    partner = by_req["d"]["partner_req_id"]
+    assert partner in ("old", "w")
+    assert by_req["w"]["status"] == ("matched" if partner == "w" else "not_matched")
+    assert len(sims) == 1 and drivers == [] and len(index) == 0
+    assert len(walkers) == 1 and walkers[0] is not sims[0].walker_agent
+
+
+def test_sim_loop_batches_on_the_match_workers(stub_osrm, monkeypatch):
+    # the cost matrix and the finalizing (the OSRM requests) stay off the tick thread
+    threads = []
+    for name in ("match_candidates", "finalize_match"):
+        def traced(*args, _fn=getattr(sim_loop, name), _name=name, **kw):
+            threads.append((_name, threading.current_thread()))
+            return _fn(*args, **kw)
+        monkeypatch.setattr(sim_loop, name, traced)
+
+    d = make_driver((51.1990, 6.7790), (51.2250, 6.7900))
+    walker = {"type": "walker", "start": {"lat": 51.2026, "lon": 6.7805}, "dest": {"lat": 51.2191, "lon": 6.7877}}
+    results = []
+    loop = sim_loop.SimLoop([], [d], [], {}, min_saving_m=100.0, rematch_every_s=3600.0, batch_window_s=0.05,
+                              route_workers=1, match_workers=2, on_result=lambda res, t: results.append(res))
+    try:
+        reqs = [{"request_id": "w1", "payload": walker}]
+        t, deadline = 0.0, time.monotonic() + 10.0
+        while not results and time.monotonic() < deadline:
+            loop.tick(t, reqs, publish=False)
+            reqs = []
+            t += 0.1
+            time.sleep(0.01)
+    finally:
+        loop.close()
+
+    assert [r["status"] for r in results] == ["matched"] and loop.matches["batch"] == 1
+    assert loop.batch == [] and loop.driver_agents == []
+    assert {name for name, _ in threads} == {"match_candidates", "finalize_match"}
+    assert all(th is not threading.current_thread() for _, th in threads)
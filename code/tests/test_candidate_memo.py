@@ -0,0 +1,120 @@
+# Candidate memo: repeated evaluations of a (driver route, walker destination) pair reuse walking costs.
+import pytest
+
+import candidate_memo
+import local_osrm
+from conftest import make_driver, make_walker
+
+
+def pair():
+    walker = make_walker((51.2026, 6.7805), (51.2191, 6.7877))
+    drivers = [make_driver((51.1990, 6.7790), (51.2250, 6.7900)),
+               make_driver((51.2000, 6.7700), (51.2300, 6.7950))]
+    return drivers, walker
+
+
+def test_repeated_evaluation_costs_no_calls(stub_osrm):
+    drivers, walker = pair()
+    first = local_osrm.build_match_light_batch(drivers, walker)
+    assert stub_osrm.calls == ["table"]
+
+    stub_osrm.calls.clear()
+    before = candidate_memo.memo_stats()
+    again = local_osrm.build_match_light_batch(drivers, walker)
+    after = candidate_memo.memo_stats()
+    assert stub_osrm.calls == []
+    assert again == first
+    assert after["pick_hits"] - before["pick_hits"] == len(drivers)
+
+    # the per-pair path reads the same memo
+    for d, ml in first:
+        assert local_osrm.build_match_light(d, walker) == ml
+    assert stub_osrm.calls == []
+
+
+def test_memo_on_and_off_agree(stub_osrm, monkeypatch):
+    drivers, walker = pair()
+    monkeypatch.setattr(local_osrm, "USE_CANDIDATE_MEMO", False)
+    ref = local_osrm.build_match_light_batch(drivers, walker)
+    ref_light = [local_osrm.build_match_light(d, walker) for d in drivers]
+
+    drivers, walker = pair()  # fresh routes, empty memo
+    monkeypatch.setattr(local_osrm, "USE_CANDIDATE_MEMO", True)
+    for _ in range(2):
+        got = local_osrm.build_match_light_batch(drivers, walker)
+        assert [ml for _, ml in got] == [ml for _, ml in ref]
+        assert [local_osrm.build_match_light(d, walker) for d in drivers] == ref_light
+
+
+def test_pickup_reused_only_near_the_stored_position(stub_osrm):
+    drivers, walker = pair()
+    d = drivers[0]
+    local_osrm.build_match_light_batch([d], walker)
+    lat, lon = walker.get_pos()
+
+    memo = candidate_memo.pair_memo(d.route, walker.route.dest)
+    pick = memo.pick
+
+    walker.pos = (lat + 0.0001, lon)  # ~11 m: same pickup, its one leg costed again
+    before = candidate_memo.memo_stats()
+    (_, ml), = local_osrm.build_match_light_batch([d], walker)
+    after = candidate_memo.memo_stats()
+    assert after["pick_hits"] - before["pick_hits"] == 1
+    assert after["drop_misses"] == before["drop_misses"]
+    assert memo.pick is pick and memo.pick_pos == (lat, lon)
+    assert ml.pick_walk_dist_m == pytest.approx(local_osrm.haversine_m(walker.pos, pick.point), abs=1.5)
+
+    walker.pos = (lat + 0.0005, lon)  # ~56 m: a fresh top-k, the dropoff costs stay known
+    before = candidate_memo.memo_stats()
+    local_osrm.build_match_light_batch([d], walker)
+    after = candidate_memo.memo_stats()
+    assert after["pick_misses"] - before["pick_misses"] == 1
+    assert memo.pick_pos == walker.pos
+
+    stub_osrm.calls.clear()
+    local_osrm.build_match_light_batch([d], walker)  # unchanged position: nothing to request
+    assert stub_osrm.calls == []
+
+
+def test_pickup_dropped_once_the_driver_passes_it(stub_osrm):
+    drivers, walker = pair()
+    d = drivers[0]
+    (_, ml), = local_osrm.build_match_light_batch([d], walker)
+    memo = candidate_memo.pair_memo(d.route, walker.route.dest)
+    assert memo.pickup(d.idx, walker.get_pos()) is not None
+
+    d.idx = ml.pickup_index + 1
+    assert memo.pickup(d.idx, walker.get_pos()) is None
+    assert memo.pick is None
+
+    stub_osrm.calls.clear()
+    got = local_osrm.build_match_light_batch([d], walker)
+    assert stub_osrm.calls == ["table"]
+    assert all(m.pickup_index >= d.idx for _, m in got)
+
+
+def test_memo_lives_on_the_route(monkeypatch):
+    monkeypatch.setattr(candidate_memo, "MAX_DESTS_PER_ROUTE", 2)
+    d = make_driver((51.1990, 6.7790), (51.2250, 6.7900))
+    a = candidate_memo.pair_memo(d.route, (51.21, 6.78))
+    assert candidate_memo.pair_memo(d.route, (51.2100000001, 6.78)) is a
+    candidate_memo.pair_memo(d.route, (51.22, 6.78))
+    candidate_memo.pair_memo(d.route, (51.23, 6.78))  # evicts the oldest
+    assert candidate_memo.pair_memo(d.route, (51.21, 6.78)) is not a
+    assert len(d.route._memo) == 2
+
+    other = make_driver((51.1990, 6.7790), (51.2250, 6.7900))
+    assert candidate_memo.pair_memo(other.route, (51.23, 6.78)) is not \
+        candidate_memo.pair_memo(d.route, (51.23, 6.78))
+
+
+@pytest.mark.parametrize("use_table", [True, False])
+def test_match_candidates_second_pass_is_free(stub_osrm, monkeypatch, use_table):
+    monkeypatch.setattr(local_osrm, "USE_TABLE", use_table)
+    drivers, walker = pair()
+    first = local_osrm.match_candidates(drivers, walker, 100.0)
+    stub_osrm.calls.clear()
+    again = local_osrm.match_candidates(drivers, walker, 100.0)
+    assert [(c.driver, c.light) for c in again] == [(c.driver, c.light) for c in first]
+    # the baseline walk comes from the route cache, the candidate legs from the memo
+    assert stub_osrm.calls == []
@@ -0,0 +1,49 @@
+# Corridor prefilter: drops only drivers that cannot match, before any routing call.
+import random
+
+import pytest
+
+import corridor
+import local_osrm
+from conftest import make_driver, make_walker, random_point
+
+
+def world(seed, n_drivers=30):
+    rnd = random.Random(seed)
+    box = (51.19, 6.74, 51.25, 6.82)
+    drivers = [make_driver(random_point(rnd, box), random_point(rnd, box), n=60) for _ in range(n_drivers)]
+    for d in drivers:
+        d.idx = rnd.randrange(0, 30)
+        d.pos = d.route.geometry_latlon[d.idx]
+    walker = make_walker((51.205, 6.765), (51.232, 6.792))
+    return drivers, walker
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_same_candidates_fewer_calls(stub_osrm, monkeypatch, seed):
+    drivers, walker = world(seed)
+
+    monkeypatch.setattr(local_osrm, "USE_CORRIDOR_FILTER", False)
+    ref = local_osrm.match_candidates(drivers, walker, 300.0)
+    calls_ref = len(stub_osrm.calls)
+
+    local_osrm.clear_route_caches()
+    stub_osrm.calls.clear()
+    monkeypatch.setattr(local_osrm, "USE_CORRIDOR_FILTER", True)
+    before = local_osrm.corridor_stats()
+    got = local_osrm.match_candidates(drivers, walker, 300.0)
+    after = local_osrm.corridor_stats()
+
+    assert [(c.driver, c.light) for c in got] == [(c.driver, c.light) for c in ref]
+    assert after["checked"] - before["checked"] == len(drivers)
+    assert after["rejected"] > before["rejected"]
+    assert len(stub_osrm.calls) < calls_ref
+
+
+def test_python_fallback_agrees(monkeypatch):
+    drivers, walker = world(7, n_drivers=60)
+    args = [(d.route, d.idx, walker.get_pos(), walker.route.dest, 4000.0) for d in drivers]
+    with_np = [corridor.corridor_feasible(*a) for a in args]
+    monkeypatch.setattr(corridor, "HAVE_NUMPY", False)
+    assert [corridor.corridor_feasible(*a) for a in args] == with_np
+    assert any(with_np) and not all(with_np)
@@ -0,0 +1,70 @@
+# Vectorized fleet update must move agents exactly like AgentState.update_position.
+import copy
+import random
+
+import pytest
+
+import local_osrm
+from AgentState import AgentState
+from RouteBase import CompactRoute, DriverRoute
+from fleet_positions import FleetPositionEngine
+
+
+def random_route(rnd, cls, n, zero_segments):
+    lat, lon = 51.2 + rnd.random() * 0.05, 6.7 + rnd.random() * 0.1
+    pts = [(lat + i * 1e-4 * rnd.random(), lon + i * 1e-4 * rnd.random()) for i in range(n)]
+    # zero-duration segments (e.g. repeated points) only on CompactRoute: the list
+    # based get_pos_at_time returns a bare point there
+    seg_t = [0.0 if zero_segments and rnd.random() < 0.1 else rnd.uniform(0.5, 5.0) for _ in range(n - 1)]
+    seg_d = [t * 10.0 for t in seg_t]
+    return cls(geometry_latlon=pts, dist=sum(seg_d), duration=sum(seg_t), start=pts[0], dest=pts[-1],
+               duration_list=seg_t, cum_time_s=local_osrm.cum_array(seg_t),
+               seg_dist_m=seg_d, cum_dist_m=local_osrm.cum_array(seg_d))
+
+
+def fleet(seed, count):
+    rnd = random.Random(seed)
+    agents = []
+    for k in range(count):
+        compact = k % 2 == 1
+        r = random_route(rnd, CompactRoute if compact else DriverRoute, rnd.randint(2, 60), compact)
+        agents.append(AgentState(route=r, start_offset_s=rnd.uniform(-50, 100),
+                                 time_scale=rnd.choice([1.0, 2.0])))
+    return agents
+
+
+def assert_same(vec, ref):
+    for a, b in zip(vec, ref):
+        assert (a.idx, a.done) == (b.idx, b.done)
+        assert a.pos == pytest.approx(b.pos, abs=1e-9)
+
+
+def test_matches_scalar_update():
+    vec = fleet(seed=3, count=300)
+    ref = copy.deepcopy(vec)
+    engine = FleetPositionEngine(capacity_points=64, capacity_agents=8)  # exercises growth
+
+    for t in [0.0, 0.5, 3.0, 17.25, 60.0, 99.9, 150.0, 400.0]:
+        engine.update(vec, t)
+        for a in ref:
+            a.update_position(t)
+        assert_same(vec, ref)
+
+    assert all(a.done for a in vec)
+
+
+def test_fleet_changes_between_ticks():
+    agents = fleet(seed=5, count=200)
+    ref = copy.deepcopy(agents)
+    engine = FleetPositionEngine(compact_slack=0)
+
+    for step in range(60):
+        # agents join late and leave again (matched, archived)
+        lo, hi = 3 * step, 20 + 3 * step
+        t = 3.0 * step
+        engine.update(agents[lo:hi], t)
+        for a in ref[lo:hi]:
+            a.update_position(t)
+        assert_same(agents[lo:hi], ref[lo:hi])
+
+    assert engine.rebuilds > 0
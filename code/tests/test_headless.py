@@ -0,0 +1,76 @@
+# Headless runner, the in-process fake OSRM it runs against and the same fake over HTTP.
+import time
+
+import pytest
+
+import headless
+import local_osrm
+from RouteBase import CompactRoute
+from fake_osrm import FakeOsrm, FakeOsrmClient, FakeOsrmServer
+
+A, B = (51.21, 6.76), (51.235, 6.79)
+
+
+@pytest.mark.parametrize("graph", ["straight", "grid"])
+def test_fake_route_parses_and_agrees_with_table(graph):
+    fake = FakeOsrm(graph=graph)
+    path = f"/route/v1/driving/{A[1]},{A[0]};{B[1]},{B[0]}?overview=full&geometries=geojson&annotations=true"
+    route = CompactRoute.from_osrm(A, B, "driving", fake.handle(path)["routes"][0])
+    assert len(route.geometry_latlon) > 10
+    assert route.cum_dist_m[-1] == pytest.approx(route.dist)
+
+    fast = fake.handle(path.replace("overview=full", "overview=false"))["routes"][0]
+    table = fake.handle(f"/table/v1/driving/{A[1]},{A[0]};{B[1]},{B[0]}?sources=0&destinations=1")
+    assert fast["distance"] == pytest.approx(route.dist, rel=1e-6)
+    assert table["distances"][0][0] == pytest.approx(route.dist, rel=1e-6)
+    assert fake.calls == {"route": 2, "route_full": 1, "table": 1}
+
+
+def test_fake_client_drops_in_for_osrm(monkeypatch):
+    client = FakeOsrmClient(FakeOsrm(graph="grid"))
+    monkeypatch.setattr(local_osrm, "OSRM", client)
+    monkeypatch.setattr(local_osrm, "DISK_CACHE", None)
+    local_osrm.clear_route_caches()
+    try:
+        route = local_osrm.fetch_route(A, B, "walking")
+        assert route.duration == pytest.approx(route.dist / 1.4)
+        with pytest.raises(local_osrm.OsrmError):
+            client.run(client.get_json("", "/nearest/v1/walking/6.7,51.2"))
+    finally:
+        client.close()
+        local_osrm.clear_route_caches()
+
+
+def test_same_seed_same_run():
+    kw = dict(ticks=40, seed=3, drivers=40, walkers=30, driver_rate=0.5, walker_rate=1.0)
+    a = headless.run_headless(**kw)
+    b = headless.run_headless(**kw)
+    assert a["digest"] == b["digest"]
+    assert (a["requests"], a["matches"]) == (b["requests"], b["matches"])
+    assert a["matches"] > 0
+    assert set(a["stages"]) == set(headless.STAGES)
+    assert headless.run_headless(**dict(kw, seed=4))["digest"] != a["digest"]
+    # the real client is back in place
+    assert not isinstance(local_osrm.OSRM, FakeOsrmClient)
+
+
+def test_fake_server_injects_latency_and_errors(monkeypatch):
+    client = local_osrm.OsrmClient(max_in_flight=8, timeout_s=5.0, retries=3, backoff_s=0.001)
+    with FakeOsrmServer(FakeOsrm(graph="grid"), latency_ms=20.0, error_rate=0.5, seed=2) as srv:
+        monkeypatch.setattr(local_osrm, "OSRM", client)
+        monkeypatch.setattr(local_osrm, "OSRM_DRIVE", srv.url)
+        monkeypatch.setattr(local_osrm, "DISK_CACHE", None)
+        local_osrm.clear_route_caches()
+        try:
+            t0 = time.perf_counter()
+            route = local_osrm.fetch_route(A, B, "driving")
+            assert time.perf_counter() - t0 >= 0.02
+            assert route.cum_dist_m[-1] == pytest.approx(route.dist)
+            dist, _ = local_osrm.fetch_table([A], [B], "driving")
+            assert dist[0][0] == pytest.approx(route.dist, rel=1e-6)
+            # 500s were retried by the client
+            assert srv.stats["errors"] > 0
+            assert srv.stats["requests"] == srv.stats["errors"] + 2
+        finally:
+            client.close()
+            local_osrm.clear_route_caches()
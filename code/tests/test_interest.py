@@ -0,0 +1,173 @@
+# Viewport interest management: clients only get what intersects their view.
+import asyncio
+import json
+import random
+
+import pytest
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+
+import realtime_runner
+from interest import InterestManager, SnapshotBuckets, view_key
+from position_stream import PositionDeltaEncoder, apply_positions
+from ws_bus import publish
+from conftest import random_point
+
+VIEW = [51.20, 6.70, 51.23, 6.75]  # south, west, north, east
+
+
+def world(seed=1, n=300, t=0.0):
+    rnd = random.Random(seed)
+    box = (51.15, 6.65, 51.30, 6.80)
+
+    sims = []
+    for i in range(n // 3):
+        (wl, wo), (dl, do) = random_point(rnd, box), random_point(rnd, box)
+        sims.append({"sim_id": f"s{i}", "phase": "WALK_TO_PICKUP",
+                     "walker": {"agent_id": f"sw{i}", "req_id": None, "lat": wl, "lon": wo, "pIdx": 0, "dIdx": 0},
+                     "driver": {"agent_id": f"sd{i}", "req_id": None, "lat": dl, "lon": do, "idx": 0}})
+    drivers = [dict(zip(("lat", "lon"), random_point(rnd, box)), agent_id=f"d{i}") for i in range(n // 3)]
+    walkers = [dict(zip(("lat", "lon"), random_point(rnd, box)), agent_id=f"w{i}") for i in range(n // 3)]
+    return {"t_s": t, "sims": sims, "leftover_drivers": drivers, "leftover_walkers": walkers}
+
+
+def inside(a, bbox):
+    return bbox[0] <= a["lat"] < bbox[2] and bbox[1] <= a["lon"] < bbox[3]
+
+
+def test_view_key():
+    mode, size, *r = view_key(VIEW, 15)
+    assert (mode, size) == ("agents", 1)
+    assert r == [5120, 670, 5123, 675]
+    assert view_key([51.2001, 6.7001, 51.2302, 6.7502], 16) == view_key(VIEW, 15)
+    assert view_key(VIEW, 12)[:2] == ("clusters", 1)
+    assert view_key(VIEW, 10)[:2] == ("clusters", 4)
+    for bad in ([51.3, 6.7, 51.2, 6.8], [51.2, 6.7], None, ["x", 1, 2, 3], [float("nan"), 6.7, 51.3, 6.8]):
+        with pytest.raises(ValueError):
+            view_key(bad, 14)
+
+
+def test_view_holds_what_intersects_the_cells():
+    data = world()
+    g = InterestManager(PositionDeltaEncoder()).set_viewport("c", VIEW, 15)
+    sims, drivers, walkers = SnapshotBuckets(data).ids(g.range)
+    assert sims == {f["sim_id"] for f in data["sims"] if inside(f["walker"], g.bbox) or inside(f["driver"], g.bbox)}
+    assert drivers == {a["agent_id"] for a in data["leftover_drivers"] if inside(a, g.bbox)}
+    assert walkers == {a["agent_id"] for a in data["leftover_walkers"] if inside(a, g.bbox)}
+    assert 0 < len(drivers) < len(data["leftover_drivers"])
+
+
+def test_clusters_count_every_agent_once():
+    data = world(n=900)
+    g = InterestManager(PositionDeltaEncoder()).set_viewport("c", [51.0, 6.5, 51.5, 7.0], 9)
+    assert g.mode == "clusters"
+    clusters = SnapshotBuckets(data).clusters(g.size, g.range)
+    assert sum(c["drivers"] for c in clusters) == 600
+    assert sum(c["walkers"] for c in clusters) == 600
+    assert len(clusters) < 60
+
+
+def moving_world(t):
+    # the same agents as world(), drifting east, so they cross view borders
+    data = world(t=float(t))
+    for a in data["leftover_drivers"] + [f["driver"] for f in data["sims"]]:
+        a["lon"] += t * 2e-3
+    return data
+
+
+def test_groups_are_shared_and_dropped():
+    stream = PositionDeltaEncoder()
+    views = InterestManager(stream)
+    data = world()
+    views.on_positions(data, stream.encode(data))
+    g1 = views.set_viewport("a", VIEW, 15)
+    assert g1.has_state()  # primed from the last snapshot
+    assert views.set_viewport("b", [51.2001, 6.7001, 51.2302, 6.7502], 16) is g1
+    assert views.set_viewport("a", VIEW, 15) is None
+    g2 = views.set_viewport("b", [51.25, 6.75, 51.28, 6.78], 15)
+    assert g2 is not g1 and len(views.groups) == 2
+    views.remove("a")
+    assert list(views.groups.values()) == [g2] and len(views) == 1
+
+
+def test_view_stream_follows_the_global_stream():
+    # a client applying its view's messages holds the global clients' frames of what is in view
+    stream = PositionDeltaEncoder(keyframe_every=7)
+    views = InterestManager(stream)
+    g = views.set_viewport("a", VIEW, 15)
+    state = None
+    entered = left = 0
+    for t in range(20):
+        data = moving_world(t)
+        (group, event), = views.on_positions(data, stream.encode(data))
+        entered += len(event["data"].get("leftover_drivers", ()))
+        left += len(event["data"].get("drivers_removed", ()))
+        state = apply_positions(state, event)
+        assert state is not None
+        sims, drivers, walkers = stream.state()
+        assert set(state["drivers"]) == {a["agent_id"] for a in data["leftover_drivers"] if inside(a, g.bbox)}
+        assert set(state["sims"]) == {f["sim_id"] for f in data["sims"]
+                                      if inside(f["walker"], g.bbox) or inside(f["driver"], g.bbox)}
+        assert all(state["sims"][k] == sims[k] for k in state["sims"])
+        assert all(state["drivers"][k] == drivers[k] for k in state["drivers"])
+    assert entered > 0 and left > 0
+    assert apply_positions(None, g.keyframe(stream))["sims"] == state["sims"]
+
+
+def test_routes_are_filtered_by_bbox():
+    views = InterestManager(PositionDeltaEncoder())
+    g = views.set_viewport("a", VIEW, 15)
+    entry = {"match_id": 1, "driver_route": "r1", "walk_to_pickup": "r2", "walk_from_dropoff": "r3",
+             "bbox": [51.1, 6.6, 51.21, 6.71]}
+    far = dict(entry, match_id=2, driver_route="r4", bbox=[52.0, 7.0, 52.1, 7.1])
+    data = {"routes_version": 1.0, "geometries": {f"r{i}": "??" for i in range(1, 5)}, "routes": [entry, far]}
+    (group, event), = views.on_routes(data)
+    assert event["type"] == "routes_delta"
+    assert [e["match_id"] for e in event["data"]["routes"]] == [1]
+    assert set(event["data"]["geometries"]) == {"r1", "r2", "r3"}
+    # cluster views draw no routes
+    views.set_viewport("b", VIEW, 10)
+    assert views.view_of["b"].routes.keyframe()["data"]["routes"] == []
+
+
+def test_viewport_clients_over_websocket():
+    async def main():
+        realtime_runner.subscribers.clear()
+        app = realtime_runner.create_app(simulate=False)
+        server = TestServer(app, host="127.0.0.1")
+        await server.start_server()
+        try:
+            async with ClientSession() as session:
+                everything = await session.ws_connect(server.make_url("/ws"))
+                local = await session.ws_connect(server.make_url("/ws"))
+                await local.send_str(json.dumps({"type": "viewport", "bbox": VIEW, "zoom": 15}))
+                msg = json.loads((await local.receive(timeout=5)).data)
+                assert msg["type"] == "view" and msg["mode"] == "agents"
+                assert json.loads((await local.receive(timeout=5)).data)["type"] == "routes"
+
+                data = world()
+                await publish(app, {"type": "positions", "data": data})
+                full = json.loads((await everything.receive(timeout=5)).data)
+                mine = json.loads((await local.receive(timeout=5)).data)
+                assert len(full["data"]["leftover_drivers"]) == 100
+                bbox, = (g.bbox for g in app["views"].groups.values())
+                assert {a["agent_id"] for a in mine["data"]["leftover_drivers"]} == {
+                    a["agent_id"] for a in data["leftover_drivers"] if inside(a, bbox)}
+                assert len(json.dumps(mine)) < len(json.dumps(full)) / 5
+
+                # zoomed out: counts per cell
+                await local.send_str(json.dumps({"type": "viewport", "bbox": [51.0, 6.5, 51.5, 7.0], "zoom": 10}))
+                types = [json.loads((await local.receive(timeout=5)).data)["type"] for _ in range(3)]
+                assert types == ["view", "routes", "clusters"]
+                # back to the full stream
+                await local.send_str(json.dumps({"type": "viewport", "bbox": None}))
+                msg = json.loads((await local.receive(timeout=5)).data)
+                assert msg["type"] == "positions" and len(msg["data"]["leftover_drivers"]) == 100
+                assert not len(app["views"]) and not app["views"].groups
+                await everything.close()
+                await local.close()
+        finally:
+            await server.close()
+
+    asyncio.run(main())
+
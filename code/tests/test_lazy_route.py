@@ -0,0 +1,42 @@
+# Walk routes whose geometry is only fetched when something reads it.
+import pytest
+
+import local_osrm
+from RouteBase import CompactRoute, LazyRoute
+from conftest import make_driver, make_walker
+from geometry import route_array
+
+
+def test_geometry_loaded_on_first_read(stub_osrm):
+    a, b = (51.2026, 6.7805), (51.2191, 6.7877)
+    r = local_osrm.lazy_walk_route(a, b)
+    assert isinstance(r, CompactRoute) and not r.loaded
+    assert r.dist > 0 and r.duration > 0
+    assert getattr(r, "_bbox", None) is None
+    assert stub_osrm.calls == ["route"]  # overview=false only
+
+    assert len(r.geometry_latlon) == 2
+    assert r.loaded and stub_osrm.calls == ["route", "route"]
+    assert r.cum_time_s[-1] == pytest.approx(r.duration)
+    assert route_array(r).shape == (2, 2)
+    assert r.get_pos_at_time(1e9) == tuple(r.geometry_latlon[-1])
+    assert len(stub_osrm.calls) == 2
+
+
+def test_loads_share_the_full_route_cache(stub_osrm):
+    a, b = (51.2026, 6.7805), (51.2191, 6.7877)
+    r1, r2 = local_osrm.lazy_walk_route(a, b), local_osrm.lazy_walk_route(a, b)
+    r1.load()
+    r2.load()
+    assert r1.seg_dist_m is r2.seg_dist_m
+    assert stub_osrm.calls.count("route") == 2  # one fast, one full
+
+
+def test_finalize_match_skips_baseline_geometry(stub_osrm):
+    walker = make_walker((51.2026, 6.7805), (51.2191, 6.7877))
+    driver = make_driver((51.1990, 6.7790), (51.2250, 6.7900))
+    m, _ = local_osrm.best_match_([driver], walker, min_saving_m=100.0)
+    assert m is not None
+    assert isinstance(m.walker, LazyRoute) and not m.walker.loaded
+    assert m.walk_route_to_pickup.geometry_latlon and m.walk_route_from_dropoff.geometry_latlon
+    assert m.saving_dist_meters == pytest.approx(m.walker.dist - m.total_walk_dist_meters)
@@ -0,0 +1,101 @@
+# Lifecycle: finished sims and agents leave the hot lists, their requests get a final "done".
+import asyncio
+import json
+
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+
+import local_osrm
+import realtime_runner
+from lifecycle import ArchiveSink, Lifecycle, agent_done_at, sim_done_at
+from MatchSimulation import Phase
+from ws_bus import send_done, send_status
+from conftest import make_driver, make_walker
+
+
+def world():
+    walker = make_walker((51.2026, 6.7805), (51.2191, 6.7877))
+    driver = make_driver((51.1990, 6.7790), (51.2250, 6.7900))
+    match, _ = local_osrm.best_match_([driver], walker, min_saving_m=100.0)
+    sim = local_osrm.make_match_sim(match, driver, walker, now_t=0.0)
+    return sim
+
+
+def test_done_sims_retired_after_keep(stub_osrm):
+    sim = world()
+    req_ids = {sim.walker_agent.agent_id: "req-w", sim.driver_agent.agent_id: "req-d", "other": "req-o"}
+    last_routes = {"req-w": {}, "req-d": {}, "req-o": {}}
+    sims = [sim]
+    life = Lifecycle(keep_s=30.0, every_s=0.0, tail=10)
+
+    end = sim_done_at(sim)
+    sim.update(end + 1.0)
+    assert sim.phase is Phase.DONE
+    assert life.retire(end + 1.0, sims, [], [], req_ids, last_routes) == []
+    assert sims == [sim]  # still shown for a while
+
+    (r,) = life.retire(end + 30.0, sims, [], [], req_ids, last_routes)
+    assert r.kind == "sim" and r.sim is sim and sims == []
+    assert sorted(r.req_ids) == ["req-d", "req-w"]
+    assert req_ids == {"other": "req-o"} and last_routes == {"req-o": {}}
+    assert r.record["match_id"] == sim.match_id and r.record["done_s"] == end
+    assert list(life.archive) == [r.record]
+    assert life.stats()["retired"] == {"sim": 1, "driver": 0, "walker": 0}
+
+
+def test_unmatched_agents_retired_and_archived(tmp_path):
+    short = [make_driver((51.20, 6.77), (51.21, 6.78), n=20) for _ in range(2)]
+    long = make_driver((51.20, 6.77), (51.26, 6.85), n=20)
+    drivers = short + [long]
+    walker = make_walker((51.20, 6.77), (51.201, 6.771))
+    walkers = [walker]
+    req_ids = {short[0].agent_id: "req-0", walker.agent_id: "req-w", long.agent_id: "req-l"}
+    sink = ArchiveSink(str(tmp_path / "archive.jsonl"))
+    life = Lifecycle(keep_s=5.0, every_s=10.0, tail=2, sink=sink)
+
+    t = max(agent_done_at(a) for a in short + walkers) + 5.0
+    for a in drivers + walkers:
+        a.update_position(t)
+    retired = life.retire(t, [], drivers, walkers, req_ids, {})
+    assert sorted(r.kind for r in retired) == ["driver", "driver", "walker"]
+    assert drivers == [long] and walkers == []
+    assert req_ids == {long.agent_id: "req-l"}
+    assert len(life.archive) == 2  # bounded tail
+
+    assert life.retire(t + 1.0, [], drivers, walkers, req_ids, {}) == []  # scans at most every every_s
+    t = max(agent_done_at(long) + 5.0, t + 10.0)
+    long.update_position(t)
+    (r,) = life.retire(t, [], drivers, walkers, req_ids, {})
+    assert r.agent is long and r.req_ids == ["req-l"] and drivers == []
+    assert life.stats()["retired"] == {"sim": 0, "driver": 3, "walker": 1}
+    life.close()
+
+    lines = [json.loads(line) for line in (tmp_path / "archive.jsonl").read_text().splitlines()]
+    assert [line["kind"] for line in lines] == ["driver", "driver", "walker", "driver"]
+    assert lines[-1]["req_ids"] == ["req-l"] and lines[-1]["matched"] is False
+
+
+def test_done_is_the_last_event_of_a_request():
+    async def main():
+        realtime_runner.subscribers.clear()
+        app = realtime_runner.create_app(simulate=False)
+        server = TestServer(app, host="127.0.0.1")
+        await server.start_server()
+        try:
+            async with ClientSession() as session:
+                ws = await session.ws_connect(server.make_url("/ws_agent?request_id=r1"))
+                while "r1" not in app["subscribers"]:
+                    await asyncio.sleep(0.01)
+                await send_status(app, "r1", "matched")
+                await send_done(app, "r1", kind="sim", record={"match_id": "m1"})
+                await send_status(app, "r1", "late")  # no subscribers any more
+
+                got = [json.loads((await ws.receive(timeout=5)).data) for _ in range(2)]
+                assert [m["status"] for m in got] == ["matched", "done"]
+                assert got[1]["record"] == {"match_id": "m1"}
+                assert "r1" not in app["subscribers"]
+                await ws.close()
+        finally:
+            await server.close()
+
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+# Metrics registry, the timed() wrapper and the /metrics route.
+import asyncio
+
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+
+import metrics
+import realtime_runner
+from ws_bus import publish
+
+
+def test_histogram_buckets_and_text_format(monkeypatch):
+    reg = metrics.Registry()
+    monkeypatch.setattr(metrics, "REGISTRY", reg)
+    h = metrics.histogram("t_seconds", "test", ("profile",), buckets=(0.1, 1.0))
+    c = metrics.counter("t_total", "test")
+    for v in (0.05, 0.5, 0.5, 3.0):
+        h.labels("walking").observe(v)
+    c.inc(2)
+
+    text = metrics.render([("t_depth", "gauge", "extra", [({"queue": 'a"b'}, 7)])])
+    assert "# TYPE t_seconds histogram" in text
+    assert 't_seconds_bucket{profile="walking",le="0.1"} 1' in text
+    assert 't_seconds_bucket{profile="walking",le="1"} 3' in text
+    assert 't_seconds_bucket{profile="walking",le="+Inf"} 4' in text
+    assert 't_seconds_count{profile="walking"} 4' in text
+    assert 't_seconds_sum{profile="walking"} 4.05' in text
+    assert "t_total 2" in text
+    assert 't_depth{queue="a\\"b"} 7' in text
+    assert metrics.counter("t_total", "again") is c
+
+
+def test_disabled_records_nothing(monkeypatch):
+    h = metrics.Histogram("x_seconds", "test")
+
+    @metrics.timed(h)
+    def f(x):
+        return x + 1
+
+    @metrics.timed(h)
+    async def g(x):
+        return x * 2
+
+    monkeypatch.setattr(metrics, "ENABLED", False)
+    assert f(1) == 2 and asyncio.run(g(2)) == 4
+    assert h.count == 0
+    monkeypatch.setattr(metrics, "ENABLED", True)
+    assert f(1) == 2 and asyncio.run(g(2)) == 4
+    assert h.count == 2
+
+
+def test_metrics_route():
+    async def main():
+        app = realtime_runner.create_app(simulate=False)
+        server = TestServer(app, host="127.0.0.1")
+        await server.start_server()
+        try:
+            await publish(app, {"type": "routes", "data": {}})
+            async with ClientSession() as session:
+                async with session.get(server.make_url("/metrics")) as r:
+                    assert r.status == 200
+                    assert r.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+                    return await r.text()
+        finally:
+            await server.close()
+
+    text = asyncio.run(main())
+    for name in ("driveby_tick_seconds", "driveby_osrm_request_seconds", "driveby_best_match_seconds",
+                 "driveby_broadcast_seconds", "driveby_tick_lag_seconds"):
+        assert f"# TYPE {name} " in text
+    assert 'driveby_queue_depth{queue="create"} 0' in text
+    assert 'driveby_route_cache_hit_ratio{cache="fast"}' in text
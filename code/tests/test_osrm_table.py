@@ -0,0 +1,81 @@
+# Batch /table costing against the local stub OSRM from conftest.py.
+import pytest
+
+import local_osrm
+from conftest import SPEED, hav, make_driver, make_walker
+
+
+def test_fetch_table_matches_pairwise(stub_osrm):
+    src = [(51.20, 6.78), (51.21, 6.79)]
+    dst = [(51.22, 6.78), (51.20, 6.80), (51.23, 6.77)]
+    dist, dur = local_osrm.fetch_table(src, dst)
+
+    assert stub_osrm.calls == ["table"]
+    for i, a in enumerate(src):
+        for j, b in enumerate(dst):
+            assert dist[i][j] == pytest.approx(hav(a, b), rel=1e-3)
+            assert dur[i][j] == pytest.approx(hav(a, b) / SPEED["walking"], rel=1e-3)
+
+
+def test_batch_agrees_with_per_pair_path(stub_osrm, monkeypatch):
+    # the memo would hand build_match_light the batch's own pickup and dropoff
+    monkeypatch.setattr(local_osrm, "USE_CANDIDATE_MEMO", False)
+    walker = make_walker((51.2026, 6.7805), (51.2191, 6.7877))
+    drivers = [
+        make_driver((51.1990, 6.7790), (51.2250, 6.7900)),
+        make_driver((51.2000, 6.7700), (51.2300, 6.7950)),
+    ]
+
+    batch = local_osrm.build_match_light_batch(drivers, walker)
+    assert stub_osrm.calls == ["table"]
+    assert [d for d, _ in batch] == drivers
+
+    for d, ml in batch:
+        ref = local_osrm.build_match_light(d, walker)
+        assert ml.pickup_index == ref.pickup_index
+        assert ml.dropoff_index == ref.dropoff_index
+        assert ml.pick_walk_dist_m == pytest.approx(ref.pick_walk_dist_m, rel=1e-3)
+        assert ml.drop_walk_s == pytest.approx(ref.drop_walk_s, rel=1e-3)
+
+
+def test_batch_is_chunked_to_table_limit(stub_osrm, monkeypatch):
+    monkeypatch.setattr(local_osrm, "OSRM_TABLE_MAX_COORDS", 60)
+    walker = make_walker((51.2026, 6.7805), (51.2191, 6.7877))
+    drivers = [make_driver((51.1990, 6.7790 + i * 1e-4), (51.2250, 6.7900)) for i in range(5)]
+
+    batch = local_osrm.build_match_light_batch(drivers, walker)
+    assert len(batch) == 5
+    # 2 + 25 coordinates per driver -> two drivers per request
+    assert stub_osrm.calls == ["table"] * 3
+
+
+def test_best_match_uses_one_table_request(stub_osrm):
+    walker = make_walker((51.2026, 6.7805), (51.2191, 6.7877))
+    drivers = [make_driver((51.1990, 6.7790), (51.2250, 6.7900)) for _ in range(3)]
+
+    m, d = local_osrm.best_match_(drivers, walker, min_saving_m=100.0)
+    assert m is not None and d in drivers
+    # all candidate legs in one request, the rest is the baseline (distance only)
+    # and the two legs finalize_match fetches with geometry
+    assert stub_osrm.calls.count("table") == 1
+    assert stub_osrm.calls.count("route") == 3
+
+
+def test_best_match_falls_back_to_route_requests(stub_osrm):
+    stub_osrm.fail_table = True
+    walker = make_walker((51.2026, 6.7805), (51.2191, 6.7877))
+    drivers = [make_driver((51.1990, 6.7790), (51.2250, 6.7900))]
+
+    m, d = local_osrm.best_match_(drivers, walker, min_saving_m=100.0)
+    assert m is not None and d is drivers[0]
+    assert "table" in stub_osrm.calls
+    assert stub_osrm.calls.count("route") > 3
+
+
+def test_walk_fast_many_coalesces_duplicate_legs(stub_osrm):
+    a, b, c = (51.20, 6.78), (51.21, 6.79), (51.22, 6.80)
+    res = local_osrm.walk_fast_many([(a, b), (a, b), (a, c), (a, b)])
+
+    assert stub_osrm.calls == ["route", "route"]
+    assert res[0] == res[1] == res[3]
+    assert res[0][0] == pytest.approx(hav(a, b), rel=1e-3)
@@ -0,0 +1,118 @@
+# Delta position stream: clients applying the stream see the server's state.
+import random
+
+
+from position_stream import PositionDeltaEncoder, RequestFrameStream, apply_positions, moved_m
+
+
+def frame(sim_id, phase, w, d, idx):
+    return {"sim_id": sim_id, "phase": phase,
+            "walker": {"agent_id": "w" + sim_id, "req_id": None, "lat": w[0], "lon": w[1], "pIdx": 0, "dIdx": 0},
+            "driver": {"agent_id": "d" + sim_id, "req_id": None, "lat": d[0], "lon": d[1], "idx": idx},
+            "meta": {"t_driver_pickup": 100.0, "t_driver_dropoff": 300.0}}
+
+
+class World:
+    # sims with moving drivers and waiting walkers, leftovers that come and go
+    def __init__(self, seed=1):
+        self.rnd = random.Random(seed)
+        self.t = 0.0
+        self.sims = {str(i): [(51.2, 6.7 + i * 1e-3), (51.21, 6.7 + i * 1e-3), 0, "WALK_TO_PICKUP"]
+                     for i in range(30)}
+        self.drivers = {f"ld{i}": (51.3, 6.8 + i * 1e-3) for i in range(20)}
+        self.walkers = {f"lw{i}": (51.1, 6.8 + i * 1e-3) for i in range(20)}
+
+    def step(self):
+        rnd = self.rnd
+        self.t += 1.0
+        for s in self.sims.values():
+            s[1] = (s[1][0] + 1e-4, s[1][1])  # ~11 m per tick
+            s[2] += 1
+            if rnd.random() < 0.2:
+                s[0] = (s[0][0] + rnd.uniform(0, 3e-5), s[0][1])  # 0..3 m
+            if rnd.random() < 0.02:
+                s[3] = "WAIT_AT_PICKUP"
+        for k in list(self.drivers):
+            self.drivers[k] = (self.drivers[k][0] + rnd.uniform(0, 3e-5), self.drivers[k][1])
+        if self.drivers and rnd.random() < 0.3:
+            self.drivers.pop(rnd.choice(list(self.drivers)), None)
+        if rnd.random() < 0.3:
+            self.walkers[f"lw{int(self.t)}x"] = (51.1, 6.9)
+
+    def snapshot(self):
+        return {"t_s": self.t,
+                "sims": [frame(k, s[3], s[0], s[1], s[2]) for k, s in self.sims.items()],
+                "leftover_drivers": [{"agent_id": k, "lat": p[0], "lon": p[1]} for k, p in self.drivers.items()],
+                "leftover_walkers": [{"agent_id": k, "lat": p[0], "lon": p[1]} for k, p in self.walkers.items()]}
+
+
+def assert_close(client, truth, tol_m):
+    assert set(client["sims"]) == {f["sim_id"] for f in truth["sims"]}
+    for f in truth["sims"]:
+        c = client["sims"][f["sim_id"]]
+        assert c["phase"] == f["phase"]
+        assert c["driver"]["idx"] == f["driver"]["idx"]
+        assert moved_m(c["walker"], f["walker"]) <= tol_m
+        assert moved_m(c["driver"], f["driver"]) <= tol_m
+    for name, key in (("drivers", "leftover_drivers"), ("walkers", "leftover_walkers")):
+        assert set(client[name]) == {a["agent_id"] for a in truth[key]}
+        for a in truth[key]:
+            assert moved_m(client[name][a["agent_id"]], a) <= tol_m
+
+
+def test_client_tracks_state_within_threshold():
+    world = World()
+    enc = PositionDeltaEncoder(min_move_m=2.0, keyframe_every=25)
+    client = None
+    kinds = []
+    for _ in range(80):
+        world.step()
+        msg = enc.encode(world.snapshot())
+        kinds.append(msg["type"])
+        client = apply_positions(client, msg)
+        assert client is not None
+        assert_close(client, world.snapshot(), 2.0)
+        assert client["sims"] == {f["sim_id"]: f for f in enc.keyframe()["data"]["sims"]}
+
+    assert kinds[0] == "positions" and kinds.count("positions") == 4  # seq 1, 25, 50, 75
+    # nothing moved -> an empty delta
+    assert enc.encode(world.snapshot()) == {"type": "positions_delta", "seq": 81, "data": {"t_s": world.t}}
+
+
+def test_gap_needs_resync():
+    world = World(seed=2)
+    enc = PositionDeltaEncoder(keyframe_every=1000)
+    client = apply_positions(None, enc.encode(world.snapshot()))
+
+    world.step()
+    enc.encode(world.snapshot())  # lost on the way
+    world.step()
+    assert apply_positions(client, enc.encode(world.snapshot())) is None
+
+    client = apply_positions(None, enc.keyframe())
+    world.step()
+    client = apply_positions(client, enc.encode(world.snapshot()))
+    assert client is not None
+    assert_close(client, world.snapshot(), enc.min_move_m)
+
+
+def test_request_stream_skips_unchanged_frames():
+    rs = RequestFrameStream(min_move_m=2.0, keyframe_every=10)
+    f = frame("s1", "WAIT_AT_PICKUP", (51.2, 6.7), (51.3, 6.7), 0)
+
+    first = rs.encode("r1", 0.0, f)
+    assert first["seq"] == 1 and first["key"] and first["request_id"] == "r1"
+    sent = [rs.encode("r1", float(t), f) for t in range(1, 9)]
+    assert sent == [None] * 8
+
+    moved = frame("s1", "WAIT_AT_PICKUP", (51.2, 6.7), (51.3001, 6.7), 1)
+    ev = rs.encode("r1", 9.0, moved)
+    assert ev["seq"] == 2 and not ev["key"]
+
+    # nothing changes for keyframe_every ticks -> keyframe anyway
+    events = [rs.encode("r1", 10.0 + t, moved) for t in range(10)]
+    assert [e["seq"] for e in events if e] == [3] and events[-1]["key"]
+
+    again = rs.resync("r1")
+    assert again["seq"] == 4 and again["data"]["frame"] == moved
+    assert rs.resync("unknown") is None
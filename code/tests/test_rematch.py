@@ -0,0 +1,186 @@
+# Incremental re-matching of leftovers: work per step follows the changes.
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import local_osrm
+import sim_loop
+from Match import MatchCandidate, MatchLight
+from rematch import IncrementalMatcher
+from spatial_index import DriverGridIndex
+from conftest import make_driver, make_walker, random_point
+
+
+class Scores:
+    # score_fn stand-in: feasible pairs and their saving are set by the test
+    def __init__(self):
+        self.saving = {}
+        self.calls = 0
+
+    def __call__(self, walker, drivers):
+        self.calls += 1
+        ml = MatchLight((0, 0), (0, 0), 1, 2, 10.0, 10.0, 60.0, 60.0)
+        return [MatchCandidate(d, ml, 60.0, 300.0, 900.0, self.saving[(walker.agent_id, d.agent_id)])
+                for d in drivers if (walker.agent_id, d.agent_id) in self.saving]
+
+
+def city(n_drivers, n_walkers, seed=3):
+    rnd = random.Random(seed)
+    box = (51.20, 6.75, 51.25, 6.83)
+    drivers = [make_driver(random_point(rnd, box), random_point(rnd, box), n=20) for _ in range(n_drivers)]
+    walkers = [make_walker(random_point(rnd, box), random_point(rnd, box)) for _ in range(n_walkers)]
+    index = DriverGridIndex()
+    for d in drivers:
+        index.add(d)
+    return drivers, walkers, index
+
+
+def test_pairs_appear_when_agents_are_rescored():
+    drivers, walkers, index = city(1, 2)
+    d, (w1, w2) = drivers[0], walkers
+    scores = Scores()
+    m = IncrementalMatcher(scores, lambda c: c.saving_s, index, radius_m=50_000, rescore_every_s=10.0)
+    m.add("driver", d, 0.0)
+    m.add("walker", w1, 0.0)
+    m.add("walker", w2, 0.0)
+    assert m.step(5.0) == []
+
+    # both walkers became matchable, the better pair wins, the loser stays a leftover
+    scores.saving = {(w1.agent_id, d.agent_id): 500.0, (w2.agent_id, d.agent_id): 800.0}
+    [(w, c)] = m.step(10.0)
+    assert w is w2 and c.driver is d
+    assert m.stats()["walkers"] == 1 and m.stats()["drivers"] == 0
+
+
+def test_work_scales_with_changes():
+    drivers, walkers, index = city(300, 300)
+    scores = Scores()
+    m = IncrementalMatcher(scores, lambda c: c.saving_s, index, rescore_every_s=60.0, max_rescore=1000)
+    for d in drivers:
+        m.add("driver", d, 0.0)
+    for w in walkers:
+        m.add("walker", w, 0.0)
+
+    # nothing is due: a tick costs no scoring at all
+    for t in range(1, 59):
+        assert m.step(float(t)) == []
+    assert scores.calls == 0
+
+    # one new walker: only its own pairs are scored
+    w = make_walker((51.22, 6.78), (51.24, 6.80))
+    m.add("walker", w, 59.0, scored=False)
+    d = index.candidates(w.get_pos(), w.route.dest, m.radius_m)[0]
+    scores.saving = {(w.agent_id, d.agent_id): 900.0}
+    [(got, c)] = m.step(59.0)
+    assert got is w and c.driver is d
+    assert scores.calls == 1  # the walker's candidates, handed out as scored
+
+
+def test_pairs_wait_in_the_heap_and_expire():
+    drivers, walkers, index = city(3, 3)
+    scores = Scores()
+    m = IncrementalMatcher(scores, lambda c: c.saving_s, index, radius_m=50_000,
+                           max_emit=1, max_pair_age_s=5.0)
+    for d in drivers:
+        m.add("driver", d, 0.0, scored=False)
+    for w in walkers:
+        m.add("walker", w, 0.0, scored=False)
+    scores.saving = {(w.agent_id, d.agent_id): 100.0 * (i + 1)
+                     for i, (w, d) in enumerate(zip(walkers, drivers))}
+
+    # one pair per step, best first; the others stay in the heap, nothing is scored again
+    [(w, c)] = m.step(0.0)
+    assert w is walkers[2] and c.driver is drivers[2]
+    calls = scores.calls
+    [(w, c)] = m.step(1.0)
+    assert w is walkers[1] and c.driver is drivers[1]
+    assert scores.calls == calls and m.stats()["pairs"] > 0
+
+    # the last pair is too old by now: its walker is scored again, then the fresh pair goes out
+    assert m.step(10.0) == []
+    assert m.stats()["expired"] >= 1
+    [(w, c)] = m.step(11.0)
+    assert w is walkers[0] and c.driver is drivers[0]
+    assert scores.calls > calls
+
+
+def test_scoring_runs_through_submit():
+    # the tick only hands out pairs of scorings that finished, it never waits for one
+    drivers, walkers, index = city(1, 1)
+    (d,), (w,) = drivers, walkers
+    scores = Scores()
+    scores.saving = {(w.agent_id, d.agent_id): 500.0}
+    held = []
+
+    def submit(fn, *args):
+        fut = Future()
+        held.append((fut, fn, args))
+        return fut
+
+    m = IncrementalMatcher(scores, lambda c: c.saving_s, index, radius_m=50_000, submit=submit)
+    m.add("driver", d, 0.0, scored=False)
+    m.add("walker", w, 0.0, scored=False)
+    assert m.step(0.0) == []
+    assert scores.calls == 0 and m.stats()["scoring"] == 2
+
+    for fut, fn, args in held:
+        fut.set_result(fn(*args))
+    [(got, c)] = m.step(1.0)
+    assert got is w and c.driver is d
+    assert m.stats()["scoring"] == 0
+
+
+def test_rematch_commit(stub_osrm):
+    # a leftover walker and driver that match once re-evaluated
+    d = make_driver((51.1990, 6.7790), (51.2250, 6.7900))
+    w = make_walker((51.2026, 6.7805), (51.2191, 6.7877))
+    drivers, walkers, sims = [d], [w], []
+    index = DriverGridIndex()
+    index.add(d)
+    req_ids = {w.agent_id: "w1"}
+
+    m = IncrementalMatcher(lambda walker, ds: local_osrm.match_candidates(ds, walker, 100.0),
+                           local_osrm.batch_weight, index)
+    m.add("driver", d, 0.0, scored=False)
+    m.add("walker", w, 0.0, scored=False)
+    [(walker, cand)] = m.step(0.0)
+    match = local_osrm.finalize_match(cand.driver, walker, cand.light)
+
+    # the driver was taken by an admission while the match was finalized
+    d.assigned = True
+    assert sim_loop.commit_rematch(walker, cand, match, sims, drivers, walkers, req_ids, index, 0.0) is None
+    d.assigned = False
+
+    res = sim_loop.commit_rematch(walker, cand, match, sims, drivers, walkers, req_ids, index, 0.0)
+    assert res["status"] == "matched" and res["req_id"] == "w1" and res["partner_req_id"] is None
+    assert drivers == [] and walkers == [] and len(index) == 0
+    assert sims[0].walker_agent is w and sims[0].driver_agent is d
+
+
+def test_sim_loop_rematches_on_the_match_workers(stub_osrm, monkeypatch):
+    # scoring and finalizing (the OSRM requests) stay off the tick thread
+    threads = []
+    for name in ("match_candidates", "finalize_match"):
+        def traced(*args, _fn=getattr(sim_loop, name), _name=name, **kw):
+            threads.append((_name, threading.current_thread()))
+            return _fn(*args, **kw)
+        monkeypatch.setattr(sim_loop, name, traced)
+
+    d = make_driver((51.1990, 6.7790), (51.2250, 6.7900))
+    w = make_walker((51.2026, 6.7805), (51.2191, 6.7877))
+    results = []
+    loop = sim_loop.SimLoop([], [d], [w], {w.agent_id: "w1"}, min_saving_m=100.0, rematch_every_s=1.0,
+                              route_workers=1, match_workers=2, on_result=lambda res, t: results.append(res))
+    try:
+        t, deadline = 0.0, time.monotonic() + 10.0
+        while not loop.sims and time.monotonic() < deadline:
+            loop.tick(t, [], publish=False)
+            t += 0.1
+            time.sleep(0.01)
+    finally:
+        loop.close()
+
+    assert [r["status"] for r in results] == ["matched"] and loop.matches["rematch"] == 1
+    assert {name for name, _ in threads} == {"match_candidates", "finalize_match"}
+    assert all(th is not threading.current_thread() for _, th in threads)
@@ -0,0 +1,93 @@
+# Persistent route cache: encoding, restart survival, TTL and eviction.
+import time
+
+import pytest
+
+import local_osrm
+from RouteBase import CompactRoute
+from route_cache import SqliteRouteCache, cache_key, decode, encode_fast, encode_route
+
+
+def full_route(n=50, nodes=True):
+    seg = [10.0 + i for i in range(n - 1)]
+    seg_t = [s / 1.4 for s in seg]
+    return CompactRoute(
+        start=(51.2, 6.78), dest=(51.2 + (n - 1) * 1e-4, 6.78 + (n - 1) * 2e-4),
+        dist=sum(seg), duration=sum(seg_t),
+        duration_list=seg_t, cum_time_s=local_osrm.cum_array(seg_t),
+        geometry_latlon=[(51.2 + i * 1e-4, 6.78 + i * 2e-4) for i in range(n)],
+        seg_dist_m=seg, cum_dist_m=local_osrm.cum_array(seg),
+        profile="walking",
+        nodes=list(range(1000, 1000 + n)) if nodes else None,
+    )
+
+
+def fields(r):
+    return (r.start, r.dest, r.dist, r.duration, r.profile, list(r.geometry_latlon),
+            list(r.duration_list), list(r.cum_time_s), list(r.seg_dist_m), list(r.cum_dist_m),
+            None if r.nodes is None else list(r.nodes))
+
+
+def test_encoding_roundtrip():
+    r = full_route()
+    assert fields(decode(encode_route(r))) == fields(r)
+    assert decode(encode_fast((812.5, 580.25))) == (812.5, 580.25)
+
+    assert decode(encode_route(full_route(nodes=False))).nodes is None
+
+
+def test_old_format_is_a_miss(tmp_path):
+    c = SqliteRouteCache(str(tmp_path / "routes.sqlite"))
+    c._conn().execute("INSERT INTO routes VALUES ('k', ?, 1e18, 0)", (b"\x02garbage",))
+    assert c.get("k") is None
+    assert len(c) == 0
+
+
+def test_survives_restart(tmp_path):
+    path = str(tmp_path / "routes.sqlite")
+    key = cache_key("http://osrm", "full", "walking", 51.2, 6.78, 51.21, 6.79)
+
+    c1 = SqliteRouteCache(path)
+    assert c1.get(key) is None
+    c1.put(key, full_route())
+    c1.close()
+
+    c2 = SqliteRouteCache(path)
+    assert fields(c2.get(key)) == fields(full_route())
+    assert c2.stats()["hits"] == 1
+
+
+def test_ttl_and_size_bound(tmp_path):
+    c = SqliteRouteCache(str(tmp_path / "routes.sqlite"), ttl_s=0.05, max_entries=10)
+    c.put("old", (1.0, 1.0))
+    time.sleep(0.1)
+    assert c.get("old") is None
+    assert c.stats()["expired"] == 1
+
+    c.ttl_s = 3600.0
+    for i in range(25):
+        c.put(f"k{i}", (float(i), float(i)))
+    assert len(c) <= 10
+    assert c.stats()["evictions"] > 0
+    # least recently written go first
+    assert c.get("k24") == (24.0, 24.0)
+    assert c.get("k0") is None
+
+
+def test_cached_paths_fill_and_reuse_disk_cache(stub_osrm, tmp_path, monkeypatch):
+    monkeypatch.setattr(local_osrm, "DISK_CACHE", SqliteRouteCache(str(tmp_path / "routes.sqlite")))
+    a, b = (51.2000001, 6.78), (51.21, 6.79)
+
+    m, s = local_osrm.walk_fast(a, b)
+    full = local_osrm.route_cached(a[0], a[1], b[0], b[1], "walking")
+    assert stub_osrm.calls == ["route", "route"]
+
+    # a "restarted" process: empty memory caches, same file
+    local_osrm.clear_route_caches()
+    assert local_osrm.walk_fast(a, b) == (m, s)
+    # quantized key: a point 1 cm away hits too
+    again = local_osrm.route_cached(a[0] + 1e-7, a[1], b[0], b[1], "walking")
+    assert fields(again) == fields(full)
+    assert stub_osrm.calls == ["route", "route"]
+    assert local_osrm.DISK_CACHE.stats()["hits"] == 2
+    assert full.dist == pytest.approx(m)
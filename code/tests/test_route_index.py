@@ -0,0 +1,69 @@
+# Per-route segment index: nearest points after a position, grid vs. scan vs. brute force.
+import math
+import random
+
+import pytest
+
+import route_index
+from conftest import make_driver, random_point
+from route_index import SegmentIndex, segment_index
+
+
+def brute(index, target, k, after):
+    x, y = index._to_xy(target)
+    out = []
+    for s in range(after[0], len(index)):
+        f, d = index._project(s, x, y)
+        if s == after[0] and f < after[1]:
+            f = after[1]
+            sx, sy = index._seg_xy(s, f)
+            d = math.hypot(sx - x, sy - y)
+        out.append((d, s, f))
+    out.sort()
+    return [(s, f, d) for d, s, f in out[:k]]
+
+
+def routes(seed, n=8):
+    rnd = random.Random(seed)
+    box = (51.19, 6.74, 51.25, 6.82)
+    return rnd, [make_driver(random_point(rnd, box), random_point(rnd, box), n=rnd.randint(2, 80)).route
+                 for _ in range(n)]
+
+
+@pytest.mark.parametrize("scan", [True, False])
+def test_nearest_matches_brute_force(monkeypatch, scan):
+    monkeypatch.setattr(route_index, "SCAN_MAX_SEGS", 10**9 if scan else -1)
+    rnd, rs = routes(3)
+    for route in rs:
+        index = SegmentIndex(route, cell_m=rnd.choice([40.0, 200.0, 800.0]))
+        assert index.scan == scan
+        for _ in range(40):
+            target = 51.18 + rnd.random() * 0.08, 6.73 + rnd.random() * 0.1
+            after = (rnd.randrange(len(index)), rnd.random())
+            k = rnd.randint(1, 6)
+            got = [(p.seg, p.frac, p.dist_m) for p in index.nearest(target, k, after)]
+            ref = brute(index, target, k, after)
+            assert [g[0] for g in got] == [r[0] for r in ref]
+            assert all(g[1] == pytest.approx(r[1]) and g[2] == pytest.approx(r[2]) for g, r in zip(got, ref))
+
+
+def test_projection_not_farther_than_vertex():
+    rnd, rs = routes(5)
+    for route in rs:
+        index = segment_index(route)
+        assert segment_index(route) is index
+        pts = route.geometry_latlon
+        for _ in range(20):
+            target = 51.18 + rnd.random() * 0.08, 6.73 + rnd.random() * 0.1
+            x, y = index._to_xy(target)
+            p = index.nearest(target, 1)[0]
+            assert min(math.hypot(*(a - b for a, b in zip(index._to_xy(q), (x, y)))) for q in pts) >= p.dist_m - 1e-9
+            assert p.seg + 1 < len(pts) and 0.0 <= p.frac <= 1.0
+
+
+def test_time_and_dist_interpolate():
+    _, (route, *_) = routes(1, n=1)
+    assert route_index.time_at(route, 0) == route.cum_time_s[0]
+    mid = route_index.time_at(route, 0, 0.5)
+    assert route.cum_time_s[0] < mid < route.cum_time_s[1]
+    assert route_index.dist_at(route, 0, 1.0) == pytest.approx(route.cum_dist_m[1])
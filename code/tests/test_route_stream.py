@@ -0,0 +1,113 @@
+# Routes stream: geometries sent once by id, then only what changed.
+import json
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from MatchSimulation import Phase
+from local_osrm import build_routes_payload
+from route_stream import RouteStream, apply_routes, decode_polyline, encode_polyline
+
+
+def test_polyline_reference_example():
+    # the example of Google's polyline documentation
+    pts = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    assert encode_polyline(pts) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@") == pts
+
+
+def test_polyline_round_trip():
+    rnd = random.Random(3)
+    pts = [(51.2 + rnd.uniform(-0.2, 0.2), 6.8 + rnd.uniform(-0.2, 0.2)) for _ in range(500)]
+    for precision in (5, 6):
+        back = decode_polyline(encode_polyline(pts, precision), precision)
+        assert len(back) == len(pts)
+        for (a, b), (c, d) in zip(pts, back):
+            assert abs(a - c) <= 0.5 / 10 ** precision + 1e-12
+            assert abs(b - d) <= 0.5 / 10 ** precision + 1e-12
+    assert decode_polyline(encode_polyline([])) == []
+
+
+def route(seed, n=20):
+    rnd = random.Random(seed)
+    return SimpleNamespace(geometry_latlon=[(51.2 + i * 1e-3, 6.8 + rnd.uniform(0, 1e-3)) for i in range(n)])
+
+
+def sim(match_id, driver_route, phase=Phase.WALK_TO_PICKUP):
+    m = SimpleNamespace(walk_route_to_pickup=route(f"{match_id}a"), walk_route_from_dropoff=route(f"{match_id}b"),
+                        pickup=(51.2, 6.8), dropoff=(51.21, 6.81), pickup_index=2, dropoff_index=12)
+    return SimpleNamespace(match_id=match_id, phase=phase, match=m, driver_agent=SimpleNamespace(route=driver_route))
+
+
+def test_deltas_carry_only_new_routes():
+    stream = RouteStream()
+    sims = [sim(i, route(i, 300)) for i in range(10)]
+    key = stream.encode(build_routes_payload(sims, 0.0, stream))
+    assert key["type"] == "routes" and key["key"] and key["seq"] == 1
+    assert len(key["data"]["geometries"]) == 30
+    assert isinstance(key["data"]["routes"][0]["driver_route"], str)
+
+    # nothing changed: nothing to send, the geometries are not encoded again
+    assert stream.encode(build_routes_payload(sims, 1.0, stream)) is None
+
+    shared = sims[0].driver_agent.route
+    sims.append(sim(10, shared))
+    sims[3].phase = Phase.DONE
+    delta = stream.encode(build_routes_payload(sims, 2.0, stream))
+    assert delta["type"] == "routes_delta" and delta["seq"] == 2
+    d = delta["data"]
+    assert [e["match_id"] for e in d["routes"]] == [10]
+    assert d["routes"][0]["driver_route"] == key["data"]["routes"][0]["driver_route"]
+    assert len(d["geometries"]) == 2  # the walk legs; the driver route is known
+    assert d["routes_removed"] == [3]
+    assert len(d["geometries_removed"]) == 3
+    assert len(json.dumps(delta)) < len(json.dumps(key)) / 5
+
+
+def test_clients_applying_the_stream_match_a_keyframe():
+    rnd = random.Random(5)
+    stream = RouteStream()
+    sims = [sim(i, route(i)) for i in range(20)]
+    client = None
+    next_id = 20
+    for t in range(40):
+        for s in sims:
+            if rnd.random() < 0.05:
+                s.phase = Phase.DONE
+        if rnd.random() < 0.5:
+            sims.append(sim(next_id, route(next_id) if rnd.random() < 0.7 else rnd.choice(sims).driver_agent.route))
+            next_id += 1
+        sims = [s for s in sims if s.phase != Phase.DONE or rnd.random() < 0.5]
+        msg = stream.encode(build_routes_payload(sims, float(t), stream))
+        if msg is not None:
+            client = apply_routes(client, json.loads(json.dumps(msg)))
+            assert client is not None
+
+    fresh = apply_routes(None, json.loads(json.dumps(stream.keyframe())))
+    assert client == fresh
+    active = [s for s in sims if s.phase != Phase.DONE]
+    assert set(client["routes"]) == {s.match_id for s in active}
+    for s in active:
+        got = client["geometries"][client["routes"][s.match_id]["driver_route"]]
+        want = s.driver_agent.route.geometry_latlon
+        assert [c for p in got for c in p] == pytest.approx([c for p in want for c in p], abs=1e-5)
+    # nothing kept for routes no match refers to
+    assert len(stream._polylines) == len(client["geometries"])
+
+
+def test_missed_delta_needs_a_resync():
+    stream = RouteStream()
+    sims = [sim(0, route(0))]
+    client = apply_routes(None, stream.encode(build_routes_payload(sims, 0.0, stream)))
+    sims.append(sim(1, route(1)))
+    stream.encode(build_routes_payload(sims, 1.0, stream))
+    sims.append(sim(2, route(2)))
+    assert apply_routes(client, stream.encode(build_routes_payload(sims, 2.0, stream))) is None
+
+
+def test_per_request_payload_is_self_contained():
+    data = build_routes_payload([sim(7, route(7))], 3.0)
+    e = data["routes"][0]
+    assert set(data["geometries"]) == {e["driver_route"], e["walk_to_pickup"], e["walk_from_dropoff"]}
+    assert len(decode_polyline(data["geometries"][e["driver_route"]])) == 20
@@ -0,0 +1,84 @@
+# Driver grid index: candidates() against a scan of every driver's remaining route.
+import math
+import random
+
+import pytest
+
+from spatial_index import DriverGridIndex, M_PER_DEG_LAT
+from conftest import make_driver, random_point
+
+BOX = (51.19, 6.74, 51.25, 6.82)
+
+
+def seg_dist_m(p, a, b):
+    # point to segment on a local flat projection around p
+    kx = M_PER_DEG_LAT * math.cos(math.radians(p[0]))
+    ax, ay = (a[1] - p[1]) * kx, (a[0] - p[0]) * M_PER_DEG_LAT
+    bx, by = (b[1] - p[1]) * kx, (b[0] - p[0]) * M_PER_DEG_LAT
+    dx, dy = bx - ax, by - ay
+    n = dx * dx + dy * dy
+    f = min(max(-(ax * dx + ay * dy) / n, 0.0), 1.0) if n else 0.0
+    return math.hypot(ax + f * dx, ay + f * dy)
+
+
+def remaining_dist_m(d, p):
+    pts = d.route.geometry_latlon
+    return min(seg_dist_m(p, pts[i], pts[i + 1]) for i in range(max(d.idx, 0), len(pts) - 1))
+
+
+def check(index, drivers, rnd, radius_m):
+    free = [d for d in drivers if d in index and not d.assigned and not d.done]
+    for _ in range(40):
+        pos, dest = random_point(rnd, BOX), random_point(rnd, BOX)
+        got = index.candidates(pos, dest, radius_m)
+        assert len({d.agent_id for d in got}) == len(got)
+        assert all(d in free for d in got)
+        # cells are coarse: everything within the radius (less the half cell the
+        # segment sampling may clip) is found, nothing beyond the covering cells
+        near = {d.agent_id for d in free
+                if max(remaining_dist_m(d, pos), remaining_dist_m(d, dest)) <= radius_m - index.cell_m / 2}
+        assert near <= {d.agent_id for d in got}
+        far = math.sqrt(2) * (radius_m + index.cell_m)
+        assert all(max(remaining_dist_m(d, pos), remaining_dist_m(d, dest)) <= far for d in got)
+
+
+@pytest.mark.parametrize("cell_m", [250.0, 500.0])
+def test_candidates_match_a_scan(cell_m):
+    rnd = random.Random(7)
+    drivers = [make_driver(random_point(rnd, BOX), random_point(rnd, BOX), n=rnd.randint(2, 40))
+               for _ in range(60)]
+    index = DriverGridIndex(cell_m=cell_m)
+    for d in drivers:
+        index.add(d)
+    check(index, drivers, rnd, 800.0)
+
+    # drivers move on, the passed segments are forgotten
+    for d in drivers:
+        d.idx = rnd.randrange(len(d.route.geometry_latlon) - 1)
+        d.pos = d.route.geometry_latlon[d.idx]
+        index.advance(d)
+    check(index, drivers, rnd, 800.0)
+
+    # removed, assigned and finished drivers are never candidates
+    for d in drivers[:15]:
+        index.remove(d)
+    for d in drivers[15:20]:
+        d.assigned = True
+    for d in drivers[20:25]:
+        d.done = True
+        index.advance(d)
+    assert len(index) == 40
+    check(index, drivers, rnd, 800.0)
+
+
+def test_candidates_in_insertion_order():
+    rnd = random.Random(1)
+    a, b = (51.20, 6.75), (51.24, 6.81)
+    drivers = [make_driver(a, b, n=10) for _ in range(5)]
+    index = DriverGridIndex()
+    for d in rnd.sample(drivers, len(drivers)):
+        index.add(d)
+    order = index.candidates(a, b, 300.0)
+    # re-adding moves a driver to the end
+    index.add(order[0])
+    assert index.candidates(a, b, 300.0) == order[1:] + order[:1]
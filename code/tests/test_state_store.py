@@ -0,0 +1,107 @@
+# State store: agents, matches and request ids written off the tick thread, restored after a restart.
+import sqlite3
+
+import pytest
+
+import local_osrm
+from state_store import MATCH_VALUES, StateStore, restore_state
+from conftest import make_driver, make_walker
+
+
+def world():
+    walker = make_walker((51.2026, 6.7805), (51.2191, 6.7877))
+    driver = make_driver((51.1990, 6.7790), (51.2250, 6.7900))
+    match, _ = local_osrm.best_match_([driver], walker, min_saving_m=100.0)
+    assert match is not None
+    sim = local_osrm.make_match_sim(match, driver, walker, now_t=5.0)
+    sim.update(5.0)
+    leftover_driver = make_driver((51.2100, 6.7600), (51.2400, 6.8000))
+    leftover_walker = make_walker((51.2300, 6.7700), (51.2350, 6.7900))
+    return sim, leftover_driver, leftover_walker
+
+
+def reload(path):
+    store = StateStore(str(path))
+    try:
+        data = store.load()
+        return restore_state(data, load_walk=lambda a, b: local_osrm.route_cached(a[0], a[1], b[0], b[1], "walking"))
+    finally:
+        store.close()
+
+
+def test_restore_after_restart(stub_osrm, tmp_path):
+    path = tmp_path / "state.sqlite"
+    sim, d, w = world()
+    store = StateStore(str(path), flush_every_s=60.0)
+    store.put_sim(sim, "req-d", "req-w")
+    store.put_agent("driver", d, "req-d2")
+    store.put_agent("walker", w)
+    store.tick(40.0)
+    assert store.stats()["records"] == 0  # nothing written on the calling thread
+    store.close()
+
+    t, sims, drivers, walkers, req_ids = reload(path)
+    assert t == 40.0
+    assert [a.agent_id for a in drivers] == [d.agent_id]
+    assert [a.agent_id for a in walkers] == [w.agent_id]
+    assert req_ids == {sim.driver_agent.agent_id: "req-d", sim.walker_agent.agent_id: "req-w",
+                       d.agent_id: "req-d2"}
+
+    (got,) = sims
+    assert got.match_id == sim.match_id and got.creation_time_s == 5.0
+    for name in MATCH_VALUES:
+        assert getattr(got.match, name) == pytest.approx(getattr(sim.match, name))
+    assert list(got.match.walk_route_to_pickup.geometry_latlon) == \
+        pytest.approx(list(sim.match.walk_route_to_pickup.geometry_latlon))
+    assert got.driver_agent.assigned and got.walker_agent.assigned
+
+    # positions follow from the clock: the same as the original moved to t
+    sim.update(40.0)
+    assert got.phase == sim.phase
+    assert got.get_walker_pos() == pytest.approx(sim.get_walker_pos())
+    assert got.get_driver_pos() == pytest.approx(sim.get_driver_pos())
+
+    # the baseline walk was never drawn: stored without geometry, fetched on first use
+    assert not got.match.walker.loaded
+    stub_osrm.calls.clear()
+    assert len(got.match.walker.geometry_latlon) == 2
+    assert stub_osrm.calls == ["route"]
+
+
+def test_snapshot_compacts_log_and_routes(stub_osrm, tmp_path):
+    path = tmp_path / "state.sqlite"
+    sim, d, w = world()
+    store = StateStore(str(path), flush_every_s=60.0)
+    store.put_sim(sim)
+    store.put_agent("driver", d)
+    store.put_agent("walker", w)
+    store.flush()
+    store.drop_sim(sim.match_id)
+    store.drop_agent(w.agent_id)
+    store.tick(12.0)
+    store.snapshot()
+
+    conn = sqlite3.connect(str(path))
+    assert conn.execute("SELECT COUNT(*) FROM log").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0] == 1
+    # only the leftover driver's route is still referenced
+    assert conn.execute("SELECT COUNT(*) FROM routes").fetchone()[0] == 1
+
+    # changes after the snapshot are replayed on top of it
+    store.put_agent("walker", w)
+    store.tick(13.0)
+    store.close()
+    assert conn.execute("SELECT COUNT(*) FROM log").fetchone()[0] == 2
+    conn.close()
+
+    t, sims, drivers, walkers, _ = reload(path)
+    assert t == 13.0 and sims == []
+    assert [a.agent_id for a in drivers] == [d.agent_id]
+    assert [a.agent_id for a in walkers] == [w.agent_id]
+
+
+def test_empty_store_loads_nothing(tmp_path):
+    store = StateStore(str(tmp_path / "state.sqlite"))
+    assert store.load() is None
+    store.close()
+
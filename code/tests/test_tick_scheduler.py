@@ -0,0 +1,79 @@
+# Fixed-rate tick scheduler: sleeps only the rest of the period, catches up after overruns.
+# Rates are powers of two so the fake clock's arithmetic is exact.
+from tick_scheduler import TickScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, s):
+        self.slept.append(s)
+        self.now += s
+
+
+def scheduler(clock, **kw):
+    s = TickScheduler(clock=clock, sleep=clock.sleep, **kw)
+    s.start()
+    return s
+
+
+def test_sleeps_only_the_remaining_budget():
+    clock = FakeClock()
+    s = scheduler(clock, rate_hz=16.0)  # 62.5 ms
+    periods = 0
+    for work in (0.015625, 0.03125, 0.0, 0.060546875):
+        clock.now += work
+        periods += s.wait()
+    assert periods == 4
+    assert clock.slept == [0.046875, 0.03125, 0.0625, 0.001953125]
+    assert clock.now == 100.0 + 4 * 0.0625
+    assert s.overruns == 0 and s.lag_s == 0.0
+
+
+def test_overrun_advances_by_elapsed_periods():
+    clock = FakeClock()
+    s = scheduler(clock, rate_hz=16.0)
+    clock.now += 0.15625  # one slow tick, 2.5 periods: the deadlines at 1 and 2 periods have passed
+    assert s.wait() == 2
+    assert s.overruns == 1 and s.lag_s == 0.03125
+    # back on the original grid: the next tick is due at start + 3 periods
+    clock.now += 0.015625
+    assert s.wait() == 1
+    assert clock.now == 100.0 + 3 * 0.0625
+
+    # over a run with overruns, the periods handed out add up to the wall time
+    periods = 0
+    for work in (0.25, 0.015625, 0.125, 0.0):
+        clock.now += work
+        periods += s.wait()
+    assert periods * 0.0625 == clock.now - (100.0 + 3 * 0.0625)
+    assert s.dropped == 0
+
+
+def test_long_stall_is_capped_and_counted():
+    clock = FakeClock()
+    s = scheduler(clock, rate_hz=8.0, max_catch_up=5)
+    clock.now += 2.5  # 20 periods
+    assert s.wait() == 5
+    assert s.dropped == 15
+    # the schedule restarts from the end of the stall
+    clock.now += 0.0625
+    assert s.wait() == 1
+    assert clock.slept[-1] == 0.0625
+
+
+def test_publish_rate_below_tick_rate():
+    clock = FakeClock()
+    s = scheduler(clock, rate_hz=16.0, publish_hz=4.0)
+    published = []
+    for _ in range(32):  # 2 s
+        published.append(s.publish_due())
+        s.wait()
+    assert sum(published) == 8
+    assert published[:5] == [True, False, False, False, True]
+    assert s.stats()["publish_hz"] == 4.0
@@ -0,0 +1,58 @@
+# Pre-encoded frames: same JSON as before, serialized once per sim and tick.
+import asyncio
+import json
+
+import pytest
+
+import local_osrm
+import wire
+from position_stream import RequestFrameStream
+
+
+def sim_frame(sim_id, w_rid, d_rid, lat=51.2):
+    return {"sim_id": sim_id, "phase": "WALK_TO_PICKUP",
+            "walker": {"agent_id": "w", "req_id": w_rid, "lat": lat, "lon": 6.7, "pIdx": 3, "dIdx": 0},
+            "driver": {"agent_id": "d", "req_id": d_rid, "lat": 51.3, "lon": 6.8, "idx": 12},
+            "meta": {"t_driver_pickup": 95.5, "t_driver_dropoff": 301.25}}
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_position_event_is_valid_json(monkeypatch, use_orjson):
+    if use_orjson and not wire.HAVE_ORJSON:
+        pytest.skip("orjson not installed")
+    monkeypatch.setattr(wire, "HAVE_ORJSON", use_orjson)
+
+    f = sim_frame("s1", "r-ü", None)
+    event = RequestFrameStream().encode("r-ü", 12.5, f)
+    buf = wire.position_event(event, wire.dumps(f))
+    assert json.loads(buf) == event
+    assert json.loads(wire.encode_event(event)) == event
+
+
+def test_dispatch_serializes_each_frame_once(monkeypatch):
+    published = []
+    dumped = []
+
+    async def fake_publish(app, rid, event, coalesce=False):
+        assert coalesce
+        published.append((rid, event))
+
+    def counting_dumps(obj):
+        dumped.append(obj)
+        return wire.dumps(obj)
+
+    monkeypatch.setattr(local_osrm, "publish_by_id", fake_publish)
+    monkeypatch.setattr(local_osrm, "dumps", counting_dumps)
+
+    app = {"subscribers": {"rw": {object()}, "rd": {object()}, "other": {object()}},
+           "req_stream": RequestFrameStream()}
+    data = {"t_s": 7.0, "sims": [sim_frame("s1", "rw", "rd"), sim_frame("s2", "nobody", None)]}
+    asyncio.run(local_osrm.dispatch_frames_by_req_id(app, data))
+
+    assert dumped == [data["sims"][0]]  # s2 has no subscriber, s1 is encoded once for both
+    assert [rid for rid, _ in published] == ["rw", "rd"]
+    for rid, buf in published:
+        assert isinstance(buf, bytes)
+        msg = json.loads(buf)
+        assert msg["request_id"] == rid and msg["seq"] == 1
+        assert msg["data"] == {"t_s": 7.0, "frame": data["sims"][0]}
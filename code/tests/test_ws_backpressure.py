@@ -0,0 +1,128 @@
+# Load test: slow WebSocket clients must not stall the others or lose their status events.
+import asyncio
+import base64
+import json
+import os
+import socket
+import time
+
+from aiohttp import WSMsgType, ClientSession
+from aiohttp.test_utils import TestServer
+
+import realtime_runner
+from ws_bus import publish, publish_by_id, send_status
+
+
+def snapshot(t, n=50):
+    return {"t_s": t, "sims": [],
+            "leftover_drivers": [{"agent_id": f"d{i}", "lat": 51.2 + t * 1e-3, "lon": 6.7} for i in range(n)],
+            "leftover_walkers": []}
+
+
+def stalled_client(port, path):
+    # handshake, then never read: the server's socket buffers fill up
+    s = socket.create_connection(("127.0.0.1", port))
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    key = base64.b64encode(os.urandom(16)).decode()
+    s.sendall((f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+               f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+    return s
+
+
+async def start(max_pending=64, max_lag_s=1.0):
+    realtime_runner.subscribers.clear()
+    app = realtime_runner.create_app(simulate=False)
+    app["ws_max_pending"] = max_pending
+    app["ws_max_lag_s"] = max_lag_s
+    server = TestServer(app, host="127.0.0.1")
+    await server.start_server()
+    return app, server
+
+
+async def wait_for(cond, timeout=10.0):
+    t0 = time.monotonic()
+    while not cond():
+        assert time.monotonic() - t0 < timeout, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_global_stream_slow_clients():
+    async def main():
+        app, server = await start()
+        slow = [stalled_client(server.port, "/ws") for _ in range(3)]
+        await wait_for(lambda: len(app["global_ws"]) == 3)
+
+        async with ClientSession() as session:
+            fast = [await session.ws_connect(server.make_url("/ws")) for _ in range(4)]
+            await wait_for(lambda: len(app["global_ws"]) == 7)
+
+            big = "x" * 200_000
+            n_routes = 40
+            t0 = time.monotonic()
+            for k in range(n_routes):
+                await publish(app, {"type": "routes", "data": {"k": k, "blob": big}})
+                for j in range(5):
+                    await publish(app, {"type": "positions", "data": snapshot(5 * k + j)})
+                await asyncio.sleep(0)
+
+            async def drain(ws):
+                routes, state = [], None
+                while len(routes) < n_routes or state is None or state != 5 * n_routes - 1:
+                    msg = json.loads((await ws.receive(timeout=10)).data)
+                    if msg["type"] == "routes":
+                        routes.append(msg["data"]["k"])
+                    elif msg["type"] == "positions":
+                        state = msg["data"]["t_s"]
+                    elif msg["type"] == "positions_delta" and state is not None:
+                        state = msg["data"]["t_s"]
+                return routes
+
+            for routes in await asyncio.gather(*(drain(ws) for ws in fast)):
+                assert routes == list(range(n_routes))  # never dropped, in order
+            # fast clients are not held back by the stalled ones
+            assert time.monotonic() - t0 < 5.0
+
+            # stalled clients are cut off, the fast ones stay
+            await wait_for(lambda: len(app["global_ws"]) <= 4 or
+                           sum(b.closed for b in app["outboxes"].values()) >= 3)
+            assert sum(not b.closed for b in app["outboxes"].values()) == 4
+            for ws in fast:
+                await ws.close()
+
+        for s in slow:
+            s.close()
+        await server.close()
+
+    asyncio.run(main())
+
+
+def test_request_stream_keeps_status_events():
+    async def main():
+        app, server = await start(max_pending=10_000, max_lag_s=30.0)
+        async with ClientSession() as session:
+            ws = await session.ws_connect(server.make_url("/ws_agent?request_id=r1"))
+            await wait_for(lambda: "r1" in realtime_runner.subscribers)
+
+            # a burst far bigger than the old 10-slot queue: positions coalesce,
+            # every status arrives, in order
+            for k in range(2000):
+                await publish_by_id(app, "r1", {"type": "position", "seq": k + 1, "data": {}}, coalesce=True)
+                if k % 100 == 0:
+                    await send_status(app, "r1", "matched", n=k)
+                    await send_status(app, "unrelated", "matched", n=k)
+
+            statuses, last_seq = [], 0
+            while last_seq < 2000:
+                msg = await ws.receive(timeout=5)
+                assert msg.type == WSMsgType.TEXT
+                ev = json.loads(msg.data)
+                if ev["type"] == "status":
+                    statuses.append(ev["n"])
+                else:
+                    assert ev["seq"] > last_seq
+                    last_seq = ev["seq"]
+            assert statuses == list(range(0, 2000, 100))
+            await ws.close()
+        await server.close()
+
+    asyncio.run(main())
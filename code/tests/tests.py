@@ -1,4 +1,6 @@
 # tests.py
+# end to end against a running app (python realtime_runner.py); without OSRM and
+# map data, start `python -m fake_osrm` first, it serves both backends on 5000/5001
 import asyncio
 import json
 import aiohttp
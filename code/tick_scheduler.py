@@ -0,0 +1,88 @@
+import time
+from typing import Callable, Dict, Optional
+
+
+class TickScheduler:
+    """
+    Fixed-rate wall clock for the simulation loop.
+
+    Tick k is due at start + k * period. wait() sleeps only for what is left
+    of the current period after the tick's work and returns how many periods
+    the simulation has to advance: 1 on schedule, more after an overrun, so
+    simulated time keeps pace with the wall clock instead of drifting by the
+    work of every tick. A stall longer than max_catch_up periods is not
+    replayed in one jump; the excess is dropped (counted) and the schedule
+    restarts from now.
+
+    publish_due() is a second, slower clock on the same loop: positions are
+    computed at rate_hz and sent to clients at publish_hz.
+    """
+
+    def __init__(self,
+                 rate_hz: float = 20.0,
+                 publish_hz: Optional[float] = None,
+                 max_catch_up: int = 5,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        if rate_hz <= 0:
+            raise ValueError("rate_hz must be > 0")
+        self.period_s = 1.0 / rate_hz
+        self.publish_period_s = 1.0 / publish_hz if publish_hz else self.period_s
+        self.max_catch_up = max(1, max_catch_up)
+        self._clock = clock
+        self._sleep = sleep
+        self._due: Optional[float] = None  # deadline of the tick running now
+        self._publish_due = 0.0
+
+        self.ticks = 0
+        self.overruns = 0
+        self.dropped = 0  # periods given up after stalls
+        self.lag_s = 0.0  # how late the current tick started
+        self.max_lag_s = 0.0
+
+    def start(self) -> None:
+        now = self._clock()
+        self._due = now
+        self._publish_due = now
+
+    def wait(self) -> int:
+        """
+        Blocks until the next tick is due; returns the number of periods the
+        simulation should advance by (1 .. max_catch_up).
+        """
+        if self._due is None:
+            self.start()
+        self._due += self.period_s
+        self.ticks += 1
+        now = self._clock()
+        if now < self._due:
+            self._sleep(self._due - now)
+            self.lag_s = 0.0
+            return 1
+
+        self.overruns += 1
+        n = 1 + int((now - self._due) // self.period_s)
+        if n > self.max_catch_up:
+            self.dropped += n - self.max_catch_up
+            n = self.max_catch_up
+            self._due = now
+        else:
+            self._due += (n - 1) * self.period_s
+        self.lag_s = now - self._due
+        self.max_lag_s = max(self.max_lag_s, self.lag_s)
+        return n
+
+    def publish_due(self) -> bool:
+        now = self._clock()
+        if now < self._publish_due:
+            return False
+        self._publish_due += self.publish_period_s
+        if self._publish_due <= now:
+            # fell behind: next publish one period from now, no burst
+            self._publish_due = now + self.publish_period_s
+        return True
+
+    def stats(self) -> Dict[str, float]:
+        return {"ticks": self.ticks, "overruns": self.overruns, "dropped": self.dropped,
+                "lag_ms": self.lag_s * 1e3, "max_lag_ms": self.max_lag_s * 1e3,
+                "rate_hz": 1.0 / self.period_s, "publish_hz": 1.0 / self.publish_period_s}
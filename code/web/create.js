@@ -1,6 +1,7 @@
 let agentWS = null;
 let wsReady = false;
 let activeRequestId = null;
+let lastPosSeq = {};  // request_id -> last position seq seen
 
 
 function setupAgentWS(requestId = null) {
@@ -38,6 +39,16 @@ function setupAgentWS(requestId = null) {
         console.log("agent ws message:", msg);
 
         if (msg.type === "position") {
+            // frames are complete, a gap only means missed moves: ask for the latest one
+            const rid = msg.request_id;
+            if (typeof msg.seq === "number" && rid) {
+                const last = lastPosSeq[rid];
+                if (last != null && msg.seq <= last && !msg.key) return;  // stale
+                if (last != null && msg.seq > last + 1 && !msg.key) {
+                    agentWS.send(JSON.stringify({type: "resync", request_id: rid}));
+                }
+                lastPosSeq[rid] = msg.seq;
+            }
             updateMyPosition(msg.data)
         }
 
@@ -726,9 +737,12 @@ async function updateMyRoutes(data) {
     const r = routes.find(x => String(x.match_id) === String(targetMatchId));
     if (!r) return;
 
-    const d = r.driver_route?.geometry_latlon;
-    const w1 = r.walk_to_pickup?.geometry_latlon;
-    const w2 = r.walk_from_dropoff?.geometry_latlon;
+    // geometries come once per message, routes refer to them by id
+    const geoms = data.geometries || {};
+    const geom = id => (typeof geoms[id] === "string") ? decodePolyline(geoms[id], data.precision) : null;
+    const d = geom(r.driver_route);
+    const w1 = geom(r.walk_to_pickup);
+    const w2 = geom(r.walk_from_dropoff);
     const pickup = r.points?.pickup;
     const dropoff = r.points?.dropoff;
     if (!Array.isArray(d) || !Array.isArray(w1) || !Array.isArray(w2)) return;
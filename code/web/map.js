@@ -7,6 +7,7 @@ function setupWebSocket() {
     ws.onopen = () => {
         wsReady = true;
         console.log("WebSocket connected");
+        sendViewport();
     };
 
     ws.onclose = () => {
@@ -26,22 +27,190 @@ function setupWebSocket() {
         console.log("WS IN", event.data);
 
 
-        if (msg.type === "positions") {
-            applyPositions(msg.data);
-            applyFocus();
+        if (msg.type === "positions" || msg.type === "positions_delta") {
+            const data = applyPositionMessage(msg);
+            if (data) {
+                applyPositions(data);
+                applyFocus();
+            }
+        }
+        if (msg.type === "view") {
+            viewMode = msg.mode;
+            if (viewMode !== "clusters") applyClusters({clusters: []});
         }
-        if (msg.type === "routes") {
-            applyRoadsVersion(msg.data);
-            applyFocus();
+        if (msg.type === "clusters") {
+            applyClusters(msg.data);
+        }
+        if (msg.type === "routes" || msg.type === "routes_delta") {
+            const data = applyRouteMessage(msg);
+            if (data) {
+                applyRoadsVersion(data);
+                applyFocus();
+            }
         }
     };
 }
 
 setupWebSocket();
 
+// ---------- Position stream (keyframes + deltas) ----------
+// posState mirrors the server's view of what this client was sent; ids keep insertion order
+let posState = null;
+let resyncPending = false;
+
+function applyPositionMessage(msg) {
+    const data = msg.data;
+
+    if (msg.type === "positions") {
+        posState = {
+            seq: (typeof msg.seq === "number") ? msg.seq : 0,
+            t_s: data.t_s,
+            sims: new Map((data.sims || []).map(f => [f.sim_id, f])),
+            drivers: new Map((data.leftover_drivers || []).map(a => [a.agent_id, a])),
+            walkers: new Map((data.leftover_walkers || []).map(a => [a.agent_id, a])),
+        };
+        resyncPending = false;
+        return materializePositions();
+    }
+
+    if (!posState || msg.seq <= posState.seq) return null;  // stale (already in a keyframe)
+    if (msg.seq !== posState.seq + 1) {
+        // missed a delta -> ask for a keyframe, ignore deltas until it arrives
+        if (!resyncPending && wsReady) {
+            ws.send(JSON.stringify({type: "resync"}));
+            resyncPending = true;
+        }
+        return null;
+    }
+
+    posState.seq = msg.seq;
+    posState.t_s = data.t_s;
+    for (const d of data.sims || []) {
+        const prev = posState.sims.get(d.sim_id);
+        if (!prev) {
+            posState.sims.set(d.sim_id, d);
+            continue;
+        }
+        // deltas only carry the changed walker/driver fields
+        const merged = {...prev, ...d};
+        if (d.walker) merged.walker = {...prev.walker, ...d.walker};
+        if (d.driver) merged.driver = {...prev.driver, ...d.driver};
+        posState.sims.set(d.sim_id, merged);
+    }
+    for (const id of data.sims_removed || []) posState.sims.delete(id);
+    for (const a of data.leftover_drivers || []) posState.drivers.set(a.agent_id, a);
+    for (const id of data.drivers_removed || []) posState.drivers.delete(id);
+    for (const a of data.leftover_walkers || []) posState.walkers.set(a.agent_id, a);
+    for (const id of data.walkers_removed || []) posState.walkers.delete(id);
+    return materializePositions();
+}
+
+function materializePositions() {
+    return {
+        t_s: posState.t_s,
+        sims: Array.from(posState.sims.values()),
+        leftover_drivers: Array.from(posState.drivers.values()),
+        leftover_walkers: Array.from(posState.walkers.values()),
+    };
+}
+
+// ---------- Route stream (geometries by route id + deltas) ----------
+// geometries are decoded once; routes reference them by id
+let routeState = null;
+let routesResyncPending = false;
+
+function applyRouteMessage(msg) {
+    const data = msg.data;
+
+    if (msg.type === "routes") {
+        const precision = data.precision;
+        routeState = {
+            seq: (typeof msg.seq === "number") ? msg.seq : 0,
+            version: data.routes_version,
+            precision,
+            geoms: new Map(Object.entries(data.geometries || {}).map(([id, p]) => [id, decodePolyline(p, precision)])),
+            routes: new Map((data.routes || []).map(r => [r.match_id, r])),
+        };
+        routesResyncPending = false;
+        return materializeRoutes();
+    }
+
+    if (!routeState || msg.seq <= routeState.seq) return null;
+    if (msg.seq !== routeState.seq + 1) {
+        if (!routesResyncPending && wsReady) {
+            ws.send(JSON.stringify({type: "resync", stream: "routes"}));
+            routesResyncPending = true;
+        }
+        return null;
+    }
+
+    routeState.seq = msg.seq;
+    routeState.version = data.routes_version;
+    for (const [id, p] of Object.entries(data.geometries || {})) {
+        routeState.geoms.set(id, decodePolyline(p, routeState.precision));
+    }
+    for (const r of data.routes || []) routeState.routes.set(r.match_id, r);
+    for (const id of data.routes_removed || []) routeState.routes.delete(id);
+    for (const id of data.geometries_removed || []) routeState.geoms.delete(id);
+    return materializeRoutes();
+}
+
+function materializeRoutes() {
+    // the layout applyRoadsVersion draws; no routes_version, the stream already
+    // drops stale messages and a new view may start at the same version
+    const geom = id => ({geometry_latlon: routeState.geoms.get(id)});
+    return {
+        routes: Array.from(routeState.routes.values()).map(r => ({
+            match_id: r.match_id,
+            driver_route: geom(r.driver_route),
+            walk_to_pickup: geom(r.walk_to_pickup),
+            walk_from_dropoff: geom(r.walk_from_dropoff),
+            points: r.points,
+            idx: r.idx,
+        })),
+    };
+}
+
 // map setup
 let map = L.map("map");
 
+// ---------- Viewport (the server only sends what is in view) ----------
+// below zoom 13 the server sends counts per cell ("clusters") instead of agents and routes
+let viewMode = null;
+let viewportTimer = null;
+let clusterMarkers = [];
+
+function sendViewport() {
+    if (!wsReady || !map._loaded) return;
+    const b = map.getBounds().pad(0.25);  // a margin, so small pans stay in the same view
+    ws.send(JSON.stringify({
+        type: "viewport",
+        bbox: [b.getSouth(), b.getWest(), b.getNorth(), b.getEast()],
+        zoom: map.getZoom(),
+    }));
+}
+
+map.on("moveend", () => {
+    clearTimeout(viewportTimer);
+    viewportTimer = setTimeout(sendViewport, 150);
+});
+
+function applyClusters(data) {
+    clusterMarkers.forEach(m => map.removeLayer(m));
+    clusterMarkers = [];
+    for (const c of data.clusters || []) {
+        const n = c.drivers + c.walkers;
+        const m = L.circleMarker([c.lat, c.lon], {
+            radius: 6 + Math.min(16, 2 * Math.log2(1 + n)),
+            color: "#1f2937",
+            fillColor: c.walkers > c.drivers ? "#f59e0b" : "#6b7280",
+            fillOpacity: 0.7,
+            weight: 1
+        }).addTo(map).bindTooltip(`${c.drivers} drivers, ${c.walkers} walkers`);
+        clusterMarkers.push(m);
+    }
+}
+
 requestAnimationFrame(() => {
     map.setView([51.2562, 7.1508], 12);
     map.invalidateSize(true);
@@ -343,7 +512,8 @@ function applyRoadsVersion(data) {
             allPts = allPts.concat(d, w1, w2);
         }
 
-        if (allPts.length > 0) {
+        // only the first time: moving the map changes the viewport, and with it the routes
+        if (allPts.length > 0 && !routesLoaded) {
             map.fitBounds(allPts, {padding: [30, 30]});
         }
 
@@ -0,0 +1,20 @@
+// Google encoded polyline -> [[lat, lon], ...] (route_stream.decode_polyline)
+function decodePolyline(s, precision) {
+    const factor = Math.pow(10, (typeof precision === "number") ? precision : 5);
+    const points = [];
+    let i = 0, lat = 0, lon = 0;
+    while (i < s.length) {
+        for (let k = 0; k < 2; k++) {
+            let shift = 0, result = 0, b;
+            do {
+                b = s.charCodeAt(i++) - 63;
+                result |= (b & 0x1f) << shift;
+                shift += 5;
+            } while (b >= 0x20);
+            const d = (result & 1) ? ~(result >> 1) : (result >> 1);
+            if (k === 0) lat += d; else lon += d;
+        }
+        points.push([lat / factor, lon / factor]);
+    }
+    return points;
+}
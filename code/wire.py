@@ -0,0 +1,50 @@
+import json
+from typing import Any, Dict, Union
+
+from aiohttp import web, WSMsgType
+
+try:
+    import orjson
+except ImportError:  # stdlib json fallback
+    orjson = None
+
+HAVE_ORJSON = orjson is not None
+HAVE_SEND_FRAME = hasattr(web.WebSocketResponse, "send_frame")  # aiohttp >= 3.11
+
+
+def dumps(obj: Any) -> bytes:
+    # UTF-8 JSON, the bytes of a WebSocket text frame
+    if HAVE_ORJSON:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def loads(buf: Union[bytes, str]) -> Any:
+    if HAVE_ORJSON:
+        return orjson.loads(buf)
+    return json.loads(buf)
+
+
+def encode_event(event: Union[Dict[str, Any], bytes]) -> bytes:
+    return event if isinstance(event, bytes) else dumps(event)
+
+
+def position_event(event: Dict[str, Any], frame_buf: bytes) -> bytes:
+    """
+    Per-request position event (RequestFrameStream.encode) around a sim frame
+    that was serialized once for all requests and subscribers of that sim.
+    """
+    head = {k: v for k, v in event.items() if k != "data"}
+    return b"".join((
+        dumps(head)[:-1],
+        b',"data":{"t_s":', dumps(event["data"]["t_s"]),
+        b',"frame":', frame_buf, b"}}",
+    ))
+
+
+async def send_encoded(ws: web.WebSocketResponse, buf: bytes) -> None:
+    # text frame straight from the shared buffer, no str round trip per subscriber
+    if HAVE_SEND_FRAME:
+        await ws.send_frame(buf, WSMsgType.TEXT)
+    else:
+        await ws.send_str(buf.decode())
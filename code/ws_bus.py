@@ -1,25 +1,169 @@
 import asyncio
-from typing import Any, Dict
-from aiohttp import web
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Union
 
+from aiohttp import web, WSCloseCode
 
-async def publish_by_id(app: web.Application, request_id: str, event: Dict[str, Any]) -> None:
-    subs: Dict[str, set[web.WebSocketResponse]] = app["subscribers"]
-    q: asyncio.Queue = app["pub_q_by_id"]
+from wire import send_encoded
 
-    if request_id not in subs:
-        return
+Payload = Union[bytes, Callable[[], bytes]]
+
+
+class CoalescingQueue:
+    """
+    Unbounded FIFO for one consumer task. An item put with a key replaces the
+    still queued item with the same key (latest wins) and moves to the end of
+    the line, so it never overtakes events queued before it; items without a
+    key are never dropped.
+    """
+
+    def __init__(self):
+        self._items: Deque[list] = deque()  # [key, value, t_enqueued, alive]
+        self._by_key: Dict[Hashable, list] = {}
+        self._live = 0
+        self._ready = asyncio.Event()
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return self._live
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._by_key
+
+    def put_nowait(self, value: Any, key: Optional[Hashable] = None) -> bool:
+        # returns True when an older item with the same key was replaced
+        replaced = False
+        if key is not None:
+            old = self._by_key.get(key)
+            if old is not None:
+                old[3] = False  # skipped by get()
+                self._live -= 1
+                self.coalesced += 1
+                replaced = True
+        entry = [key, value, time.monotonic(), True]
+        self._items.append(entry)
+        self._live += 1
+        if key is not None:
+            self._by_key[key] = entry
+        self._ready.set()
+        return replaced
+
+    def oldest_age_s(self) -> float:
+        # age of the head of the line, replaced items included: how far behind the consumer is
+        return time.monotonic() - self._items[0][2] if self._items else 0.0
 
-    # keep only latest event if queue is full
-    if q.full():
+    async def get(self) -> Any:
+        while True:
+            while not self._items:
+                self._ready.clear()
+                await self._ready.wait()
+            key, value, _, alive = self._items.popleft()
+            if not alive:
+                continue
+            self._live -= 1
+            if key is not None:
+                del self._by_key[key]
+            return value
+
+
+class Outbox:
+    """
+    Outbound queue of one WebSocket, drained by its own writer task, so a
+    slow client only delays itself. Positions are put with a key (latest
+    wins), status and route events without one. A client whose queue is
+    older than max_lag_s or longer than max_pending, or that does not take a
+    message within max_lag_s, is disconnected.
+    """
+
+    def __init__(self, ws: web.WebSocketResponse, max_pending: int = 256, max_lag_s: float = 10.0):
+        self.ws = ws
+        self.max_pending = max_pending
+        self.max_lag_s = max_lag_s
+        self.sent = 0
+        self.closed = False
+        self._q = CoalescingQueue()
+        self._writer = asyncio.create_task(self._run())
+
+    @property
+    def coalesced(self) -> int:
+        return self._q.coalesced
+
+    def __len__(self) -> int:
+        return len(self._q)
+
+    def put(self, buf: bytes, key: Optional[Hashable] = None,
+            on_coalesce: Optional[Callable[[], bytes]] = None) -> None:
+        """
+        on_coalesce: for messages that build on the previous one (position
+        deltas); if an unsent one is replaced, the writer sends on_coalesce()
+        (a keyframe) instead.
+        """
+        if self.closed:
+            return
+        if on_coalesce is not None and key in self._q:
+            self._q.put_nowait(on_coalesce, key)
+        else:
+            self._q.put_nowait(buf, key)
+        if len(self._q) > self.max_pending or self._q.oldest_age_s() > self.max_lag_s:
+            self.kick("send queue lag")
+
+    async def _run(self) -> None:
         try:
-            q.get_nowait()
-            q.task_done()
-        except asyncio.QueueEmpty:
+            while True:
+                payload: Payload = await self._q.get()
+                buf = payload() if callable(payload) else payload
+                # a client that stops reading blocks here once the socket buffers are full
+                await asyncio.wait_for(send_encoded(self.ws, buf), self.max_lag_s)
+                self.sent += 1
+        except asyncio.CancelledError:
             pass
-    #print("publish_by_id", request_id, "subs?", request_id in subs, "qsize", q.qsize())
-    #print("event:", event)
-    await q.put((request_id, event))
+        except asyncio.TimeoutError:
+            self.kick("send timed out")
+        except Exception:
+            # connection gone, the handler's finally cleans up
+            self.closed = True
+
+    def kick(self, reason: str) -> None:
+        if self.closed:
+            return
+        print("disconnecting slow websocket client:", reason,
+              f"(pending={len(self._q)}, lag={self._q.oldest_age_s():.1f}s)")
+        self.close()
+        asyncio.ensure_future(self.ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=reason.encode()))
+
+    def close(self) -> None:
+        self.closed = True
+        self._writer.cancel()
+
+
+def outbox_of(app: web.Application, ws: web.WebSocketResponse) -> Optional[Outbox]:
+    return app["outboxes"].get(ws)
+
+
+def open_outbox(app: web.Application, ws: web.WebSocketResponse) -> Outbox:
+    box = Outbox(ws, max_pending=app.get("ws_max_pending", 256), max_lag_s=app.get("ws_max_lag_s", 10.0))
+    app["outboxes"][ws] = box
+    return box
+
+
+def close_outbox(app: web.Application, ws: web.WebSocketResponse) -> None:
+    box = app["outboxes"].pop(ws, None)
+    if box is not None:
+        box.close()
+
+
+async def publish_by_id(app: web.Application, request_id: str, event: Union[Dict[str, Any], bytes],
+                        coalesce: bool = False, last: bool = False) -> None:
+    # coalesce=True for position frames: a newer frame of the same request replaces
+    # an unsent one; status events are never dropped. last=True: the request's
+    # subscribers are dropped once this event is delivered
+    subs: Dict[str, set[web.WebSocketResponse]] = app["subscribers"]
+    q: CoalescingQueue = app["pub_q_by_id"]
+
+    if request_id not in subs:
+        return
+    q.put_nowait((request_id, event, coalesce, last), key=("position", request_id) if coalesce else None)
 
 
 async def send_status(app: web.Application, request_id: str, status: str, **extra) -> None:
@@ -28,16 +172,16 @@ async def send_status(app: web.Application, request_id: str, status: str, **extr
     await publish_by_id(app, request_id, event)
 
 
+async def send_done(app: web.Application, request_id: str, **extra) -> None:
+    # final status of a request
+    event = {"type": "status", "status": "done", "request_id": request_id}
+    event.update(extra)
+    await publish_by_id(app, request_id, event, last=True)
 
-async def publish(app: web.Application, event: Dict[str, Any]) -> None:
-    q: asyncio.Queue = app["pub_q"]
 
-    # keep only latest event if queue is full
-    if q.full():
-        try:
-            q.get_nowait()
-            q.task_done()
-        except asyncio.QueueEmpty:
-            pass
 
-    await q.put(event)
+async def publish(app: web.Application, event: Dict[str, Any]) -> None:
+    q: CoalescingQueue = app["pub_q"]
+
+    # positions: keep only the latest snapshot, routes are never dropped
+    q.put_nowait(event, key="positions" if event.get("type") == "positions" else None)